@@ -0,0 +1,275 @@
+#pylint: disable=bare-except, invalid-name, too-many-arguments, too-many-instance-attributes
+"""
+    Automated reduction of new runs as they are written to a data directory.
+
+    The directory is polled for new data files. A file is considered complete
+    once its size and modification time have not changed for a while and its
+    meta-data can be read. Direct beams are remembered. Each new scattering run is
+    matched to the closest direct beam, using the meta-data from the file, and
+    reduced in a worker process with the template configuration.
+    Only a limited number of runs are reduced at once, the others are queued.
+"""
+from __future__ import absolute_import, division, print_function
+import os
+import glob
+import time
+import logging
+import collections
+import multiprocessing
+
+from .data_handling import event_reader
+from .data_handling.instrument import Instrument
+from .batch_reduction import reduce_set
+
+# Slit opening logs, in the order they are looked for
+SLIT_LOGS = [['BL4A:Mot:S1:X:Gap', 'BL4A:Mot:S2:X:Gap', 'BL4A:Mot:S3:X:Gap'],
+             ['S1HWidth', 'S2HWidth', 'S3HWidth']]
+
+# Logs needed to match a run with a direct beam
+RUN_INFO_LOGS = ['data_type', 'LambdaRequest'] + SLIT_LOGS[0] + SLIT_LOGS[1]
+
+
+class RunInfo(object):
+    """
+        Meta-data needed to match a run with a direct beam
+    """
+    def __init__(self, file_path):
+        """
+            :param str file_path: path of the data file
+        """
+        logs, _ = event_reader.read_logs(file_path, names=RUN_INFO_LOGS)
+        self.file_path = file_path
+        self.number = logs.get('run_number', 0)
+        self.is_direct_beam = logs.get('data_type', 0) == 1
+        self.lambda_center = logs.get('LambdaRequest', 0)
+        self.slit1_width = self.slit2_width = self.slit3_width = 0
+        for names in SLIT_LOGS:
+            if names[0] in logs:
+                self.slit1_width, self.slit2_width, self.slit3_width = [logs.get(name, 0) for name in names]
+                break
+
+
+class DirectoryWatcher(object):
+    """
+        Poll a directory for new files that are no longer being written
+    """
+    def __init__(self, directory, pattern='*.nxs.h5', settle_time=10.0, include_existing=False):
+        """
+            :param str directory: directory to watch
+            :param str pattern: file name pattern
+            :param float settle_time: time, in seconds, a file must remain unchanged
+            :param bool include_existing: if True, the files already present will be reported
+        """
+        self.directory = directory
+        self.pattern = pattern
+        self.settle_time = settle_time
+        # Size, modification time and time of the last change of each file being written
+        self._pending = {}
+        # Files that were already processed, or that were present when we started
+        self.reported = set() if include_existing else set(self._list_files())
+
+    def _list_files(self):
+        return glob.glob(os.path.join(self.directory, self.pattern))
+
+    def poll(self, now=None):
+        """
+            Return the new files that have stopped changing since the last call
+            :param float now: current time
+        """
+        now = time.time() if now is None else now
+        completed = []
+        for file_path in sorted(self._list_files()):
+            if file_path in self.reported:
+                continue
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            signature = (stat.st_size, stat.st_mtime)
+            if file_path not in self._pending or not self._pending[file_path][0] == signature:
+                self._pending[file_path] = (signature, now)
+            elif now - self._pending[file_path][1] >= self.settle_time:
+                completed.append(file_path)
+        return completed
+
+    def done(self, file_path):
+        """
+            Mark a file as processed
+            :param str file_path: file reported by poll()
+        """
+        self._pending.pop(file_path, None)
+        self.reported.add(file_path)
+
+    def retry(self, file_path, now=None):
+        """
+            Wait for another settle time before reporting a file again
+            :param str file_path: file reported by poll()
+            :param float now: current time
+        """
+        if file_path in self._pending:
+            self._pending[file_path] = (self._pending[file_path][0], time.time() if now is None else now)
+
+
+class AutoReduction(object):
+    """
+        Reduce new runs as they appear in a data directory
+    """
+    def __init__(self, directory, configuration, output_options, log_dir, n_processes=2,
+                 settle_time=10.0, poll_interval=2.0, include_existing=False, trace=False):
+        """
+            :param str directory: data directory to watch
+            :param Configuration configuration: template configuration
+            :param dict output_options: output options for the ProcessingWorkflow
+            :param str log_dir: directory for the log of each run
+            :param int n_processes: maximum number of runs reduced at once
+            :param float settle_time: time, in seconds, a file must remain unchanged before being reduced
+            :param float poll_interval: time between checks of the directory, in seconds
+            :param bool include_existing: if True, the runs already in the directory will be reduced
+            :param bool trace: if True, a Chrome trace file will be written for each run
+        """
+        self.configuration = configuration
+        self.output_options = output_options
+        self.log_dir = log_dir
+        self.n_processes = max(int(n_processes), 1)
+        self.poll_interval = poll_interval
+        self.trace = trace
+        self.instrument = Instrument()
+        self.watcher = DirectoryWatcher(directory, settle_time=settle_time, include_existing=include_existing)
+        self.direct_beams = []
+        self.queue = collections.deque()
+        self.running = {}
+        self.results = []
+        self._pool = None
+        self._stop = False
+
+        # Remember the direct beams already in the directory
+        if not include_existing:
+            for file_path in sorted(self.watcher.reported):
+                self._add_file(file_path, queue=False)
+
+    @property
+    def pool(self):
+        """
+            Return the process pool, starting it if needed.
+            Each worker process only reduces one run, so that memory is returned to the system.
+        """
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.n_processes, maxtasksperchild=1)
+        return self._pool
+
+    def _add_file(self, file_path, queue=True):
+        """
+            Read the meta-data of a new file and either remember it as a direct beam
+            or queue it for reduction. Returns False if the file could not be read.
+            :param str file_path: path of the data file
+            :param bool queue: if True, scattering runs will be queued for reduction
+        """
+        try:
+            run_info = RunInfo(file_path)
+        except:
+            logging.debug("Could not read %s yet", file_path)
+            return False
+        if run_info.is_direct_beam:
+            logging.info("Direct beam found: %s", run_info.number)
+            self.direct_beams.append(run_info)
+        elif queue:
+            logging.info("Queuing run %s", run_info.number)
+            self.queue.append(run_info)
+        return True
+
+    def find_direct_beam(self, run_info):
+        """
+            Return the closest direct beam matching a run, or None.
+            The slit openings are ignored if no direct beam matches them.
+            :param RunInfo run_info: scattering run
+        """
+        for skip_slits in [False, True]:
+            matches = [item for item in self.direct_beams
+                       if self.instrument.direct_beam_match(run_info, item, skip_slits=skip_slits)]
+            if matches:
+                return min(matches, key=lambda item: abs(item.number - run_info.number))
+        return None
+
+    def scan(self, now=None):
+        """
+            Look for new files in the data directory
+            :param float now: current time
+        """
+        for file_path in self.watcher.poll(now):
+            if self._add_file(file_path):
+                self.watcher.done(file_path)
+            else:
+                self.watcher.retry(file_path, now)
+
+    def submit(self):
+        """
+            Start the reduction of queued runs, up to the maximum number of processes
+        """
+        while self.queue and len(self.running) < self.n_processes:
+            run_info = self.queue.popleft()
+            direct_beam = self.find_direct_beam(run_info)
+            if direct_beam is None:
+                logging.warning("No direct beam found for run %s", run_info.number)
+            reduction_set = dict(name=str(run_info.number), runs=[run_info.number],
+                                 data_files=[run_info.file_path],
+                                 direct_beam_files=[direct_beam.file_path] if direct_beam else [])
+            task = dict(reduction_set=reduction_set, configuration=self.configuration,
+                        output_options=self.output_options, log_dir=self.log_dir, trace=self.trace)
+            self.running[run_info.number] = self.pool.apply_async(reduce_set, (task,))
+
+    def collect(self):
+        """
+            Gather the results of the completed reductions
+        """
+        for number in [key for key in self.running if self.running[key].ready()]:
+            try:
+                result = self.running.pop(number).get()
+            except:
+                logging.exception("Reduction of run %s failed", number)
+                continue
+            logging.info("Run %s: %s [%.1f sec] %s", result['name'], result['status'],
+                         result['time'], result['error'])
+            self.results.append(result)
+
+    def process(self, now=None):
+        """
+            Check for new runs, start their reduction and collect the results
+            :param float now: current time
+        """
+        self.collect()
+        self.scan(now)
+        self.submit()
+
+    def run(self, timeout=None):
+        """
+            Process new runs until stop() is called or the timeout expires.
+            :param float timeout: maximum time to run, in seconds
+        """
+        t_0 = time.time()
+        logging.info("Watching %s", self.watcher.directory)
+        try:
+            while not self._stop and (timeout is None or time.time() - t_0 < timeout):
+                self.process()
+                time.sleep(self.poll_interval)
+            if self.queue:
+                logging.warning("Skipping %s queued runs", len(self.queue))
+            while self.running:
+                self.collect()
+                time.sleep(self.poll_interval)
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        """
+            Stop watching for new runs, once the current reductions are done
+        """
+        self._stop = True
+
+    def shutdown(self):
+        """
+            Stop the worker processes
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
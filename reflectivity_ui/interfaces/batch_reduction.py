@@ -0,0 +1,346 @@
+#pylint: disable=bare-except, invalid-name, too-many-locals
+"""
+    Headless reduction of several independent sets of runs.
+
+    A set is either a reduced QuickNXS .dat file, from which the data and
+    reduction parameters are reloaded, or a list of run numbers to be reduced
+    with a template configuration. Each set is processed by a ProcessingWorkflow
+    in its own worker process, with its own log file.
+
+    With --watch, new runs are instead reduced as they are written to the
+    data directory, see auto_reduction.
+"""
+from __future__ import absolute_import, division, print_function
+import sys
+import os
+import copy
+import glob
+import time
+import logging
+import argparse
+import traceback
+import multiprocessing
+
+from .configuration import Configuration
+from .data_manager import DataManager
+from .data_handling.processing_workflow import ProcessingWorkflow, DEFAULT_OPTIONS
+from .data_handling import tracing
+
+# Output formats that can be selected, and the corresponding output options
+OUTPUT_FORMATS = dict(ascii='format_multi', numpy='format_numpy', matlab='format_matlab',
+                      genx='format_genx', hdf5='format_hdf5', mantid='format_mantid')
+
+# Outputs that can be selected, and the corresponding output options
+OUTPUT_ITEMS = dict(specular='export_specular', asym='export_asym', offspec='export_offspec',
+                    offspec_binned='export_offspec_smooth', gisans='export_gisans')
+
+# Data file patterns, tried in order, for a given run number
+DATA_FILE_PATTERNS = ['*_%s.nxs.h5', '*_%s_event.nxs']
+
+
+def parse_run_list(text):
+    """
+        Return the list of run numbers in a string like '25001-25003,25010'
+        :param str text: comma-separated list of runs or run ranges
+    """
+    runs = []
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '-' in item:
+            first, last = item.split('-', 1)
+            runs.extend(range(int(first), int(last) + 1))
+        else:
+            runs.append(int(item))
+    return runs
+
+
+def find_data_file(run_number, data_dir):
+    """
+        Return the path of the data file for a run, or None if it is not found
+        :param int run_number: run number
+        :param str data_dir: directory to look in
+    """
+    for pattern in DATA_FILE_PATTERNS:
+        file_list = sorted(glob.glob(os.path.join(data_dir, pattern % run_number)))
+        if file_list:
+            return file_list[0]
+    return None
+
+
+def get_base_configuration(use_settings=False):
+    """
+        Return the configuration the reduction will be based on.
+        :param bool use_settings: if True, the options saved by the application will be used
+    """
+    settings = None
+    if use_settings:
+        try:
+            from PyQt5 import QtCore
+            settings = QtCore.QSettings('.refredm')
+        except:
+            logging.error("Could not read the application settings: %s", sys.exc_info()[1])
+    configuration = Configuration(settings)
+    # The smoothing parameters are chosen interactively, so we always bin the off-specular data
+    configuration.apply_smoothing = False
+    return configuration
+
+
+def get_reduction_sets(inputs, data_dir='', direct_beams=None):
+    """
+        Return the list of reduction sets for a list of inputs.
+        Each input is either a reduced .dat file, or a list of run numbers.
+
+        :param list inputs: list of file paths or run lists
+        :param str data_dir: directory containing the data files
+        :param list direct_beams: run numbers of the direct beams used for run lists
+    """
+    reduction_sets = []
+    for item in inputs:
+        if item.endswith('.dat'):
+            name = os.path.splitext(os.path.basename(item))[0]
+            reduction_sets.append(dict(name=name, reduced_file=os.path.abspath(item)))
+        else:
+            runs = parse_run_list(item)
+            reduction_sets.append(dict(name='+'.join([str(r) for r in runs]),
+                                       data_files=[find_data_file(r, data_dir) for r in runs],
+                                       direct_beam_files=[find_data_file(r, data_dir) for r in direct_beams or []],
+                                       runs=runs))
+
+    # Sets with the same name would write the same log and output files:
+    # give them a suffix with their position in the list of inputs
+    names = [item['name'] for item in reduction_sets]
+    for i, item in enumerate(reduction_sets):
+        if names.count(item['name']) > 1:
+            item['suffix'] = str(i + 1)
+            item['name'] = '%s_%s' % (item['name'], item['suffix'])
+    return reduction_sets
+
+
+def get_set_output_options(output_options, reduction_set):
+    """
+        Return the output options for a reduction set.
+        The suffix of a set given by get_reduction_sets() is added to its output
+        file names, so that sets with the same runs don't overwrite each other's outputs.
+        :param dict output_options: output options common to all sets
+        :param dict reduction_set: description of the reduction set
+    """
+    if 'suffix' not in reduction_set:
+        return output_options
+    output_options = copy.deepcopy(output_options)
+    template = output_options['output_file_template']
+    if '{numbers}' in template:
+        output_options['output_file_template'] = template.replace('{numbers}', '{numbers}_%s' % reduction_set['suffix'])
+    else:
+        output_options['output_directory'] = os.path.join(output_options['output_directory'], reduction_set['name'])
+    return output_options
+
+
+def load_reduction_set(data_manager, reduction_set, configuration):
+    """
+        Load the data of a reduction set and fill the reduction and direct beam lists
+        :param DataManager data_manager: data manager to load the data into
+        :param dict reduction_set: description of the reduction set
+        :param Configuration configuration: configuration to base the loaded data on
+    """
+    if 'reduced_file' in reduction_set:
+        data_manager.load_data_from_reduced_file(reduction_set['reduced_file'], configuration=configuration)
+        return
+
+    for file_path in reduction_set['direct_beam_files']:
+        if file_path is None:
+            raise RuntimeError("Could not find all the direct beam files")
+        data_manager.load(file_path, copy.deepcopy(configuration))
+        data_manager.add_active_to_normalization()
+
+    configuration.match_direct_beam = bool(data_manager.direct_beam_list)
+    for run, file_path in zip(reduction_set['runs'], reduction_set['data_files']):
+        if file_path is None:
+            raise RuntimeError("Could not find the data file for run %s" % run)
+        data_manager.load(file_path, copy.deepcopy(configuration))
+        data_manager.add_active_to_reduction()
+
+    # Scaling factors are not known for new data
+    data_manager.stitch_data_sets(normalize_to_unity=configuration.normalize_to_unity,
+                                  q_cutoff=configuration.total_reflectivity_q_cutoff,
+                                  global_fit=configuration.global_stitching)
+
+
+def reduce_set(task):
+    """
+        Reduce a set of runs and write the outputs.
+        This is executed in a worker process and returns a summary of the result.
+        The time spent in each processing stage is written to the log, and to
+        a Chrome trace file if the task has the trace option set.
+        :param dict task: reduction set, configuration, output options and log directory
+    """
+    reduction_set = task['reduction_set']
+    log_file = os.path.join(task['log_dir'], '%s.log' % reduction_set['name'])
+    handler = logging.FileHandler(log_file, mode='w')
+    handler.setFormatter(logging.Formatter('%(levelname)s:%(asctime)-15s %(message)s'))
+    logging.getLogger().addHandler(handler)
+
+    result = dict(name=reduction_set['name'], status='OK', error='', n_runs=0,
+                  files=[], log_file=log_file)
+    tracer = tracing.get_tracer()
+    tracer.clear()
+    t_0 = time.time()
+    try:
+        logging.info("Reducing %s", reduction_set['name'])
+        data_manager = DataManager(os.getcwd())
+        load_reduction_set(data_manager, reduction_set, task['configuration'])
+        result['n_runs'] = len(data_manager.reduction_list)
+        if not data_manager.reduction_list:
+            raise RuntimeError("No data could be loaded")
+
+        workflow = ProcessingWorkflow(data_manager, task['output_options'])
+        workflow.execute()
+        result['files'] = workflow.exported_data_files
+    except:
+        result['status'] = 'FAILED'
+        result['error'] = str(sys.exc_info()[1])
+        logging.error("Reduction of %s failed:\n%s", reduction_set['name'], traceback.format_exc())
+    finally:
+        result['time'] = time.time() - t_0
+        logging.info("%s: %s [%.1f sec]", reduction_set['name'], result['status'], result['time'])
+        logging.info("Processing time:\n%s", tracer.get_summary_table(group_by='run'))
+        if task.get('trace', False):
+            trace_file = os.path.join(task['log_dir'], '%s.trace.json' % reduction_set['name'])
+            try:
+                tracer.write_chrome_trace(trace_file)
+            except:
+                logging.error("Could not write %s: %s", trace_file, sys.exc_info()[1])
+        logging.getLogger().removeHandler(handler)
+        handler.close()
+    return result
+
+
+def run(tasks, n_processes=1):
+    """
+        Reduce all the sets, n_processes at a time.
+        Each worker process only reduces one set, so that memory is returned to the system.
+        :param list tasks: list of tasks, as expected by reduce_set()
+        :param int n_processes: number of worker processes
+    """
+    results = []
+    pool = multiprocessing.Pool(max(min(n_processes, len(tasks)), 1), maxtasksperchild=1)
+    try:
+        for result in pool.imap_unordered(reduce_set, tasks):
+            logging.info("%s: %s [%.1f sec]", result['name'], result['status'], result['time'])
+            results.append(result)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    order = dict([(task['reduction_set']['name'], i) for i, task in enumerate(tasks)])
+    return sorted(results, key=lambda item: order[item['name']])
+
+
+def get_summary(results, total_time):
+    """
+        Return a summary table of the reduction results
+        :param list results: list of results returned by reduce_set()
+        :param float total_time: total processing time
+    """
+    width = max([len(item['name']) for item in results] + [4])
+    lines = ['%-*s  %6s  %4s  %9s  %s' % (width, 'Set', 'Status', 'Runs', 'Time[sec]', 'Files / Error')]
+    for item in results:
+        detail = str(len(item['files'])) if item['status'] == 'OK' else item['error']
+        lines.append('%-*s  %6s  %4s  %9.1f  %s' % (width, item['name'], item['status'],
+                                                    item['n_runs'], item['time'], detail))
+    n_failed = len([item for item in results if not item['status'] == 'OK'])
+    lines.append('%s sets reduced, %s failed, in %.1f sec' % (len(results) - n_failed, n_failed, total_time))
+    return '\n'.join(lines)
+
+
+def get_output_options(output_dir, formats, items, template=None):
+    """
+        Return the output options for the ProcessingWorkflow
+        :param str output_dir: output directory
+        :param list formats: list of output formats, from OUTPUT_FORMATS
+        :param list items: list of outputs, from OUTPUT_ITEMS
+        :param str template: output file name template
+    """
+    output_options = copy.deepcopy(DEFAULT_OPTIONS)
+    for key, option in list(OUTPUT_FORMATS.items()) + list(OUTPUT_ITEMS.items()):
+        output_options[option] = key in formats or key in items
+    output_options['output_directory'] = output_dir
+    if template is not None:
+        output_options['output_file_template'] = template
+    return output_options
+
+
+def main(argv=None):
+    """
+        Command line entry point. Returns the number of failed sets.
+    """
+    parser = argparse.ArgumentParser(description="Reduce sets of REF_M runs without the user interface")
+    parser.add_argument('inputs', nargs='*',
+                        help="reduced .dat files, or run lists such as 25001-25004,25010")
+    parser.add_argument('-o', '--output-dir', default=os.getcwd(), help="output directory")
+    parser.add_argument('-d', '--data-dir', default=os.getcwd(), help="directory of the data files for run lists")
+    parser.add_argument('-b', '--direct-beams', default='', help="direct beam runs to use with run lists")
+    parser.add_argument('-n', '--processes', type=int, default=max(multiprocessing.cpu_count() - 1, 1),
+                        help="number of sets to reduce in parallel")
+    parser.add_argument('-f', '--formats', default='ascii,mantid',
+                        help="comma-separated output formats: %s" % ','.join(sorted(OUTPUT_FORMATS)))
+    parser.add_argument('-e', '--export', default='specular',
+                        help="comma-separated outputs: %s" % ','.join(sorted(OUTPUT_ITEMS)))
+    parser.add_argument('-t', '--template', default=None, help="output file name template")
+    parser.add_argument('--log-dir', default=None, help="directory for the log of each set [output directory]")
+    parser.add_argument('--trace', action='store_true',
+                        help="write the timing of the processing stages of each set as a Chrome trace file")
+    parser.add_argument('--use-settings', action='store_true',
+                        help="use the options saved by the application as template configuration")
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help="watch the data directory and reduce new runs as they are written")
+    parser.add_argument('--settle-time', type=float, default=10.0,
+                        help="time, in seconds, a new file must remain unchanged before being reduced")
+    parser.add_argument('--include-existing', action='store_true',
+                        help="when watching, also reduce the runs already in the data directory")
+    args = parser.parse_args(argv)
+    if not args.inputs and not args.watch:
+        parser.error("Nothing to reduce: give reduced files, run lists or --watch")
+
+    formats = [item.strip() for item in args.formats.split(',') if item.strip()]
+    items = [item.strip() for item in args.export.split(',') if item.strip()]
+    for value, choices in [(formats, OUTPUT_FORMATS), (items, OUTPUT_ITEMS)]:
+        unknown = [item for item in value if item not in choices]
+        if unknown:
+            parser.error("Unknown choice: %s" % ','.join(unknown))
+
+    log_dir = args.log_dir or args.output_dir
+    for directory in [args.output_dir, log_dir]:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    configuration = get_base_configuration(args.use_settings)
+    output_options = get_output_options(args.output_dir, formats, items, args.template)
+
+    t_0 = time.time()
+    if args.watch:
+        from .auto_reduction import AutoReduction
+        service = AutoReduction(args.data_dir, configuration, output_options, log_dir,
+                                n_processes=args.processes, settle_time=args.settle_time,
+                                include_existing=args.include_existing, trace=args.trace)
+        try:
+            service.run()
+        except KeyboardInterrupt:
+            logging.info("Stopped watching %s", args.data_dir)
+        if service.results:
+            print(get_summary(service.results, time.time() - t_0))
+        return len([item for item in service.results if not item['status'] == 'OK'])
+
+    reduction_sets = get_reduction_sets(args.inputs, args.data_dir, parse_run_list(args.direct_beams))
+    tasks = [dict(reduction_set=item, configuration=configuration,
+                  output_options=get_set_output_options(output_options, item),
+                  log_dir=log_dir, trace=args.trace) for item in reduction_sets]
+    for task in tasks:
+        if not os.path.isdir(task['output_options']['output_directory']):
+            os.makedirs(task['output_options']['output_directory'])
+    results = run(tasks, args.processes)
+    print(get_summary(results, time.time() - t_0))
+    return len([item for item in results if not item['status'] == 'OK'])
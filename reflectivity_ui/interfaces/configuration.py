@@ -17,6 +17,103 @@ class Configuration(object):
     KZI_VS_KZF = 1
     DELTA_KZ_VS_QZ = 3
 
+    # Choice of reduction backend
+    REDUCTION_HISTOGRAM = 0
+    REDUCTION_EVENTS = 1
+
+    # Processing stages, in the order in which they are applied.
+    # Changing a parameter invalidates its stage and all the stages after it.
+    STAGE_BINNING = 'binning'
+    STAGE_ROI = 'roi'
+    STAGE_NORMALIZATION = 'normalization'
+    STAGE_SCALING = 'scaling'
+    STAGES = [STAGE_BINNING, STAGE_ROI, STAGE_NORMALIZATION, STAGE_SCALING]
+
+    # Stages applied to the processed data when it is plotted or exported.
+    # Changing their parameters does not invalidate any other stage.
+    STAGE_OFFSPEC = 'offspec'
+    STAGE_GISANS = 'gisans'
+    STAGE_DISPLAY = 'display'
+    OUTPUT_STAGES = [STAGE_OFFSPEC, STAGE_GISANS, STAGE_DISPLAY]
+
+    # Processing stage that each reduction parameter affects.
+    PARAMETER_STAGES = {
+        # Loading and TOF binning of the event data
+        'tof_bins': STAGE_BINNING,
+        'tof_range': STAGE_BINNING,
+        'tof_bin_type': STAGE_BINNING,
+        'tof_overwrite': STAGE_BINNING,
+        'wl_bandwidth': STAGE_BINNING,
+        'count_threshold': STAGE_BINNING,
+        # Regions of interest and geometry
+        'peak_position': STAGE_ROI,
+        'peak_width': STAGE_ROI,
+        'low_res_position': STAGE_ROI,
+        'low_res_width': STAGE_ROI,
+        'bck_position': STAGE_ROI,
+        'bck_width': STAGE_ROI,
+        'subtract_background': STAGE_ROI,
+        'use_constant_q': STAGE_ROI,
+        'use_dangle': STAGE_ROI,
+        'set_direct_pixel': STAGE_ROI,
+        'direct_pixel_overwrite': STAGE_ROI,
+        'set_direct_angle_offset': STAGE_ROI,
+        'direct_angle_offset_overwrite': STAGE_ROI,
+        'sample_size': STAGE_ROI,
+        'do_final_rebin': STAGE_ROI,
+        'final_rebin_step': STAGE_ROI,
+        'reduction_backend': STAGE_ROI,
+        # Options of the peak finding, which determines the regions of interest
+        'use_roi': STAGE_ROI,
+        'use_roi_bck': STAGE_ROI,
+        'use_tight_bck': STAGE_ROI,
+        'bck_offset': STAGE_ROI,
+        'update_peak_range': STAGE_ROI,
+        'force_peak_roi': STAGE_ROI,
+        'force_low_res_roi': STAGE_ROI,
+        'force_bck_roi': STAGE_ROI,
+        # Direct beam normalization
+        'normalization': STAGE_NORMALIZATION,
+        'match_direct_beam': STAGE_NORMALIZATION,
+        # Scaling and trimming of the final reflectivity
+        'scaling_factor': STAGE_SCALING,
+        'cut_first_n_points': STAGE_SCALING,
+        'cut_last_n_points': STAGE_SCALING,
+        'normalize_to_unity': STAGE_SCALING,
+        'total_reflectivity_q_cutoff': STAGE_SCALING,
+        'global_stitching': STAGE_SCALING,
+        # Off-specular binning, slicing and smoothing
+        'off_spec_x_axis': STAGE_OFFSPEC,
+        'off_spec_slice': STAGE_OFFSPEC,
+        'off_spec_qz_list': STAGE_OFFSPEC,
+        'off_spec_slice_qz_min': STAGE_OFFSPEC,
+        'off_spec_slice_qz_max': STAGE_OFFSPEC,
+        'off_spec_err_weight': STAGE_OFFSPEC,
+        'off_spec_nxbins': STAGE_OFFSPEC,
+        'off_spec_nybins': STAGE_OFFSPEC,
+        'apply_smoothing': STAGE_OFFSPEC,
+        'off_spec_sigmas': STAGE_OFFSPEC,
+        'off_spec_sigmax': STAGE_OFFSPEC,
+        'off_spec_sigmay': STAGE_OFFSPEC,
+        'off_spec_x_min': STAGE_OFFSPEC,
+        'off_spec_x_max': STAGE_OFFSPEC,
+        'off_spec_y_min': STAGE_OFFSPEC,
+        'off_spec_y_max': STAGE_OFFSPEC,
+        # GISANS binning
+        'gisans_wl_min': STAGE_GISANS,
+        'gisans_wl_max': STAGE_GISANS,
+        'gisans_wl_npts': STAGE_GISANS,
+        'gisans_qy_npts': STAGE_GISANS,
+        'gisans_qz_npts': STAGE_GISANS,
+        'gisans_use_pf': STAGE_GISANS,
+        # Plotting options
+        'normalize_x_tof': STAGE_DISPLAY,
+        'x_wl_map': STAGE_DISPLAY,
+        'angle_map': STAGE_DISPLAY,
+        'log_1d': STAGE_DISPLAY,
+        'log_2d': STAGE_DISPLAY,
+    }
+
     def __init__(self, settings=None):
         self.instrument = Instrument()
         # Number of TOF bins
@@ -73,6 +170,8 @@ class Configuration(object):
         # Normalize to unity when stitching
         self.normalize_to_unity = True
         self.total_reflectivity_q_cutoff = 0.01
+        # Fit all the scaling factors together when stitching
+        self.global_stitching = False
 
         # Cut first and last N points
         self.cut_first_n_points = 1
@@ -119,6 +218,9 @@ class Configuration(object):
         # Reduction options
         self.match_direct_beam = False
         self.normalization = None
+        # Compute the specular reflectivity from TOF histograms with
+        # MagnetismReflectometryReduction, or directly from the events
+        self.reduction_backend = Configuration.REDUCTION_HISTOGRAM
 
         if settings is not None:
             try:
@@ -159,6 +261,24 @@ class Configuration(object):
         self.bck_position = (value[1] + value[0]) / 2.0
         self.bck_width = value[1] - value[0] + 1
 
+    def changed_stages(self, other):
+        """
+            Return the set of processing stages that need to be recomputed
+            for data processed with another configuration to match this one.
+            :param Configuration other: configuration the data was processed with
+        """
+        if other is None:
+            return set(Configuration.STAGES + Configuration.OUTPUT_STAGES)
+        first_stage = len(Configuration.STAGES)
+        output_stages = set()
+        for param, stage in Configuration.PARAMETER_STAGES.items():
+            if not getattr(self, param) == getattr(other, param):
+                if stage in Configuration.OUTPUT_STAGES:
+                    output_stages.add(stage)
+                else:
+                    first_stage = min(first_stage, Configuration.STAGES.index(stage))
+        return set(Configuration.STAGES[first_stage:]) | output_stages
+
     def to_q_settings(self, settings):
         """
             Save configuration to QSettings
@@ -189,6 +309,7 @@ class Configuration(object):
         # Normalize to unity when stitching
         settings.setValue('normalize_to_unity', self.normalize_to_unity)
         settings.setValue('total_reflectivity_q_cutoff', self.total_reflectivity_q_cutoff)
+        settings.setValue('global_stitching', self.global_stitching)
 
         settings.setValue('normalize_x_tof', self.normalize_x_tof)
         settings.setValue('x_wl_map', self.x_wl_map)
@@ -205,6 +326,7 @@ class Configuration(object):
         settings.setValue('sample_size', self.sample_size)
         settings.setValue('do_final_rebin', self.do_final_rebin)
         settings.setValue('final_rebin_step', self.final_rebin_step)
+        settings.setValue('reduction_backend', self.reduction_backend)
 
         # Off-specular options
         settings.setValue('off_spec_x_axis', self.off_spec_x_axis)
@@ -271,6 +393,7 @@ class Configuration(object):
         # Normalize to unity when stitching
         self.normalize_to_unity = _verify_true('normalize_to_unity', self.normalize_to_unity)
         self.total_reflectivity_q_cutoff = float(settings.value('total_reflectivity_q_cutoff', self.total_reflectivity_q_cutoff))
+        self.global_stitching = _verify_true('global_stitching', self.global_stitching)
 
         self.normalize_x_tof = _verify_true('normalize_x_tof', self.normalize_x_tof)
         self.x_wl_map = _verify_true('x_wl_map', self.x_wl_map)
@@ -287,6 +410,7 @@ class Configuration(object):
         self.sample_size = float(settings.value('sample_size', self.sample_size))
         self.do_final_rebin = _verify_true('do_final_rebin', self.do_final_rebin)
         self.final_rebin_step = float(settings.value('final_rebin_step', self.final_rebin_step))
+        self.reduction_backend = int(settings.value('reduction_backend', self.reduction_backend))
 
         # Off-specular options
         self.off_spec_x_axis = int(settings.value('off_spec_x_axis', self.off_spec_x_axis))
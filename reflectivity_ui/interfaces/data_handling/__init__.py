@@ -1,6 +1,11 @@
 """
     Data handling using Mantid
 """
+#pylint: disable=bare-except
+import sys
+import os
+import logging
+
 class ApplicationConfiguration(object):
     """
         Application-level configuration
@@ -11,5 +16,45 @@ class ApplicationConfiguration(object):
     ANA_STATE = "AnalyzerState"
     ANA_VETO = "AnalyzerVeto"
 
-    def __init__(self):
+    def __init__(self, settings=None):
         self.mantid_path = '/opt/mantid42'
+
+        # Bin the events without Mantid to show a preview while a file is loading
+        self.load_preview = False
+
+        # On-disk cache of binned detector data, see cube_cache.configure
+        self.use_cube_cache = True
+        self.cube_cache_dir = os.path.join(os.path.expanduser('~'), '.refredm_cache')
+        self.cube_cache_size = 20 * 1024**3
+
+        # Chrome trace file with the timing of the processing stages, written when the application closes.
+        # It is only written if its path is given with the REFREDM_TRACE_FILE environment variable.
+        self.trace_file = os.environ.get('REFREDM_TRACE_FILE', None)
+
+        if settings is not None:
+            try:
+                self.from_q_settings(settings)
+            except:
+                logging.error("Could not process application settings\n  %s", sys.exc_info()[1])
+
+    def to_q_settings(self, settings):
+        """
+            Save configuration to QSettings
+            :param settings QSettings: QSettings object
+        """
+        settings.setValue('load_preview', self.load_preview)
+        settings.setValue('use_cube_cache', self.use_cube_cache)
+        settings.setValue('cube_cache_dir', self.cube_cache_dir)
+        settings.setValue('cube_cache_size', self.cube_cache_size)
+
+    def from_q_settings(self, settings):
+        """ Retrieve configuration from QSettings """
+        def _verify_true(parameter, default):
+            """ Utility function to read a bool """
+            _value = settings.value(parameter, str(default))
+            return str(_value).lower() == 'true'
+
+        self.load_preview = _verify_true('load_preview', self.load_preview)
+        self.use_cube_cache = _verify_true('use_cube_cache', self.use_cube_cache)
+        self.cube_cache_dir = str(settings.value('cube_cache_dir', self.cube_cache_dir))
+        self.cube_cache_size = int(settings.value('cube_cache_size', self.cube_cache_size))
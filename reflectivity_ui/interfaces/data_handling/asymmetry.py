@@ -0,0 +1,42 @@
+"""
+    Spin asymmetry between two cross-sections
+"""
+from __future__ import absolute_import, division, print_function
+import numpy as np
+
+
+def spin_asymmetry(p_data, m_data):
+    """
+        Compute the spin asymmetry SA = (R+ - R-) / (R+ + R-) and its uncertainty.
+
+        Each point of the plus state is matched with the first point of the
+        minus state at the same or higher Q, since the number of points may be
+        different if the last few points had no signal. Only points where both
+        reflectivities are positive are kept.
+
+        Returns an array with columns [Q, SA, dSA], followed by the extra
+        columns of the plus state.
+
+        :param numpy.ndarray p_data: plus state, with columns [Q, R, dR, ...] sorted by Q
+        :param numpy.ndarray m_data: minus state, with columns [Q, R, dR, ...] sorted by Q
+    """
+    p_data = np.asarray(p_data)
+    m_data = np.asarray(m_data)
+    n_columns = p_data.shape[1] if p_data.ndim == 2 else 3
+    if len(p_data) == 0 or len(m_data) == 0:
+        return np.zeros((0, n_columns))
+
+    i_m = np.searchsorted(m_data[:, 0], p_data[:, 0], side='left')
+    matched = i_m < len(m_data)
+    p_data = p_data[matched]
+    m_data = m_data[i_m[matched]]
+
+    p_r, p_dr = p_data[:, 1], p_data[:, 2]
+    m_r, m_dr = m_data[:, 1], m_data[:, 2]
+    good = (p_r > 0) & (m_r > 0)
+    p_r, p_dr, m_r, m_dr = p_r[good], p_dr[good], m_r[good], m_dr[good]
+
+    ratio = (p_r - m_r) / (p_r + m_r)
+    d_ratio = 2.0 / (p_r + m_r)**2
+    d_ratio *= np.sqrt(m_r**2 * p_dr**2 + p_r**2 * m_dr**2)
+    return np.column_stack([p_data[good, 0], ratio, d_ratio, p_data[good, 3:]])
@@ -0,0 +1,198 @@
+"""
+    On-disk cache of the binned [x, y, TOF] detector data.
+
+    Each entry is a directory holding the data, xydata and xtofdata arrays
+    of a cross-section as .npy files. Entries are keyed on the data file
+    (path, size and modification time), the cross-section, the settings used
+    to split the events into cross-sections and the TOF binning.
+    Cached data is memory-mapped when read back.
+    The least recently used entries are removed when the cache grows over its size budget.
+"""
+#pylint: disable=bare-except
+from __future__ import absolute_import, division, print_function
+import sys
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+import numpy as np
+
+from . import ApplicationConfiguration
+
+ARRAY_NAMES = ['data', 'xydata', 'xtofdata']
+
+
+class CubeCache(object):
+    """
+        Cache of binned detector data, stored in a local directory
+    """
+    def __init__(self, directory, max_size):
+        """
+            :param str directory: directory where the data is stored
+            :param int max_size: maximum size of the cache, in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+
+    @classmethod
+    def get_key(cls, file_path, cross_section, tof_edges, event_filter=None):
+        """
+            Return a unique key for a cross-section binned with the given TOF edges.
+            The size and modification time of the file are part of the key so that
+            data is not reused if a file is rewritten.
+
+            :param str file_path: path of the data file
+            :param str cross_section: cross-section ID
+            :param array tof_edges: TOF bin edges
+            :param list event_filter: settings used to split the events into cross-sections,
+                                      see Instrument.get_event_filter
+        """
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        tof_hash = hashlib.sha1(np.ascontiguousarray(tof_edges, dtype=float).tobytes()).hexdigest()
+        key = "%s|%s|%s|%s|%s|%s" % (file_path, stat.st_size, stat.st_mtime, cross_section,
+                                     str(event_filter), tof_hash)
+        return hashlib.sha1(key.encode('utf8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def contains(self, file_path, cross_section, tof_edges, event_filter=None):
+        """
+            Return True if the data for a cross-section is cached.
+
+            :param str file_path: path of the data file
+            :param str cross_section: cross-section ID
+            :param array tof_edges: TOF bin edges
+            :param list event_filter: settings used to split the events into cross-sections
+        """
+        try:
+            return os.path.isdir(self._entry_path(self.get_key(file_path, cross_section, tof_edges, event_filter)))
+        except:
+            return False
+
+    def load(self, file_path, cross_section, tof_edges, event_filter=None):
+        """
+            Return the memory-mapped (data, xydata, xtofdata) arrays for
+            a cross-section, or None if they are not cached.
+
+            :param str file_path: path of the data file
+            :param str cross_section: cross-section ID
+            :param array tof_edges: TOF bin edges
+            :param list event_filter: settings used to split the events into cross-sections
+        """
+        try:
+            entry = self._entry_path(self.get_key(file_path, cross_section, tof_edges, event_filter))
+            if not os.path.isdir(entry):
+                return None
+            arrays = tuple(np.load(os.path.join(entry, '%s.npy' % name), mmap_mode='r')
+                           for name in ARRAY_NAMES)
+            # Keep track of the last access to evict the least recently used entries
+            os.utime(entry, None)
+            return arrays
+        except:
+            logging.error("Could not read cached data for %s %s: %s", file_path, cross_section, sys.exc_info()[1])
+            return None
+
+    def store(self, file_path, cross_section, tof_edges, data, xydata, xtofdata, event_filter=None):
+        """
+            Store the binned data for a cross-section, and evict old entries as needed.
+
+            :param str file_path: path of the data file
+            :param str cross_section: cross-section ID
+            :param array tof_edges: TOF bin edges
+            :param array data: [x, y, TOF] array
+            :param array xydata: [y, x] projection
+            :param array xtofdata: [x, TOF] projection
+            :param list event_filter: settings used to split the events into cross-sections
+        """
+        if self.max_size <= 0:
+            return
+        tmp_dir = None
+        try:
+            entry = self._entry_path(self.get_key(file_path, cross_section, tof_edges, event_filter))
+            if os.path.isdir(entry):
+                return
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Write to a temporary directory first so that partial entries are never read
+            tmp_dir = tempfile.mkdtemp(dir=self.directory, prefix='.tmp_')
+            for name, array in zip(ARRAY_NAMES, [data, xydata, xtofdata]):
+                np.save(os.path.join(tmp_dir, '%s.npy' % name), array)
+            os.rename(tmp_dir, entry)
+            tmp_dir = None
+            self.evict()
+        except:
+            logging.error("Could not cache data for %s %s: %s", file_path, cross_section, sys.exc_info()[1])
+        finally:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def get_entries(self):
+        """
+            Return a list of (last access time, size, path) for each cache entry,
+            sorted from the least to the most recently used.
+        """
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for item in os.listdir(self.directory):
+            entry = os.path.join(self.directory, item)
+            if item.startswith('.') or not os.path.isdir(entry):
+                continue
+            size = sum([os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry)])
+            entries.append((os.path.getmtime(entry), size, entry))
+        return sorted(entries)
+
+    def get_size(self):
+        """
+            Return the total size of the cache, in bytes
+        """
+        return sum([entry[1] for entry in self.get_entries()])
+
+    def evict(self):
+        """
+            Remove the least recently used entries until the cache fits its size budget.
+        """
+        entries = self.get_entries()
+        total_size = sum([entry[1] for entry in entries])
+        for _, size, entry in entries:
+            if total_size <= self.max_size:
+                break
+            # Memory-mapped files still in use remain valid after removal on Linux
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
+
+    def clear(self):
+        """
+            Remove all cached data
+        """
+        for _, _, entry in self.get_entries():
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+_cube_cache = None
+_application_conf = None
+
+def configure(application_conf):
+    """
+        Set the application configuration that determines the location
+        and size of the cube cache, and whether it is used.
+        :param ApplicationConfiguration application_conf: application configuration
+    """
+    global _cube_cache, _application_conf #pylint: disable=global-statement
+    _application_conf = application_conf
+    _cube_cache = None
+
+def get_cube_cache():
+    """
+        Return the application cube cache, or None if it is disabled
+    """
+    global _cube_cache #pylint: disable=global-statement
+    application_conf = _application_conf if _application_conf is not None else ApplicationConfiguration()
+    if not application_conf.use_cube_cache:
+        return None
+    if _cube_cache is None:
+        _cube_cache = CubeCache(application_conf.cube_cache_dir, application_conf.cube_cache_size)
+    return _cube_cache
@@ -4,7 +4,6 @@
 #pylint: disable=too-few-public-methods, wrong-import-position, too-many-instance-attributes, wrong-import-order
 from __future__ import absolute_import, division, print_function
 import sys
-import time
 import logging
 import math
 import copy
@@ -13,6 +12,7 @@ import numpy as np
 from scipy import ndimage
 import scipy.optimize as opt
 from .peak_finding import find_peaks, peak_prominences, peak_widths
+from . import tracing
 
 # Import mantid according to the application configuration
 from . import ApplicationConfiguration
@@ -80,9 +80,8 @@ class DataInfo(object):
         self.tof_range = self.get_tof_range(ws)
         self.calculated_scattering_angle = 0.0
         self.theta_d = 0.0
-        t_0 = time.time()
-        self.determine_data_type(ws)
-        logging.info("INSPECT: %s sec" % (time.time()-t_0))
+        with tracing.span('DataInfo.determine_data_type', 'load', run=self.run_number, cross_section=cross_section):
+            self.determine_data_type(ws)
 
     def get_tof_range(self, ws):
         """
@@ -18,6 +18,7 @@ import mantid
 
 from .instrument import Instrument
 from .data_set import NexusMetaData
+from . import stitching
 
 
 def generate_short_script(reduction_list):
@@ -85,12 +86,13 @@ def generate_script(reduction_list, pol_state):
         script += '\n'
     return script
 
-def stitch_reflectivity(reduction_list, xs=None, normalize_to_unity=True, q_cutoff=0.01):
+def stitch_reflectivity(reduction_list, xs=None, normalize_to_unity=True, q_cutoff=0.01, global_fit=False):
     """
         Stitch and normalize data sets
 
         :param string xs: name of the cross-section to use
         :param bool normalize_to_unity: if True, the specular ridge will be normalized to 1
+        :param bool global_fit: if True, fit all the scaling factors together
     """
     if not reduction_list:
         return []
@@ -99,164 +101,33 @@ def stitch_reflectivity(reduction_list, xs=None, normalize_to_unity=True, q_cuto
     if xs is None:
         xs = reduction_list[0].cross_sections.keys()[0]
 
-    # First, determine the overall scaling factor as needed
-    scaling_factor = 1.0
-    if normalize_to_unity:
-        idx_list = reduction_list[0].cross_sections[xs].q < q_cutoff
-        total = 0
-        weights = 0
-        for i in range(len(reduction_list[0].cross_sections[xs]._r)):
-            if idx_list[i]:
-                w = 1.0 / float(reduction_list[0].cross_sections[xs]._dr[i])**2
-                total += w * float(reduction_list[0].cross_sections[xs]._r[i])
-                weights += w
-        if weights > 0 and total > 0:
-            scaling_factor = weights / total
-        reduction_list[0].set_parameter("scaling_factor", scaling_factor)
-    else:
-        scaling_factor = reduction_list[0].cross_sections[xs].configuration.scaling_factor
-
-    # Stitch the data sets together
-    _previous_ws = None
-    running_scale = scaling_factor
-    scaling_factors = [running_scale]
+    return stitching.stitch_reduction_list(reduction_list, xs, normalize_to_unity=normalize_to_unity,
+                                           q_cutoff=q_cutoff, cross_sections=[xs], global_fit=global_fit)
 
-    for i in range(len(reduction_list)):
-        n_total = len(reduction_list[i].cross_sections[xs].q)
-        p_0 = reduction_list[i].cross_sections[xs].configuration.cut_first_n_points
-        p_n = n_total - reduction_list[i].cross_sections[xs].configuration.cut_last_n_points
-        ws = api.CreateWorkspace(DataX=reduction_list[i].cross_sections[xs].q[p_0:p_n],
-                                 DataY=reduction_list[i].cross_sections[xs]._r[p_0:p_n],
-                                 DataE=reduction_list[i].cross_sections[xs]._dr[p_0:p_n])
-        ws.setDistribution(True)
-        ws = api.ConvertToHistogram(ws)
-        if _previous_ws is not None:
-            _, scale = api.Stitch1D(_previous_ws, ws)
-            running_scale *= scale
-            scaling_factors.append(running_scale)
-            reduction_list[i].set_parameter("scaling_factor", running_scale)
-        _previous_ws = api.CloneWorkspace(ws)
-
-    return scaling_factors
-
-def _prepare_workspace_for_stitching(cross_section, ws_name):
-    """
-        Create a workspace from a CrossSectionData object that we
-        can call Stitch1D on.
-        :param CrossSectionData cross_section: cross section data object
-    """
-    n_total = len(cross_section.q)
-    p_0 = cross_section.configuration.cut_first_n_points
-    p_n = n_total - cross_section.configuration.cut_last_n_points
-    ws = api.CreateWorkspace(DataX=cross_section.q[p_0:p_n],
-                             DataY=cross_section._r[p_0:p_n],
-                             DataE=cross_section._dr[p_0:p_n],
-                             OutputWorkspace=ws_name)
-    ws.setDistribution(True)
-    ws = api.ConvertToHistogram(ws, OutputWorkspace=ws_name)
-    return ws
-
-def smart_stitch_reflectivity(reduction_list, xs=None, normalize_to_unity=True, q_cutoff=0.01):
+def smart_stitch_reflectivity(reduction_list, xs=None, normalize_to_unity=True, q_cutoff=0.01, global_fit=False):
     """
-        Stitch and normalize data sets
+        Stitch and normalize data sets, using all the cross-sections
+        to determine the scaling factors.
 
         :param string xs: name of the cross-section to use for the first data set
         :param bool normalize_to_unity: if True, the specular ridge will be normalized to 1
+        :param bool global_fit: if True, fit all the scaling factors together
     """
-    if not reduction_list:
-        return []
-
-    # Select the cross-section we will use to determine the scaling factors
-    if xs is None:
-        xs = reduction_list[0].cross_sections.keys()[0]
-
-    # First, determine the overall scaling factor as needed
-    scaling_factor = 1.0
-    if normalize_to_unity:
-        idx_list = reduction_list[0].cross_sections[xs].q < q_cutoff
-        total = 0
-        weights = 0
-        for i in range(len(reduction_list[0].cross_sections[xs]._r)):
-            if idx_list[i]:
-                w = 1.0 / float(reduction_list[0].cross_sections[xs]._dr[i])**2
-                total += w * float(reduction_list[0].cross_sections[xs]._r[i])
-                weights += w
-        if weights > 0 and total > 0:
-            scaling_factor = weights / total
-        reduction_list[0].set_parameter("scaling_factor", scaling_factor)
-    else:
-        scaling_factor = reduction_list[0].cross_sections[xs].configuration.scaling_factor
-
-    # Stitch the data sets together
-    running_scale = scaling_factor
-    scaling_factors = [running_scale]
-
-    for i in range(len(reduction_list)-1):
-        # Pick the cross-section with the highest signal
-        xs = reduction_list[i+1].get_highest_cross_section()
-
-        # Low-Q data set
-        _previous_ws = _prepare_workspace_for_stitching(reduction_list[i].cross_sections[xs],
-                                                        "low_q_workspace")
-        # High-Q data set
-        ws = _prepare_workspace_for_stitching(reduction_list[i+1].cross_sections[xs],
-                                              "high_q_workspace")
-
-        _, scale = api.Stitch1D(_previous_ws, ws)
-        running_scale *= scale
-        scaling_factors.append(running_scale)
-        reduction_list[i+1].set_parameter("scaling_factor", running_scale)
-
-    return scaling_factors
+    return stitching.stitch_reduction_list(reduction_list, xs, normalize_to_unity=normalize_to_unity,
+                                           q_cutoff=q_cutoff, global_fit=global_fit)
 
 def merge_reflectivity(reduction_list, xs, q_min=0.001, q_step=-0.01):
     """
-        Combine the workspaces for a given cross-section into a single workspace.
-
-        TODO: trim workspaces
-            trim_first = [item.cross_sections[pol_state].configuration.cut_first_n_points for item in self.data_manager.reduction_list]
-            trim_last = [item.cross_sections[pol_state].configuration.cut_last_n_points for item in self.data_manager.reduction_list]
+        Combine the scaled and trimmed reflectivity for a given cross-section.
+        Returns the Q, R and dR arrays, or None if there is no data.
 
+        :param list reduction_list: list of NexusData objects
+        :param str xs: cross-section name
+        :param float q_min: lower edge of the Q grid
+        :param float q_step: Q bin width, or relative bin width if negative
     """
-    ws_list = []
-    scaling_factors = []
-    q_max = q_min
-
-    for i in range(len(reduction_list)):
-        # If we couldn't calculate the reflectivity, we won't have a workspace available
-        if reduction_list[i].cross_sections[xs].reflectivity_workspace is None:
-            continue
-
-        _, _q_max = reduction_list[i].get_q_range()
-        q_max = max(q_max, _q_max)
-        ws_name = str(reduction_list[i].cross_sections[xs].reflectivity_workspace)
-        # Stitch1DMany only scales workspaces relative to the first one
-        if i == 0:
-            api.Scale(InputWorkspace=ws_name, OutputWorkspace=ws_name+'_histo',
-                      factor=reduction_list[i].cross_sections[xs].configuration.scaling_factor,
-                      Operation='Multiply')
-            api.ConvertToHistogram(InputWorkspace=ws_name+'_histo', OutputWorkspace=ws_name+'_histo')
-        else:
-            scaling_factors.append(reduction_list[i].cross_sections[xs].configuration.scaling_factor)
-            api.ConvertToHistogram(InputWorkspace=ws_name, OutputWorkspace=ws_name+'_histo')
-        ws_list.append(ws_name+'_histo')
-        params = "%s, %s, %s" % (q_min, q_step, q_max)
-
-    if len(ws_list) > 1:
-        merged_ws, _ = api.Stitch1DMany(InputWorkspaces=ws_list, Params=params,
-                                        UseManualScaleFactors=True, ManualScaleFactors=scaling_factors,
-                                        OutputWorkspace=ws_name+"_merged")
-    elif len(ws_list) == 1:
-        merged_ws = api.CloneWorkspace(ws_list[0], OutputWorkspace=ws_name+"_merged")
-    else:
-        return None
-
-    # Remove temporary workspaces
-    for ws in ws_list:
-        api.DeleteWorkspace(ws)
-
-    api.SaveAscii(InputWorkspace=merged_ws, Filename="/tmp/test.txt")
-    return merged_ws
+    merged = stitching.merge_reduction_list(reduction_list, [xs], q_min=q_min, q_step=q_step)
+    return merged.get(xs, None)
 
 def get_scaled_workspaces(reduction_list, xs):
     """
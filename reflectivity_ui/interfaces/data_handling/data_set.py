@@ -9,7 +9,8 @@ import logging
 from collections import OrderedDict
 import copy
 import math
-import time
+import os
+import hashlib
 import numpy as np
 
 # Import mantid according to the application configuration
@@ -20,9 +21,15 @@ import mantid.simpleapi as api
 # Set Mantid logging level to warnings
 api.ConfigService.setLogLevel(3)
 
+from ..configuration import Configuration
 from .data_info import DataInfo
+from . import event_reader
+from .cube_cache import get_cube_cache
 from . import off_specular
 from . import gisans
+from . import preview
+from . import event_reduction
+from . import tracing
 
 ### Parameters needed for some calculations.
 H_OVER_M_NEUTRON = 3.956034e-7 # h/m_n [m^2/s]
@@ -31,27 +38,35 @@ H_OVER_M_NEUTRON = 3.956034e-7 # h/m_n [m^2/s]
 #TODO: This should be a parameter
 N_EVENTS_CUTOFF = 100
 
+# Number of reduction results kept for each data set, see NexusData.calculate_reflectivity
+REDUCTION_MEMO_SIZE = 8
+
 def getIxyt(nxs_data):
     """
         Return [x, y, TOF] array
         @param nxs_data: Mantid workspace
     """
-    _tof_axis = nxs_data.readX(0)[:].copy()
-    nbr_tof = len(_tof_axis)
-
     sz_y_axis = int(nxs_data.getInstrument().getNumberParameter("number-of-y-pixels")[0]) #256
     sz_x_axis = int(nxs_data.getInstrument().getNumberParameter("number-of-x-pixels")[0]) #304
 
-    _y_axis = np.zeros((sz_x_axis, sz_y_axis, nbr_tof-1))
-    #_y_error_axis = np.zeros((sz_x_axis, sz_y_axis, nbr_tof-1))
-
-    for x in range(sz_x_axis):
-        for y in range(sz_y_axis):
-            _index = int(sz_y_axis*x+y)
-            _tmp_data = nxs_data.readY(_index)[:]
-            _y_axis[x, y, :] = _tmp_data
+    # The workspace index of pixel (x, y) is sz_y_axis*x+y, so the
+    # [spectrum, TOF] array extracted in one call can be reshaped in place.
+    _y_axis = nxs_data.extractY()[:sz_x_axis*sz_y_axis]
+    return _y_axis.reshape(sz_x_axis, sz_y_axis, nxs_data.blocksize())
 
-    return _y_axis
+def get_tof_edges(configuration):
+    """
+        Return the TOF bin edges for a given configuration
+        :param Configuration configuration: reduction configuration
+    """
+    #TODO: only the TOF binning is implemented
+    if configuration.tof_overwrite is not None:
+        return configuration.tof_overwrite
+    if configuration.tof_bin_type == 1: # constant Q
+        return 1./np.linspace(1./configuration.tof_range[0], 1./configuration.tof_range[1], configuration.tof_bins+1)
+    elif configuration.tof_bin_type == 2: # constant 1/wavelength
+        return configuration.tof_range[0]*(((configuration.tof_range[1]/configuration.tof_range[0])**(1./configuration.tof_bins))**np.arange(configuration.tof_bins+1))
+    return np.arange(configuration.tof_range[0], configuration.tof_range[1], configuration.tof_bins)
 
 class NexusData(object):
     """
@@ -63,6 +78,10 @@ class NexusData(object):
         self.configuration = configuration
         self.cross_sections = {}
         self.main_cross_section = None
+        # True if the data was binned by load_preview and has no Mantid workspaces
+        self.is_preview = False
+        # Results of previous reductions, keyed on their inputs
+        self._reduction_memo = OrderedDict()
 
     @property
     def nbytes(self):
@@ -74,6 +93,103 @@ class NexusData(object):
             total_size += self.cross_sections[d].nbytes
         return total_size
 
+    @property
+    def memory_size(self):
+        """
+            Approximate memory used by the data, including the Mantid workspaces
+        """
+        total_size = 0
+        for xs in self.cross_sections:
+            total_size += self.cross_sections[xs].memory_size
+        for name in self._get_memo_workspaces():
+            total_size += api.mtd[name].getMemorySize()
+        return total_size
+
+    def release_workspaces(self):
+        """
+            Delete the Mantid workspaces associated with this data set
+        """
+        for xs in self.cross_sections:
+            self.cross_sections[xs].release_workspaces()
+        if "r%s" % self.number in api.mtd:
+            api.DeleteWorkspace("r%s" % self.number)
+        for name in self._get_memo_workspaces():
+            api.DeleteWorkspace(name)
+        self._reduction_memo.clear()
+
+    def _get_memo_workspaces(self, key=None):
+        """
+            Names of the workspaces holding memoized reduction results
+            :param str key: if given, only return the workspaces for this memo entry
+        """
+        keys = self._reduction_memo.keys() if key is None else [key]
+        names = []
+        for _key in keys:
+            for xs_id in self._reduction_memo[_key]:
+                names.append(self._reduction_memo[_key][xs_id][4])
+        return [name for name in names if name in api.mtd]
+
+    def _get_reduction_key(self, conf, direct_beam, ws_norm, ws_list):
+        """
+            Return a key identifying the inputs of a reduction.
+            The scaling and trimming parameters, and the output options, are
+            applied after the reduction and are not part of the key.
+            :param Configuration conf: configuration used for the reduction
+            :param CrossSectionData direct_beam: direct beam data
+            :param str ws_norm: name of the direct beam workspace, or None
+            :param list ws_list: names of the workspaces to reduce
+        """
+        reduction_stages = [Configuration.STAGE_BINNING, Configuration.STAGE_ROI, Configuration.STAGE_NORMALIZATION]
+        parameters = [(param, getattr(conf, param)) for param in sorted(Configuration.PARAMETER_STAGES)
+                      if Configuration.PARAMETER_STAGES[param] in reduction_stages]
+        norm = [direct_beam.number, str(ws_norm), direct_beam.configuration.peak_roi,
+                direct_beam.configuration.bck_roi, direct_beam.configuration.low_res_roi]
+        key = "%s|%s|%s" % (str(parameters), str(norm), str([str(ws) for ws in ws_list]))
+        return hashlib.sha1(key.encode('utf8')).hexdigest()
+
+    def _restore_reduction(self, key, output_ws):
+        """
+            Set the reflectivity of each cross-section from a memoized reduction,
+            and copy the saved workspaces back to the output workspaces.
+            :param str key: memo key
+            :param str output_ws: name of the output workspace (group)
+        """
+        ws_names = []
+        for xs_id in self._reduction_memo[key]:
+            q, _r, _dr, ws_name, memo_ws = self._reduction_memo[key][xs_id]
+            api.CloneWorkspace(InputWorkspace=memo_ws, OutputWorkspace=ws_name)
+            ws_names.append(ws_name)
+            self.cross_sections[xs_id].q = q.copy()
+            self.cross_sections[xs_id]._r = _r.copy()
+            self.cross_sections[xs_id]._dr = _dr.copy()
+            self.cross_sections[xs_id].preview = None
+            self.cross_sections[xs_id]._reflectivity_workspace = ws_name
+        if len(ws_names) > 1:
+            api.GroupWorkspaces(InputWorkspaces=ws_names, OutputWorkspace=output_ws)
+        self._reduction_memo[key] = self._reduction_memo.pop(key)
+
+    def _store_reduction(self, key):
+        """
+            Save the reduction results of each cross-section, and remove
+            the oldest saved results if we have too many.
+            :param str key: memo key
+        """
+        entry = OrderedDict()
+        for xs in self.cross_sections:
+            ws_name = self.cross_sections[xs]._reflectivity_workspace
+            if ws_name is None or self.cross_sections[xs].q is None:
+                continue
+            memo_ws = "%s_memo_%s" % (ws_name, key[:8])
+            api.CloneWorkspace(InputWorkspace=ws_name, OutputWorkspace=memo_ws)
+            entry[xs] = (self.cross_sections[xs].q.copy(), self.cross_sections[xs]._r.copy(),
+                         self.cross_sections[xs]._dr.copy(), ws_name, memo_ws)
+        self._reduction_memo[key] = entry
+        while len(self._reduction_memo) > REDUCTION_MEMO_SIZE:
+            _key = next(iter(self._reduction_memo))
+            for name in self._get_memo_workspaces(_key):
+                api.DeleteWorkspace(name)
+            del self._reduction_memo[_key]
+
     def get_highest_cross_section(self, n_points=10):
         """
             Get the cross-section with the largest signal at the
@@ -144,8 +260,6 @@ class NexusData(object):
         logging.info("%s Reduction with DB: %s [config: %s]",
                      self.number, direct_beam.number,
                      self.configuration.normalization)
-        angle_offset = 0 # Offset from dangle0, in radians
-        def _as_ints(a): return [int(round(a[0])), int(round(a[1])) - 1]
         output_ws = "r%s" % self.number
 
         ws_norm = None
@@ -154,6 +268,46 @@ class NexusData(object):
 
         ws_list = [self.cross_sections[xs]._event_workspace for xs in self.cross_sections]
         conf = self.cross_sections[self.main_cross_section].configuration
+
+        with tracing.span('NexusData.calculate_reflectivity', 'reduction', run=self.number,
+                          backend=conf.reduction_backend) as _span:
+            # Reuse the results of a previous reduction with the same inputs
+            memo_key = self._get_reduction_key(conf, direct_beam, ws_norm, ws_list)
+            if memo_key in self._reduction_memo:
+                try:
+                    self._restore_reduction(memo_key, output_ws)
+                    logging.info("%s Reduction results reused", self.number)
+                    _span.set(reused=True)
+                    return
+                except:
+                    logging.error("Could not reuse reduction results for %s: %s", self.number, sys.exc_value)
+                    for name in self._get_memo_workspaces(memo_key):
+                        api.DeleteWorkspace(name)
+                    del self._reduction_memo[memo_key]
+
+            if conf.reduction_backend == Configuration.REDUCTION_EVENTS:
+                self._reduce_events(conf, direct_beam if apply_norm else None, output_ws)
+            else:
+                self._reduce_histograms(conf, direct_beam, apply_norm, ws_norm, ws_list, output_ws)
+
+            try:
+                self._store_reduction(memo_key)
+            except:
+                logging.error("Could not save reduction results for %s: %s", self.number, sys.exc_value)
+
+    def _reduce_histograms(self, conf, direct_beam, apply_norm, ws_norm, ws_list, output_ws):
+        """
+            Compute the reflectivity of all cross-sections with MagnetismReflectometryReduction
+            :param Configuration conf: reduction options
+            :param CrossSectionData direct_beam: direct beam data
+            :param bool apply_norm: if True, the direct beam will be used for normalization
+            :param str ws_norm: name of the direct beam workspace
+            :param list ws_list: names of the workspaces to reduce
+            :param str output_ws: name of the output workspace
+        """
+        angle_offset = 0 # Offset from dangle0, in radians
+        def _as_ints(a): return [int(round(a[0])), int(round(a[1])) - 1]
+
         wsg = api.GroupWorkspaces(InputWorkspaces=ws_list)
 
         _dirpix = conf.direct_pixel_overwrite if conf.set_direct_pixel else None
@@ -221,8 +375,33 @@ class NexusData(object):
             self.cross_sections[xs_id].q = xs.readX(0)[:].copy()
             self.cross_sections[xs_id]._r = xs.readY(0)[:].copy()
             self.cross_sections[xs_id]._dr = xs.readE(0)[:].copy()
+            self.cross_sections[xs_id].preview = None
             self.cross_sections[xs_id]._reflectivity_workspace = str(xs)
 
+    def _reduce_events(self, conf, direct_beam, output_ws):
+        """
+            Compute the reflectivity of all cross-sections from the events,
+            see event_reduction.EventReflectivity
+            :param Configuration conf: reduction options
+            :param CrossSectionData direct_beam: direct beam data, or None
+            :param str output_ws: name of the output workspace
+        """
+        ws_names = []
+        for xs in self.cross_sections:
+            reduction = event_reduction.EventReflectivity(self.cross_sections[xs], direct_beam=direct_beam,
+                                                          configuration=conf)
+            q, _r, _dr = reduction.specular()
+            ws_name = "%s_%s" % (output_ws, xs) if len(self.cross_sections) > 1 else output_ws
+            reduction.create_workspace(q, _r, _dr, ws_name)
+            ws_names.append(ws_name)
+            self.cross_sections[xs].q = q
+            self.cross_sections[xs]._r = _r
+            self.cross_sections[xs]._dr = _dr
+            self.cross_sections[xs].preview = None
+            self.cross_sections[xs]._reflectivity_workspace = ws_name
+        if len(ws_names) > 1:
+            api.GroupWorkspaces(InputWorkspaces=ws_names, OutputWorkspace=output_ws)
+
     def calculate_gisans(self, direct_beam, progress=None):
         """
             Compute GISANS
@@ -284,12 +463,16 @@ class NexusData(object):
         """
             Loop through the cross-section data sets and update
             the reflectivity.
+            Returns the set of processing stages that need to be recomputed.
         """
+        stages = set()
         for xs in self.cross_sections:
             try:
-                self.cross_sections[xs].update_configuration(configuration)
+                stages |= self.cross_sections[xs].update_configuration(configuration)
             except:
+                stages |= set(Configuration.STAGES + Configuration.OUTPUT_STAGES)
                 logging.error("Could not update configuration for %s\n  %s", xs, sys.exc_value)
+        return stages
 
     def update_calculated_values(self):
         """
@@ -298,65 +481,131 @@ class NexusData(object):
         for xs in self.cross_sections:
             self.cross_sections[xs].update_calculated_values()
 
-    def load(self, update_parameters=True, progress=None):
+    def load_preview(self, progress=None):
         """
-            Load cross-sections from a nexus file.
+            Bin the events of each cross-section directly from the event nexus file,
+            without loading the events in Mantid. The cross-sections can be plotted
+            and used for the NumPy-side calculations, but not for the Mantid reduction.
+            Use load() to get the full data.
+            Nothing is loaded if the binned data is already in the cube cache.
             :param function progress: call-back function to track progress
-            :param bool update_parameters: if True, we will find peak ranges
         """
+        self.is_preview = True
         self.cross_sections = OrderedDict()
-        if progress is not None:
-            progress(5, "Filtering data...", out_of=100.0)
-
         try:
-            xs_list = self.configuration.instrument.load_data(self.file_path)
-            logging.info("%s loaded: %s xs", self.file_path, len(xs_list))
+            with tracing.span('NexusData.load_preview', 'load', file=os.path.basename(self.file_path),
+                              nbytes=os.path.getsize(self.file_path)) as _span:
+                logs, log_units = event_reader.read_logs(self.file_path)
+                _span.set(run=logs.get('run_number', 0))
+                configuration = copy.deepcopy(self.configuration)
+                configuration.tof_range = event_reader.get_tof_range(logs, log_units, configuration.wl_bandwidth)
+                tof_edges = get_tof_edges(configuration)
+                # The full data will load quickly if it was binned in a previous session
+                cube_cache = get_cube_cache()
+                if cube_cache is not None and \
+                    any([cube_cache.contains(self.file_path, name, tof_edges,
+                                             configuration.instrument.get_event_filter())
+                         for name in event_reader.STATES]):
+                    _span.set(cached=True)
+                    return self.cross_sections
+                histograms = event_reader.read_event_histograms(self.file_path, tof_edges,
+                                                                n_x_pixel=configuration.instrument.n_x_pixel,
+                                                                n_y_pixel=configuration.instrument.n_y_pixel,
+                                                                progress=progress)
         except:
-            logging.error("Could not load file %s\n  %s", str(self.file_path), sys.exc_value)
+            logging.error("Could not read events from %s\n  %s", str(self.file_path), sys.exc_value)
             return self.cross_sections
 
-        progress_value = 0
-        # Keep track of cross-section with max counts so we can use it to
-        # select peak regions
-        _max_counts = 0
-        _max_xs = None
-        for ws in xs_list:
-            # Get the unique name for the cross-section, determined by the filtering
-            channel = ws.getRun().getProperty("cross_section_id").value
-            if progress is not None:
-                progress_value += int(100.0/len(xs_list))
-                progress(progress_value, "Loading %s..." % str(channel), out_of=100.0)
-
-            # Get rid of emty workspaces
-            logging.info("Loading %s: %s events", str(channel), ws.getNumberEvents())
-            if ws.getNumberEvents() < N_EVENTS_CUTOFF:
-                logging.warn("Too few events for %s: %s", channel, ws.getNumberEvents())
+        for name in histograms:
+            counts, proton_charge, n_events = histograms[name]
+            if n_events < N_EVENTS_CUTOFF:
+                logging.warn("Too few events for %s: %s", name, n_events)
                 continue
-
-            name = ws.getRun().getProperty("cross_section_id").value
-            cross_section = CrossSectionData(name, self.configuration, entry_name=channel, workspace=ws)
+            cross_section = CrossSectionData(name, configuration, entry_name=name)
+            cross_section.file_path = self.file_path
+            cross_section.logs = logs
+            cross_section.log_units = log_units
+            cross_section.number = logs.get('run_number', 0)
+            cross_section.proton_charge = proton_charge
+            cross_section.total_counts = n_events
+            cross_section.set_preview_info(logs, log_units)
+            cross_section.tof_edges = tof_edges
+            cross_section.set_histogram_data(counts)
             self.cross_sections[name] = cross_section
             self.number = cross_section.number
-            if cross_section.total_counts > _max_counts:
-                _max_counts = cross_section.total_counts
-                _max_xs = name
 
-        # Now that we know which cross section has the most data,
-        # use that one to get the reduction parameters
-        self.main_cross_section = _max_xs
-        self.cross_sections[_max_xs].get_reduction_parameters(update_parameters=update_parameters)
+        if len(self.cross_sections) > 0:
+            self.main_cross_section = max(self.cross_sections, key=lambda xs: self.cross_sections[xs].total_counts)
+        return self.cross_sections
 
-        # Push the configuration (reduction options and peak regions) from the
-        # cross-section with the most data to all other cross-sections.
-        for xs in self.cross_sections:
-            if xs == _max_xs:
-                continue
-            self.cross_sections[xs].update_configuration(self.cross_sections[_max_xs].configuration)
+    def load(self, update_parameters=True, progress=None):
+        """
+            Load cross-sections from a nexus file.
+            :param function progress: call-back function to track progress
+            :param bool update_parameters: if True, we will find peak ranges
+        """
+        with tracing.span('NexusData.load', 'load', file=os.path.basename(self.file_path)) as _span:
+            self.is_preview = False
+            self.cross_sections = OrderedDict()
+            if progress is not None:
+                progress(5, "Filtering data...", out_of=100.0)
 
-        if progress is not None:
-            progress(100, "Complete", out_of=100.0)
+            try:
+                with tracing.span('Instrument.load_data', 'load', file=os.path.basename(self.file_path),
+                                  nbytes=os.path.getsize(self.file_path)):
+                    xs_list = self.configuration.instrument.load_data(self.file_path)
+                logging.info("%s loaded: %s xs", self.file_path, len(xs_list))
+            except:
+                logging.error("Could not load file %s\n  %s", str(self.file_path), sys.exc_value)
+                return self.cross_sections
+
+            progress_value = 0
+            # Keep track of cross-section with max counts so we can use it to
+            # select peak regions
+            _max_counts = 0
+            _max_xs = None
+            for ws in xs_list:
+                # Get the unique name for the cross-section, determined by the filtering
+                channel = ws.getRun().getProperty("cross_section_id").value
+                if progress is not None:
+                    progress_value += int(100.0/len(xs_list))
+                    progress(progress_value, "Loading %s..." % str(channel), out_of=100.0)
+
+                # Get rid of emty workspaces
+                logging.info("Loading %s: %s events", str(channel), ws.getNumberEvents())
+                if ws.getNumberEvents() < N_EVENTS_CUTOFF:
+                    logging.warn("Too few events for %s: %s", channel, ws.getNumberEvents())
+                    continue
+
+                name = ws.getRun().getProperty("cross_section_id").value
+                cross_section = CrossSectionData(name, self.configuration, entry_name=channel, workspace=ws)
+                cross_section.file_path = self.file_path
+                self.cross_sections[name] = cross_section
+                self.number = cross_section.number
+                if cross_section.total_counts > _max_counts:
+                    _max_counts = cross_section.total_counts
+                    _max_xs = name
+
+            _span.set(run=self.number, n_cross_sections=len(self.cross_sections))
+
+            # Now that we know which cross section has the most data,
+            # use that one to get the reduction parameters
+            self.main_cross_section = _max_xs
+            with tracing.span('CrossSectionData.get_reduction_parameters', 'load',
+                              run=self.number, cross_section=_max_xs):
+                self.cross_sections[_max_xs].get_reduction_parameters(update_parameters=update_parameters)
+
+            # Push the configuration (reduction options and peak regions) from the
+            # cross-section with the most data to all other cross-sections.
+            for xs in self.cross_sections:
+                if xs == _max_xs:
+                    continue
+                self.cross_sections[xs].update_configuration(self.cross_sections[_max_xs].configuration)
 
-        return self.cross_sections
+            if progress is not None:
+                progress(100, "Complete", out_of=100.0)
+
+            return self.cross_sections
 
 
 class CrossSectionData(object):
@@ -377,6 +626,7 @@ class CrossSectionData(object):
     def __init__(self, name, configuration, entry_name='entry', workspace=None):
         self.name = name
         self.entry_name = entry_name
+        self.file_path = None
         self.cross_section_label = entry_name
         self.measurement_type = 'polarized'
         self.configuration = copy.deepcopy(configuration)
@@ -384,6 +634,8 @@ class CrossSectionData(object):
         self.q = None
         self._r = None
         self._dr = None
+        # Fast estimate of the reflectivity, displayed until the reduction is done
+        self.preview = None
         self._event_workspace = None
         # Flag to tell us whether we succeeded in using the meta data ROI
         self.use_roi_actual = True
@@ -406,6 +658,8 @@ class CrossSectionData(object):
         self.data = None
         self.xydata = None
         self.xtofdata = None
+        # Summed-area table of the data, for fast ROI sums
+        self._roi_integral = None
 
         self.meta_data_roi_peak = None
         self.meta_data_roi_bck = None
@@ -414,6 +668,10 @@ class CrossSectionData(object):
         self.scattering_angle = 0
         self._reflectivity_workspace = None
 
+        # Copy of the configuration used to process the data,
+        # used to determine what needs to be recomputed when it changes
+        self._processed_configuration = None
+
         # Offset data
         self.off_spec = None
 
@@ -469,7 +727,40 @@ class CrossSectionData(object):
         self._angle_offset = value
 
     @property
-    def nbytes(self): return self.data.nbytes
+    def nbytes(self):
+        # Memory-mapped arrays don't count since they can be paged out
+        return sum([item.nbytes for item in [self.data, self.xydata, self.xtofdata, self._roi_integral]
+                    if item is not None and not isinstance(item, np.memmap)])
+
+    @property
+    def workspace_names(self):
+        """
+            Names of the Mantid workspaces associated with this cross-section
+        """
+        names = []
+        if self._event_workspace is not None:
+            names.append(str(self._event_workspace))
+        if self._reflectivity_workspace is not None:
+            ws_name = str(self._reflectivity_workspace)
+            names.extend([ws_name, ws_name+'_histo', ws_name+'_scaled'])
+        return [name for name in names if name in api.mtd]
+
+    @property
+    def memory_size(self):
+        """
+            Approximate memory used by the data, including the Mantid workspaces
+        """
+        total_size = self.nbytes
+        for name in self.workspace_names:
+            total_size += api.mtd[name].getMemorySize()
+        return total_size
+
+    def release_workspaces(self):
+        """
+            Delete the Mantid workspaces associated with this cross-section
+        """
+        for name in self.workspace_names:
+            api.DeleteWorkspace(name)
 
     @property
     def xdata(self): return self.xydata.mean(axis=0)
@@ -612,37 +903,76 @@ class CrossSectionData(object):
         self.scattering_angle = self.configuration.instrument.scattering_angle_from_data(self)
 
         # Determine binning
-        #TODO: only the TOF binning is implemented
-        if self.configuration.tof_overwrite is not None:
-            tof_edges = self.configuration.tof_overwrite
-        else:
-            if self.configuration.tof_bin_type == 1: # constant Q
-                tof_edges = 1./np.linspace(1./self.configuration.tof_range[0], 1./self.configuration.tof_range[1], self.configuration.tof_bins+1)
-            elif self.configuration.tof_bin_type == 2: # constant 1/wavelength
-                tof_edges = self.configuration.tof_range[0]*(((self.configuration.tof_range[1]/self.configuration.tof_range[0])**(1./self.configuration.tof_bins))**np.arange(self.configuration.tof_bins+1))
-            else:
-                tof_edges = np.arange(self.configuration.tof_range[0], self.configuration.tof_range[1], self.configuration.tof_bins)
-        self.tof_edges = tof_edges
+        self.tof_edges = get_tof_edges(self.configuration)
+        self._processed_configuration = copy.deepcopy(self.configuration)
 
     def prepare_plot_data(self):
         """
             Bin events to be used for plotting and in-app calculations
         """
-        workspace = api.mtd[self._event_workspace]
         if self.xtofdata is None:
-            t_0 = time.time()
-            binning_ws = api.CreateWorkspace(DataX=self.tof_edges, DataY=np.zeros(len(self.tof_edges)-1))
-            data_rebinned = api.RebinToWorkspace(WorkspaceToRebin=workspace, WorkspaceToMatch=binning_ws)
-            Ixyt = getIxyt(data_rebinned)
-
-            # Create projections for the 2D datasets
-            Ixy = Ixyt.sum(axis=2)
-            Ixt = Ixyt.sum(axis=1)
-            # Store the data
-            self.data = Ixyt.astype(float) # 3D dataset
-            self.xydata = Ixy.transpose().astype(float) # 2D dataset
-            self.xtofdata = Ixt.astype(float) # 2D dataset
-            logging.info("Plot data generated: %s sec", time.time()-t_0)
+            with tracing.span('CrossSectionData.prepare_plot_data', 'load', run=self.number,
+                              cross_section=self.name) as _span:
+                # Use the binned data from a previous session if we have it
+                cube_cache = get_cube_cache() if self.file_path is not None else None
+                if cube_cache is not None:
+                    cached = cube_cache.load(self.file_path, self.name, self.tof_edges,
+                                             self.configuration.instrument.get_event_filter())
+                    if cached is not None:
+                        self.data, self.xydata, self.xtofdata = cached
+                        self._roi_integral = None
+                        _span.set(cached=True)
+                        _span.add_bytes(self.data.nbytes)
+                        return
+
+                workspace = api.mtd[self._event_workspace]
+                binning_ws = api.CreateWorkspace(DataX=self.tof_edges, DataY=np.zeros(len(self.tof_edges)-1))
+                data_rebinned = api.RebinToWorkspace(WorkspaceToRebin=workspace, WorkspaceToMatch=binning_ws)
+                # extractY() already returns a float array, no need to copy it
+                self.set_histogram_data(getIxyt(data_rebinned))
+                _span.set(cached=False)
+                _span.add_bytes(self.data.nbytes)
+                if cube_cache is not None:
+                    cube_cache.store(self.file_path, self.name, self.tof_edges,
+                                     self.data, self.xydata, self.xtofdata,
+                                     event_filter=self.configuration.instrument.get_event_filter())
+
+    def set_preview_info(self, logs, log_units):
+        """
+            Fill the instrument information from the DAS logs read by event_reader,
+            for data loaded without a workspace. See Instrument.get_info.
+            :param dict logs: log values returned by event_reader.read_logs
+            :param dict log_units: log units returned by event_reader.read_logs
+        """
+        instrument = self.configuration.instrument
+        self.lambda_center = logs.get('LambdaRequest', 0)
+        self.dangle = logs.get('DANGLE', 0)
+        self.sangle = logs.get('SANGLE', 0)
+        self.angle_offset = logs.get('DANGLE0', 0)
+        self.direct_pixel = logs.get('DIRPIX', 0)
+        if 'SampleDetDis' in logs:
+            self.dist_sam_det = event_reader.get_distance(logs, log_units, 'SampleDetDis')
+        if 'ModeratorSamDis' in logs:
+            dist_mod_sam = event_reader.get_distance(logs, log_units, 'ModeratorSamDis')
+            self.dist_mod_det = dist_mod_sam + self.dist_sam_det
+            self.dist_mod_mon = dist_mod_sam - 2.75
+
+        self.pixel_width = instrument.pixel_width
+        self.n_det_size_x = instrument.n_x_pixel
+        self.n_det_size_y = instrument.n_y_pixel
+        self.det_size_x = self.n_det_size_x * self.pixel_width # horizontal size of detector [m]
+        self.det_size_y = self.n_det_size_y * self.pixel_width # vertical size of detector [m]
+
+    def set_histogram_data(self, data):
+        """
+            Store the [x, y, TOF] data and create the projections used for plotting.
+            :param array data: 3D array of counts binned according to tof_edges
+        """
+        self.data = data # 3D dataset
+        self._roi_integral = None
+        # Create projections for the 2D datasets
+        self.xydata = data.sum(axis=2).transpose() # 2D dataset
+        self.xtofdata = data.sum(axis=1) # 2D dataset
 
     def get_reduction_parameters(self, update_parameters=True):
         """
@@ -671,38 +1001,72 @@ class CrossSectionData(object):
                 self.configuration.bck_roi = data_info.background
         self.process_configuration()
 
+    def get_roi_integral(self):
+        """
+            Return the summed-area table of the data over x and y, for each TOF bin.
+            Element [i, j, t] is the sum of data[:i, :j, t], so that the counts
+            in any rectangular region are obtained from four elements.
+        """
+        self.prepare_plot_data()
+        if self._roi_integral is None:
+            n_x, n_y, n_tof = self.data.shape
+            integral = np.zeros((n_x+1, n_y+1, n_tof))
+            np.cumsum(self.data, axis=0, out=integral[1:, 1:, :])
+            np.cumsum(integral[1:, 1:, :], axis=1, out=integral[1:, 1:, :])
+            self._roi_integral = integral
+        return self._roi_integral
+
+    def get_roi_counts(self, x_range, y_range):
+        """
+            Return the counts vs TOF summed over a rectangular region of the detector.
+            The ranges are clipped to the detector.
+            :param list x_range: [min, max[ pixel range in x
+            :param list y_range: [min, max[ pixel range in y
+        """
+        integral = self.get_roi_integral()
+        x_min, x_max = [int(min(max(x, 0), integral.shape[0]-1)) for x in x_range]
+        y_min, y_max = [int(min(max(y, 0), integral.shape[1]-1)) for y in y_range]
+        if x_max <= x_min or y_max <= y_min:
+            return np.zeros(integral.shape[2])
+        return integral[x_max, y_max] - integral[x_min, y_max] - integral[x_max, y_min] + integral[x_min, y_min]
+
     def get_counts_vs_TOF(self):
         """
             Used for normalization, returns ROI counts vs TOF.
         """
-        self.prepare_plot_data()
         # Calculate ROI intensities and normalize by number of points
-        raw_data = self.data[self.configuration.peak_roi[0]:self.configuration.peak_roi[1],
-                             self.configuration.low_res_roi[0]:self.configuration.low_res_roi[1], :]
+        summed_raw = self.get_roi_counts(self.configuration.peak_roi, self.configuration.low_res_roi)
         size_roi = float((self.configuration.low_res_roi[1] - self.configuration.low_res_roi[0]) * (self.configuration.peak_roi[1] - self.configuration.peak_roi[0]))
-        summed_raw = raw_data.sum(axis=0).sum(axis=0)
 
         # Remove the background
         bck = self.get_background_vs_TOF()
 
         return (summed_raw/math.fabs(size_roi) - bck)/self.proton_charge
 
-    def get_background_vs_TOF(self):
+    def get_background_vs_TOF(self, with_variance=False):
         """
             Returns the background counts vs TOF
+            :param bool with_variance: if True, the variance of the background is also returned
         """
         # Find the background pixels to use, excluding the peak if there's an overlap.
-        dims = self.data.shape
-        indices = [(i >= self.configuration.bck_roi[0] and i < self.configuration.bck_roi[1]) \
-                   and not (i >= self.configuration.peak_roi[0] and i < self.configuration.peak_roi[1]) for i in range(dims[0])]
-        indices = np.asarray(indices)
-        n_bins = len(indices[indices == True])
-        raw_bck = self.data[indices,
-                            self.configuration.low_res_roi[0]:self.configuration.low_res_roi[1], :]
-        summed_bck = raw_bck.sum(axis=0).sum(axis=0)
-        size_bck = float(n_bins * (self.configuration.low_res_roi[1]-self.configuration.low_res_roi[0]))
-
-        return summed_bck/math.fabs(size_bck)
+        n_x = self.get_roi_integral().shape[0]-1
+        bck_min, bck_max = [min(max(x, 0), n_x) for x in self.configuration.bck_roi]
+        overlap_min = max(bck_min, min(max(self.configuration.peak_roi[0], 0), n_x))
+        overlap_max = min(bck_max, min(max(self.configuration.peak_roi[1], 0), n_x))
+        n_bins = max(bck_max-bck_min, 0)
+
+        summed_bck = self.get_roi_counts([bck_min, bck_max], self.configuration.low_res_roi)
+        if overlap_max > overlap_min:
+            summed_bck = summed_bck - self.get_roi_counts([overlap_min, overlap_max], self.configuration.low_res_roi)
+            n_bins -= overlap_max - overlap_min
+        size_bck = math.fabs(float(n_bins * (self.configuration.low_res_roi[1]-self.configuration.low_res_roi[0])))
+        if size_bck == 0:
+            summed_bck = np.zeros_like(summed_bck)
+            size_bck = 1.0
+
+        if with_variance:
+            return summed_bck/size_bck, summed_bck/size_bck**2
+        return summed_bck/size_bck
 
     def update_calculated_values(self):
         """
@@ -712,19 +1076,49 @@ class CrossSectionData(object):
 
     def update_configuration(self, configuration):
         """
-            Update configuration
+            Update configuration, recomputing only what depends on the parameters that changed.
+            Returns the set of processing stages that need to be recomputed, as
+            defined in Configuration.PARAMETER_STAGES.
+            :param Configuration configuration: new configuration
         """
-        if configuration is not None:
-            self.configuration = copy.deepcopy(configuration)
+        if configuration is None:
+            return set()
+
+        stages = configuration.changed_stages(self._processed_configuration)
+        old_configuration = self._processed_configuration
+        self.configuration = copy.deepcopy(configuration)
+
+        if Configuration.STAGE_BINNING in stages:
+            tof_edges = self.tof_edges
             self.update_calculated_values()
             self.process_configuration()
+            # The binned data needs to be recreated from the events if the binning changed
+            if self._event_workspace is not None and \
+                (tof_edges is None or not np.array_equal(tof_edges, self.tof_edges)):
+                self.data = None
+                self.xydata = None
+                self.xtofdata = None
+                self._roi_integral = None
+        elif Configuration.STAGE_ROI in stages:
+            self.update_calculated_values()
+        self._processed_configuration = copy.deepcopy(configuration)
 
-            # We want to keep consistency between the specular calculations
-            # and the off-spec and GISANS ones. So clear the off-spec and GISANS
-            # to force a recalculation.
-            #TODO: This is a problem when switching beteewn the Off-spec and GISANS tabs
+        # We want to keep consistency between the specular calculations
+        # and the off-spec and GISANS ones. So clear the off-spec and GISANS
+        # to force a recalculation.
+        #TODO: This is a problem when switching beteewn the Off-spec and GISANS tabs
+        if Configuration.STAGE_NORMALIZATION in stages:
             self.off_spec = None
             self.gisans_data = None
+        elif Configuration.STAGE_SCALING in stages:
+            # The off-specular intensity is proportional to the scaling factor
+            # and is trimmed only when merging, so it can be rescaled in place.
+            if self.off_spec is not None and old_configuration.scaling_factor != 0:
+                _rescale = self.configuration.scaling_factor / old_configuration.scaling_factor
+                self.off_spec.S *= _rescale
+                self.off_spec.dS *= _rescale
+            self.gisans_data = None
+        return stages
 
     def reflectivity(self, direct_beam=None, configuration=None):
         """
@@ -744,80 +1138,101 @@ class CrossSectionData(object):
         if not apply_norm:
             direct_beam = CrossSectionData('none', self.configuration, 'none')
 
-        logging.info("%s:%s Reduction with DB: %s [config: %s]",
-                      self.number, self.entry_name, direct_beam.number,
-                      self.configuration.normalization)
-        angle_offset = 0 # Offset from dangle0, in radians
-        def _as_ints(a): return [int(round(a[0])), int(round(a[1]))]
-        output_ws = "r%s_%s" % (self.number, str(self.entry_name))
-
-        ws_norm = None
-        if apply_norm and direct_beam._event_workspace is not None:
-            ws_norm = direct_beam._event_workspace
-
-        logging.info("Calc: %s %s %s", str(_as_ints(self.configuration.peak_roi)),
-                      str(_as_ints(self.configuration.bck_roi)),
-                      str(_as_ints(self.configuration.low_res_roi)))
-
-        _dirpix = configuration.direct_pixel_overwrite if configuration.set_direct_pixel else None
-        _dangle0 = configuration.direct_angle_offset_overwrite if configuration.set_direct_angle_offset else None
-
-        ws = api.MagnetismReflectometryReduction(InputWorkspace=self._event_workspace,
-                                                 NormalizationWorkspace=ws_norm,
-                                                 SignalPeakPixelRange=_as_ints(self.configuration.peak_roi),
-                                                 SubtractSignalBackground=True,
-                                                 SignalBackgroundPixelRange=_as_ints(self.configuration.bck_roi),
-                                                 ApplyNormalization=apply_norm,
-                                                 NormPeakPixelRange=_as_ints(direct_beam.configuration.peak_roi),
-                                                 SubtractNormBackground=True,
-                                                 NormBackgroundPixelRange=_as_ints(direct_beam.configuration.bck_roi),
-                                                 CutLowResDataAxis=True,
-                                                 LowResDataAxisPixelRange=_as_ints(self.configuration.low_res_roi),
-                                                 CutLowResNormAxis=True,
-                                                 LowResNormAxisPixelRange=_as_ints(direct_beam.configuration.low_res_roi),
-                                                 CutTimeAxis=True,
-                                                 QMin=0.001,
-                                                 QStep=-0.01,
-                                                 AngleOffset=angle_offset,
-                                                 UseWLTimeAxis=False,
-                                                 TimeAxisStep=self.configuration.tof_bins,
-                                                 UseSANGLE=not self.configuration.use_dangle,
-                                                 TimeAxisRange=self.configuration.tof_range,
-                                                 SpecularPixel=self.configuration.peak_position,
-                                                 ConstantQBinning=self.configuration.use_constant_q,
-                                                 #EntryName=str(self.entry_name),
-                                                 ConstQTrim=0.1,
-                                                 ErrorWeightedBackground=False,
-                                                 SampleLength=self.configuration.sample_size,
-                                                 DAngle0Overwrite=_dangle0,
-                                                 DirectPixelOverwrite=_dirpix,
-                                                 OutputWorkspace=output_ws)
-
-        ################## FOR COMPATIBILITY WITH QUICKNXS ##################
-        run_object = ws.getRun()
-        peak_min = run_object.getProperty("scatt_peak_min").value
-        peak_max = run_object.getProperty("scatt_peak_max").value
-        low_res_min = run_object.getProperty("scatt_low_res_min").value
-        low_res_max = run_object.getProperty("scatt_low_res_max").value
-        norm_x_min = run_object.getProperty("norm_peak_min").value
-        norm_x_max = run_object.getProperty("norm_peak_max").value
-        norm_y_min = run_object.getProperty("norm_low_res_min").value
-        norm_y_max = run_object.getProperty("norm_low_res_max").value
-        tth = ws.getRun().getProperty("SANGLE").getStatistics().mean * math.pi / 180.0
-        quicknxs_scale = (float(norm_x_max)-float(norm_x_min)) * (float(norm_y_max)-float(norm_y_min))
-        quicknxs_scale /= (float(peak_max)-float(peak_min)) * (float(low_res_max)-float(low_res_min))
-        quicknxs_scale *= 0.005 / math.sin(tth)
-
-        ws = api.Scale(InputWorkspace=output_ws, OutputWorkspace=output_ws,
-                       factor=quicknxs_scale, Operation='Multiply')
-        #####################################################################
-
-        self.q = ws.readX(0)[:].copy()
-        self._r = ws.readY(0)[:].copy() #* self.configuration.scaling_factor
-        self._dr = ws.readE(0)[:].copy() #* self.configuration.scaling_factor
-
-        #DeleteWorkspace(ws)
-        self._reflectivity_workspace = str(ws)
+        with tracing.span('CrossSectionData.reflectivity', 'reduction', run=self.number, cross_section=self.name):
+            logging.info("%s:%s Reduction with DB: %s [config: %s]",
+                          self.number, self.entry_name, direct_beam.number,
+                          self.configuration.normalization)
+            angle_offset = 0 # Offset from dangle0, in radians
+            def _as_ints(a): return [int(round(a[0])), int(round(a[1]))]
+            output_ws = "r%s_%s" % (self.number, str(self.entry_name))
+
+            if self.configuration.reduction_backend == Configuration.REDUCTION_EVENTS:
+                reduction = event_reduction.EventReflectivity(self, direct_beam=direct_beam if apply_norm else None)
+                self.q, self._r, self._dr = reduction.specular()
+                reduction.create_workspace(self.q, self._r, self._dr, output_ws)
+                self.preview = None
+                self._reflectivity_workspace = output_ws
+                return
+
+            ws_norm = None
+            if apply_norm and direct_beam._event_workspace is not None:
+                ws_norm = direct_beam._event_workspace
+
+            logging.info("Calc: %s %s %s", str(_as_ints(self.configuration.peak_roi)),
+                          str(_as_ints(self.configuration.bck_roi)),
+                          str(_as_ints(self.configuration.low_res_roi)))
+
+            _dirpix = configuration.direct_pixel_overwrite if configuration.set_direct_pixel else None
+            _dangle0 = configuration.direct_angle_offset_overwrite if configuration.set_direct_angle_offset else None
+
+            ws = api.MagnetismReflectometryReduction(InputWorkspace=self._event_workspace,
+                                                     NormalizationWorkspace=ws_norm,
+                                                     SignalPeakPixelRange=_as_ints(self.configuration.peak_roi),
+                                                     SubtractSignalBackground=True,
+                                                     SignalBackgroundPixelRange=_as_ints(self.configuration.bck_roi),
+                                                     ApplyNormalization=apply_norm,
+                                                     NormPeakPixelRange=_as_ints(direct_beam.configuration.peak_roi),
+                                                     SubtractNormBackground=True,
+                                                     NormBackgroundPixelRange=_as_ints(direct_beam.configuration.bck_roi),
+                                                     CutLowResDataAxis=True,
+                                                     LowResDataAxisPixelRange=_as_ints(self.configuration.low_res_roi),
+                                                     CutLowResNormAxis=True,
+                                                     LowResNormAxisPixelRange=_as_ints(direct_beam.configuration.low_res_roi),
+                                                     CutTimeAxis=True,
+                                                     QMin=0.001,
+                                                     QStep=-0.01,
+                                                     AngleOffset=angle_offset,
+                                                     UseWLTimeAxis=False,
+                                                     TimeAxisStep=self.configuration.tof_bins,
+                                                     UseSANGLE=not self.configuration.use_dangle,
+                                                     TimeAxisRange=self.configuration.tof_range,
+                                                     SpecularPixel=self.configuration.peak_position,
+                                                     ConstantQBinning=self.configuration.use_constant_q,
+                                                     #EntryName=str(self.entry_name),
+                                                     ConstQTrim=0.1,
+                                                     ErrorWeightedBackground=False,
+                                                     SampleLength=self.configuration.sample_size,
+                                                     DAngle0Overwrite=_dangle0,
+                                                     DirectPixelOverwrite=_dirpix,
+                                                     OutputWorkspace=output_ws)
+
+            ################## FOR COMPATIBILITY WITH QUICKNXS ##################
+            run_object = ws.getRun()
+            peak_min = run_object.getProperty("scatt_peak_min").value
+            peak_max = run_object.getProperty("scatt_peak_max").value
+            low_res_min = run_object.getProperty("scatt_low_res_min").value
+            low_res_max = run_object.getProperty("scatt_low_res_max").value
+            norm_x_min = run_object.getProperty("norm_peak_min").value
+            norm_x_max = run_object.getProperty("norm_peak_max").value
+            norm_y_min = run_object.getProperty("norm_low_res_min").value
+            norm_y_max = run_object.getProperty("norm_low_res_max").value
+            tth = ws.getRun().getProperty("SANGLE").getStatistics().mean * math.pi / 180.0
+            quicknxs_scale = (float(norm_x_max)-float(norm_x_min)) * (float(norm_y_max)-float(norm_y_min))
+            quicknxs_scale /= (float(peak_max)-float(peak_min)) * (float(low_res_max)-float(low_res_min))
+            quicknxs_scale *= 0.005 / math.sin(tth)
+
+            ws = api.Scale(InputWorkspace=output_ws, OutputWorkspace=output_ws,
+                           factor=quicknxs_scale, Operation='Multiply')
+            #####################################################################
+
+            self.q = ws.readX(0)[:].copy()
+            self._r = ws.readY(0)[:].copy() #* self.configuration.scaling_factor
+            self._dr = ws.readE(0)[:].copy() #* self.configuration.scaling_factor
+            self.preview = None
+
+            #DeleteWorkspace(ws)
+            self._reflectivity_workspace = str(ws)
+
+    def calculate_preview(self, direct_beam=None):
+        """
+            Compute a fast estimate of the reflectivity from the binned data.
+            The Q, R and dR arrays are stored in self.preview.
+            :param CrossSectionData direct_beam: if given, this data will be used to normalize the output
+        """
+        self.prepare_plot_data()
+        if direct_beam is not None:
+            direct_beam.prepare_plot_data()
+        self.preview = preview.reflectivity(self, direct_beam=direct_beam)
 
     def offspec(self, direct_beam=None):
         """
@@ -833,7 +1248,9 @@ class CrossSectionData(object):
         if direct_beam:
             direct_beam.prepare_plot_data()
         self.off_spec = off_specular.OffSpecular(self)
-        return self.off_spec(direct_beam)
+        with tracing.span('OffSpecular', 'reduction', run=self.number, cross_section=self.name,
+                          nbytes=self.data.nbytes):
+            return self.off_spec(direct_beam)
 
     def gisans(self, direct_beam=None):
         """
@@ -845,7 +1262,9 @@ class CrossSectionData(object):
         if direct_beam:
             direct_beam.prepare_plot_data()
         self.gisans_data = gisans.GISANS(self)
-        self.gisans_data(direct_beam)
+        with tracing.span('GISANS', 'reduction', run=self.number, cross_section=self.name,
+                          nbytes=self.data.nbytes):
+            self.gisans_data(direct_beam)
 
         self.SGrid = self.gisans_data.SGrid
         self.QyGrid = self.gisans_data.QyGrid
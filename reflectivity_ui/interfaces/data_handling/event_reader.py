@@ -0,0 +1,253 @@
+"""
+    Fast reader for event nexus files, using h5py directly.
+
+    The events are histogrammed in pixel and TOF for each cross-section,
+    without going through LoadEventNexus. The resulting [x, y, TOF] arrays
+    are the same as the ones produced by CrossSectionData.prepare_plot_data
+    and can be used for previews and the NumPy-side calculations.
+    The reduction itself still needs the Mantid workspaces.
+"""
+#pylint: disable=invalid-name, too-many-locals, bare-except
+from __future__ import absolute_import, division, print_function
+import re
+import logging
+from collections import OrderedDict
+import numpy as np
+import h5py
+
+# Log used to split the events into cross-sections, see Instrument.dummy_filter_cross_sections
+STATE_LOG = "BL4A:SF:ICP:getDI"
+STATES = OrderedDict([('Off_Off', 15),
+                      ('On_On', 63),
+                      ('Off_On', 31),
+                      ('On_Off', 47)])
+
+# Number of events read from the file at once
+CHUNK_SIZE = 20000000
+
+# Conversion from pC to micro-Amp-hour, as used by gd_prtn_chrg
+PC_TO_MICRO_AMP_HOUR = 1.0 / 3.6e9
+
+
+def _to_datetime64(iso_time):
+    """
+        Convert an ISO8601 time string, with an optional time zone,
+        to a UTC numpy datetime64.
+        :param str iso_time: time string
+    """
+    if isinstance(iso_time, bytes):
+        iso_time = iso_time.decode('utf8')
+    iso_time = str(iso_time).strip()
+    tz_offset = np.timedelta64(0, 'm')
+    toks = re.match(r'(.*?)(Z|([+-])(\d\d):?(\d\d))$', iso_time)
+    if toks is not None:
+        iso_time = toks.group(1)
+        if toks.group(3) is not None:
+            sign = 1 if toks.group(3) == '+' else -1
+            tz_offset = np.timedelta64(sign * (60 * int(toks.group(4)) + int(toks.group(5))), 'm')
+    return np.datetime64(iso_time, 'ns') - tz_offset
+
+
+def _relative_times(dataset, attribute, reference):
+    """
+        Return the times stored in a dataset, in seconds relative to a reference time.
+        :param dataset: h5py dataset of times in seconds
+        :param str attribute: name of the attribute holding the start time of the dataset
+        :param datetime64 reference: reference time
+    """
+    times = dataset[()].astype(float)
+    if attribute in dataset.attrs:
+        times += (_to_datetime64(dataset.attrs[attribute]) - reference) / np.timedelta64(1, 's')
+    return times
+
+
+def _get_states(log_times, log_values, times):
+    """
+        Return the cross-section index for each time, given the state log.
+        A state starts at a log entry and ends at the next one.
+        Times before the first log entry, or with an unknown state, are given -1.
+    """
+    entry = np.searchsorted(log_times, times, side='right') - 1
+    values = np.where(entry >= 0, log_values[np.clip(entry, 0, None)], -1)
+    xs_index = -np.ones(len(times), dtype=int)
+    for i, pol_state in enumerate(STATES):
+        xs_index[values == STATES[pol_state]] = i
+    return xs_index
+
+
+def get_event_banks(entry):
+    """
+        Return the names of the event groups in a nexus entry.
+        :param entry: h5py group for the nexus entry
+    """
+    banks = []
+    for name in entry:
+        if name.startswith('bank') and name.endswith('_events') and 'event_id' in entry[name]:
+            banks.append(name)
+    return sorted(banks)
+
+
+def read_logs(file_path, entry_name=None, names=None):
+    """
+        Read the mean value and units of the numerical DASlogs.
+        :param str file_path: path to the event nexus file
+        :param str entry_name: name of the nexus entry, if None the first entry is used
+        :param list names: names of the logs to read, if None all the logs are read
+    """
+    logs = {}
+    units = {}
+    with h5py.File(file_path, mode='r') as nxs:
+        entry = nxs[entry_name] if entry_name is not None else nxs[sorted(nxs.keys())[0]]
+        if names is None:
+            names = list(entry['DASlogs'].keys())
+        for name in names:
+            if name not in entry['DASlogs']:
+                continue
+            try:
+                value = entry['DASlogs'][name]['value'][()]
+                if not np.issubdtype(np.asarray(value).dtype, np.number) or np.size(value) == 0:
+                    continue
+                logs[name] = np.float64(np.mean(value))
+                _units = entry['DASlogs'][name]['value'].attrs.get('units', '')
+                units[name] = _units.decode('utf8') if isinstance(_units, bytes) else str(_units)
+            except:
+                logging.debug("Skipping log %s", name)
+        if 'run_number' in entry:
+            run_number = entry['run_number'][()]
+            run_number = run_number[0] if np.ndim(run_number) > 0 else run_number
+            logs['run_number'] = int(run_number.decode('utf8') if isinstance(run_number, bytes) else run_number)
+    return logs, units
+
+
+def get_distance(logs, units, name):
+    """
+        Return a distance log in meters. Distances are logged in mm unless
+        their units say otherwise.
+        :param dict logs: log values returned by read_logs
+        :param dict units: log units returned by read_logs
+        :param str name: name of the log
+    """
+    distance = logs[name]
+    if not units.get(name) in ['m', 'meter']:
+        distance /= 1000.0
+    return distance
+
+
+def get_tof_range(logs, units, wl_bandwidth):
+    """
+        Determine the TOF range from the logs, as done in DataInfo.get_tof_range
+        :param dict logs: log values returned by read_logs
+        :param dict units: log units returned by read_logs
+        :param float wl_bandwidth: wavelength bandwidth
+    """
+    sample_detector_distance = get_distance(logs, units, 'SampleDetDis')
+    source_sample_distance = get_distance(logs, units, 'ModeratorSamDis')
+
+    h = 6.626e-34  # m^2 kg s^-1
+    m = 1.675e-27  # kg
+    cst = (source_sample_distance + sample_detector_distance) / h * m
+    wl = logs['LambdaRequest']
+    chopper_speed = logs['SpeedRequest1']
+    half_width = wl_bandwidth / 2.0
+    tof_min = cst * (wl - half_width * 60.0 / chopper_speed) * 1e-4
+    tof_max = cst * (wl + half_width * 60.0 / chopper_speed) * 1e-4
+    return [tof_min, tof_max]
+
+
+def read_event_histograms(file_path, tof_edges, n_x_pixel=304, n_y_pixel=256,
+                          entry_name=None, chunk_size=CHUNK_SIZE, progress=None):
+    """
+        Histogram the events of each cross-section in pixel and TOF.
+        Events are read in chunks of pulses and split according to the
+        state log at their pulse time, like Instrument.dummy_filter_cross_sections.
+
+        Returns an ordered dictionary with, for each cross-section with events,
+        a tuple with the [x, y, TOF] counts, the proton charge in micro-Amp-hour
+        and the number of events.
+
+        :param str file_path: path to the event nexus file
+        :param array tof_edges: TOF bin edges, in microseconds
+        :param int n_x_pixel: number of pixels in x
+        :param int n_y_pixel: number of pixels in y
+        :param str entry_name: name of the nexus entry, if None the first entry is used
+        :param int chunk_size: approximate number of events to read at once
+        :param function progress: call-back function to track progress
+    """
+    tof_edges = np.asarray(tof_edges, dtype=float)
+    n_tof = len(tof_edges) - 1
+    n_pixels = n_x_pixel * n_y_pixel
+    n_xs = len(STATES)
+    counts = [None] * n_xs
+    n_events = np.zeros(n_xs, dtype=int)
+    charge = np.zeros(n_xs)
+
+    with h5py.File(file_path, mode='r') as nxs:
+        entry = nxs[entry_name] if entry_name is not None else nxs[sorted(nxs.keys())[0]]
+        banks = get_event_banks(entry)
+
+        # All times are computed relative to the first pulse of the first bank
+        reference = _to_datetime64(entry[banks[0]]['event_time_zero'].attrs['offset'])
+        state_log = entry['DASlogs'][STATE_LOG]
+        log_times = _relative_times(state_log['time'], 'start', reference)
+        log_values = state_log['value'][()].astype(int)
+
+        # Proton charge for each cross-section
+        if 'proton_charge' in entry['DASlogs']:
+            pc_log = entry['DASlogs']['proton_charge']
+            pc_states = _get_states(log_times, log_values,
+                                    _relative_times(pc_log['time'], 'start', reference))
+            pc_values = pc_log['value'][()].astype(float)
+            for i in range(n_xs):
+                charge[i] = pc_values[pc_states == i].sum() * PC_TO_MICRO_AMP_HOUR
+
+        for i_bank, bank in enumerate(banks):
+            events = entry[bank]
+            pulse_times = _relative_times(events['event_time_zero'], 'offset', reference)
+            pulse_states = _get_states(log_times, log_values, pulse_times)
+            event_index = events['event_index'][()].astype(np.int64)
+            total_events = events['event_id'].shape[0]
+            pulse_ends = np.append(event_index[1:], total_events)
+
+            # Read whole pulses, about chunk_size events at a time
+            first_pulse = 0
+            while first_pulse < len(event_index):
+                last_pulse = np.searchsorted(event_index, event_index[first_pulse] + chunk_size, side='left')
+                last_pulse = max(last_pulse, first_pulse + 1)
+                i_start = event_index[first_pulse]
+                i_stop = pulse_ends[last_pulse - 1]
+
+                pixel_id = events['event_id'][i_start:i_stop].astype(np.int64)
+                tof = events['event_time_offset'][i_start:i_stop]
+                xs_index = np.repeat(pulse_states[first_pulse:last_pulse],
+                                     pulse_ends[first_pulse:last_pulse] - event_index[first_pulse:last_pulse])
+
+                tof_bin = np.searchsorted(tof_edges, tof, side='right') - 1
+                # Like Mantid, the last bin includes its upper edge
+                tof_bin[tof == tof_edges[-1]] = n_tof - 1
+                good = (xs_index >= 0) & (tof_bin >= 0) & (tof_bin < n_tof) \
+                    & (pixel_id >= 0) & (pixel_id < n_pixels)
+                n_events += np.bincount(xs_index[xs_index >= 0], minlength=n_xs)
+
+                bin_index = pixel_id * n_tof + tof_bin
+                for i in range(n_xs):
+                    _selected = good & (xs_index == i)
+                    if not np.any(_selected):
+                        continue
+                    _counts = np.bincount(bin_index[_selected], minlength=n_pixels * n_tof)
+                    if counts[i] is None:
+                        counts[i] = _counts.astype(float)
+                    else:
+                        counts[i] += _counts
+
+                first_pulse = last_pulse
+                if progress is not None:
+                    _fraction = (i_bank + float(first_pulse) / len(event_index)) / len(banks)
+                    progress(int(100 * _fraction), "Reading events...", out_of=100.0)
+
+    histograms = OrderedDict()
+    for i, pol_state in enumerate(STATES):
+        if n_events[i] > 0:
+            if counts[i] is None:
+                counts[i] = np.zeros(n_pixels * n_tof)
+            histograms[pol_state] = (counts[i].reshape(n_x_pixel, n_y_pixel, n_tof), charge[i], n_events[i])
+    return histograms
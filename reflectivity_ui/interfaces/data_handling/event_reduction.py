@@ -0,0 +1,269 @@
+"""
+    Event-based reflectivity reduction.
+
+    Instead of histogramming the events in TOF before converting to Q,
+    Q is computed for each event and the events are histogrammed directly
+    on the final Q grid. When using constant-Q binning, each event is given the
+    outgoing angle of its pixel, so the Q resolution is not limited by the TOF binning.
+
+    Adapted from test/notebooks/event_reduction.py. The events of all the pixels
+    in a region of interest are gathered once and processed as whole arrays.
+"""
+#pylint: disable=invalid-name, too-many-instance-attributes, too-many-locals, too-many-arguments, bare-except
+from __future__ import absolute_import, division, print_function
+import sys
+import math
+import logging
+import numpy as np
+
+# Import mantid according to the application configuration
+from . import ApplicationConfiguration
+application_conf = ApplicationConfiguration()
+sys.path.insert(0, application_conf.mantid_path)
+import mantid.simpleapi as api
+
+from .preview import get_theta
+
+### Parameters needed for some calculations.
+H_OVER_M_NEUTRON = 3.956034e-7 # h/m_n [m^2/s]
+
+# Origin of the Q binning, as used by MagnetismReflectometryReduction
+Q_ORIGIN = 0.001
+
+
+def get_q_binning(q_min, q_max, q_step, q_origin=Q_ORIGIN):
+    """
+        Return Q bin edges covering [q_min, q_max], aligned on a grid starting at q_origin.
+        :param float q_min: minimum Q
+        :param float q_max: maximum Q
+        :param float q_step: step size in Q. A negative value gives a log scale
+        :param float q_origin: Q value of the first edge of the grid
+    """
+    if q_step > 0:
+        i_min = int(math.floor((q_min - q_origin) / q_step))
+        i_max = int(math.ceil((q_max - q_origin) / q_step))
+        return q_origin + q_step * np.arange(i_min, i_max + 1)
+    growth = math.log(1.0 + math.fabs(q_step))
+    i_min = int(math.floor(math.log(q_min / q_origin) / growth))
+    i_max = int(math.ceil(math.log(q_max / q_origin) / growth))
+    return q_origin * np.exp(growth * np.arange(i_min, i_max + 1))
+
+
+def get_events(workspace, x_range, y_range, n_y):
+    """
+        Return the TOF and x pixel of all the events in a region of the detector.
+        The pixels of each x column of the region are first grouped in a single
+        spectrum with GroupDetectors, so that the events are extracted once per column.
+        :param workspace: Mantid event workspace
+        :param list x_range: [min, max[ pixel range in x
+        :param list y_range: [min, max[ pixel range in y
+        :param int n_y: number of pixels in y
+    """
+    n_spectra = workspace.getNumberHistograms()
+    y_min = max(int(y_range[0]), 0)
+    y_max = min(int(y_range[1]), n_y)
+    x_pixels = [x for x in range(max(int(x_range[0]), 0), int(x_range[1]))
+                if x * n_y + y_min < n_spectra]
+    if len(x_pixels) == 0 or y_max <= y_min:
+        return np.zeros(0), np.zeros(0, dtype=int)
+
+    # One group of workspace indices per x column
+    pattern = ','.join(['%d-%d' % (x * n_y + y_min, min(x * n_y + y_max, n_spectra) - 1) for x in x_pixels])
+    grouped = api.GroupDetectors(InputWorkspace=workspace, GroupingPattern=pattern, PreserveEvents=True,
+                                 OutputWorkspace='%s_roi_events' % str(workspace))
+    try:
+        tofs = [grouped.getSpectrum(i).getTofs() for i in range(len(x_pixels))]
+    finally:
+        api.DeleteWorkspace(grouped)
+    n_events = [len(tof) for tof in tofs]
+    return np.concatenate(tofs), np.repeat(np.asarray(x_pixels), n_events)
+
+
+class EventReflectivity(object):
+    """
+        Event-based specular reflectivity of a cross-section.
+        The reduction options are taken from the configuration and the
+        direct beam is used for normalization, as in NexusData.calculate_reflectivity.
+    """
+    def __init__(self, cross_section, direct_beam=None, configuration=None):
+        """
+            :param CrossSectionData cross_section: data object
+            :param CrossSectionData direct_beam: if given, this data will be used to normalize the output
+            :param Configuration configuration: reduction options [default: the cross-section configuration]
+        """
+        self.data_set = cross_section
+        self.direct_beam = direct_beam
+        self.configuration = configuration if configuration is not None else cross_section.configuration
+        self.n_y = cross_section.configuration.instrument.n_y_pixel
+        self.pixel_width = getattr(cross_section, 'pixel_width', 0.0007)
+        self.theta = get_theta(cross_section)
+        self.q_bins = None
+
+    def _wavelength(self, tof, data_set):
+        """ Convert TOF in microseconds to wavelength in Angstrom """
+        return H_OVER_M_NEUTRON * tof / data_set.dist_mod_det * 1e4
+
+    def _roi_events(self, data_set, configuration, peak_roi):
+        """
+            Return the wavelength and x pixel of the events in a region of interest,
+            within the TOF range of the configuration.
+        """
+        tof, x = get_events(data_set.event_workspace, peak_roi, configuration.low_res_roi, self.n_y)
+        if configuration.tof_range[1] > configuration.tof_range[0]:
+            in_range = (tof >= configuration.tof_range[0]) & (tof <= configuration.tof_range[1])
+            tof, x = tof[in_range], x[in_range]
+        return self._wavelength(tof, data_set), x
+
+    def _background_regions(self, configuration):
+        """
+            Return the background pixel ranges, excluding the peak, and the ratio
+            of the number of peak pixels to the number of background pixels.
+        """
+        bck_min, bck_max = configuration.bck_roi
+        peak_min, peak_max = configuration.peak_roi
+        regions = []
+        if bck_min < peak_min:
+            regions.append([bck_min, min(bck_max, peak_min)])
+        if bck_max > peak_max:
+            regions.append([max(bck_min, peak_max), bck_max])
+        n_bck = sum([r[1] - r[0] for r in regions])
+        if n_bck <= 0:
+            return [], 0
+        return regions, float(peak_max - peak_min) / n_bck
+
+    def _q(self, wl, x):
+        """
+            Return Q for each event. With constant-Q binning, the outgoing
+            angle of each event is determined from its pixel.
+        """
+        if self.configuration.use_constant_q:
+            x_distance = self.pixel_width * (self.configuration.peak_position - x)
+            delta_theta_f = np.arctan(x_distance / self.data_set.dist_sam_det) / 2.0
+            return 4.0 * np.pi / wl * np.sin(self.theta + delta_theta_f) * np.cos(delta_theta_f)
+        return 4.0 * np.pi / wl * math.sin(self.theta)
+
+    def _direct_beam_density(self):
+        """
+            Return the direct beam wavelength bins, and the counts per unit
+            of wavelength per unit of charge in each bin.
+        """
+        db_conf = self.direct_beam.configuration
+        wl_edges = self._wavelength(self.direct_beam.tof_edges, self.direct_beam)
+        wl, _ = self._roi_events(self.direct_beam, db_conf, db_conf.peak_roi)
+        counts, _ = np.histogram(wl, bins=wl_edges)
+        counts = counts.astype(float)
+        if self.configuration.subtract_background:
+            regions, ratio = self._background_regions(db_conf)
+            for region in regions:
+                wl, _ = self._roi_events(self.direct_beam, db_conf, region)
+                counts -= ratio * np.histogram(wl, bins=wl_edges)[0]
+        charge = self.direct_beam.proton_charge if self.direct_beam.proton_charge > 0 else 1.0
+        return wl_edges, counts / np.diff(wl_edges) / charge
+
+    def _histogram(self, wl, x, norm_edges=None, norm_density=None):
+        """
+            Histogram events in Q, normalizing each event by the direct beam
+            intensity at its wavelength.
+            Returns the weighted counts, their variance, and the number of events in each bin.
+        """
+        q = self._q(wl, x)
+        if norm_density is None:
+            weights = np.ones(len(q))
+        else:
+            wl_centers = (norm_edges[:-1] + norm_edges[1:]) / 2.0
+            density = np.interp(wl, wl_centers, norm_density, left=0, right=0)
+            good = density > 0
+            q, wl = q[good], wl[good]
+            # A Q bin covers a wavelength band of width wl * dQ / Q
+            weights = q / (wl * density[good])
+        counts, _ = np.histogram(q, bins=self.q_bins, weights=weights)
+        variance, _ = np.histogram(q, bins=self.q_bins, weights=weights**2)
+        n_events, _ = np.histogram(q, bins=self.q_bins)
+        if norm_density is not None:
+            counts /= np.diff(self.q_bins)
+            variance /= np.diff(self.q_bins)**2
+        return counts, variance, n_events
+
+    def specular(self):
+        """
+            Compute the specular reflectivity.
+            Returns Q, R and dR arrays, including the quicknxs scaling factor.
+        """
+        conf = self.configuration
+        wl, x = self._roi_events(self.data_set, conf, conf.peak_roi)
+        logging.info("Event reduction of %s: %s events in the peak region", self.data_set.name, len(wl))
+
+        norm_edges, norm_density = None, None
+        if self.direct_beam is not None:
+            norm_edges, norm_density = self._direct_beam_density()
+
+        # Q binning covering the data
+        q = self._q(wl, x)
+        q = q[q > 0]
+        if len(q) == 0:
+            return np.zeros(0), np.zeros(0), np.zeros(0)
+        step = conf.final_rebin_step if conf.final_rebin_step != 0 else -0.01
+        self.q_bins = get_q_binning(q.min(), q.max(), step)
+
+        refl, variance, n_events = self._histogram(wl, x, norm_edges, norm_density)
+        if conf.subtract_background:
+            regions, ratio = self._background_regions(conf)
+            for region in regions:
+                bck_wl, bck_x = self._roi_events(self.data_set, conf, region)
+                # The background is spread over the angles of the peak pixels
+                bck_x = np.full(len(bck_x), conf.peak_position)
+                bck, bck_variance, _ = self._histogram(bck_wl, bck_x, norm_edges, norm_density)
+                refl -= ratio * bck
+                variance += ratio**2 * bck_variance
+
+        charge = self.data_set.proton_charge if self.data_set.proton_charge > 0 else 1.0
+        refl /= charge
+        d_refl = np.sqrt(variance) / charge
+
+        # Scaling factor used by quicknxs
+        scale = 0.005 / math.sin(self.theta) if self.theta > 0.0002 else 1.0
+        if self.direct_beam is not None:
+            db_conf = self.direct_beam.configuration
+            scale *= (db_conf.peak_roi[1] - db_conf.peak_roi[0]) * (db_conf.low_res_roi[1] - db_conf.low_res_roi[0])
+            scale /= float((conf.peak_roi[1] - conf.peak_roi[0]) * (conf.low_res_roi[1] - conf.low_res_roi[0]))
+
+        # Remove empty bins, as done by the CleanupBadData option of the reduction
+        good = (n_events > 0) & (refl != 0)
+        q_centers = (self.q_bins[:-1] + self.q_bins[1:]) / 2.0
+        return q_centers[good], refl[good] * scale, d_refl[good] * scale
+
+    def create_workspace(self, q, refl, d_refl, output_ws):
+        """
+            Create the output workspace, with the same logs as the
+            output of MagnetismReflectometryReduction needed for the exports.
+            :param array q: Q values
+            :param array refl: reflectivity
+            :param array d_refl: reflectivity uncertainty
+            :param str output_ws: name of the output workspace
+        """
+        conf = self.configuration
+        ws = api.CreateWorkspace(DataX=q, DataY=refl, DataE=d_refl, NSpec=1, UnitX='MomentumTransfer',
+                                 ParentWorkspace=self.data_set.event_workspace, OutputWorkspace=output_ws)
+
+        def _add_log(name, value, log_type='Number'):
+            api.AddSampleLog(Workspace=ws, LogName=name, LogText=str(value), LogType=log_type)
+
+        _add_log('two_theta', 2.0 * self.theta * 180.0 / math.pi)
+        _add_log('specular_pixel', conf.peak_position)
+        _add_log('constant_q_binning', int(conf.use_constant_q))
+        _add_log('scatt_peak_min', conf.peak_roi[0])
+        _add_log('scatt_peak_max', conf.peak_roi[1] - 1)
+        _add_log('scatt_low_res_min', conf.low_res_roi[0])
+        _add_log('scatt_low_res_max', conf.low_res_roi[1] - 1)
+        if self.direct_beam is not None:
+            db_conf = self.direct_beam.configuration
+            _add_log('normalization_run', self.direct_beam.number, 'String')
+            _add_log('normalization_file_path', self.direct_beam.file_path, 'String')
+            _add_log('normalization_dirpix', self.direct_beam.direct_pixel)
+            _add_log('norm_peak_min', db_conf.peak_roi[0])
+            _add_log('norm_peak_max', db_conf.peak_roi[1] - 1)
+            _add_log('norm_low_res_min', db_conf.low_res_roi[0])
+            _add_log('norm_low_res_max', db_conf.low_res_roi[1] - 1)
+        else:
+            _add_log('normalization_run', 'None', 'String')
+        return ws
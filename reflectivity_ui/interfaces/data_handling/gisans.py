@@ -3,7 +3,6 @@
 """
 from __future__ import absolute_import, division, print_function
 import logging
-from multiprocessing import Pool
 
 import numpy as np
 
@@ -67,11 +66,15 @@ class GISANS(object):
         PN = len(self.data_set.tof) - self.data_set.configuration.cut_last_n_points
         self.wavelengths = wavelengths[P0:PN]
 
-        # calculate reciprocal space, incident and outgoing perpendicular wave vectors
-        self.Qy = k[np.newaxis, np.newaxis, P0:PN] * (np.sin(phi) * np.cos(af)[:, np.newaxis])[:, :, np.newaxis]
-        p_i = k[np.newaxis, np.newaxis, P0:PN] * ((0. * phi) + np.sin(ai)[:, np.newaxis])[:, :, np.newaxis]
-        self.p_f = k[np.newaxis, np.newaxis, P0:PN] * ((0. * phi) + np.sin(af)[:, np.newaxis])[:, :, np.newaxis]
-        self.Qz = p_i + self.p_f
+        self.k = k[P0:PN]
+
+        # calculate reciprocal space, incident and outgoing perpendicular wave vectors.
+        # The coordinates are separable: only keep the factors depending on the pixel
+        # position, and compute the full [x, y, TOF] arrays when they are requested.
+        self._qy_xy = np.sin(phi) * np.cos(af)[:, np.newaxis]
+        p_i = self.k[np.newaxis, :] * np.sin(ai)[:, np.newaxis]
+        self._p_f = self.k[np.newaxis, :] * np.sin(af)[:, np.newaxis]
+        self._qz = p_i + self._p_f
 
         raw = self.data_set.data[active_area_x[0]:active_area_x[1],
                                  active_area_y[0]:active_area_y[1],
@@ -86,10 +89,7 @@ class GISANS(object):
 
             norm_y_min, norm_y_max = direct_beam.configuration.low_res_roi
             norm_x_min, norm_x_max = direct_beam.configuration.peak_roi
-            norm_raw_multi_dim = direct_beam.data[norm_x_min:norm_x_max,
-                                                  norm_y_min:norm_y_max, P0:PN]
-
-            norm_raw = norm_raw_multi_dim.sum(axis=0).sum(axis=0)
+            norm_raw = direct_beam.get_roi_counts([norm_x_min, norm_x_max], [norm_y_min, norm_y_max])[P0:PN]
             norm_d_raw = np.sqrt(norm_raw)
             norm_scale = (float(norm_x_max)-float(norm_x_min)) * (float(norm_y_max)-float(norm_y_min))
             norm_raw /= norm_scale * direct_beam.proton_charge
@@ -108,118 +108,185 @@ class GISANS(object):
 
         # Create plotting data
         #TODO: use options to plot the right data (for instance: qz or pf)
-        self.SGrid, qy, qz = np.histogram2d(self.Qy.flatten(), self.Qz.flatten(),
-                                            bins=(50, 50),
-                                            weights=intensity.flatten())
-        npoints, _, _ = np.histogram2d(self.Qy.flatten(), self.Qz.flatten(),
-                                       bins=(50, 50))
+        tof_indices = np.arange(len(self.k))
+        qy_edges = _auto_edges([self.get_qy_range(tof_indices)], 50)
+        qz_edges = _auto_edges([(self._qz.min(), self._qz.max())] if self._qz.size else [], 50)
+        npoints, self.SGrid, _ = self.histogram(tof_indices, qy_edges, qz_edges)
         self.SGrid[npoints > 0] /= npoints[npoints > 0]
         self.SGrid = self.SGrid.transpose()
-        qy = (qy[:-1]+qy[1:])/2.
-        qz = (qz[:-1]+qz[1:])/2.
+        qy = (qy_edges[:-1]+qy_edges[1:])/2.
+        qz = (qz_edges[:-1]+qz_edges[1:])/2.
         self.QyGrid, self.QzGrid = np.meshgrid(qy, qz)
 
-def merge(reduction_list, pol_state, wl_min=0, wl_max=100):
-    """
-        Merge the off-specular data from a reduction list.
-        :param list reduction_list: list of NexusData objects
-        :param string pol_state: polarization state to consider
+    @property
+    def Qy(self):
+        """ Qy for each [x, y, TOF] point """
+        return self.k[np.newaxis, np.newaxis, :] * self._qy_xy[:, :, np.newaxis]
 
-        The scaling factors should have been determined at this point. Just use them
-        to merge the different runs in a set.
+    @property
+    def Qz(self):
+        """ Qz for each [x, y, TOF] point """
+        return np.repeat(self._qz[:, np.newaxis, :], self._qy_xy.shape[1], axis=1)
 
-        TODO: This doesn't deal with the overlap properly. It assumes that the user
-        cut the overlapping points by hand.
-    """
-    _qy = np.zeros(0)
-    _qz = np.zeros(0)
-    _pf = np.zeros(0)
-    _s = np.zeros(0)
-    _ds = np.zeros(0)
-    _wl = np.zeros(0)
+    @property
+    def p_f(self):
+        """ Outgoing perpendicular wave vector for each [x, y, TOF] point """
+        return np.repeat(self._p_f[:, np.newaxis, :], self._qy_xy.shape[1], axis=1)
 
-    for item in reduction_list:
-        gisans = item.cross_sections[pol_state].gisans_data
-        Qy, Qz, pf, S, dS = (gisans.Qy, gisans.Qz, gisans.p_f, gisans.S, gisans.dS)
+    def get_qy(self, tof_index):
+        """
+            Return Qy for each [x, y] pixel, for a given TOF bin
+            :param int tof_index: TOF bin index
+        """
+        return self.k[tof_index] * self._qy_xy
 
-        # Filter according to wavelength
-        filtered = np.where((gisans.wavelengths >= wl_min) & (gisans.wavelengths <= wl_max))
-        _qy = np.concatenate((_qy, Qy[:, :, filtered].flatten()))
-        _qz = np.concatenate((_qz, Qz[:, :, filtered].flatten()))
-        _pf = np.concatenate((_pf, pf[:, :, filtered].flatten()))
-        _s = np.concatenate((_s, S[:, :, filtered].flatten()))
-        _ds = np.concatenate((_ds, dS[:, :, filtered].flatten()))
-        _wl = np.concatenate((_wl, gisans.wavelengths[filtered]))
+    def get_qy_range(self, tof_indices):
+        """
+            Return the minimum and maximum Qy for a set of TOF bins
+            :param list tof_indices: TOF bin indices
+        """
+        k = self.k[tof_indices]
+        if len(k) == 0:
+            return None
+        # k is positive, so the extrema are reached for the extrema of the pixel factor
+        return (k * self._qy_xy.min()).min(), (k * self._qy_xy.max()).max()
 
-    return _qy, _qz, _pf, _s, _ds, _wl
+    def get_z_axis(self, use_pf=False):
+        """
+            Return Qz, or p_f, for each [x, TOF] point.
+            Those don't depend on the y position.
+            :param bool use_pf: if True, p_f will be returned instead of Qz
+        """
+        return self._p_f if use_pf else self._qz
+
+    def histogram(self, tof_indices, qy_edges, z_edges, use_pf=False):
+        """
+            Histogram the data of the given TOF bins, one TOF bin at a time.
+            Returns the number of points, the summed intensity and the summed variance
+            for each [Qy, Qz] bin.
+
+            :param list tof_indices: TOF bin indices
+            :param numpy.ndarray qy_edges: Qy bin edges
+            :param numpy.ndarray z_edges: Qz, or p_f, bin edges
+            :param bool use_pf: if True, p_f will be used instead of Qz
+        """
+        n_qy = len(qy_edges) - 1
+        n_z = len(z_edges) - 1
+        n_points = np.zeros(n_qy * n_z)
+        summed = np.zeros(n_qy * n_z)
+        variance = np.zeros(n_qy * n_z)
+        z_axis = self.get_z_axis(use_pf)
+        for i in tof_indices:
+            qy_index = _bin_index(self.get_qy(i), qy_edges)
+            z_index = _bin_index(z_axis[:, i], z_edges)
+            bins = (qy_index * n_z + z_index[:, np.newaxis]).ravel()
+            n_points += np.bincount(bins, minlength=n_qy * n_z)
+            summed += np.bincount(bins, weights=self.S[:, :, i].ravel(), minlength=n_qy * n_z)
+            variance += np.bincount(bins, weights=self.dS[:, :, i].ravel()**2, minlength=n_qy * n_z)
+        return n_points.reshape((n_qy, n_z)), summed.reshape((n_qy, n_z)), variance.reshape((n_qy, n_z))
 
 def rebin_extract(reduction_list, pol_state, wl_min, wl_max, qy_npts=50, qz_npts=50, use_pf=False):
+    """
+        Merge the GISANS data of a wavelength band and rebin it.
+        Returns the intensity, Qy, Qz (or p_f) and uncertainty arrays.
+    """
+    return _rebin(reduction_list, pol_state, [[wl_min, wl_max]],
+                  qy_npts=qy_npts, qz_npts=qz_npts, use_pf=use_pf)[0]
 
-    binning = (qy_npts+1, qz_npts+1)
-    qy, qz, pf, intensity, d_intensity, _ = merge(reduction_list, pol_state, wl_min=wl_min, wl_max=wl_max)
-    if use_pf:
-        _z_axis = pf
+def _auto_edges(ranges, n_bins):
+    """
+        Return the bin edges that numpy.histogram2d uses when given a number of bins
+        :param list ranges: list of (minimum, maximum) pairs for the data to bin
+        :param int n_bins: number of bins
+    """
+    ranges = [item for item in ranges if item is not None]
+    if len(ranges) == 0:
+        first_edge, last_edge = 0., 1.
     else:
-        _z_axis = qz
-
-    n_points, _qy, _qz_axis = np.histogram2d(qy, _z_axis, bins=binning)
-    _intensity_summed, _, _ = np.histogram2d(qy, _z_axis, bins=(_qy, _qz_axis), weights=intensity)
-    _intensity_err, _, _ = np.histogram2d(qy, _z_axis, bins=(_qy, _qz_axis), weights=d_intensity**2)
+        first_edge = min([item[0] for item in ranges])
+        last_edge = max([item[1] for item in ranges])
+    if first_edge == last_edge:
+        first_edge = first_edge - 0.5
+        last_edge = last_edge + 0.5
+    return np.linspace(first_edge, last_edge, n_bins + 1)
+
+def _bin_index(values, edges):
+    """
+        Return the index of the bin each value falls into, with the last edge
+        included in the last bin as for numpy.histogram2d.
+        :param numpy.ndarray values: data to bin
+        :param numpy.ndarray edges: bin edges
+    """
+    indices = np.searchsorted(edges, values, side='right')
+    indices[values == edges[-1]] -= 1
+    return indices - 1
 
-    _intensity_summed[n_points>0] /= n_points[n_points>0]
-    _intensity_err = np.sqrt(_intensity_err)
-    _intensity_err[n_points>0] /= n_points[n_points>0]
+def rebin_bands(reduction_list, pol_state, wl_min, wl_max, wl_npts=2, qy_npts=50, qz_npts=50, use_pf=False):
+    """
+        Rebin the GISANS data of each of wl_npts wavelength bands.
+        Returns the same output as rebin_extract(), for each band.
+    """
+    wl_step = (wl_max - wl_min) / wl_npts
+    band_edges = [[wl_min + i * wl_step, wl_min + (i + 1) * wl_step] for i in range(wl_npts)]
+    return _rebin(reduction_list, pol_state, band_edges,
+                  qy_npts=qy_npts, qz_npts=qz_npts, use_pf=use_pf)
 
-    _qy = (_qy[:-1]+_qy[1:])/2.
-    _qz_axis = (_qz_axis[:-1]+_qz_axis[1:])/2.
+def _rebin(reduction_list, pol_state, band_edges, qy_npts=50, qz_npts=50, use_pf=False):
+    """
+        Rebin the GISANS data of a list of wavelength bands.
 
-    return _intensity_summed, _qy, _qz_axis, _intensity_err
+        The counts of all the bands are accumulated in [band, Qy, Qz] arrays.
+        The Qy and Qz bins of each band cover the range of the data in that band,
+        so each band is histogrammed separately with GISANS.histogram(), which
+        goes through the TOF bins of the band one at a time. This avoids building
+        the [x, y, TOF] Qy array of each run, which takes more memory than the data.
+        The bands include both of their boundaries, so that a point
+        on the boundary between two bands is counted in both.
 
-def _rebin_proc(data):
-    # Filter data
-    wl = data['wl']
-    filtered = np.where((wl >= data['wl_min']) & (wl <= data['wl_max']))
-    qy = data['qy'][filtered]
-    _z_axis = data['qz'][filtered]
-    intensity = data['intensity'][filtered]
-    d_intensity = data['d_intensity'][filtered]
+        :param list reduction_list: list of NexusData objects
+        :param string pol_state: polarization state to consider
+        :param list band_edges: list of [wl_min, wl_max] pairs
+    """
+    n_bands = len(band_edges)
+    n_qy = qy_npts + 1
+    n_qz = qz_npts + 1
 
-    # Perform binning
-    n_points, _qy, _qz_axis = np.histogram2d(qy, _z_axis, bins=data['binning'])
-    _intensity_summed, _, _ = np.histogram2d(qy, _z_axis, bins=(_qy, _qz_axis), weights=intensity)
-    _intensity_err, _, _ = np.histogram2d(qy, _z_axis, bins=(_qy, _qz_axis), weights=d_intensity**2)
+    # List the TOF bins of each run that belong to each band
+    runs = []
+    for item in reduction_list:
+        gisans = item.cross_sections[pol_state].gisans_data
+        wl = gisans.wavelengths
+        runs.append((gisans, [np.where((wl >= _wl_min) & (wl <= _wl_max))[0]
+                              for _wl_min, _wl_max in band_edges]))
+
+    n_points = np.zeros((n_bands, n_qy, n_qz))
+    _intensity_summed = np.zeros((n_bands, n_qy, n_qz))
+    _intensity_err = np.zeros((n_bands, n_qy, n_qz))
+    results = []
+    for i in range(n_bands):
+        # Find the Qy and Qz range of the data in this band
+        qy_ranges = [gisans.get_qy_range(indices[i]) for gisans, indices in runs]
+        z_ranges = []
+        for gisans, indices in runs:
+            if len(indices[i]) > 0:
+                z_axis = gisans.get_z_axis(use_pf)[:, indices[i]]
+                z_ranges.append((z_axis.min(), z_axis.max()))
+        qy_edges = _auto_edges(qy_ranges, n_qy)
+        qz_edges = _auto_edges(z_ranges, n_qz)
+
+        for gisans, indices in runs:
+            _counts, _summed, _variance = gisans.histogram(indices[i], qy_edges, qz_edges, use_pf=use_pf)
+            n_points[i] += _counts
+            _intensity_summed[i] += _summed
+            _intensity_err[i] += _variance
+
+        _qy = (qy_edges[:-1]+qy_edges[1:])/2.
+        _qz_axis = (qz_edges[:-1]+qz_edges[1:])/2.
+        results.append([_qy, _qz_axis])
 
-    _intensity_summed[n_points>0] /= n_points[n_points>0]
     _intensity_err = np.sqrt(_intensity_err)
-    _intensity_err[n_points>0] /= n_points[n_points>0]
+    has_points = n_points > 0
+    _intensity_summed[has_points] /= n_points[has_points]
+    _intensity_err[has_points] /= n_points[has_points]
 
-    _qy = (_qy[:-1]+_qy[1:])/2.
-    _qz_axis = (_qz_axis[:-1]+_qz_axis[1:])/2.
- 
-    return _intensity_summed, _qy, _qz_axis, _intensity_err
-
-def rebin_parallel(reduction_list, pol_state, wl_min, wl_max, wl_npts=2, qy_npts=50, qz_npts=50, use_pf=False):
-    """
-        Process the wavelength bands in parallel.
-    """
-    # First, merge all the data
-    binning = (qy_npts+1, qz_npts+1)
-    qy, qz, pf, intensity, d_intensity, wl_array = merge(reduction_list, pol_state, wl_min=0, wl_max=100.0)
-    if use_pf:
-        _z_axis = pf
-    else:
-        _z_axis = qz
-
-    # Create one job per wavelength band
-    inputs = []
-    for i in range(wl_npts):
-        wl_step = (wl_max - wl_min) / wl_npts
-        _wl_min = wl_min + i * wl_step
-        _wl_max = wl_min + (i + 1) * wl_step
-        _d = dict(qy=qy, qz=_z_axis, intensity=intensity, d_intensity=d_intensity,
-                  wl=wl_array, wl_min=_wl_min, wl_max=_wl_max, binning=binning)
-        inputs.append(_d)
-
-    pool = Pool(wl_npts)
-    results = pool.map(_rebin_proc, inputs)
-    return results
+    return [(_intensity_summed[i], results[i][0], results[i][1], _intensity_err[i]) for i in range(n_bands)]
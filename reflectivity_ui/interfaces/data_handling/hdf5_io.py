@@ -0,0 +1,142 @@
+#pylint: disable=invalid-name, too-many-arguments, too-many-locals
+"""
+    Write reduced data to HDF5.
+
+    Each cross-section is a group holding its data as chunked, compressed
+    datasets, so that large off-specular and GISANS results can be written
+    quickly and partly read back. The reduction parameters written in the
+    header of QuickNXS files are stored as attributes.
+
+    Layout:
+        /                           file information and global options
+        /reduction/direct_beam_runs/<i>  direct beam parameters
+        /reduction/data_runs/<i>         data run parameters
+        /<cross-section>            label, columns and units
+        /<cross-section>/data       [point][column] array, or [pixel][TOF][column]
+                                    for off-specular data (data_<i> for each run)
+        /<cross-section>/<band>     the same, for each GISANS wavelength band
+"""
+from __future__ import absolute_import, division, print_function
+import time
+import numpy as np
+import h5py
+
+from ... import __version__
+from . import quicknxs_io
+
+# Target size of a chunk, in bytes
+CHUNK_SIZE = 256 * 1024
+
+# Gzip compression level
+COMPRESSION_LEVEL = 4
+
+
+def get_chunk_shape(shape, item_size=8):
+    """
+        Return a chunk shape holding complete rows of the leading axis,
+        so that any range of points, pixels or Qy values can be read back alone.
+        :param tuple shape: shape of the dataset
+        :param int item_size: size of an item, in bytes
+    """
+    row_size = item_size * int(np.prod(shape[1:]))
+    n_rows = max(min(CHUNK_SIZE // max(row_size, 1), shape[0]), 1)
+    return (n_rows,) + tuple(shape[1:])
+
+
+def create_dataset(group, name, data):
+    """
+        Write an array as a chunked, compressed dataset
+        :param h5py.Group group: parent group
+        :param str name: name of the dataset
+        :param ndarray data: data to write
+    """
+    data = np.asarray(data, dtype=float)
+    if data.size == 0:
+        return group.create_dataset(name, data=data)
+    return group.create_dataset(name, data=data, chunks=get_chunk_shape(data.shape, data.itemsize),
+                                compression='gzip', compression_opts=COMPRESSION_LEVEL, shuffle=True)
+
+
+def _write_parameters(group, parameter_list):
+    """
+        Store each parameter dictionary as the attributes of a sub-group
+        :param h5py.Group group: parent group
+        :param list parameter_list: list of parameter dictionaries
+    """
+    for i, parameters in enumerate(parameter_list):
+        run_group = group.create_group(str(i))
+        for key, value in parameters.items():
+            run_group.attrs[key] = value
+
+
+def _write_data(group, data, label, output_data):
+    """
+        Write the data of a cross-section to a group
+        :param h5py.Group group: group for the cross-section
+        :param ndarray or list data: data array, or list of arrays, one per run
+        :param str label: cross-section label
+        :param dict output_data: data dictionary, for the column names and units
+    """
+    group.attrs['label'] = label
+    group.attrs['columns'] = [str(item) for item in output_data['columns']]
+    group.attrs['units'] = [str(item) for item in output_data['units']]
+    if isinstance(data, list) and len(data) == 1:
+        data = data[0]
+    if isinstance(data, list):
+        for i, item in enumerate(data):
+            create_dataset(group, 'data_%d' % i, item)
+    else:
+        create_dataset(group, 'data', data)
+
+
+def write_hdf5(output_path, output_data, reduction_list, direct_beam_list, xs=None, data_type='Specular'):
+    """
+        Write reduced data to an HDF5 file.
+
+        :param str output_path: output file path
+        :param dict output_data: data dictionary, as produced by the ProcessingWorkflow
+        :param list reduction_list: list of NexusData objects
+        :param list direct_beam_list: list of NexusData objects for the direct beams
+        :param list xs: list of cross-sections to write [defaults to all]
+        :param str data_type: type of data being written
+    """
+    if xs is None:
+        xs = list(output_data['cross_sections'].keys())
+    cross_section_bins = output_data.get('cross_section_bins', {})
+    wavelength_bands = output_data.get('wavelength_bands', {})
+
+    with h5py.File(output_path, 'w') as h5_file:
+        h5_file.attrs['creator'] = 'QuickNXS %s' % __version__
+        h5_file.attrs['mantid_version'] = str(quicknxs_io.mantid.__version__)
+        h5_file.attrs['date'] = time.strftime(u"%Y-%m-%d %H:%M:%S")
+        h5_file.attrs['type'] = data_type
+        h5_file.attrs['input_file_indices'] = ','.join([str(item.number) for item in reduction_list])
+        h5_file.attrs['extracted_states'] = ','.join([str(item) for item in xs])
+
+        parameters = quicknxs_io.get_reduction_parameters(reduction_list, direct_beam_list)
+        if parameters is not None:
+            direct_beams, data_runs, global_options = parameters
+            reduction_group = h5_file.create_group('reduction')
+            _write_parameters(reduction_group.create_group('direct_beam_runs'), direct_beams)
+            _write_parameters(reduction_group.create_group('data_runs'), data_runs)
+            for key, value in global_options.items():
+                h5_file.attrs[key] = value
+
+        # GISANS data is grouped by cross-section, with one sub-group per wavelength band
+        bands = {}
+        for pol_state, band_list in cross_section_bins.items():
+            for band in band_list:
+                bands[band] = pol_state
+
+        for pol_state in xs:
+            if pol_state not in output_data:
+                continue
+            label = output_data['cross_sections'].get(pol_state, pol_state)
+            if pol_state in bands:
+                parent = h5_file.require_group(bands[pol_state])
+                group = parent.create_group(pol_state)
+                if pol_state in wavelength_bands:
+                    group.attrs['wavelength_range'] = wavelength_bands[pol_state]
+            else:
+                group = h5_file.create_group(pol_state)
+            _write_data(group, output_data[pol_state], label, output_data)
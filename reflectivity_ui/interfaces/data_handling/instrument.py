@@ -87,7 +87,9 @@ class Instrument(object):
     def dummy_filter_cross_sections(self, ws):
         """
             Filter events according to an aggregated state log.
-            :param str file_path: file to read
+            The events are classified against the state log and sent
+            to their cross-section in a single pass.
+            :param workspace ws: Mantid event workspace to filter
 
             BL4A:SF:ICP:getDI
 
@@ -101,8 +103,51 @@ class Instrument(object):
                   'On_Off': 47,
                   'Off_On': 31,
                   'On_On': 63}
+        base_name = '%s_entry' % ws.getRunNumber()
+        splitter_name = '%s_state_splitter' % ws.getRunNumber()
+
+        try:
+            splitter = self.get_state_splitter(ws, state_log, states)
+            api.FilterEvents(InputWorkspace=ws, SplitterWorkspace=splitter,
+                             RelativeTime=True, FilterByPulseTime=True,
+                             CorrectionToSample='None', SplitSampleLogs=True,
+                             GroupWorkspaces=False, OutputWorkspaceIndexedFrom1=False,
+                             OutputUnfilteredEvents=False,
+                             OutputWorkspaceBaseName=base_name)
+        except:
+            logging.error("Could not filter cross-sections in a single pass: %s", sys.exc_info()[1])
+            # Clean up partial outputs and filter each state separately
+            for name in [splitter_name] + ['%s_%s' % (base_name, pol_state) for pol_state in states]:
+                if name in api.mtd:
+                    api.DeleteWorkspace(name)
+            return self.filter_cross_sections_by_state(ws, state_log, states)
+        api.DeleteWorkspace(splitter_name)
+
         cross_sections = []
+        for pol_state in ['Off_Off', 'On_On', 'Off_On', 'On_Off']:
+            # FilterEvents only creates workspaces for states found in the log
+            if '%s_%s' % (base_name, pol_state) not in api.mtd:
+                logging.error("Could not filter %s: state not found in %s", pol_state, state_log)
+                continue
+            _ws = api.RenameWorkspace(InputWorkspace='%s_%s' % (base_name, pol_state),
+                                      OutputWorkspace='%s-%s' % (base_name, pol_state))
+            _ws.getRun()['cross_section_id'] = pol_state
+            cross_sections.append(_ws)
+
+        return cross_sections
+
+    @classmethod
+    def filter_cross_sections_by_state(cls, ws, state_log, states):
+        """
+            Filter events one cross-section at a time. This is slower than
+            the single pass of dummy_filter_cross_sections(), but a failure
+            only loses the cross-section it happens in.
 
+            :param workspace ws: Mantid event workspace to filter
+            :param str state_log: name of the log holding the state
+            :param dict states: state value for each cross-section name
+        """
+        cross_sections = []
         for pol_state in ['Off_Off', 'On_On', 'Off_On', 'On_Off']:
             try:
                 _ws = api.FilterByLogValue(InputWorkspace=ws, LogName=state_log, TimeTolerance=0.1,
@@ -116,6 +161,37 @@ class Instrument(object):
 
         return cross_sections
 
+    @classmethod
+    def get_state_splitter(cls, ws, state_log, states):
+        """
+            Create a splitter table assigning each time interval of the
+            state log to its cross-section. Intervals start at a log entry
+            and end at the next one, the last one extending to the end of the run.
+            Intervals with a state value not in the list are rejected.
+
+            :param workspace ws: Mantid event workspace
+            :param str state_log: name of the log holding the state
+            :param dict states: state value for each cross-section name
+        """
+        run = ws.getRun()
+        run_start = np.datetime64(run.startTime().toISO8601String())
+        run_end = np.datetime64(run.endTime().toISO8601String())
+
+        state_values = np.asarray(run.getProperty(state_log).value).astype(int)
+        start_times = (run.getProperty(state_log).times - run_start) / np.timedelta64(1, 's')
+        end_of_run = max((run_end - run_start) / np.timedelta64(1, 's'), start_times[-1]) + 1.0
+        stop_times = np.append(start_times[1:], end_of_run)
+
+        splitter = api.CreateEmptyTableWorkspace(OutputWorkspace='%s_state_splitter' % ws.getRunNumber())
+        splitter.addColumn('double', 'start')
+        splitter.addColumn('double', 'stop')
+        splitter.addColumn('str', 'target')
+        state_names = dict((states[pol_state], pol_state) for pol_state in states)
+        for i, value in enumerate(state_values):
+            if value in state_names:
+                splitter.addRow([float(start_times[i]), float(stop_times[i]), state_names[value]])
+        return splitter
+
     def load_data(self, file_path):
         """
             Load a data set according to the needs ot the instrument.
@@ -138,6 +214,8 @@ class Instrument(object):
         else:
             ws = api.LoadEventNexus(Filename=file_path, OutputWorkspace="raw_events")
             xs_list = self.dummy_filter_cross_sections(ws)
+            # The filtered workspaces hold all the events we need
+            api.DeleteWorkspace(ws)
 
         return xs_list
 
@@ -188,6 +266,13 @@ class Instrument(object):
             return True
         return False
 
+    def get_event_filter(self):
+        """
+            Return the settings used to split the events into cross-sections,
+            so that data filtered with different settings is not mixed up.
+        """
+        return [self.pol_state, self.pol_veto, self.ana_state, self.ana_veto, USE_SLOW_FLIPPER_LOG]
+
     @classmethod
     def get_info(cls, workspace, data_object):
         """
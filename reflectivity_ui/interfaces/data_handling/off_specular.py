@@ -3,11 +3,12 @@
     Class to execute and hold the off-specular reflectivity calculation.
 """
 import logging
+from functools import reduce
 import numpy as np
-import scipy.stats
-from multiprocessing import Pool
+import scipy.spatial
 
 from reflectivity_ui.interfaces.configuration import Configuration
+from . import worker_pool
 
 H_OVER_M_NEUTRON = 3.956034e-7 # h/m_n [m^2/s]
 
@@ -94,10 +95,7 @@ class OffSpecular(object):
 
             norm_y_min, norm_y_max = direct_beam.configuration.low_res_roi
             norm_x_min, norm_x_max = direct_beam.configuration.peak_roi
-            norm_raw_multi_dim = direct_beam.data[norm_x_min:norm_x_max,
-                                                  norm_y_min:norm_y_max, :]
-
-            norm_raw = norm_raw_multi_dim.sum(axis=0).sum(axis=0)
+            norm_raw = direct_beam.get_roi_counts([norm_x_min, norm_x_max], [norm_y_min, norm_y_max])
             norm_d_raw = np.sqrt(norm_raw)
             norm_scale = (float(norm_x_max)-float(norm_x_min)) * (float(norm_y_max)-float(norm_y_min))
             norm_raw /= norm_scale * direct_beam.proton_charge
@@ -123,12 +121,12 @@ def merge(reduction_list, pol_state):
         TODO: This doesn't deal with the overlap properly. It assumes that the user
         cut the overlapping points by hand.
     """
-    _qx = np.empty(0)
-    _qz = np.empty(0)
-    _ki_z = np.empty(0)
-    _kf_z = np.empty(0)
-    _s = np.empty(0)
-    _ds = np.empty(0)
+    _qx = []
+    _qz = []
+    _ki_z = []
+    _kf_z = []
+    _s = []
+    _ds = []
 
     for item in reduction_list:
         offspec = item.cross_sections[pol_state].off_spec
@@ -140,20 +138,15 @@ def merge(reduction_list, pol_state):
         p_n = n_total-item.cross_sections[pol_state].configuration.cut_last_n_points
 
         #NOTE: need to unravel the arrays from [TOF][pixel] to [q_points]
-        Qx = np.ravel(Qx[:, p_0:p_n])
-        Qz = np.ravel(Qz[:, p_0:p_n])
-        ki_z = np.ravel(ki_z[:, p_0:p_n])
-        kf_z = np.ravel(kf_z[:, p_0:p_n])
-        S = np.ravel(S[:, p_0:p_n])
-        dS = np.ravel(dS[:, p_0:p_n])
-
-        _qx = np.concatenate((_qx, Qx))
-        _qz = np.concatenate((_qz, Qz))
-        _ki_z = np.concatenate((_ki_z, ki_z))
-        _kf_z = np.concatenate((_kf_z, kf_z))
-        _s = np.concatenate((_s, S))
-        _ds = np.concatenate((_ds, dS))
-
+        _qx.append(np.ravel(Qx[:, p_0:p_n]))
+        _qz.append(np.ravel(Qz[:, p_0:p_n]))
+        _ki_z.append(np.ravel(ki_z[:, p_0:p_n]))
+        _kf_z.append(np.ravel(kf_z[:, p_0:p_n]))
+        _s.append(np.ravel(S[:, p_0:p_n]))
+        _ds.append(np.ravel(dS[:, p_0:p_n]))
+
+    _qx, _qz, _ki_z, _kf_z, _s, _ds = [np.concatenate(_list) if _list else np.empty(0)
+                                       for _list in [_qx, _qz, _ki_z, _kf_z, _s, _ds]]
     return _qx, _qz, _ki_z, _kf_z, _ki_z-_kf_z, _s, _ds
 
 def closest_bin(q, bin_edges):
@@ -167,83 +160,138 @@ def closest_bin(q, bin_edges):
             return i
     return None
 
+class OffSpecularAccumulator(object):
+    """
+        Rebin off-specular data on a regular grid, one run at a time.
+
+        Only the sums needed for each bin are kept, so that the memory used
+        doesn't depend on the number of runs. The binning is the same as
+        scipy.stats.binned_statistic_2d for the given range and number of bins.
+    """
+    def __init__(self, axes=None, use_weights=True,
+                 n_bins_x=350, n_bins_y=350, x_min=-0.015, x_max=0.015, y_min=0, y_max=0.1):
+        """
+            :param int axes: axes to use, as defined in Configuration
+            :param bool use_weights: if True, compute the average weighted by the uncertainties
+        """
+        self.axes = axes
+        self.use_weights = use_weights
+        self.x_label = 'ki_z-kf_z'
+        self.y_label = 'Qz'
+        if axes == Configuration.QX_VS_QZ:
+            self.x_label = 'Qx'
+        elif axes == Configuration.KZI_VS_KZF:
+            self.x_label = 'ki_z'
+            self.y_label = 'kf_z'
+
+        self.x_edges = _linear_edges(x_min, x_max, n_bins_x)
+        self.y_edges = _linear_edges(y_min, y_max, n_bins_y)
+        self._shape = (n_bins_x, n_bins_y)
+
+        # Sums for each bin
+        self.counts = np.zeros(self._shape)
+        if use_weights:
+            self.weighted_sum = np.zeros(self._shape)
+            self.weight_sum = np.zeros(self._shape)
+        else:
+            self.value_sum = np.zeros(self._shape)
+            self.variance_sum = np.zeros(self._shape)
+
+    def _sum(self, bins, values):
+        """ Sum values in each bin """
+        return np.bincount(bins, weights=values, minlength=self.counts.size).reshape(self._shape)
+
+    def add(self, cross_section):
+        """
+            Add the off-specular result of a cross-section.
+            :param CrossSectionData cross_section: cross-section with computed off-specular data
+        """
+        offspec = cross_section.off_spec
+        n_total = len(offspec.S[0])
+        p_0 = cross_section.configuration.cut_first_n_points
+        p_n = n_total-cross_section.configuration.cut_last_n_points
+
+        if self.axes == Configuration.QX_VS_QZ:
+            x_values, y_values = offspec.Qx, offspec.Qz
+        elif self.axes == Configuration.KZI_VS_KZF:
+            x_values, y_values = offspec.ki_z, offspec.kf_z
+        else:
+            x_values, y_values = offspec.ki_z-offspec.kf_z, offspec.Qz
+
+        x_index = _binned_statistic_index(np.ravel(x_values[:, p_0:p_n]), self.x_edges)
+        y_index = _binned_statistic_index(np.ravel(y_values[:, p_0:p_n]), self.y_edges)
+        in_range = (x_index >= 0) & (x_index < self._shape[0]) & (y_index >= 0) & (y_index < self._shape[1])
+        bins = x_index[in_range] * self._shape[1] + y_index[in_range]
+        S = np.ravel(offspec.S[:, p_0:p_n])[in_range]
+        dS = np.ravel(offspec.dS[:, p_0:p_n])[in_range]
+
+        self.counts += self._sum(bins, None)
+        if self.use_weights:
+            self.weighted_sum += self._sum(bins, S/dS**2)
+            self.weight_sum += self._sum(bins, 1/dS**2)
+        else:
+            self.value_sum += self._sum(bins, S)
+            self.variance_sum += self._sum(bins, dS**2)
+
+    def result(self):
+        """
+            Return the rebinned intensity and its uncertainty as [y, x] arrays,
+            followed by the bin centers and the axis labels.
+        """
+        if self.use_weights:
+            # Weighted average
+            result = (self.weighted_sum / self.weight_sum).T
+            error = np.sqrt(1.0/self.weight_sum).T
+        else:
+            # Simple average, with errors
+            result = (self.value_sum / self.counts).T
+            error = (np.sqrt(self.variance_sum) / self.counts).T
+        result = np.nan_to_num(result)
+        error = np.nan_to_num(error)
+
+        x_middle = self.x_edges[:-1] + (self.x_edges[1] - self.x_edges[0]) / 2.0
+        y_middle = self.y_edges[:-1] + (self.y_edges[1] - self.y_edges[0]) / 2.0
+        return result, error, x_middle, y_middle, [self.x_label, self.y_label]
+
+def _linear_edges(x_min, x_max, n_bins):
+    """
+        Return the bin edges used by scipy.stats.binned_statistic_2d for a given range
+    """
+    if x_min == x_max:
+        x_min -= 0.5
+        x_max += 0.5
+    return np.linspace(x_min, x_max, n_bins + 1)
+
+def _binned_statistic_index(values, edges):
+    """
+        Return the index of the bin each value falls into, following scipy.stats.binned_statistic_2d.
+        Values outside the bins have an index of -1 or len(edges)-1.
+        :param numpy.ndarray values: values to bin
+        :param numpy.ndarray edges: bin edges
+    """
+    indices = np.digitize(values, edges)
+    # Values on the last edge, within rounding, go in the last bin
+    decimal = int(-np.log10(np.diff(edges).min())) + 6
+    on_edge = np.where((values >= edges[-1]) &
+                       (np.around(values, decimal) == np.around(edges[-1], decimal)))[0]
+    indices[on_edge] -= 1
+    return indices - 1
+
 def rebin_extract(reduction_list, pol_state, axes=None, use_weights=True,
                   n_bins_x=350, n_bins_y=350, x_min=-0.015, x_max=0.015, y_min=0, y_max=0.1):
     """
         Rebin off-specular data and extract cut at given Qz values.
-        Note: the analysis computers with RHEL7 have Scipy 0.12 installed, which makes
-        this code uglier. Refactor once we get a more recent version.
     """
-    Qx, Qz, ki_z, kf_z, delta_k, S, dS = merge(reduction_list, pol_state)
-
-    # Specify how many bins we want in each direction.
-    _bins = [n_bins_x, n_bins_y]
-
     # Specify the axes
     if axes is None:
         axes = reduction_list[0].cross_sections[pol_state].configuration.off_spec_x_axis
-    x_label = 'ki_z-kf_z'
-    y_label = 'Qz'
-    x_values = delta_k
-    y_values = Qz
-    if axes == Configuration.QX_VS_QZ:
-        x_label = 'Qx'
-        x_values = Qx
-    elif axes == Configuration.KZI_VS_KZF:
-        x_label = 'ki_z'
-        y_label = 'kf_z'
-        x_values = ki_z
-        y_values = kf_z
-
-    # Find the indices of S[TOF][main_axis_pixel] where we have non-zero data.
-    if use_weights:
-        # Compute the weighted average
-        # - Weighted sum
-        _r = S/dS**2
-        statistic, x_edge, y_edge, _ = scipy.stats.binned_statistic_2d(x_values, y_values, _r,
-                                                                       statistic='sum',
-                                                                       range=[[x_min, x_max], [y_min, y_max]],
-                                                                       bins=_bins)
-        # - Sum of weights
-        _w = 1/dS**2
-        w_statistic, _, _, _ = scipy.stats.binned_statistic_2d(x_values, y_values, _w,
-                                                               statistic='sum',
-                                                               range=[[x_min, x_max], [y_min, y_max]],
-                                                               bins=[x_edge, y_edge])
-
-        result = statistic / w_statistic
-        result = result.T
-        error = np.sqrt(1.0/w_statistic).T
-        result = np.nan_to_num(result)
-        error = np.nan_to_num(error)
-    else:
-        # Compute the simple average, with errors
-        statistic, x_edge, y_edge, _ = scipy.stats.binned_statistic_2d(x_values, y_values, S,
-                                                                       statistic='mean',
-                                                                       range=[[x_min, x_max], [y_min, y_max]],
-                                                                       bins=_bins)
-        # Compute the errors
-        _w = dS**2
-        w_statistic, _, _, _ = scipy.stats.binned_statistic_2d(x_values, y_values, _w,
-                                                               statistic='sum',
-                                                               range=[[x_min, x_max], [y_min, y_max]],
-                                                               bins=[x_edge, y_edge])
-
-        _c = np.ones(len(x_values))
-        counts, _, _, _ = scipy.stats.binned_statistic_2d(x_values, y_values, _c,
-                                                          statistic='sum',
-                                                          range=[[x_min, x_max], [y_min, y_max]],
-                                                          bins=[x_edge, y_edge])
-
-        result = statistic.T
-        error = (np.sqrt(w_statistic) / counts).T
-        result = np.nan_to_num(result)
-        error = np.nan_to_num(error)
-
-    x_middle = x_edge[:-1] + (x_edge[1] - x_edge[0]) / 2.0
-    y_middle = y_edge[:-1] + (y_edge[1] - y_edge[0]) / 2.0
 
-    return result, error, x_middle, y_middle, [x_label, y_label]
+    accumulator = OffSpecularAccumulator(axes=axes, use_weights=use_weights,
+                                         n_bins_x=n_bins_x, n_bins_y=n_bins_y,
+                                         x_min=x_min, x_max=x_max, y_min=y_min, y_max=y_max)
+    for item in reduction_list:
+        accumulator.add(item.cross_sections[pol_state])
+    return accumulator.result()
 
 def get_slice(qz, data, error, q_min, q_max):
     """
@@ -274,7 +322,10 @@ def _smooth_data(x, y, I, sigmas=3., gridx=150, gridy=50,
       to a given grid point and averages their intensities
       weighted by the gaussian of the distance.
 
-      :param dict settings: Contains options for 'grid', 'sigma' and 'region' of the algorithm
+      A KD-tree is built once over the (x/sigmax, y/sigmay) coordinates, in which
+      the distance to a grid point is the normalized distance used for the weights.
+      Only the points within range of each grid point are then considered.
+
       :param numpy.ndarray x: x-values of the original data
       :param numpy.ndarray y: y-values of the original data
       :param numpy.ndarray I: Intensity values of the original data
@@ -288,37 +339,61 @@ def _smooth_data(x, y, I, sigmas=3., gridx=150, gridy=50,
     Xout, Yout=np.meshgrid(xout, yout)
     Iout=np.zeros_like(Xout)
     ssigmax, ssigmay=sigmax**2, sigmay**2
+    if indices is None:
+        indices = [0, gridx]
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+    I = np.asarray(I)
+    tree = scipy.spatial.cKDTree(np.vstack([x/sigmax, y/sigmay]).T)
 
     imax=len(Xout)
     for i in range(imax):
-        #for j in range(len(Xout[0])):
         for j in range(indices[0], indices[1]):
             xij=Xout[i, j]
             yij=Yout[i, j]
+            # Ratio between the sigmas at this grid point and the given sigmas, squared
+            scale = 1.0
             if axis_sigma_scaling:
                 if axis_sigma_scaling==1: xyij=xij
                 elif axis_sigma_scaling==2: xyij=yij
                 elif axis_sigma_scaling==3: xyij=xij+yij
                 if xyij==0:
                     continue
+                scale = xyij/xysigma0
                 ssigmaxi=ssigmax/xysigma0*xyij
                 ssigmayi=ssigmay/xysigma0*xyij
-                rij=(x-xij)**2/ssigmaxi+(y-yij)**2/ssigmayi # normalized distance^2
             else:
-                rij=(x-xij)**2/ssigmax+(y-yij)**2/ssigmay # normalized distance^2
+                ssigmaxi, ssigmayi = ssigmax, ssigmay
+
+            if scale > 0:
+                # Use a slightly larger radius so that rounding can't exclude a point,
+                # the selection below is done with the exact distance.
+                radius = sigmas * np.sqrt(scale) * (1.0 + 1e-6)
+                candidates = tree.query_ball_point([xij/sigmax, yij/sigmay], radius)
+                if len(candidates) == 0:
+                    continue
+                candidates = np.sort(np.asarray(candidates, dtype=int))
+            else:
+                # With negative sigmas every point is within range
+                candidates = np.arange(len(x))
+
+            rij=(x[candidates]-xij)**2/ssigmaxi+(y[candidates]-yij)**2/ssigmayi # normalized distance^2
             take=np.where(rij<sigmas**2) # take points up to 3 sigma distance
             if len(take[0])==0:
                 continue
             Pij=np.exp(-0.5*rij[take])
             Pij/=Pij.sum()
-            Iout[i, j]=(Pij*I[take]).sum()
+            Iout[i, j]=(Pij*I[candidates[take]]).sum()
     return Xout, Yout, Iout
 
 def proc(data):
     """
-        Serializable function to be called by each thread
+        Serializable function to be called by each worker.
+        The input data points are read from the shared buffers.
     """
-    return _smooth_data(x=data['x'], y=data['y'], I=data['I'], sigmas=data['sigmas'],
+    return _smooth_data(x=worker_pool.load(data['x']), y=worker_pool.load(data['y']),
+                        I=worker_pool.load(data['I']), sigmas=data['sigmas'],
                         gridx=data['gridx'], gridy=data['gridy'],
                         sigmax=data['sigmax'], sigmay=data['sigmay'],
                         x1=data['x1'], x2=data['x2'], y1=data['y1'], y2=data['y2'],
@@ -328,30 +403,30 @@ def proc(data):
 def smooth_data(x, y, I, sigmas=3., gridx=150, gridy=50,
                 sigmax=0.0005, sigmay=0.0005,
                 x1=-0.03, x2=0.03, y1=0.0, y2=0.1,
-                axis_sigma_scaling=None, xysigma0=0.06, pool=5):
+                axis_sigma_scaling=None, xysigma0=0.06, pool=None, progress=None):
     """
-        Execute legacy smoothing process by spreading it to a pool
-        of processes.
+        Execute legacy smoothing process by spreading the columns
+        of the output grid over a pool of processes.
+
+        :param WorkerPool pool: worker pool [defaults to the application pool]
+        :param ProgressReporter progress: reporter object
     """
-    pool = int(pool)
-    xout=np.linspace(x1, x2, gridx)
-    p = Pool(pool)
-    n = len(xout)
-    step = int(n/pool)
-    indices = [[step*i, step*(i+1)] for i in range(pool)]
-    indices[-1][1]=n
-
-    inputs = []
-    for i in range(pool):
-        _d = dict(x=x, y=y, I=I,
-                 sigmas=sigmas, gridx=gridx, gridy=gridy,
-                 sigmax=sigmax, sigmay=sigmay,
-                 x1=x1, x2=x2, y1=y1, y2=y2,
-                 axis_sigma_scaling=axis_sigma_scaling, xysigma0=xysigma0,
-                 indices=indices[i])
-        inputs.append(_d)
-
-    results = p.map(proc, inputs)
+    if pool is None:
+        pool = worker_pool.get_pool()
+
+    with worker_pool.SharedArrays() as shared:
+        _x, _y, _I = shared.add('x', x), shared.add('y', y), shared.add('I', I)
+        inputs = []
+        for indices in pool.chunks(gridx):
+            _d = dict(x=_x, y=_y, I=_I,
+                      sigmas=sigmas, gridx=gridx, gridy=gridy,
+                      sigmax=sigmax, sigmay=sigmay,
+                      x1=x1, x2=x2, y1=y1, y2=y2,
+                      axis_sigma_scaling=axis_sigma_scaling, xysigma0=xysigma0,
+                      indices=indices)
+            inputs.append(_d)
+        results = pool.map(proc, inputs, progress=progress, message="Smoothing off-specular data")
+
     x_out = results[0][0]
     y_out = results[0][1]
     _data = [r[2] for r in results]
@@ -0,0 +1,174 @@
+"""
+    Fast estimate of the specular reflectivity, computed with NumPy from
+    the binned [x, y, TOF] data instead of running MagnetismReflectometryReduction.
+
+    The calculation follows the reduction: the signal and direct beam are summed
+    over their regions of interest, the background is subtracted, both are
+    normalized by the proton charge and the quicknxs scaling factor is applied.
+    No final Q rebinning is done, so that each point corresponds to a TOF bin.
+    This is meant for interactive display only. The Mantid reduction
+    remains the reference for anything that gets saved.
+"""
+#pylint: disable=invalid-name, too-many-locals, bare-except
+from __future__ import absolute_import, division, print_function
+import math
+import logging
+import numpy as np
+
+from .gisans import H_OVER_M_NEUTRON
+
+
+def get_wavelength(cross_section):
+    """
+        Return the wavelength at the center of each TOF bin, in Angstrom
+        :param CrossSectionData cross_section: data object
+    """
+    tof = (cross_section.tof_edges[:-1] + cross_section.tof_edges[1:]) / 2.0
+    return H_OVER_M_NEUTRON * tof / cross_section.dist_mod_det * 1e4
+
+
+def get_theta(cross_section):
+    """
+        Return the reflection angle, in radians, as used by the reduction
+        :param CrossSectionData cross_section: data object
+    """
+    if cross_section.configuration.use_dangle:
+        return math.fabs(cross_section.scattering_angle) * math.pi / 180.0
+    sangle = getattr(cross_section, 'sangle', cross_section.logs.get('SANGLE', 0))
+    return math.fabs(sangle) * math.pi / 180.0
+
+
+def _roi_size(roi_x, roi_y):
+    """ Number of pixels in a region of interest """
+    return float(roi_x[1] - roi_x[0]) * float(roi_y[1] - roi_y[0])
+
+
+def get_signal(cross_section, subtract_background=True):
+    """
+        Return the counts per pixel in the peak region vs TOF, normalized
+        by the proton charge, and its uncertainty.
+        :param CrossSectionData cross_section: data object
+        :param bool subtract_background: if True, the background will be subtracted
+    """
+    configuration = cross_section.configuration
+    size_roi = math.fabs(_roi_size(configuration.peak_roi, configuration.low_res_roi))
+    summed = cross_section.get_roi_counts(configuration.peak_roi, configuration.low_res_roi)
+    signal = summed / size_roi
+    variance = summed / size_roi**2
+    if subtract_background:
+        bck, d_bck = cross_section.get_background_vs_TOF(with_variance=True)
+        signal = signal - bck
+        variance = variance + d_bck
+    charge = cross_section.proton_charge if cross_section.proton_charge > 0 else 1.0
+    return signal / charge, np.sqrt(variance) / charge
+
+
+def get_pixel_signal(cross_section, subtract_background=True):
+    """
+        Return the counts for each pixel of the peak region, summed over the
+        low-resolution direction and normalized by the proton charge, and its uncertainty.
+        The arrays are [x, TOF].
+        :param CrossSectionData cross_section: data object
+        :param bool subtract_background: if True, the background will be subtracted
+    """
+    configuration = cross_section.configuration
+    integral = cross_section.get_roi_integral()
+    n_x = integral.shape[0] - 1
+    x_min, x_max = [int(min(max(x, 0), n_x)) for x in configuration.peak_roi]
+    y_min, y_max = [int(min(max(y, 0), integral.shape[1] - 1)) for y in configuration.low_res_roi]
+    # Difference of the summed-area table along x gives the low-res sums for each pixel
+    columns = integral[x_min:x_max + 1, y_max] - integral[x_min:x_max + 1, y_min]
+    summed = np.diff(columns, axis=0)
+    n_y = float(configuration.low_res_roi[1] - configuration.low_res_roi[0])
+    signal = summed / n_y
+    variance = summed / n_y**2
+    if subtract_background:
+        bck, d_bck = cross_section.get_background_vs_TOF(with_variance=True)
+        signal = signal - bck[np.newaxis, :]
+        variance = variance + d_bck[np.newaxis, :]
+    charge = cross_section.proton_charge if cross_section.proton_charge > 0 else 1.0
+    return signal / charge, np.sqrt(variance) / charge, np.arange(x_min, x_max)
+
+
+def get_normalization(cross_section, direct_beam):
+    """
+        Return the direct beam counts per pixel vs TOF, rebinned to the
+        TOF binning of the data, and its uncertainty.
+        :param CrossSectionData cross_section: data object
+        :param CrossSectionData direct_beam: direct beam data object
+    """
+    norm, d_norm = get_signal(direct_beam, subtract_background=cross_section.configuration.subtract_background)
+    if len(direct_beam.tof_edges) == len(cross_section.tof_edges) \
+        and np.allclose(direct_beam.tof_edges, cross_section.tof_edges):
+        return norm, d_norm
+
+    # Interpolate the counts per unit of TOF if the binning is different
+    db_tof = (direct_beam.tof_edges[:-1] + direct_beam.tof_edges[1:]) / 2.0
+    db_width = np.diff(direct_beam.tof_edges)
+    tof = (cross_section.tof_edges[:-1] + cross_section.tof_edges[1:]) / 2.0
+    width = np.diff(cross_section.tof_edges)
+    norm = np.interp(tof, db_tof, norm / db_width, left=0, right=0) * width
+    d_norm = np.interp(tof, db_tof, d_norm / db_width, left=0, right=0) * width
+    return norm, d_norm
+
+
+def reflectivity(cross_section, direct_beam=None):
+    """
+        Compute the reflectivity of a cross-section.
+        Returns Q, R and dR arrays sorted in Q, before the scaling factor is applied.
+
+        :param CrossSectionData cross_section: data object
+        :param CrossSectionData direct_beam: if given, this data will be used to normalize the output
+    """
+    configuration = cross_section.configuration
+    wl = get_wavelength(cross_section)
+    theta = get_theta(cross_section)
+    if direct_beam is not None:
+        norm, d_norm = get_normalization(cross_section, direct_beam)
+    else:
+        norm, d_norm = np.ones(len(wl)), np.zeros(len(wl))
+    good = norm > 0
+    _norm = np.where(good, norm, 1.0)
+
+    # Scaling factor used by quicknxs
+    _scale = 0.005 / math.sin(theta) if theta > 0.0002 else 1.0
+
+    if configuration.use_constant_q:
+        signal, d_signal, pixels = get_pixel_signal(cross_section, configuration.subtract_background)
+        # Each pixel sees a different outgoing angle. Put the reflectivity of each
+        # pixel on the Q grid of the specular pixel before averaging.
+        rad_per_pixel = cross_section.det_size_x / cross_section.dist_sam_det / cross_section.data.shape[0]
+        k = 2.0 * np.pi / wl
+        q = 2.0 * k * math.sin(theta)
+        order = np.argsort(q)
+        q = q[order]
+        r = np.full((len(pixels), len(q)), np.nan)
+        dr2 = np.full((len(pixels), len(q)), np.nan)
+        for i, x in enumerate(pixels):
+            a_f = theta + (configuration.peak_position - x) * rad_per_pixel
+            q_x = k * (math.sin(theta) + math.sin(a_f))
+            r_x = signal[i] / _norm
+            dr2_x = (d_signal[i] / _norm)**2 + (signal[i] * d_norm / _norm**2)**2
+            _order = np.argsort(q_x)
+            r[i] = np.interp(q, q_x[_order], r_x[_order], left=np.nan, right=np.nan)
+            dr2[i] = np.interp(q, q_x[_order], dr2_x[_order], left=np.nan, right=np.nan)
+        # Average over the pixels that cover each Q value
+        n_pixels = np.sum(np.isfinite(r), axis=0)
+        covered = n_pixels > 0
+        n_pixels[~covered] = 1
+        r = np.nansum(r, axis=0) / n_pixels
+        dr = np.sqrt(np.nansum(dr2, axis=0)) / n_pixels
+        good = good[order] & covered
+    else:
+        signal, d_signal = get_signal(cross_section, configuration.subtract_background)
+        q = 4.0 * np.pi * math.sin(theta) / wl
+        r = signal / _norm
+        dr = np.sqrt((d_signal / _norm)**2 + (signal * d_norm / _norm**2)**2)
+        order = np.argsort(q)
+        q, r, dr, good = q[order], r[order], dr[order], good[order]
+
+    if direct_beam is None:
+        # Without normalization, the reduction returns the summed counts
+        logging.info("Preview without normalization for %s", cross_section.name)
+        _scale *= math.fabs(_roi_size(configuration.peak_roi, configuration.low_res_roi))
+    return q[good], r[good] * _scale, dr[good] * _scale
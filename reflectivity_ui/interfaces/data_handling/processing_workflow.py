@@ -5,10 +5,8 @@
 from __future__ import absolute_import, division, print_function
 import sys
 import os
-import math
 import copy
 import logging
-import time
 import numpy as np
 
 import smtplib
@@ -21,7 +19,7 @@ import zipfile
 import cStringIO
 
 from ..configuration import Configuration
-from . import quicknxs_io, data_manipulation, off_specular, gisans
+from . import quicknxs_io, hdf5_io, data_manipulation, off_specular, asymmetry, tracing
 
 
 DEFAULT_OPTIONS = dict(export_specular=True,
@@ -30,6 +28,7 @@ DEFAULT_OPTIONS = dict(export_specular=True,
                        export_offspec=False,
                        export_offspec_smooth=False,
                        format_genx=False,
+                       format_hdf5=False,
                        format_matlab=False,
                        format_mantid=True,
                        format_multi=True,
@@ -67,27 +66,30 @@ class ProcessingWorkflow(object):
         if not self.data_manager.reduction_states:
             return
 
-        if self.output_options['export_specular']:
-            if progress is not None:
-                progress(10, "Computing reflectivity")
-            self.specular_reflectivity()
+        with tracing.span('ProcessingWorkflow.execute', 'output', n_runs=len(self.data_manager.reduction_list)):
+            if self.output_options['export_specular']:
+                if progress is not None:
+                    progress(10, "Computing reflectivity")
+                self.specular_reflectivity()
 
-        if self.output_options['export_offspec'] or self.output_options['export_offspec_smooth']:
-            if progress is not None:
-                progress(20, "Computing off-specular reflectivity")
-            self.offspec(raw=self.output_options['export_offspec'],
-                         binned=self.output_options['export_offspec_smooth'])
+            if self.output_options['export_offspec'] or self.output_options['export_offspec_smooth']:
+                if progress is not None:
+                    progress(20, "Computing off-specular reflectivity")
+                sub_task = progress.create_sub_task(max_value=40) if progress else None
+                self.offspec(raw=self.output_options['export_offspec'],
+                             binned=self.output_options['export_offspec_smooth'],
+                             progress=sub_task)
 
-        if progress is not None:
-                progress(60, "Computing GISANS")
-        if self.output_options['export_gisans']:
-            self.gisans(progress=progress)
+            if progress is not None:
+                    progress(60, "Computing GISANS")
+            if self.output_options['export_gisans']:
+                self.gisans(progress=progress)
 
-        if self.output_options['email_send']:
-            self.send_email()
+            if self.output_options['email_send']:
+                self.send_email()
 
-        if progress is not None:
-            progress(100, "Complete")
+            if progress is not None:
+                progress(100, "Complete")
 
     def get_file_name(self, run_list=None, pol_state=None, data_type='dat', process_type='Specular'):
         """
@@ -107,6 +109,19 @@ class ProcessingWorkflow(object):
         base_name = base_name.replace('{type}', data_type)
         return os.path.join(self.output_options['output_directory'], base_name)
 
+    def get_output_states(self, output_data, xs=None):
+        """
+            Return the list of all output states we have to deal with
+            :param dict output_data: dictionary of numpy arrays
+            :param list xs: list of cross sections available in the output_data
+        """
+        if xs is not None:
+            return list(xs)
+        output_states = copy.copy(self.data_manager.reduction_states)
+        if self.output_options['export_asym'] and 'SA' in output_data:
+            output_states.append("SA")
+        return output_states
+
     def write_quicknxs(self, output_data, output_file_base, xs=None):
         """
             Write QuickNXS output reflectivity file.
@@ -120,12 +135,7 @@ class ProcessingWorkflow(object):
         col_names = [u'%s [%s]' % (cols[i], units[i]) for i in range(len(cols))]
 
         # List of all output states we have to deal with
-        if xs is not None:
-            output_states = xs
-        else:
-            output_states = copy.copy(self.data_manager.reduction_states)
-            if self.output_options['export_asym'] and 'SA' in output_data:
-                output_states.append("SA")
+        output_states = self.get_output_states(output_data, xs)
 
         # Sanity check
         if len(output_states) == 0:
@@ -144,13 +154,36 @@ class ProcessingWorkflow(object):
                 continue
 
             state_output_path = output_file_base.replace('{state}', pol_state)
-            quicknxs_io.write_reflectivity_header(self.data_manager.reduction_list,
-                                                  self.data_manager.direct_beam_list,
-                                                  state_output_path, _pol_state)
-            quicknxs_io.write_reflectivity_data(state_output_path, output_data[pol_state],
-                                                col_names, as_5col=five_cols)
+            with tracing.span('ProcessingWorkflow.write_quicknxs', 'output', cross_section=pol_state) as _span:
+                quicknxs_io.write_reflectivity_header(self.data_manager.reduction_list,
+                                                      self.data_manager.direct_beam_list,
+                                                      state_output_path, _pol_state)
+                quicknxs_io.write_reflectivity_data(state_output_path, output_data[pol_state],
+                                                    col_names, as_5col=five_cols)
+                _span.add_bytes(os.path.getsize(state_output_path))
             self.exported_data_files.append(state_output_path)
 
+    def write_hdf5(self, output_data, output_path, xs=None, process_type='Specular'):
+        """
+            Write an HDF5 file with all the output states.
+            :param dict output_data: dictionary of numpy arrays
+            :param str output_path: output file path
+            :param list xs: list of cross sections available in the output_data
+            :param str process_type: descriptor for the process type
+        """
+        output_states = self.get_output_states(output_data, xs)
+        if len(output_states) == 0:
+            return
+        try:
+            with tracing.span('ProcessingWorkflow.write_hdf5', 'output', process_type=process_type) as _span:
+                hdf5_io.write_hdf5(output_path, output_data, self.data_manager.reduction_list,
+                                   self.data_manager.direct_beam_list, xs=output_states,
+                                   data_type=process_type)
+                _span.add_bytes(os.path.getsize(output_path))
+            self.exported_data_files.append(output_path)
+        except:
+            logging.error("Could not save in HDF5 format: %s", sys.exc_info()[1])
+
     def write_genx(self, output_data, output_path):
         '''
             Create a Genx .gx model file with the right polarization states
@@ -202,122 +235,170 @@ class ProcessingWorkflow(object):
         # The following would be used to recalculate it:
         #    self.data_manager.calculate_reflectivity(specular=True)
 
-        #self.data_manager.merge_data_sets(asymmetry=self.output_options['export_asym'])
+        # The outputs are written from the points of each run, see get_output_data(),
+        # so the merged reflectivity of DataManager.merge_data_sets() is not used here.
 
-        run_list = [str(item.number) for item in self.data_manager.reduction_list]
+        with tracing.span('ProcessingWorkflow.specular_reflectivity', 'output'):
+            run_list = [str(item.number) for item in self.data_manager.reduction_list]
 
-        output_data = self.get_output_data()
-
-        # QuickNXS format
-        if self.output_options['format_multi']:
-            output_file_base = self.get_file_name(run_list)
-            self.write_quicknxs(output_data, output_file_base)
-
-        # Numpy arrays
-        if self.output_options['format_numpy']:
-            output_file = self.get_file_name(run_list, data_type='npz', pol_state='all')
-            np.savez(output_file, **output_data)
-            self.exported_data_files.append(output_file)
-
-        # Matlab output
-        if self.output_options['format_matlab']:
-            try:
-                from scipy.io import savemat
-                output_file = self.get_file_name(run_list, data_type='mat', pol_state='all')
-                savemat(output_file, output_data, oned_as='column')
-                self.exported_data_files.append(output_file)
-            except:
-                logging.error("Could not save in matlab format: %s", sys.exc_info([1]))
+            output_data = self.get_output_data()
 
-        if self.output_options['format_genx']:
-            output_path = self.get_file_name(run_list, data_type='gx', pol_state='all')
-            self.write_genx(output_data, output_path)
-            self.exported_data_files.append(output_path)
+            # QuickNXS format
+            if self.output_options['format_multi']:
+                output_file_base = self.get_file_name(run_list)
+                self.write_quicknxs(output_data, output_file_base)
+
+            # Numpy arrays
+            if self.output_options['format_numpy']:
+                output_file = self.get_file_name(run_list, data_type='npz', pol_state='all')
+                np.savez(output_file, **output_data)
+                self.exported_data_files.append(output_file)
 
-        if self.output_options['format_mantid']:
-            output_file = self.get_file_name(run_list, data_type='py', pol_state='all')
-            script = data_manipulation.generate_short_script(self.data_manager.reduction_list)
-            with open(output_file, 'w') as file_object:
-                file_object.write(script)
-            self.exported_data_files.append(output_file)
+            # Matlab output
+            if self.output_options['format_matlab']:
+                try:
+                    from scipy.io import savemat
+                    output_file = self.get_file_name(run_list, data_type='mat', pol_state='all')
+                    savemat(output_file, output_data, oned_as='column')
+                    self.exported_data_files.append(output_file)
+                except:
+                    logging.error("Could not save in matlab format: %s", sys.exc_info([1]))
+
+            # HDF5 output
+            if self.output_options['format_hdf5']:
+                output_file = self.get_file_name(run_list, data_type='h5', pol_state='all')
+                self.write_hdf5(output_data, output_file)
+
+            if self.output_options['format_genx']:
+                output_path = self.get_file_name(run_list, data_type='gx', pol_state='all')
+                self.write_genx(output_data, output_path)
+                self.exported_data_files.append(output_path)
+
+            if self.output_options['format_mantid']:
+                output_file = self.get_file_name(run_list, data_type='py', pol_state='all')
+                script = data_manipulation.generate_short_script(self.data_manager.reduction_list)
+                with open(output_file, 'w') as file_object:
+                    file_object.write(script)
+                self.exported_data_files.append(output_file)
 
     def gisans(self, progress=None):
         """
             Export GISANS.
         """
-        run_list = [str(item.number) for item in self.data_manager.reduction_list]
+        with tracing.span('ProcessingWorkflow.gisans', 'output'):
+            run_list = [str(item.number) for item in self.data_manager.reduction_list]
 
-        # Refresh the reflectivity calculation
-        if progress is not None:
-            progress(65, "Reducing GISANS...")
+            # Refresh the reflectivity calculation
+            if progress is not None:
+                progress(65, "Reducing GISANS...")
 
-        self.data_manager.cached_gisans = None
-        self.data_manager.reduce_gisans(progress=None)
+            self.data_manager.cached_gisans = None
+            self.data_manager.reduce_gisans(progress=None)
 
-        if progress is not None:
-            progress(75, "Binning GISANS...")
+            if progress is not None:
+                progress(75, "Binning GISANS...")
 
-        data_dict = self.get_gisans_data(progress=None)
-        self.data_manager.cached_gisans = data_dict
+            data_dict = self.get_gisans_data(progress=None)
+            self.data_manager.cached_gisans = data_dict
 
-        if progress is not None:
-            progress(90, "Writing data")
+            if progress is not None:
+                progress(90, "Writing data")
 
-        output_file_base = self.get_file_name(run_list, process_type='GISANS')
-        self.write_quicknxs(data_dict, output_file_base, xs=data_dict['cross_sections'].keys())
+            output_file_base = self.get_file_name(run_list, process_type='GISANS')
+            self.write_quicknxs(data_dict, output_file_base, xs=data_dict['cross_sections'].keys())
+            if self.output_options['format_hdf5']:
+                output_file = self.get_file_name(run_list, data_type='h5', pol_state='all', process_type='GISANS')
+                self.write_hdf5(data_dict, output_file, xs=data_dict['cross_sections'].keys(), process_type='GISANS')
 
-        if progress is not None:
-            progress(100, "GISANS complete")
+            if progress is not None:
+                progress(100, "GISANS complete")
 
-    def offspec(self, raw=True, binned=False):
+    def offspec(self, raw=True, binned=False, progress=None):
         """
             Export off-specular reflectivity.
             :param bool raw: if true, the raw results will be saved
             :param bool binned: if true, the raw results will be binned and saved
+            :param ProgressReporter progress: reporter object
         """
-        run_list = [str(item.number) for item in self.data_manager.reduction_list]
-
-        # Refresh the reflectivity calculation
-        self.data_manager.cached_offspec = None
-        self.data_manager.reduce_offspec()
-
-        if raw or binned:
-            output_data = self.get_offspec_data()
-        # Export raw result
-        if raw:
-            # QuickNXS format
-            output_file_base = self.get_file_name(run_list, process_type='OffSpec')
-            self.write_quicknxs(output_data, output_file_base)
-
-        # Export binned result
-        if binned:
-            if self.data_manager.active_channel.configuration.apply_smoothing:
-                # "Smooth" version
-                try:
-                    smooth_output, slice_data_dict = self.smooth_offspec(output_data)
-                    output_file_base = self.get_file_name(run_list, process_type='OffSpecSmooth')
-                    self.write_quicknxs(smooth_output, output_file_base)
+        with tracing.span('ProcessingWorkflow.offspec', 'output', raw=raw, binned=binned):
+            run_list = [str(item.number) for item in self.data_manager.reduction_list]
+
+            # Refresh the reflectivity calculation.
+            # For the binned output, each run is rebinned as soon as it is computed.
+            apply_smoothing = self.data_manager.active_channel.configuration.apply_smoothing
+            accumulators = None
+            if binned and not apply_smoothing:
+                accumulators = self.create_offspec_accumulators()
+            self.data_manager.cached_offspec = None
+            self.data_manager.reduce_offspec(accumulators=accumulators)
+
+            # The merged raw data is only needed for the raw and smoothed outputs
+            if raw or (binned and apply_smoothing):
+                output_data = self.get_offspec_data()
+            # Export raw result
+            if raw:
+                # QuickNXS format
+                output_file_base = self.get_file_name(run_list, process_type='OffSpec')
+                self.write_quicknxs(output_data, output_file_base)
+                if self.output_options['format_hdf5']:
+                    output_file = self.get_file_name(run_list, data_type='h5', pol_state='all', process_type='OffSpec')
+                    self.write_hdf5(output_data, output_file, process_type='OffSpec')
+
+            # Export binned result
+            if binned:
+                if apply_smoothing:
+                    # "Smooth" version
+                    try:
+                        smooth_output, slice_data_dict = self.smooth_offspec(output_data, progress=progress)
+                        output_file_base = self.get_file_name(run_list, process_type='OffSpecSmooth')
+                        self.write_quicknxs(smooth_output, output_file_base)
+                        if self.output_options['format_hdf5']:
+                            output_file = self.get_file_name(run_list, data_type='h5', pol_state='all',
+                                                             process_type='OffSpecSmooth')
+                            self.write_hdf5(smooth_output, output_file, process_type='OffSpecSmooth')
+                        if slice_data_dict is not None and 'cross_sections' in slice_data_dict:
+                            output_file_base = self.get_file_name(run_list, process_type='OffSpecSmoothSlice')
+                            self.write_quicknxs(slice_data_dict, output_file_base, xs=slice_data_dict['cross_sections'].keys())
+                        self.data_manager.cached_offspec = smooth_output
+                    except:
+                        raise
+                        logging.error("Problem writing smooth off-spec output: %s", sys.exc_value)
+                else:
+                    # Binned version
+                    binned_data, slice_data_dict = self.get_rebinned_offspec_data(accumulators)
+                    # QuickNXS format ['smooth' is an odd name but we keep it for backward compatibility]
+                    output_file_base = self.get_file_name(run_list, process_type='OffSpecBinned')
+                    self.write_quicknxs(binned_data, output_file_base)
+                    if self.output_options['format_hdf5']:
+                        output_file = self.get_file_name(run_list, data_type='h5', pol_state='all',
+                                                         process_type='OffSpecBinned')
+                        self.write_hdf5(binned_data, output_file, process_type='OffSpecBinned')
                     if slice_data_dict is not None and 'cross_sections' in slice_data_dict:
-                        output_file_base = self.get_file_name(run_list, process_type='OffSpecSmoothSlice')
+                        output_file_base = self.get_file_name(run_list, process_type='OffSpecSlice')
                         self.write_quicknxs(slice_data_dict, output_file_base, xs=slice_data_dict['cross_sections'].keys())
-                    self.data_manager.cached_offspec = smooth_output
-                except:
-                    raise
-                    logging.error("Problem writing smooth off-spec output: %s", sys.exc_value)
-            else:
-                # Binned version
-                binned_data, slice_data_dict = self.get_rebinned_offspec_data()
-                # QuickNXS format ['smooth' is an odd name but we keep it for backward compatibility]
-                output_file_base = self.get_file_name(run_list, process_type='OffSpecBinned')
-                self.write_quicknxs(binned_data, output_file_base)
-                if slice_data_dict is not None and 'cross_sections' in slice_data_dict:
-                    output_file_base = self.get_file_name(run_list, process_type='OffSpecSlice')
-                    self.write_quicknxs(slice_data_dict, output_file_base, xs=slice_data_dict['cross_sections'].keys())
-                self.data_manager.cached_offspec = binned_data
-
-    def get_rebinned_offspec_data(self):
+                    self.data_manager.cached_offspec = binned_data
+
+    def create_offspec_accumulators(self):
+        """
+            Return an OffSpecularAccumulator for each cross-section,
+            using the binning options of the active channel
+        """
+        configuration = self.data_manager.active_channel.configuration
+        return dict([(pol_state, off_specular.OffSpecularAccumulator(axes=configuration.off_spec_x_axis,
+                                                                     use_weights=configuration.off_spec_err_weight,
+                                                                     n_bins_x=configuration.off_spec_nxbins,
+                                                                     n_bins_y=configuration.off_spec_nybins,
+                                                                     x_min=configuration.off_spec_x_min,
+                                                                     x_max=configuration.off_spec_x_max,
+                                                                     y_min=configuration.off_spec_y_min,
+                                                                     y_max=configuration.off_spec_y_max))
+                     for pol_state in self.data_manager.reduction_states])
+
+    def get_rebinned_offspec_data(self, accumulators=None):
         """
             Get a data dictionary ready for saving
+            :param dict accumulators: OffSpecularAccumulator for each cross-section, filled by
+                                      DataManager.reduce_offspec(). If None, the runs are rebinned here.
         """
         data_dict = None
         slice_data_dict = {}
@@ -328,42 +409,46 @@ class ProcessingWorkflow(object):
             return {}
 
         for pol_state in self.data_manager.reduction_states:
-            r, dr, x, y, labels = off_specular.rebin_extract(self.data_manager.reduction_list,
-                                                             pol_state,
-                                                             axes=self.data_manager.active_channel.configuration.off_spec_x_axis,
-                                                             use_weights=self.data_manager.active_channel.configuration.off_spec_err_weight,
-                                                             n_bins_x=self.data_manager.active_channel.configuration.off_spec_nxbins,
-                                                             n_bins_y=self.data_manager.active_channel.configuration.off_spec_nybins,
-                                                             x_min=self.data_manager.active_channel.configuration.off_spec_x_min,
-                                                             x_max=self.data_manager.active_channel.configuration.off_spec_x_max,
-                                                             y_min=self.data_manager.active_channel.configuration.off_spec_y_min,
-                                                             y_max=self.data_manager.active_channel.configuration.off_spec_y_max)
-            if data_dict is None:
-                data_dict = dict(units=['1/A', '1/A', 'a.u.', 'a.u.'],
-                                 columns=[labels[0], labels[1], 'I', 'dI'],
-                                 cross_sections={})
-
-            # Create array of x-values
-            x_tiled = np.tile(x, len(y))
-            x_tiled = x_tiled.reshape([len(y), len(x)])
-
-            # Create array of y-values
-            y_tiled = np.tile(y, len(x))
-            y_tiled = y_tiled.reshape([len(x), len(y)])
-            y_tiled = y_tiled.T
-
-            rdata = np.array([x_tiled, y_tiled, r, dr]).transpose((1, 2, 0))
+            with tracing.span('ProcessingWorkflow.get_rebinned_offspec_data', 'output', cross_section=pol_state):
+                if accumulators is not None and pol_state in accumulators:
+                    r, dr, x, y, labels = accumulators[pol_state].result()
+                else:
+                    r, dr, x, y, labels = off_specular.rebin_extract(self.data_manager.reduction_list,
+                                                                     pol_state,
+                                                                     axes=self.data_manager.active_channel.configuration.off_spec_x_axis,
+                                                                     use_weights=self.data_manager.active_channel.configuration.off_spec_err_weight,
+                                                                     n_bins_x=self.data_manager.active_channel.configuration.off_spec_nxbins,
+                                                                     n_bins_y=self.data_manager.active_channel.configuration.off_spec_nybins,
+                                                                     x_min=self.data_manager.active_channel.configuration.off_spec_x_min,
+                                                                     x_max=self.data_manager.active_channel.configuration.off_spec_x_max,
+                                                                     y_min=self.data_manager.active_channel.configuration.off_spec_y_min,
+                                                                     y_max=self.data_manager.active_channel.configuration.off_spec_y_max)
+                if data_dict is None:
+                    data_dict = dict(units=['1/A', '1/A', 'a.u.', 'a.u.'],
+                                     columns=[labels[0], labels[1], 'I', 'dI'],
+                                     cross_sections={})
+
+                # Create array of x-values
+                x_tiled = np.tile(x, len(y))
+                x_tiled = x_tiled.reshape([len(y), len(x)])
+
+                # Create array of y-values
+                y_tiled = np.tile(y, len(x))
+                y_tiled = y_tiled.reshape([len(x), len(y)])
+                y_tiled = y_tiled.T
+
+                rdata = np.array([x_tiled, y_tiled, r, dr]).transpose((1, 2, 0))
 
-            if pol_state in self.data_manager.reduction_list[0].cross_sections:
-                _pol_state = self.data_manager.reduction_list[0].cross_sections[pol_state].cross_section_label
-            else:
-                _pol_state = pol_state
-            data_dict[pol_state] = [np.nan_to_num(rdata)]
-            data_dict["cross_sections"][pol_state] = _pol_state
+                if pol_state in self.data_manager.reduction_list[0].cross_sections:
+                    _pol_state = self.data_manager.reduction_list[0].cross_sections[pol_state].cross_section_label
+                else:
+                    _pol_state = pol_state
+                data_dict[pol_state] = [np.nan_to_num(rdata)]
+                data_dict["cross_sections"][pol_state] = _pol_state
 
-            # Slices
-            slice_data_dict = self.get_slice_output_data(x, y, r, dr, pol_state, labels[1],
-                                                         **slice_data_dict)
+                # Slices
+                slice_data_dict = self.get_slice_output_data(x, y, r, dr, pol_state, labels[1],
+                                                             **slice_data_dict)
 
         return data_dict, slice_data_dict
 
@@ -376,7 +461,7 @@ class ProcessingWorkflow(object):
         use_pf = self.data_manager.active_channel.configuration.gisans_use_pf
 
         data_dict = dict(units=['1/A', '1/A', 'a.u.', 'a.u.'], cross_sections={},
-                         cross_section_bins={})
+                         cross_section_bins={}, wavelength_bands={})
         if use_pf:
             data_dict['columns'] = ['Qy', 'pf', 'I', 'dI']
         else:
@@ -387,43 +472,33 @@ class ProcessingWorkflow(object):
             logging.error("List of cross-sections is empty")
             return data_dict
 
-        t_0 = time.time()
-        _parallel = False
         for pol_state in self.data_manager.reduction_states:
-            if _parallel:
-                binned_data = gisans.rebin_parallel(self.data_manager.reduction_list, pol_state,
-                                                    wl_min=wl_min, wl_max=wl_max, wl_npts=wl_npts,
-                                                    qy_npts=qy_npts, qz_npts=qz_npts, use_pf=use_pf)
-            data_dict["cross_section_bins"][pol_state] = []
-            for i in range(wl_npts):
-                wl_step = (wl_max - wl_min) / wl_npts
-                _wl_min = wl_min + i * wl_step
-                _wl_max = wl_min + (i + 1) * wl_step
-                if _parallel:
+            with tracing.span('ProcessingWorkflow.get_gisans_data', 'output', cross_section=pol_state):
+                binned_data = self.data_manager.rebin_gisans_bands(pol_state, wl_min=wl_min, wl_max=wl_max,
+                                                                   wl_npts=wl_npts, qy_npts=qy_npts,
+                                                                   qz_npts=qz_npts, use_pf=use_pf)
+                data_dict["cross_section_bins"][pol_state] = []
+                for i in range(wl_npts):
+                    wl_step = (wl_max - wl_min) / wl_npts
+                    _wl_min = wl_min + i * wl_step
+                    _wl_max = wl_min + (i + 1) * wl_step
                     _intensity, _qy, _qz_axis, _intensity_err = binned_data[i]
-                else:
-                    _intensity, _qy, _qz_axis, _intensity_err = self.data_manager.rebin_gisans(pol_state,
-                                                                                               wl_min=_wl_min,
-                                                                                               wl_max=_wl_max,
-                                                                                               qy_npts=qy_npts,
-                                                                                               qz_npts=qz_npts,
-                                                                                               use_pf=use_pf)
 
-                qz, qy = np.meshgrid(_qz_axis, _qy)
-                rdata = np.array([qy, qz, _intensity, _intensity_err]).transpose((1, 2, 0))
+                    qz, qy = np.meshgrid(_qz_axis, _qy)
+                    rdata = np.array([qy, qz, _intensity, _intensity_err]).transpose((1, 2, 0))
 
-                if pol_state in self.data_manager.reduction_list[0].cross_sections:
-                    _pol_state = self.data_manager.reduction_list[0].cross_sections[pol_state].cross_section_label
-                else:
-                    _pol_state = pol_state
+                    if pol_state in self.data_manager.reduction_list[0].cross_sections:
+                        _pol_state = self.data_manager.reduction_list[0].cross_sections[pol_state].cross_section_label
+                    else:
+                        _pol_state = pol_state
 
-                _pol_state = '%.3f-%.3f_%s' % (_wl_min, _wl_max, pol_state)
-                _pol_state_clean = '%.3f-%.3f_%s' % (_wl_min, _wl_max, _pol_state)
-                data_dict[_pol_state] = [np.nan_to_num(rdata)]
-                data_dict["cross_sections"][_pol_state] = _pol_state_clean
-                data_dict["cross_section_bins"][pol_state].append(_pol_state)
+                    _pol_state = '%.3f-%.3f_%s' % (_wl_min, _wl_max, pol_state)
+                    _pol_state_clean = '%.3f-%.3f_%s' % (_wl_min, _wl_max, _pol_state)
+                    data_dict[_pol_state] = [np.nan_to_num(rdata)]
+                    data_dict["cross_sections"][_pol_state] = _pol_state_clean
+                    data_dict["cross_section_bins"][pol_state].append(_pol_state)
+                    data_dict["wavelength_bands"][_pol_state] = [_wl_min, _wl_max]
 
-        logging.info("GISANS processing time: %s sec", (time.time()-t_0))
         return data_dict
 
     def get_offspec_data(self):
@@ -445,41 +520,43 @@ class ProcessingWorkflow(object):
 
         ki_max = 0.01
         for pol_state in self.data_manager.reduction_states:
-            # The scaling factors should have been determined at this point. Just use them
-            # to merge the different runs in a set.
+            with tracing.span('ProcessingWorkflow.get_offspec_data', 'output', cross_section=pol_state):
+                # The scaling factors should have been determined at this point. Just use them
+                # to merge the different runs in a set.
 
-            combined_data = []
+                combined_data = []
 
-            for item in self.data_manager.reduction_list:
-                offspec = item.cross_sections[pol_state].off_spec
-                Qx, Qz, ki_z, kf_z, S, dS = (offspec.Qx, offspec.Qz, offspec.ki_z, offspec.kf_z,
-                                             offspec.S, offspec.dS)
+                for item in self.data_manager.reduction_list:
+                    offspec = item.cross_sections[pol_state].off_spec
+                    Qx, Qz, ki_z, kf_z, S, dS = (offspec.Qx, offspec.Qz, offspec.ki_z, offspec.kf_z,
+                                                 offspec.S, offspec.dS)
 
-                n_total = len(S[0])
-                # P_0 and P_N are the number of points to cut in TOF on each side
-                p_0 = item.cross_sections[pol_state].configuration.cut_first_n_points
-                p_n = n_total-item.cross_sections[pol_state].configuration.cut_last_n_points
+                    n_total = len(S[0])
+                    # P_0 and P_N are the number of points to cut in TOF on each side
+                    p_0 = item.cross_sections[pol_state].configuration.cut_first_n_points
+                    p_n = n_total-item.cross_sections[pol_state].configuration.cut_last_n_points
 
-                rdata = np.array([Qx[:, p_0:p_n], Qz[:, p_0:p_n], ki_z[:, p_0:p_n], kf_z[:, p_0:p_n],
-                                  ki_z[:, p_0:p_n]-kf_z[:, p_0:p_n], S[:, p_0:p_n], dS[:, p_0:p_n]]).transpose((1, 2, 0))
-                combined_data.append(rdata)
-                ki_max = max(ki_max, ki_z.max())
+                    rdata = np.array([Qx[:, p_0:p_n], Qz[:, p_0:p_n], ki_z[:, p_0:p_n], kf_z[:, p_0:p_n],
+                                      ki_z[:, p_0:p_n]-kf_z[:, p_0:p_n], S[:, p_0:p_n], dS[:, p_0:p_n]]).transpose((1, 2, 0))
+                    combined_data.append(rdata)
+                    ki_max = max(ki_max, ki_z.max())
 
-            if pol_state in self.data_manager.reduction_list[0].cross_sections:
-                _pol_state = self.data_manager.reduction_list[0].cross_sections[pol_state].cross_section_label
-            else:
-                _pol_state = pol_state
-            data_dict[pol_state] = combined_data
-            data_dict["cross_sections"][pol_state] = _pol_state
+                if pol_state in self.data_manager.reduction_list[0].cross_sections:
+                    _pol_state = self.data_manager.reduction_list[0].cross_sections[pol_state].cross_section_label
+                else:
+                    _pol_state = pol_state
+                data_dict[pol_state] = combined_data
+                data_dict["cross_sections"][pol_state] = _pol_state
         data_dict['ki_max'] = ki_max
         return data_dict
 
-    def smooth_offspec(self, data_dict):
+    def smooth_offspec(self, data_dict, progress=None):
         """
             NOTE: 
 
             Create a smoothed dataset from the off-specular scattering.
             :param dict data_dict: the output of get_offspec_data()
+            :param ProgressReporter progress: reporter object
 
             Note for my own integrity (MD):
                I don't think one should smooth data distributions and do any quantitative
@@ -521,17 +598,19 @@ class ProcessingWorkflow(object):
                 axis_sigma_scaling = 2
                 xysigma0 = Qzmax / 3.
 
-            x, y, I = off_specular.smooth_data(x, y, I,
-                                               sigmas=self.output_options['off_spec_sigmas'],
-                                               gridx=self.output_options['off_spec_nxbins'],
-                                               gridy=self.output_options['off_spec_nybins'],
-                                               sigmax=self.output_options['off_spec_sigmax'],
-                                               sigmay=self.output_options['off_spec_sigmay'],
-                                               x1=self.output_options['off_spec_x_min'],
-                                               x2=self.output_options['off_spec_x_max'],
-                                               y1=self.output_options['off_spec_y_min'],
-                                               y2=self.output_options['off_spec_y_max'],
-                                               axis_sigma_scaling=axis_sigma_scaling, xysigma0=xysigma0)
+            with tracing.span('off_specular.smooth_data', 'output', cross_section=channel, nbytes=I.nbytes):
+                x, y, I = off_specular.smooth_data(x, y, I,
+                                                   sigmas=self.output_options['off_spec_sigmas'],
+                                                   gridx=self.output_options['off_spec_nxbins'],
+                                                   gridy=self.output_options['off_spec_nybins'],
+                                                   sigmax=self.output_options['off_spec_sigmax'],
+                                                   sigmay=self.output_options['off_spec_sigmay'],
+                                                   x1=self.output_options['off_spec_x_min'],
+                                                   x2=self.output_options['off_spec_x_max'],
+                                                   y1=self.output_options['off_spec_y_min'],
+                                                   y2=self.output_options['off_spec_y_max'],
+                                                   axis_sigma_scaling=axis_sigma_scaling, xysigma0=xysigma0,
+                                                   progress=progress)
             output_data[channel] = [np.array([x, y, I]).transpose((1, 2, 0))]
             output_data['cross_sections'][channel] = data_dict['cross_sections'][channel]
 
@@ -582,59 +661,47 @@ class ProcessingWorkflow(object):
         p_n = [item.cross_sections[first_state].configuration.cut_last_n_points for item in self.data_manager.reduction_list]
 
         for pol_state in self.data_manager.reduction_states:
-            # The scaling factors should have been determined at this point. Just use them
-            # to merge the different runs in a set.
-            ws_list = data_manipulation.get_scaled_workspaces(self.data_manager.reduction_list, pol_state)
+            with tracing.span('ProcessingWorkflow.get_output_data', 'output', cross_section=pol_state):
+                # The scaling factors should have been determined at this point. Just use them
+                # to merge the different runs in a set.
+                ws_list = data_manipulation.get_scaled_workspaces(self.data_manager.reduction_list, pol_state)
+
+                # If the reflectivity calculation failed, we may not have data to work with
+                # for this cross-section.
+                if len(ws_list) == 0:
+                    continue
+
+                combined_data = []
+                for i, ws in enumerate(ws_list):
+                    _x = ws.readX(0)
+                    n_total = len(_x)
+                    x = ws.readX(0)[p_0[i]:n_total-p_n[i]]
+                    y = ws.readY(0)[p_0[i]:n_total-p_n[i]]
+                    dy = ws.readE(0)[p_0[i]:n_total-p_n[i]]
+                    dx = ws.readDx(0)[p_0[i]:n_total-p_n[i]]
+                    # This should be actual theta calculated
+                    tth_value = ws.getRun().getProperty("two_theta").value / 2.0 * np.pi / 180.0
+                    #tth_value = ws.getRun().getProperty("SANGLE").getStatistics().mean * math.pi / 180.0
+                    tth = np.ones(len(x)) * tth_value
+                    combined_data.append(np.vstack((x, y, dy, dx, tth)).transpose())
+
+                _output_data = np.vstack(combined_data)
+                ordered = np.argsort(_output_data, axis=0).transpose()[0]
+                output_data = _output_data[ordered]
 
-            # If the reflectivity calculation failed, we may not have data to work with
-            # for this cross-section.
-            if len(ws_list) == 0:
-                continue
-
-            combined_data = []
-            for i, ws in enumerate(ws_list):
-                _x = ws.readX(0)
-                n_total = len(_x)
-                x = ws.readX(0)[p_0[i]:n_total-p_n[i]]
-                y = ws.readY(0)[p_0[i]:n_total-p_n[i]]
-                dy = ws.readE(0)[p_0[i]:n_total-p_n[i]]
-                dx = ws.readDx(0)[p_0[i]:n_total-p_n[i]]
-                # This should be actual theta calculated
-                tth_value = ws.getRun().getProperty("two_theta").value / 2.0 * np.pi / 180.0
-                #tth_value = ws.getRun().getProperty("SANGLE").getStatistics().mean * math.pi / 180.0
-                tth = np.ones(len(x)) * tth_value
-                combined_data.append(np.vstack((x, y, dy, dx, tth)).transpose())
-
-            _output_data = np.vstack(combined_data)
-            ordered = np.argsort(_output_data, axis=0).transpose()[0]
-            output_data = _output_data[ordered]
-
-            if pol_state in self.data_manager.reduction_list[0].cross_sections:
-                _pol_state = self.data_manager.reduction_list[0].cross_sections[pol_state].cross_section_label
-            else:
-                _pol_state = pol_state
-            data_dict[pol_state] = output_data
-            data_dict["cross_sections"][pol_state] = _pol_state
+                if pol_state in self.data_manager.reduction_list[0].cross_sections:
+                    _pol_state = self.data_manager.reduction_list[0].cross_sections[pol_state].cross_section_label
+                else:
+                    _pol_state = pol_state
+                data_dict[pol_state] = output_data
+                data_dict["cross_sections"][pol_state] = _pol_state
 
         # Asymmetry
         if self.output_options['export_asym']:
             p_state, m_state = self.data_manager.determine_asymmetry_states()
             if p_state and m_state:
-                # Get the list of workspaces
-                asym_data = []
                 if p_state in data_dict and m_state in data_dict:
-                    # Sometimes the number of points may be different if the last few points had no signal.
-                    for i in range(len(data_dict[p_state])):
-                        p_point = data_dict[p_state][i]
-                        i_m = len(data_dict[m_state][data_dict[m_state].T[0] < p_point[0]])
-                        if i_m < len(data_dict[m_state]):
-                            m_point = data_dict[m_state][i_m]
-                            if p_point[1] > 0 and m_point[1] > 0:
-                                ratio = (p_point[1] - m_point[1]) / (p_point[1] + m_point[1])
-                                d_ratio = 2.0 / (p_point[1] + m_point[1])**2
-                                d_ratio *= math.sqrt(m_point[1]**2 * p_point[2]**2 + p_point[1]**2 * m_point[2]**2)
-                                asym_data.append([p_point[0], ratio, d_ratio, p_point[3], p_point[4]])
-                    data_dict['SA'] = np.asarray(asym_data)
+                    data_dict['SA'] = asymmetry.spin_asymmetry(data_dict[p_state], data_dict[m_state])
                 else:
                     logging.error("Asym request but failed: %s %s %s %s", p_state, m_state,
                                   len(data_dict[p_state]), len(data_dict[m_state]))
@@ -35,42 +35,33 @@ def _find_h5_data(filename):
             return _new_filename
     return filename
 
-def write_reflectivity_header(reduction_list, direct_beam_list, output_path, pol_states):
+# Parameters describing the direct beam and data runs, in the order they are written
+DIRECT_BEAM_OPTIONS = ['DB_ID', 'P0', 'PN', 'x_pos', 'x_width', 'y_pos', 'y_width',
+                       'bg_pos', 'bg_width', 'dpix', 'tth', 'number', 'File']
+DATASET_OPTIONS = ['scale', 'P0', 'PN', 'x_pos', 'x_width', 'y_pos', 'y_width',
+                   'bg_pos', 'bg_width', 'fan', 'dpix', 'tth', 'number', 'DB_ID', 'File']
+
+def get_reduction_parameters(reduction_list, direct_beam_list):
     """
-        Write out reflectivity header in a format readable by QuickNXS
-        :param str output_path: output file path
-        :param str pol_states: descriptor for the polarization state
+        Return the reduction parameters of a reduction list, as written in the header
+        of QuickNXS files. The direct beam and data run parameters are returned as two
+        lists of dictionaries, along with a dictionary of global options.
+        Returns None if there is no data.
+
+        :param list reduction_list: list of NexusData objects
+        :param list direct_beam_list: list of NexusData objects for the direct beams
     """
-    # Sanity check
     if not reduction_list:
-        return
-
-    direct_beam_options = ['DB_ID', 'P0', 'PN', 'x_pos', 'x_width', 'y_pos', 'y_width',
-                           'bg_pos', 'bg_width', 'dpix', 'tth', 'number', 'File']
-    dataset_options = ['scale', 'P0', 'PN', 'x_pos', 'x_width', 'y_pos', 'y_width',
-                       'bg_pos', 'bg_width', 'fan', 'dpix', 'tth', 'number', 'DB_ID', 'File']
-
-    fd = open(output_path, 'w')
-    fd.write("# Datafile created by QuickNXS %s\n" % __version__)
-    fd.write("# Datafile created using Mantid %s\n" % mantid.__version__)
-    fd.write("# Date: %s\n" % time.strftime(u"%Y-%m-%d %H:%M:%S"))
-    fd.write("# Type: Specular\n")
-    run_list = [str(item.number) for item in reduction_list]
-    fd.write("# Input file indices: %s\n" % ','.join(run_list))
-    fd.write("# Extracted states: %s\n" % pol_states)
-    fd.write("#\n")
-    fd.write("# [Direct Beam Runs]\n")
-    toks = ['%8s' % item for item in direct_beam_options]
-    fd.write("# %s\n" % '  '.join(toks))
+        return None
 
     # Get the list of cross-sections
-    pol_list = reduction_list[0].cross_sections.keys()
+    pol_list = list(reduction_list[0].cross_sections.keys())
     if not pol_list:
         logging.error("No data found in run %s", reduction_list[0].number)
-        return
+        return None
 
     # Direct beam section
-    i_direct_beam = 0
+    direct_beams = []
     for data_set in reduction_list:
         run_object = data_set.cross_sections[pol_list[0]].reflectivity_workspace.getRun()
         normalization_run = run_object.getProperty("normalization_run").value
@@ -82,40 +73,25 @@ def write_reflectivity_header(reduction_list, direct_beam_list, output_path, pol
                 direct_beam = db_i
         if direct_beam is None:
             continue
-        db_pol = direct_beam.cross_sections.keys()[0]
+        db_pol = list(direct_beam.cross_sections.keys())[0]
         conf = direct_beam.cross_sections[db_pol].configuration
-        i_direct_beam += 1
         dpix = run_object.getProperty("normalization_dirpix").value
         filename = run_object.getProperty("normalization_file_path").value
 
-        item = dict(DB_ID=i_direct_beam, tth=0, P0=0, PN=0,
-                    x_pos=conf.peak_position,
-                    x_width=conf.peak_width,
-                    y_pos=conf.low_res_position,
-                    y_width=conf.low_res_width,
-                    bg_pos=conf.bck_position,
-                    bg_width=conf.bck_width,
-                    dpix=dpix,
-                    number=normalization_run,
-                    File=filename)
-
-        par_list = ['{%s}' % p for p in direct_beam_options]
-        template = "# %s\n" % '  '.join(par_list)
-        _clean_dict = {}
-        for key in item:
-            if isinstance(item[key], (bool, str)):
-                _clean_dict[key] = "%8s" % item[key]
-            else:
-                _clean_dict[key] = "%8g" % item[key]
-        fd.write(template.format(**_clean_dict))
+        direct_beams.append(dict(DB_ID=len(direct_beams) + 1, tth=0, P0=0, PN=0,
+                                 x_pos=conf.peak_position,
+                                 x_width=conf.peak_width,
+                                 y_pos=conf.low_res_position,
+                                 y_width=conf.low_res_width,
+                                 bg_pos=conf.bck_position,
+                                 bg_width=conf.bck_width,
+                                 dpix=dpix,
+                                 number=normalization_run,
+                                 File=filename))
 
     # Scattering data
-    fd.write("#\n")
-    fd.write("# [Data Runs]\n")
-    toks = ['%8s' % item for item in dataset_options]
-    fd.write("# %s\n" % '  '.join(toks))
+    data_runs = []
     i_direct_beam = 0
-
     conf = None
     for data_set in reduction_list:
         conf = data_set.cross_sections[pol_list[0]].configuration
@@ -148,21 +124,72 @@ def write_reflectivity_header(reduction_list, direct_beam_list, output_path, pol
             i_direct_beam += 1
             db_id = i_direct_beam
 
-        item = dict(scale=scaling_factor, DB_ID=db_id,
-                    P0=conf.cut_first_n_points, PN=conf.cut_last_n_points, tth=tth,
-                    fan=constant_q_binning,
-                    x_pos=conf.peak_position,
-                    x_width=conf.peak_width,
-                    y_pos=conf.low_res_position,
-                    y_width=conf.low_res_width,
-                    bg_pos=conf.bck_position,
-                    bg_width=conf.bck_width,
-                    dpix=dpix,
-                    number=str(ws.getRunNumber()),
-                    File=filename)
-
-        par_list = ['{%s}' % p for p in dataset_options]
-        template = "# %s\n" % '  '.join(par_list)
+        data_runs.append(dict(scale=scaling_factor, DB_ID=db_id,
+                              P0=conf.cut_first_n_points, PN=conf.cut_last_n_points, tth=tth,
+                              fan=constant_q_binning,
+                              x_pos=conf.peak_position,
+                              x_width=conf.peak_width,
+                              y_pos=conf.low_res_position,
+                              y_width=conf.low_res_width,
+                              bg_pos=conf.bck_position,
+                              bg_width=conf.bck_width,
+                              dpix=dpix,
+                              number=str(ws.getRunNumber()),
+                              File=filename))
+
+    global_options = dict(sample_length=10 if conf is None else conf.sample_size)
+    return direct_beams, data_runs, global_options
+
+def write_reflectivity_header(reduction_list, direct_beam_list, output_path, pol_states):
+    """
+        Write out reflectivity header in a format readable by QuickNXS
+        :param str output_path: output file path
+        :param str pol_states: descriptor for the polarization state
+    """
+    # Sanity check
+    if not reduction_list:
+        return
+
+    fd = open(output_path, 'w')
+    fd.write("# Datafile created by QuickNXS %s\n" % __version__)
+    fd.write("# Datafile created using Mantid %s\n" % mantid.__version__)
+    fd.write("# Date: %s\n" % time.strftime(u"%Y-%m-%d %H:%M:%S"))
+    fd.write("# Type: Specular\n")
+    run_list = [str(item.number) for item in reduction_list]
+    fd.write("# Input file indices: %s\n" % ','.join(run_list))
+    fd.write("# Extracted states: %s\n" % pol_states)
+    fd.write("#\n")
+    fd.write("# [Direct Beam Runs]\n")
+    toks = ['%8s' % item for item in DIRECT_BEAM_OPTIONS]
+    fd.write("# %s\n" % '  '.join(toks))
+
+    parameters = get_reduction_parameters(reduction_list, direct_beam_list)
+    if parameters is None:
+        fd.close()
+        return
+    direct_beams, data_runs, global_options = parameters
+
+    # Direct beam section
+    par_list = ['{%s}' % p for p in DIRECT_BEAM_OPTIONS]
+    template = "# %s\n" % '  '.join(par_list)
+    for item in direct_beams:
+        _clean_dict = {}
+        for key in item:
+            if isinstance(item[key], (bool, str)):
+                _clean_dict[key] = "%8s" % item[key]
+            else:
+                _clean_dict[key] = "%8g" % item[key]
+        fd.write(template.format(**_clean_dict))
+
+    # Scattering data
+    fd.write("#\n")
+    fd.write("# [Data Runs]\n")
+    toks = ['%8s' % item for item in DATASET_OPTIONS]
+    fd.write("# %s\n" % '  '.join(toks))
+
+    par_list = ['{%s}' % p for p in DATASET_OPTIONS]
+    template = "# %s\n" % '  '.join(par_list)
+    for item in data_runs:
         _clean_dict = {}
         for key in item:
             if isinstance(item[key], str):
@@ -174,11 +201,34 @@ def write_reflectivity_header(reduction_list, direct_beam_list, output_path, pol
     fd.write("#\n")
     fd.write("# [Global Options]\n")
     fd.write("# name           value\n")
-    sample_size = 10 if conf is None else conf.sample_size
-    fd.write("# sample_length  %s\n" % str(sample_size))
+    fd.write("# sample_length  %s\n" % str(global_options['sample_length']))
     fd.write("#\n")
     fd.close()
 
+# Approximate number of values to format at once when writing data
+WRITE_CHUNK_SIZE = 2**18
+
+def _write_blocks(fd, blocks, delimiter='\t', separator=True):
+    """
+        Write a [block][row][column] array with the same output as calling
+        np.savetxt(fd, block, delimiter=delimiter, fmt='%-18e') on each block.
+        Many blocks are formatted at once to avoid the per-row overhead.
+
+        :param file fd: output file
+        :param ndarray blocks: data to be written
+        :param str delimiter: column delimiter
+        :param bool separator: if True, an empty line will be written after each block
+    """
+    n_blocks, n_rows, n_cols = blocks.shape
+    row_format = delimiter.join(['%-18e'] * n_cols) + '\n'
+    block_format = row_format * n_rows
+    if separator:
+        block_format += '\n'
+    step = max(WRITE_CHUNK_SIZE // max(n_rows * n_cols, 1), 1)
+    for i in range(0, n_blocks, step):
+        chunk = blocks[i:i+step]
+        fd.write((block_format * len(chunk)) % tuple(chunk.ravel().tolist()))
+
 def write_reflectivity_data(output_path, data, col_names, as_5col=True):
     """
         Write out reflectivity header in a format readable by QuickNXS
@@ -202,16 +252,18 @@ def write_reflectivity_data(output_path, data, col_names, as_5col=True):
         fd.write(u"# %s\n" % '\t'.join(toks))
 
         if isinstance(data, list):
-            # [TOF][pixel][parameter]
+            # [TOF][pixel][parameter], with an empty line after each pixel
             for tof_item in data:
-                for pixel_item in tof_item:
-                    np.savetxt(fd, pixel_item, delimiter='\t', fmt='%-18e')
-                    fd.write(u'\n'.encode('utf8'))
+                tof_item = np.asarray(tof_item, dtype=float)
+                if tof_item.ndim == 2:
+                    tof_item = tof_item[:, :, np.newaxis]
+                _write_blocks(fd, tof_item, delimiter='\t')
         else:
+            data = np.asarray(data, dtype=float)
             if four_cols:
-                np.savetxt(fd, data[:, :4], delimiter=' ', fmt='%-18e')
+                _write_blocks(fd, data[:, np.newaxis, :4], delimiter=' ', separator=False)
             else:
-                np.savetxt(fd, data, delimiter='\t', fmt='%-18e')
+                _write_blocks(fd, data[:, np.newaxis, :], delimiter='\t', separator=False)
 
 def read_reduced_file(file_path, configuration=None):
     """
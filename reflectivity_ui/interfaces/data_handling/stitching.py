@@ -0,0 +1,257 @@
+"""
+    Stitching of the reflectivity curves of a reduction list.
+
+    The scaling factor between two runs is computed from the points in their
+    overlap region, with an error-weighted least-squares fit. All the cross-sections
+    of a run share the same scaling factor, so they are fitted together.
+    The factors can be chained from one run to the next, or determined with
+    a global fit using every pair of overlapping runs.
+
+    Once scaled, the runs can be merged onto a common Q grid.
+"""
+#pylint: disable=invalid-name, too-many-locals, protected-access
+from __future__ import absolute_import, division, print_function
+import logging
+import numpy as np
+
+# Number of iterations used to refine the weights of the overlap fit
+N_ITERATIONS = 3
+
+
+def get_points(cross_section):
+    """
+        Return the Q, R and dR arrays of a cross-section, without the cut points.
+        :param CrossSectionData cross_section: data object
+    """
+    if cross_section.q is None or cross_section._r is None:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    q = np.asarray(cross_section.q)
+    if len(q) == len(cross_section._r) + 1:
+        q = (q[1:] + q[:-1]) / 2.0
+    n_total = len(q)
+    p_0 = cross_section.configuration.cut_first_n_points
+    p_n = n_total - cross_section.configuration.cut_last_n_points
+    return q[p_0:p_n], np.asarray(cross_section._r)[p_0:p_n], np.asarray(cross_section._dr)[p_0:p_n]
+
+
+def normalization_factor(cross_section, q_cutoff=0.01):
+    """
+        Return the factor that brings the weighted average of the reflectivity
+        below q_cutoff to 1, or 1 if there are no points to use.
+        :param CrossSectionData cross_section: data object
+        :param float q_cutoff: critical q-value below which we expect R=1
+    """
+    r = np.asarray(cross_section._r)
+    dr = np.asarray(cross_section._dr)
+    q = np.asarray(cross_section.q)[:len(r)]
+    idx = (q < q_cutoff) & (dr > 0)
+    w = 1.0 / dr[idx]**2
+    total = np.sum(w * r[idx])
+    weights = np.sum(w)
+    if weights > 0 and total > 0:
+        return float(weights / total)
+    return 1.0
+
+
+def overlap_scale(low_q_data, high_q_data):
+    """
+        Compute the factor to apply to the high-Q run to match the low-Q run
+        in their overlap region. The low-Q data is interpolated at the Q values of
+        the high-Q data. Returns the factor and its variance, or None if the runs don't overlap.
+
+        :param list low_q_data: list of (q, r, dr) arrays for the low-Q run, one per cross-section
+        :param list high_q_data: list of (q, r, dr) arrays for the high-Q run, in the same order
+    """
+    r_low = []
+    dr_low = []
+    r_high = []
+    dr_high = []
+    for (q_a, r_a, dr_a), (q_b, r_b, dr_b) in zip(low_q_data, high_q_data):
+        if len(q_a) == 0 or len(q_b) == 0:
+            continue
+        order = np.argsort(q_a)
+        q_a, r_a, dr_a = q_a[order], r_a[order], dr_a[order]
+        idx = (q_b >= q_a[0]) & (q_b <= q_a[-1]) & np.isfinite(r_b) & np.isfinite(dr_b)
+        r_low.append(np.interp(q_b[idx], q_a, r_a))
+        dr_low.append(np.interp(q_b[idx], q_a, dr_a))
+        r_high.append(r_b[idx])
+        dr_high.append(dr_b[idx])
+
+    if not r_high:
+        return None
+    r_low = np.concatenate(r_low)
+    dr_low = np.concatenate(dr_low)
+    r_high = np.concatenate(r_high)
+    dr_high = np.concatenate(dr_high)
+    if np.sum(r_high) <= 0:
+        return None
+
+    # Start from the ratio of the integrals, as Stitch1D does, and refine the weights
+    scale = np.sum(r_low) / np.sum(r_high)
+    for _ in range(N_ITERATIONS):
+        variance = dr_low**2 + scale**2 * dr_high**2
+        good = variance > 0
+        if not np.any(good):
+            return scale, np.inf
+        w = 1.0 / variance[good]
+        denominator = np.sum(w * r_high[good]**2)
+        if denominator <= 0:
+            return None
+        scale = np.sum(w * r_low[good] * r_high[good]) / denominator
+    return scale, 1.0 / denominator
+
+
+def compute_scaling_factors(data, scaling_factor=1.0, global_fit=False):
+    """
+        Compute the scaling factor of each run.
+
+        :param list data: list of runs, each given as a list of (q, r, dr) arrays, one per cross-section
+        :param float scaling_factor: scaling factor of the first run
+        :param bool global_fit: if True, fit all the factors together using every overlapping pair of runs
+    """
+    # Chain the runs together
+    scaling_factors = [scaling_factor]
+    for i in range(len(data) - 1):
+        result = overlap_scale(data[i], data[i+1])
+        if result is None:
+            logging.error("No overlap between runs %s and %s: keeping the same scaling factor", i, i+1)
+            scaling_factors.append(scaling_factors[-1])
+        else:
+            scaling_factors.append(float(scaling_factors[-1] * result[0]))
+
+    if not global_fit or len(data) < 3:
+        return scaling_factors
+
+    # Fit corrections to the log of the chained factors, for all runs but the first one.
+    # Each overlapping pair gives an estimate of the ratio between two factors.
+    log_factors = np.log(scaling_factors)
+    rows = []
+    values = []
+    for i in range(len(data) - 1):
+        for j in range(i + 1, len(data)):
+            result = overlap_scale(data[i], data[j])
+            if result is None or not result[0] > 0 or not np.isfinite(result[1]):
+                continue
+            scale, variance = result
+            weight = scale / np.sqrt(variance) if variance > 0 else 1.0
+            row = np.zeros(len(data) - 1)
+            row[j - 1] = weight
+            if i > 0:
+                row[i - 1] = -weight
+            rows.append(row)
+            values.append(weight * (np.log(scale) - (log_factors[j] - log_factors[i])))
+
+    if not rows:
+        return scaling_factors
+    corrections = np.linalg.lstsq(np.asarray(rows), np.asarray(values), rcond=-1)[0]
+    return [scaling_factor] + [float(value) for value in np.exp(log_factors[1:] + corrections)]
+
+
+def stitch_reduction_list(reduction_list, xs=None, normalize_to_unity=True, q_cutoff=0.01,
+                          cross_sections=None, global_fit=False):
+    """
+        Determine the scaling factor of each run of a reduction list and set them.
+        Returns the list of scaling factors.
+
+        :param list reduction_list: list of NexusData objects
+        :param string xs: name of the cross-section to use to normalize the first run
+        :param bool normalize_to_unity: if True, the specular ridge will be normalized to 1
+        :param float q_cutoff: critical q-value below which we expect R=1
+        :param list cross_sections: cross-sections to use [defaults to those common to all runs]
+        :param bool global_fit: if True, fit all the scaling factors together
+    """
+    if not reduction_list:
+        return []
+
+    if xs is None:
+        xs = list(reduction_list[0].cross_sections.keys())[0]
+
+    # First, determine the overall scaling factor as needed
+    if normalize_to_unity:
+        scaling_factor = normalization_factor(reduction_list[0].cross_sections[xs], q_cutoff)
+        reduction_list[0].set_parameter("scaling_factor", scaling_factor)
+    else:
+        scaling_factor = reduction_list[0].cross_sections[xs].configuration.scaling_factor
+
+    if cross_sections is None:
+        cross_sections = [key for key in reduction_list[0].cross_sections
+                          if all([key in item.cross_sections for item in reduction_list])]
+
+    data = [[get_points(item.cross_sections[key]) for key in cross_sections]
+            for item in reduction_list]
+    scaling_factors = compute_scaling_factors(data, scaling_factor, global_fit=global_fit)
+
+    for i in range(1, len(reduction_list)):
+        reduction_list[i].set_parameter("scaling_factor", scaling_factors[i])
+    return scaling_factors
+
+
+def get_q_edges(q_min, q_step, q_max):
+    """
+        Return the edges of a Q grid covering [q_min, q_max].
+        As for the Mantid Rebin parameters, a negative step gives a logarithmic
+        binning where each bin is |q_step| times wider than the previous one.
+
+        :param float q_min: lower edge of the grid
+        :param float q_step: bin width, or relative bin width if negative
+        :param float q_max: Q value the grid should cover
+    """
+    if q_step < 0:
+        n_bins = max(int(np.ceil(np.log(q_max / q_min) / np.log(1.0 - q_step))), 1)
+        return q_min * (1.0 - q_step)**np.arange(n_bins + 1)
+    n_bins = max(int(np.ceil((q_max - q_min) / q_step)), 1)
+    return q_min + q_step * np.arange(n_bins + 1)
+
+
+def merge_reduction_list(reduction_list, cross_sections, q_min=0.001, q_step=-0.01):
+    """
+        Merge the trimmed and scaled runs of a reduction list onto a common Q grid.
+        The points falling in the same Q bin are averaged with weights given by their
+        uncertainties. All the cross-sections are binned together, on the same grid.
+        Returns a dictionary of (q, r, dr) arrays, one entry per cross-section, with the
+        empty Q bins removed.
+
+        :param list reduction_list: list of NexusData objects
+        :param list cross_sections: cross-sections to merge
+        :param float q_min: lower edge of the Q grid
+        :param float q_step: Q bin width, or relative bin width if negative
+    """
+    _q = []
+    _r = []
+    _dr = []
+    _xs_index = []
+    for i, xs in enumerate(cross_sections):
+        for item in reduction_list:
+            if xs not in item.cross_sections:
+                continue
+            q, r, dr = get_points(item.cross_sections[xs])
+            scale = item.cross_sections[xs].configuration.scaling_factor
+            idx = (dr > 0) & np.isfinite(r) & np.isfinite(dr)
+            _q.append(q[idx])
+            _r.append(r[idx] * scale)
+            _dr.append(dr[idx] * scale)
+            _xs_index.append(np.ones(np.sum(idx), dtype=int) * i)
+
+    output = {}
+    if not _q or sum([len(q) for q in _q]) == 0:
+        return output
+    q, r, dr, xs_index = [np.concatenate(_list) for _list in [_q, _r, _dr, _xs_index]]
+
+    edges = get_q_edges(q_min, q_step, max(q.max(), q_min))
+    n_bins = len(edges) - 1
+    q_index = np.searchsorted(edges, q, side='right') - 1
+    # Include the last edge in the last bin
+    q_index[q == edges[-1]] = n_bins - 1
+    in_range = (q_index >= 0) & (q_index < n_bins)
+
+    bins = xs_index[in_range] * n_bins + q_index[in_range]
+    w = 1.0 / dr[in_range]**2
+    n_total = len(cross_sections) * n_bins
+    weights = np.bincount(bins, weights=w, minlength=n_total).reshape((len(cross_sections), n_bins))
+    summed = np.bincount(bins, weights=w * r[in_range], minlength=n_total).reshape((len(cross_sections), n_bins))
+
+    q_centers = (edges[:-1] + edges[1:]) / 2.0
+    for i, xs in enumerate(cross_sections):
+        good = weights[i] > 0
+        output[xs] = (q_centers[good], summed[i][good] / weights[i][good], 1.0 / np.sqrt(weights[i][good]))
+    return output
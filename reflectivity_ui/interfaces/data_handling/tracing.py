@@ -0,0 +1,274 @@
+#pylint: disable=invalid-name, too-many-instance-attributes
+"""
+    Timing of the processing stages.
+
+    Each stage is timed as a span, which can be nested in the span of the
+    stage calling it:
+
+        with tracing.span('NexusData.load', 'load', run=self.number) as _span:
+            ...
+            _span.add_bytes(self.nbytes)
+
+    A span records its duration, the number of bytes it produced or read,
+    and a context such as the run number and cross-section. The context of
+    a span is inherited by the spans nested in it.
+
+    Methods can also be timed as a whole with the traced() decorator.
+
+    Completed spans are kept by the session tracer, and can be written
+    as a Chrome trace-event file (chrome://tracing or https://ui.perfetto.dev)
+    or summarized as a table of the time spent in each stage.
+"""
+from __future__ import absolute_import, division, print_function
+import os
+import json
+import time
+import functools
+import logging
+import threading
+import collections
+
+# Maximum number of completed spans kept by a tracer
+MAX_SPANS = 100000
+
+# Text types, including unicode on python 2
+try:
+    STRING_TYPES = (basestring,)
+except NameError:
+    STRING_TYPES = (str,)
+
+
+class Span(object):
+    """
+        Timing of a processing stage
+    """
+    def __init__(self, tracer, name, category='', parent=None, nbytes=0, **context):
+        """
+            :param Tracer tracer: tracer recording the span
+            :param str name: name of the stage
+            :param str category: category of the stage, such as load, reduction, output or plot
+            :param Span parent: enclosing span
+            :param int nbytes: number of bytes processed
+        """
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.parent = parent
+        self.nbytes = nbytes
+        self.context = dict(parent.context) if parent is not None else {}
+        self.context.update(context)
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.thread_id = threading.current_thread().ident
+        self.start = None
+        self.duration = None
+        # Time spent in the nested spans
+        self.children_time = 0
+
+    @property
+    def self_time(self):
+        """
+            Time spent in this stage, excluding nested stages
+        """
+        return self.duration - self.children_time if self.duration is not None else None
+
+    def set(self, **context):
+        """
+            Add information to the context, such as the run number once it is known
+        """
+        self.context.update(context)
+
+    def add_bytes(self, nbytes):
+        """
+            Add to the number of bytes processed
+            :param int nbytes: number of bytes
+        """
+        self.nbytes += int(nbytes)
+
+    def __enter__(self):
+        self.tracer._push(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.time() - self.start
+        if exc_type is not None:
+            self.context['error'] = str(exc_value)
+        self.tracer._pop(self)
+        return False
+
+
+class Tracer(object):
+    """
+        Collection of the completed spans of a session
+    """
+    def __init__(self, max_spans=MAX_SPANS):
+        """
+            :param int max_spans: maximum number of spans kept, the oldest are dropped first
+        """
+        self.spans = collections.deque(maxlen=max_spans)
+        self.t_0 = time.time()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _push(self, span):
+        self._stack().append(span)
+
+    def _pop(self, span):
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        if span.parent is not None:
+            span.parent.children_time += span.duration
+        self.spans.append(span)
+        logging.debug("%s%s %s: %.3f sec", '  ' * span.depth, span.name,
+                      _format_context(span.context), span.duration)
+
+    def span(self, name, category='', nbytes=0, **context):
+        """
+            Return a span for a stage, nested in the current span of this thread.
+
+            :param str name: name of the stage
+            :param str category: category of the stage
+            :param int nbytes: number of bytes processed
+            :param context: information about the data being processed, such as run and cross_section
+        """
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        return Span(self, name, category, parent=parent, nbytes=nbytes, **context)
+
+    @property
+    def current_span(self):
+        """
+            Return the innermost open span of this thread, or None
+        """
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def clear(self):
+        """
+            Forget the completed spans and start a new session
+        """
+        self.spans.clear()
+        self.t_0 = time.time()
+
+    def get_summary(self, group_by=None):
+        """
+            Return the number of calls, total time, time excluding nested stages,
+            maximum time and number of bytes for each stage, ordered by total time.
+
+            :param str group_by: context key used to break down each stage, such as run
+        """
+        rows = collections.OrderedDict()
+        for span in list(self.spans):
+            key = span.name if group_by is None else (span.name, span.context.get(group_by, ''))
+            if key not in rows:
+                rows[key] = dict(name=span.name, group=span.context.get(group_by, '') if group_by else '',
+                                 category=span.category, calls=0, total=0.0, self_time=0.0, max=0.0, nbytes=0)
+            row = rows[key]
+            row['calls'] += 1
+            row['total'] += span.duration
+            row['self_time'] += span.self_time
+            row['max'] = max(row['max'], span.duration)
+            row['nbytes'] += span.nbytes
+        return sorted(rows.values(), key=lambda item: item['total'], reverse=True)
+
+    def get_summary_table(self, group_by=None):
+        """
+            Return the summary of the session as a text table
+            :param str group_by: context key used to break down each stage, such as run
+        """
+        summary = self.get_summary(group_by)
+        name_width = max([len(item['name']) for item in summary] + [5])
+        group_width = max([len(str(item['group'])) for item in summary] + [len(group_by or '')])
+        _format = '%-*s  %-*s  %5s  %9s  %9s  %9s  %9s'
+        lines = [_format % (name_width, 'Stage', group_width, group_by or '', 'Calls',
+                            'Total[s]', 'Self[s]', 'Max[s]', 'MB')]
+        for item in summary:
+            lines.append('%-*s  %-*s  %5d  %9.3f  %9.3f  %9.3f  %9.1f' % (name_width, item['name'],
+                                                                         group_width, item['group'],
+                                                                         item['calls'], item['total'],
+                                                                         item['self_time'], item['max'],
+                                                                         item['nbytes'] / 1024.**2))
+        lines.append('Session time: %.1f sec' % (time.time() - self.t_0))
+        return '\n'.join(lines)
+
+    def get_chrome_trace(self):
+        """
+            Return the spans as a Chrome trace-event dictionary.
+            Times are in microseconds from the start of the session.
+        """
+        pid = os.getpid()
+        events = [dict(name='process_name', ph='M', pid=pid, tid=0, args=dict(name='QuickNXS'))]
+        for span in list(self.spans):
+            args = dict((key, _to_json(value)) for key, value in span.context.items())
+            args['bytes'] = span.nbytes
+            events.append(dict(name=span.name, cat=span.category or 'default', ph='X',
+                               ts=(span.start - self.t_0) * 1e6, dur=span.duration * 1e6,
+                               pid=pid, tid=span.thread_id, args=args))
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+    def write_chrome_trace(self, file_path):
+        """
+            Write the spans as a Chrome trace-event JSON file
+            :param str file_path: output file path
+        """
+        with open(file_path, 'w') as fd:
+            json.dump(self.get_chrome_trace(), fd)
+
+
+def _to_json(value):
+    """
+        Return a value that can be written to JSON
+    """
+    if isinstance(value, (bool, int, float) + STRING_TYPES) or value is None:
+        return value
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def _format_context(context):
+    return ' '.join(['%s=%s' % (key, context[key]) for key in sorted(context)])
+
+
+_tracer = None
+
+
+def get_tracer():
+    """
+        Return the tracer of the session
+    """
+    global _tracer #pylint: disable=global-statement
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def span(name, category='', nbytes=0, **context):
+    """
+        Return a span for a stage, recorded by the session tracer.
+        See Tracer.span().
+    """
+    return get_tracer().span(name, category, nbytes=nbytes, **context)
+
+
+def traced(name, category='', context=None):
+    """
+        Decorator timing each call of a function as a span
+
+        :param str name: name of the stage
+        :param str category: category of the stage
+        :param function context: function returning the context of a call, given the first argument
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            _context = context(args[0]) if context is not None and args else {}
+            with span(name, category, **_context):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
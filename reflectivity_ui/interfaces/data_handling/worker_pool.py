@@ -0,0 +1,215 @@
+#pylint: disable=invalid-name, bare-except
+"""
+    Application-wide pool of worker processes.
+
+    The pool is created the first time it is needed and is kept until the
+    application shuts down. Large input arrays are not pickled for each task:
+    they are written once to memory-mapped files, and the workers open them
+    from a small descriptor.
+"""
+from __future__ import absolute_import, division, print_function
+import os
+import logging
+import shutil
+import tempfile
+import threading
+import multiprocessing
+import numpy as np
+
+# Number of chunks per worker, so that faster workers can pick up more work
+CHUNKS_PER_WORKER = 4
+
+# Time between checks for a cancellation while waiting for results, in seconds
+POLL_INTERVAL = 0.2
+
+# Memory-backed file system used for the shared buffers, when available
+SHARED_MEMORY_DIR = '/dev/shm'
+
+
+class Cancelled(Exception):
+    """
+        Raised when a parallel task was cancelled before completion
+    """
+    pass
+
+
+class SharedArrays(object):
+    """
+        Set of numpy arrays written to memory-mapped files
+        so that they can be shared with the worker processes.
+    """
+    def __init__(self):
+        _dir = SHARED_MEMORY_DIR if os.access(SHARED_MEMORY_DIR, os.W_OK) else None
+        self.directory = tempfile.mkdtemp(prefix='refredm_', dir=_dir)
+        self.descriptors = {}
+
+    def add(self, name, array):
+        """
+            Copy an array to a shared buffer and return its descriptor.
+            :param str name: name of the array
+            :param numpy.ndarray array: data to share
+        """
+        array = np.ascontiguousarray(array)
+        file_path = None
+        if array.size > 0:
+            file_path = os.path.join(self.directory, '%s.dat' % name)
+            _buffer = np.memmap(file_path, dtype=array.dtype, mode='w+', shape=array.shape)
+            _buffer[...] = array
+            _buffer.flush()
+            del _buffer
+        self.descriptors[name] = dict(file_path=file_path, dtype=array.dtype.str, shape=array.shape)
+        return self.descriptors[name]
+
+    def release(self):
+        """
+            Delete the shared buffers
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.descriptors = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def load(descriptor):
+    """
+        Open a shared array, read-only, from its descriptor.
+        :param dict descriptor: descriptor returned by SharedArrays.add()
+    """
+    if descriptor['file_path'] is None:
+        return np.empty(descriptor['shape'], dtype=np.dtype(descriptor['dtype']))
+    return np.memmap(descriptor['file_path'], dtype=np.dtype(descriptor['dtype']),
+                     mode='r', shape=tuple(descriptor['shape']))
+
+
+def _run_task(args):
+    """
+        Execute a task in a worker and tag the result with the task index
+    """
+    function, index, task = args
+    return index, function(task)
+
+
+class WorkerPool(object):
+    """
+        Long-lived pool of worker processes
+    """
+    def __init__(self, n_workers=None):
+        """
+            :param int n_workers: number of processes [defaults to the number of CPUs minus one]
+        """
+        if n_workers is None:
+            n_workers = max(multiprocessing.cpu_count() - 1, 1)
+        self.n_workers = int(n_workers)
+        self._pool = None
+        self._cancelled = threading.Event()
+
+    @property
+    def pool(self):
+        """
+            Return the process pool, starting it if needed
+        """
+        if self._pool is None:
+            logging.info("Starting %s worker processes", self.n_workers)
+            self._pool = multiprocessing.Pool(self.n_workers)
+        return self._pool
+
+    def chunks(self, n_items):
+        """
+            Split a range of items into balanced [start, stop] chunks.
+            :param int n_items: number of items to process
+        """
+        n_chunks = max(min(n_items, self.n_workers * CHUNKS_PER_WORKER), 1)
+        edges = [int(round(i * n_items / n_chunks)) for i in range(n_chunks + 1)]
+        return [[edges[i], edges[i+1]] for i in range(n_chunks) if edges[i+1] > edges[i]]
+
+    def map(self, function, tasks, progress=None, message=''):
+        """
+            Execute a function on a list of tasks and return the results in order.
+            Raises Cancelled if cancel() is called before all the tasks are done.
+            While waiting for the results, the progress reporter is updated
+            regularly so that the user interface can process a cancellation.
+
+            :param function: module-level function taking a task as argument
+            :param list tasks: list of picklable task descriptions
+            :param ProgressReporter progress: reporter object
+            :param str message: message to report along with the progress
+        """
+        self._cancelled.clear()
+        results = [None] * len(tasks)
+        inputs = [(function, i, task) for i, task in enumerate(tasks)]
+        if progress is not None and hasattr(progress, 'set_cancellable'):
+            progress.set_cancellable(True)
+        try:
+            iterator = self.pool.imap_unordered(_run_task, inputs)
+            n_done = 0
+            while n_done < len(tasks):
+                try:
+                    i, result = iterator.next(timeout=POLL_INTERVAL)
+                    results[i] = result
+                    n_done += 1
+                except multiprocessing.TimeoutError:
+                    pass
+                if progress is not None:
+                    progress(n_done, message, out_of=len(tasks))
+                if self._cancelled.is_set():
+                    raise Cancelled("Cancelled after %s of %s tasks" % (n_done, len(tasks)))
+        except:
+            # Stop the remaining tasks, the pool will be restarted when needed
+            self.terminate()
+            raise
+        finally:
+            if progress is not None and hasattr(progress, 'set_cancellable'):
+                progress.set_cancellable(False)
+        return results
+
+    def cancel(self):
+        """
+            Cancel the tasks being processed by map().
+            This is meant to be called while map() is waiting for results,
+            for instance from the cancel button of the progress reporter.
+        """
+        self._cancelled.set()
+
+    def terminate(self):
+        """
+            Stop the workers immediately
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def shutdown(self):
+        """
+            Stop the workers once they are done with their current tasks
+        """
+        self.cancel()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+_worker_pool = None
+
+def get_pool():
+    """
+        Return the application's worker pool
+    """
+    global _worker_pool #pylint: disable=global-statement
+    if _worker_pool is None:
+        _worker_pool = WorkerPool()
+    return _worker_pool
+
+def shutdown():
+    """
+        Shut down the application's worker pool, if it was started
+    """
+    global _worker_pool #pylint: disable=global-statement
+    if _worker_pool is not None:
+        _worker_pool.shutdown()
+        _worker_pool = None
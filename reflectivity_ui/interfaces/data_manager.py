@@ -6,17 +6,21 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 import sys
 import os
-import time
 import numpy as np
 import logging
 from reflectivity_ui.interfaces.data_handling.data_set import NexusData
 from .data_handling import data_manipulation
+from .data_handling import stitching
+from .data_handling import asymmetry
 from .data_handling import quicknxs_io
 from .data_handling import off_specular
 from .data_handling import gisans
+from .data_handling import tracing
+from .data_handling.cube_cache import get_cube_cache
 
 class DataManager(object):
-    MAX_CACHE = 50
+    # Memory budget for the data cache, in bytes
+    MAX_CACHE_MEMORY = 8 * 1024**3
 
     def __init__(self, current_directory):
         self.current_directory = current_directory
@@ -54,8 +58,50 @@ class DataManager(object):
     def get_cachesize(self):
         return len(self._cache)
 
+    def get_cache_memory(self):
+        """
+            Return the approximate memory used by the cached data, in bytes
+        """
+        return sum([nexus_data.memory_size for nexus_data in self._cache])
+
+    def _is_in_use(self, nexus_data):
+        """
+            Returns True if the data set is active or part of the reduction
+            or direct beam lists, in which case it should stay in memory.
+            :param NexusData nexus_data: data set object
+        """
+        return nexus_data is self._nexus_data \
+            or self.find_data_in_reduction_list(nexus_data) is not None \
+            or self.find_data_in_direct_beam_list(nexus_data) is not None
+
+    def _evict_cache(self):
+        """
+            Remove the least recently used data sets from the cache until
+            it fits in its memory budget. Data sets that are in use are kept.
+        """
+        cache_memory = [nexus_data.memory_size for nexus_data in self._cache]
+        total_memory = sum(cache_memory)
+        i = 0
+        while total_memory > self.MAX_CACHE_MEMORY and i < len(self._cache):
+            if self._is_in_use(self._cache[i]):
+                i += 1
+                continue
+            logging.info("Removing %s from cache", self._cache[i].file_path)
+            self._cache.pop(i).release_workspaces()
+            total_memory -= cache_memory.pop(i)
+
     def clear_cache(self):
-        self._cache = []
+        """
+            Remove all the data sets that are not in use from the cache,
+            along with their Mantid workspaces, and clear the on-disk cube cache.
+        """
+        cube_cache = get_cube_cache()
+        if cube_cache is not None:
+            cube_cache.clear()
+        for nexus_data in self._cache:
+            if not self._is_in_use(nexus_data):
+                nexus_data.release_workspaces()
+        self._cache = [nexus_data for nexus_data in self._cache if self._is_in_use(nexus_data)]
 
     def set_active_data_from_reduction_list(self, index):
         """
@@ -160,6 +206,9 @@ class DataManager(object):
         """
             Add active data set to reduction list
         """
+        if self._nexus_data is not None and self._nexus_data.is_preview:
+            logging.error("The data is still loading and cannot be added to the reduction list")
+            return False
         if not self._nexus_data in self.reduction_list:
             if self.is_active_data_compatible():
                 if len(self.reduction_list) == 0:
@@ -184,6 +233,9 @@ class DataManager(object):
         """
             Add active data set to the direct beam list
         """
+        if self._nexus_data is not None and self._nexus_data.is_preview:
+            logging.error("The data is still loading and cannot be added to the direct beam list")
+            return False
         if not self._nexus_data in self.direct_beam_list:
             self.direct_beam_list.append(self._nexus_data)
             return True
@@ -213,89 +265,127 @@ class DataManager(object):
         _value = start_value + (stop_value-start_value)*value
         call_back(_value, message)
 
-    def load(self, file_path, configuration, force=False, update_parameters=True, progress=None):
+    def load(self, file_path, configuration, force=False, update_parameters=True, progress=None,
+             preview=None):
         """
             Load a data file
             :param str file_path: file path
             :param Configuration configuration: configuration to use to load the data
             :param bool force: it True, existing data will be replaced if it exists.
             :param bool update_parameters: if True, we will find peak ranges
-        """
-        nexus_data = None
-        is_from_cache = False
-        reduction_list_id = None
-        direct_beam_list_id = None
-
-        # Check whether the file is in cache
-        if progress is not None:
-            progress(10, "Loading data...")
-        for i in range(len(self._cache)):
-            if self._cache[i].file_path == file_path:
-                if force:
-                    # Check whether the data is in the reduction list before
-                    # removing it.
-                    reduction_list_id = self.find_data_in_reduction_list(self._cache[i])
-                    direct_beam_list_id = self.find_data_in_direct_beam_list(self._cache[i])
-                    self._cache.pop(i)
-                else:
-                    nexus_data = self._cache[i]
-                    is_from_cache = True
-                break
-
-        # If we don't have the data, load it
-        if nexus_data is None:
-            configuration.normalization = None
-            nexus_data = NexusData(file_path, configuration)
-            sub_task = progress.create_sub_task(max_value=70) if progress else None
-            nexus_data.load(progress=sub_task, update_parameters=update_parameters)
-
-        if progress is not None:
-            progress(80, "Calculating...")
-
-        if nexus_data is not None:
-            self._nexus_data = nexus_data
-            directory, file_name = os.path.split(file_path)
-            self.current_directory = directory
-            self.current_file_name = file_name
-            self.set_channel(0)
-
-            # If we didn't get this data set from our cache,
-            # then add it and compute its reflectivity.
-            if not is_from_cache:
-                # Find suitable direct beam
-                logging.info("Direct beam from loader: %s", configuration.normalization)
-                if configuration.normalization is None and configuration.match_direct_beam:
-                    self.find_best_direct_beam()
-
-                # Replace reduction and normalization entries as needed
-                if reduction_list_id is not None:
-                    self.reduction_list[reduction_list_id] = nexus_data
-                if direct_beam_list_id is not None:
-                    self.direct_beam_list[direct_beam_list_id] = nexus_data
-                # Compute reflectivity
+            :param function preview: if given, the data is first binned without Mantid
+                                     and this function is called to show it while the
+                                     full data is loading
+        """
+        with tracing.span('DataManager.load', 'load', file=os.path.basename(file_path)) as _span:
+            nexus_data = None
+            is_from_cache = False
+            reduction_list_id = None
+            direct_beam_list_id = None
+
+            # Check whether the file is in cache
+            if progress is not None:
+                progress(10, "Loading data...")
+            for i in range(len(self._cache)):
+                if self._cache[i].file_path == file_path:
+                    if force:
+                        # Check whether the data is in the reduction list before
+                        # removing it.
+                        reduction_list_id = self.find_data_in_reduction_list(self._cache[i])
+                        direct_beam_list_id = self.find_data_in_direct_beam_list(self._cache[i])
+                        self._cache.pop(i).release_workspaces()
+                    else:
+                        # Move the data to the end of the cache as the most recently used
+                        nexus_data = self._cache.pop(i)
+                        self._cache.append(nexus_data)
+                        is_from_cache = True
+                    break
+
+            # If we don't have the data, load it
+            if nexus_data is None:
+                configuration.normalization = None
+                previous_data = self._nexus_data
+                previous_channel = self.active_channel
+                if preview is not None:
+                    self.load_preview(file_path, configuration, preview)
+                nexus_data = NexusData(file_path, configuration)
+                sub_task = progress.create_sub_task(max_value=70) if progress else None
                 try:
-                    self.calculate_reflectivity()
+                    nexus_data.load(progress=sub_task, update_parameters=update_parameters)
                 except:
-                    logging.error("Reflectivity calculation failed for %s", file_name)
-
-                while len(self._cache)>=self.MAX_CACHE:
-                    self._cache.pop(0)
-                self._cache.append(nexus_data)
-
-        if progress is not None:
-            progress(100)
-        return is_from_cache
+                    # Don't leave the preview as the active data
+                    self._nexus_data = previous_data
+                    self.active_channel = previous_channel
+                    raise
+
+            if progress is not None:
+                progress(80, "Calculating...")
+
+            if nexus_data is not None:
+                _span.set(run=nexus_data.number, cached=is_from_cache)
+                self._nexus_data = nexus_data
+                directory, file_name = os.path.split(file_path)
+                self.current_directory = directory
+                self.current_file_name = file_name
+                self.set_channel(0)
+
+                # If we didn't get this data set from our cache,
+                # then add it and compute its reflectivity.
+                if not is_from_cache:
+                    # Find suitable direct beam
+                    logging.info("Direct beam from loader: %s", configuration.normalization)
+                    if configuration.normalization is None and configuration.match_direct_beam:
+                        self.find_best_direct_beam()
+
+                    # Replace reduction and normalization entries as needed
+                    if reduction_list_id is not None:
+                        self.reduction_list[reduction_list_id] = nexus_data
+                    if direct_beam_list_id is not None:
+                        self.direct_beam_list[direct_beam_list_id] = nexus_data
+                    # Compute reflectivity
+                    try:
+                        self.calculate_reflectivity()
+                    except:
+                        logging.error("Reflectivity calculation failed for %s", file_name)
+
+                    self._cache.append(nexus_data)
+                    self._evict_cache()
+
+            if progress is not None:
+                progress(100)
+            return is_from_cache
+
+    def load_preview(self, file_path, configuration, callback):
+        """
+            Bin the events of a data file without Mantid and make the result the
+            active data set until the full data is loaded. The preview is not
+            cached and cannot be added to the reduction or direct beam lists.
+            No preview is shown if the binned data is in the cube cache, since
+            the full data will then load quickly.
+            :param str file_path: file path
+            :param Configuration configuration: configuration to use to load the data
+            :param function callback: function called to show the preview
+        """
+        nexus_data = NexusData(file_path, configuration)
+        if not nexus_data.load_preview():
+            return
+        self._nexus_data = nexus_data
+        self.set_channel(0)
+        try:
+            callback()
+        except:
+            logging.error("Could not show the preview of %s: %s", file_path, sys.exc_info()[1])
 
     def update_configuration(self, configuration, active_only=False, nexus_data=None):
         """
-            Update configuration
+            Update configuration.
+            Returns the set of processing stages that need to be recomputed.
         """
         if active_only:
-            self.active_channel.update_configuration(configuration)
+            return self.active_channel.update_configuration(configuration)
         elif nexus_data is not None:
-            nexus_data.update_configuration(configuration)
-        else:
-            self._nexus_data.update_configuration(configuration)
+            return nexus_data.update_configuration(configuration)
+        return self._nexus_data.update_configuration(configuration)
 
     def get_active_direct_beam(self):
         """
@@ -366,7 +456,6 @@ class DataManager(object):
         """
             Compute GISANS for a single data set
         """
-        t_0 = time.time()
         # Select the data to work on
         if nexus_data is None:
             nexus_data = self._nexus_data
@@ -376,8 +465,8 @@ class DataManager(object):
         if direct_beam is None:
             raise RuntimeError("Please select a direct beam data set for your data.")
 
-        nexus_data.calculate_gisans(direct_beam=direct_beam, progress=progress)
-        logging.info("Calculate GISANS: %s %s sec", nexus_data.number, (time.time()-t_0))
+        with tracing.span('DataManager.calculate_gisans', 'reduction', run=nexus_data.number):
+            nexus_data.calculate_gisans(direct_beam=direct_beam, progress=progress)
 
     def is_offspec_available(self):
         """
@@ -402,13 +491,16 @@ class DataManager(object):
                 return False
         return True
 
-    def reduce_offspec(self, progress=None):
+    def reduce_offspec(self, progress=None, accumulators=None):
         """
             Since the specular reflectivity is prominently displayed, it is updated as
             soon as parameters change. This is not the case for the off-specular, which is
             computed on-demand.
             This method goes through the data sets in the reduction list and re-calculate
             the off-specular reflectivity.
+
+            :param dict accumulators: OffSpecularAccumulator for each cross-section,
+                                      to which each run is added as soon as it is computed
         """
         for nexus_data in self.reduction_list:
             try:
@@ -416,6 +508,11 @@ class DataManager(object):
             except:
                 logging.error("Could not compute reflectivity for %s\n  %s",
                               nexus_data.number, sys.exc_info()[1])
+                continue
+            if accumulators is not None:
+                for pol_state in accumulators:
+                    if pol_state in nexus_data.cross_sections:
+                        accumulators[pol_state].add(nexus_data.cross_sections[pol_state])
 
     def rebin_gisans(self, pol_state, wl_min=0, wl_max=100, qy_npts=50, qz_npts=50, use_pf=False):
         """
@@ -424,9 +521,20 @@ class DataManager(object):
         return gisans.rebin_extract(self.reduction_list, pol_state=pol_state, wl_min=wl_min, wl_max=wl_max,
                                     qy_npts=qy_npts, qz_npts=qz_npts, use_pf=use_pf)
 
-    def calculate_reflectivity(self, configuration=None, active_only=False, nexus_data=None, specular=True):
+    def rebin_gisans_bands(self, pol_state, wl_min=0, wl_max=100, wl_npts=2, qy_npts=50, qz_npts=50, use_pf=False):
+        """
+            Merge all the GISANS data and rebin each wavelength band.
+            Returns a list with the output of rebin_gisans() for each band.
+        """
+        return gisans.rebin_bands(self.reduction_list, pol_state=pol_state, wl_min=wl_min, wl_max=wl_max,
+                                  wl_npts=wl_npts, qy_npts=qy_npts, qz_npts=qz_npts, use_pf=use_pf)
+
+    def calculate_reflectivity(self, configuration=None, active_only=False, nexus_data=None, specular=True,
+                               cross_section=None):
         """
             Calculater reflectivity using the current configuration
+            :param CrossSectionData cross_section: cross-section to compute when active_only
+                                                   is True [defaults to the active channel]
         """
         # Select the data to work on
         if nexus_data is None:
@@ -435,12 +543,30 @@ class DataManager(object):
         # Try to find the direct beam in the list of direct beam data sets
         direct_beam = self._find_direct_beam(nexus_data)
 
-        if not specular:
-            nexus_data.calculate_offspec(direct_beam=direct_beam)
-        elif active_only:
-            self.active_channel.reflectivity(direct_beam=direct_beam, configuration=configuration)
+        with tracing.span('DataManager.calculate_reflectivity', 'reduction', run=nexus_data.number,
+                          specular=specular):
+            if not specular:
+                nexus_data.calculate_offspec(direct_beam=direct_beam)
+            elif active_only:
+                if cross_section is None:
+                    cross_section = self.active_channel
+                cross_section.reflectivity(direct_beam=direct_beam, configuration=configuration)
+            else:
+                nexus_data.calculate_reflectivity(direct_beam=direct_beam, configuration=configuration)
+
+    def calculate_preview(self, active_only=False):
+        """
+            Compute a fast estimate of the reflectivity of the current data,
+            to be displayed until the reduction is done.
+            :param bool active_only: if True, only the active cross-section is computed
+        """
+        direct_beam = self._find_direct_beam(self._nexus_data)
+        if active_only:
+            channels = [self.active_channel]
         else:
-            nexus_data.calculate_reflectivity(direct_beam=direct_beam, configuration=configuration)
+            channels = [self._nexus_data.cross_sections[xs] for xs in self._nexus_data.cross_sections]
+        for channel in channels:
+            channel.calculate_preview(direct_beam=direct_beam)
 
     def find_best_direct_beam(self):
         """
@@ -515,24 +641,31 @@ class DataManager(object):
                 n_points = len(item.cross_sections[xs].q)-overlap_idx[0][0]
                 item.set_parameter("cut_last_n_points", n_points)
 
-    def stitch_data_sets(self, normalize_to_unity=True, q_cutoff=0.01):
+    def stitch_data_sets(self, normalize_to_unity=True, q_cutoff=0.01, global_fit=False):
         """
             Determine scaling factors for each data set
             :param bool normalize_to_unity: If True, the reflectivity plateau will be normalized to 1.
             :param float q_cutoff: critical q-value below which we expect R=1
+            :param bool global_fit: If True, all the scaling factors are fitted together.
         """
-        data_manipulation.smart_stitch_reflectivity(self.reduction_list, self.active_channel.name, normalize_to_unity,
-                                                    q_cutoff=q_cutoff)
+        with tracing.span('DataManager.stitch_data_sets', 'reduction', n_runs=len(self.reduction_list)):
+            data_manipulation.smart_stitch_reflectivity(self.reduction_list, self.active_channel.name,
+                                                        normalize_to_unity, q_cutoff=q_cutoff, global_fit=global_fit)
 
     def merge_data_sets(self, asymmetry=True):
-        self.final_merged_reflectivity = {}
-        for pol_state in self.reduction_states:
-            # The scaling factors should have been determined at this point. Just use them
-            # to merge the different runs in a set.
-            merged_ws = data_manipulation.merge_reflectivity(self.reduction_list, xs=pol_state,
-                                                             q_min=0.001, q_step=-0.01)
-            self.final_merged_reflectivity[pol_state] = merged_ws
-        
+        """
+            Merge the runs of the reduction list for each cross-section.
+            The scaling factors should have been determined at this point. Just use them
+            to merge the different runs in a set.
+            The exported files keep the points of each run instead, so the merged
+            reflectivity is only available to scripts, in final_merged_reflectivity.
+            :param bool asymmetry: if True, the spin asymmetry will also be computed
+        """
+        with tracing.span('DataManager.merge_data_sets', 'reduction', n_runs=len(self.reduction_list)):
+            self.final_merged_reflectivity = stitching.merge_reduction_list(self.reduction_list,
+                                                                            self.reduction_states,
+                                                                            q_min=0.001, q_step=-0.01)
+
         # Compute asymmetry
         if asymmetry:
             self.asymmetry()
@@ -587,13 +720,10 @@ class DataManager(object):
         """
         p_state, m_state = self.determine_asymmetry_states()
 
-        # Get the list of workspaces
         if p_state in self.final_merged_reflectivity and m_state in self.final_merged_reflectivity:
-            p_ws = self.final_merged_reflectivity[p_state]
-            m_ws = self.final_merged_reflectivity[m_state]
-            ratio_ws = (p_ws - m_ws) / (p_ws + m_ws)
-
-            self.final_merged_reflectivity['SA'] = ratio_ws
+            p_data = np.asarray(self.final_merged_reflectivity[p_state]).T
+            m_data = np.asarray(self.final_merged_reflectivity[m_state]).T
+            self.final_merged_reflectivity['SA'] = tuple(asymmetry.spin_asymmetry(p_data, m_data).T)
 
     def extract_meta_data(self, file_path=None):
         """
@@ -611,50 +741,46 @@ class DataManager(object):
             :param str file_path: reduced file to load
             :param Configuration configuration: configuration to base the loaded data on
         """
-        t_0 = time.time()
-        db_files, data_files = quicknxs_io.read_reduced_file(file_path, configuration)
-        logging.info("Reduced file loaded: %s sec", time.time()-t_0)
-
-        n_loaded = 0
-        n_total = len(db_files)+len(data_files)
-        if progress and n_total > 0:
-            progress.set_value(1, message="Loaded %s" % os.path.basename(file_path), out_of=n_total)
-        for r_id, run_file, conf in db_files:
-            t_i = time.time()
-            if os.path.isfile(run_file):
-                is_from_cache = self.load(run_file, conf, update_parameters=False)
-                if is_from_cache:
-                    configuration.normalization = None
-                    self._nexus_data.update_configuration(conf)
-                self.add_active_to_normalization()
-                logging.info("%s loaded: %s sec [%s]", r_id, time.time()-t_i, time.time()-t_0)
-                if progress:
-                    progress.set_value(n_loaded, message="%s loaded" % os.path.basename(run_file), out_of=n_total)
-            else:
-                logging.error("File does not exist: %s", run_file)
-                if progress:
-                    progress.set_value(n_loaded, message="ERROR: %s does not exist" % run_file, out_of=n_total)
-            n_loaded += 1
-
-        for r_id, run_file, conf in data_files:
-            t_i = time.time()
-            if os.path.isfile(run_file):
-                is_from_cache = self.load(run_file, conf, update_parameters=False)
-                if is_from_cache:
-                    configuration.normalization = None
-                    self._nexus_data.update_configuration(conf)
-                    self.calculate_reflectivity()
-                self.add_active_to_reduction()
-                logging.info("%s loaded: %s sec [%s]", r_id, time.time()-t_i, time.time()-t_0)
-                if progress:
-                    progress.set_value(n_loaded, message="%s loaded" % os.path.basename(run_file), out_of=n_total)
-            else:
-                logging.error("File does not exist: %s", run_file)
-                if progress:
-                    progress.set_value(n_loaded, message="ERROR: %s does not exist" % run_file, out_of=n_total)
-            n_loaded += 1
-
-        if progress:
-            progress.set_value(n_total, message="Done", out_of=n_total)
+        with tracing.span('DataManager.load_data_from_reduced_file', 'load', file=os.path.basename(file_path)):
+            with tracing.span('quicknxs_io.read_reduced_file', 'load', file=os.path.basename(file_path)):
+                db_files, data_files = quicknxs_io.read_reduced_file(file_path, configuration)
+
+            n_loaded = 0
+            n_total = len(db_files)+len(data_files)
+            if progress and n_total > 0:
+                progress.set_value(1, message="Loaded %s" % os.path.basename(file_path), out_of=n_total)
+            for r_id, run_file, conf in db_files:
+                if os.path.isfile(run_file):
+                    is_from_cache = self.load(run_file, conf, update_parameters=False)
+                    if is_from_cache:
+                        configuration.normalization = None
+                        self._nexus_data.update_configuration(conf)
+                    self.add_active_to_normalization()
+                    logging.info("%s loaded", r_id)
+                    if progress:
+                        progress.set_value(n_loaded, message="%s loaded" % os.path.basename(run_file), out_of=n_total)
+                else:
+                    logging.error("File does not exist: %s", run_file)
+                    if progress:
+                        progress.set_value(n_loaded, message="ERROR: %s does not exist" % run_file, out_of=n_total)
+                n_loaded += 1
+
+            for r_id, run_file, conf in data_files:
+                if os.path.isfile(run_file):
+                    is_from_cache = self.load(run_file, conf, update_parameters=False)
+                    if is_from_cache:
+                        configuration.normalization = None
+                        self._nexus_data.update_configuration(conf)
+                        self.calculate_reflectivity()
+                    self.add_active_to_reduction()
+                    logging.info("%s loaded", r_id)
+                    if progress:
+                        progress.set_value(n_loaded, message="%s loaded" % os.path.basename(run_file), out_of=n_total)
+                else:
+                    logging.error("File does not exist: %s", run_file)
+                    if progress:
+                        progress.set_value(n_loaded, message="ERROR: %s does not exist" % run_file, out_of=n_total)
+                n_loaded += 1
 
-        logging.info("DONE: %s sec", time.time()-t_0)
+            if progress:
+                progress.set_value(n_total, message="Done", out_of=n_total)
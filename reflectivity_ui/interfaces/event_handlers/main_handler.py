@@ -9,10 +9,11 @@ import os
 import logging
 import glob
 import math
-import time
 from PyQt5 import QtGui, QtCore, QtWidgets
 
 from ..configuration import Configuration
+from ..data_handling import tracing
+from ..data_handling import worker_pool
 from .progress_reporter import ProgressReporter
 
 
@@ -30,12 +31,16 @@ class MainHandler(object):
                                                        self.main_window)
         self._path_watcher.directoryChanged.connect(self.update_file_list)
 
-        self.cache_indicator = QtWidgets.QLabel("Files loaded: 0")
+        self.cache_indicator = QtWidgets.QLabel("Cache: 0 files, 0 MB")
         self.cache_indicator.setMargin(5)
         self.cache_indicator.setSizePolicy(QtWidgets.QSizePolicy.Fixed,
                                            QtWidgets.QSizePolicy.Preferred)
-        self.cache_indicator.setMinimumWidth(110)
+        self.cache_indicator.setMinimumWidth(180)
         self.ui.statusbar.addPermanentWidget(self.cache_indicator)
+        # Refresh the memory usage periodically since reductions create new workspaces
+        self._cache_timer = QtCore.QTimer(self.main_window)
+        self._cache_timer.timeout.connect(self.update_cache_indicator)
+        self._cache_timer.start(5000)
         button = QtWidgets.QPushButton('Empty Cache')
         self.ui.statusbar.addPermanentWidget(button)
         button.pressed.connect(self.empty_cache)
@@ -48,6 +53,14 @@ class MainHandler(object):
         self.progress_bar.setMaximumSize(140, 100)
         self.ui.statusbar.addPermanentWidget(self.progress_bar)
 
+        # Button to cancel the parallel tasks, shown while they run
+        self.cancel_button = QtWidgets.QPushButton('Cancel')
+        self.cancel_button.setFlat(True)
+        self.cancel_button.setMaximumSize(150, 20)
+        self.cancel_button.pressed.connect(self.cancel_task)
+        self.cancel_button.hide()
+        self.ui.statusbar.addPermanentWidget(self.cancel_button)
+
         self.status_message = QtWidgets.QLabel("")
         self.status_message.setMinimumWidth(1000)
         self.status_message.setMargin(5)
@@ -55,14 +68,29 @@ class MainHandler(object):
 
     def new_progress_reporter(self):
         """ Return a progress reporter """
-        return ProgressReporter(progress_bar=self.progress_bar, status_bar=self.status_message)
+        return ProgressReporter(progress_bar=self.progress_bar, status_bar=self.status_message,
+                                cancel_button=self.cancel_button)
+
+    def cancel_task(self):
+        """
+            Cancel the parallel task in progress
+        """
+        worker_pool.get_pool().cancel()
+        self.report_message("Cancelling...")
 
     def empty_cache(self):
         """
             Empty the data cache
         """
         self._data_manager.clear_cache()
-        self.cache_indicator.setText("Files loaded: 0")
+        self.update_cache_indicator()
+
+    def update_cache_indicator(self):
+        """
+            Show the number of cached files and the memory they use
+        """
+        self.cache_indicator.setText("Cache: %s files, %.0f MB" % (self._data_manager.get_cachesize(),
+                                                                  self._data_manager.get_cache_memory()/1024.**2))
 
     def open_file(self, file_path, force=False, silent=False):
         """
@@ -71,26 +99,36 @@ class MainHandler(object):
             :param bool force: if true, the file will be reloaded
             :param bool silent: if true, the UI will not be updated
         """
+        self.main_window.flush_pending_reduction()
         if not os.path.isfile(file_path):
             self.report_message("File does not exist",
                                 detailed_message="The following file does not exist:\n  %s" % file_path,
                                 pop_up=True, is_error=True)
             return
-        t_0 = time.time()
-        self.main_window.auto_change_active = True
-        try:
-            self.report_message("Loading file %s" % file_path)
-            prog = ProgressReporter(progress_bar=self.progress_bar, status_bar=self.status_message)
-            configuration = self.get_configuration()
-            self._data_manager.load(file_path, configuration, force=force, progress=prog)
-            self.report_message("Loaded file %s" % self._data_manager.current_file_name)
-        except:
-            self.report_message("Error loading file %s" % self._data_manager.current_file_name,
-                                detailed_message=str(sys.exc_value), pop_up=False, is_error=True)
-        if not silent:
-            self.file_loaded()
-        self.main_window.auto_change_active = False
-        logging.info("DONE: %s sec", time.time()-t_0)
+        with tracing.span('MainHandler.open_file', 'ui', file=os.path.basename(file_path)):
+            self.main_window.auto_change_active = True
+            try:
+                self.report_message("Loading file %s" % file_path)
+                prog = ProgressReporter(progress_bar=self.progress_bar, status_bar=self.status_message)
+                configuration = self.get_configuration()
+                show_preview = not silent and self.main_window.application_conf.load_preview
+                self._data_manager.load(file_path, configuration, force=force, progress=prog,
+                                        preview=self.show_preview if show_preview else None)
+                self.report_message("Loaded file %s" % self._data_manager.current_file_name)
+            except:
+                self.report_message("Error loading file %s" % self._data_manager.current_file_name,
+                                    detailed_message=str(sys.exc_value), pop_up=False, is_error=True)
+            if not silent:
+                self.file_loaded()
+            self.main_window.auto_change_active = False
+
+    def show_preview(self):
+        """
+            Plot the detector projections of a file binned without Mantid,
+            while the full data is loading. They are replaced by file_loaded().
+        """
+        self.main_window.initiate_projection_plot.emit(False)
+        QtWidgets.QApplication.instance().processEvents()
 
     def file_loaded(self):
         """
@@ -121,7 +159,7 @@ class MainHandler(object):
         self.main_window.initiate_reflectivity_plot.emit(False)
         self.main_window.initiate_projection_plot.emit(False)
 
-        self.cache_indicator.setText('Files loaded: %s' % (self._data_manager.get_cachesize()))
+        self.update_cache_indicator()
 
     def update_tables(self):
         """
@@ -333,42 +371,40 @@ class MainHandler(object):
                                                              directory=output_dir,
                                                              filter=filter_)
 
-        t_0 = time.time()
         if file_path:
-            # Clear the reduction list first so that we don't create problems later
-            self.clear_direct_beams()
-            self.clear_reflectivity()
-            configuration = self.get_configuration()
-            prog = self.new_progress_reporter()
-            self._data_manager.load_data_from_reduced_file(file_path, configuration=configuration,
-                                                           progress=prog)
-
-            # Update output directory
-            file_dir, _ = os.path.split(unicode(file_path))
-            self.main_window.settings.setValue('output_directory', file_dir)
-
-            self.main_window.auto_change_active = True
-
-            self.ui.normalizeTable.setRowCount(len(self._data_manager.direct_beam_list))
-            for idx, _ in enumerate(self._data_manager.direct_beam_list):
-                self._data_manager.set_active_data_from_direct_beam_list(idx)
-                self.update_direct_beam_table(idx, self._data_manager.active_channel)
-            self.ui.reductionTable.setRowCount(len(self._data_manager.reduction_list))
-            for idx, _ in enumerate(self._data_manager.reduction_list):
-                self._data_manager.set_active_data_from_reduction_list(idx)
-                self.update_reduction_table(idx, self._data_manager.active_channel)
-
-            direct_beam_ids = [str(r.number) for r in self._data_manager.direct_beam_list]
-            self.ui.normalization_list_label.setText(u", ".join(direct_beam_ids))
-
-            self.file_loaded()
-
-            if self._data_manager.active_channel is not None:
-                self.populate_from_configuration(self._data_manager.active_channel.configuration)
-                self.update_file_list(self._data_manager.current_file)
-            self.main_window.auto_change_active = False
-
-            logging.info("UI updated: %s", time.time()-t_0)
+            with tracing.span('MainHandler.open_reduced_file', 'ui', file=os.path.basename(file_path)):
+                # Clear the reduction list first so that we don't create problems later
+                self.clear_direct_beams()
+                self.clear_reflectivity()
+                configuration = self.get_configuration()
+                prog = self.new_progress_reporter()
+                self._data_manager.load_data_from_reduced_file(file_path, configuration=configuration,
+                                                               progress=prog)
+
+                # Update output directory
+                file_dir, _ = os.path.split(unicode(file_path))
+                self.main_window.settings.setValue('output_directory', file_dir)
+
+                self.main_window.auto_change_active = True
+
+                self.ui.normalizeTable.setRowCount(len(self._data_manager.direct_beam_list))
+                for idx, _ in enumerate(self._data_manager.direct_beam_list):
+                    self._data_manager.set_active_data_from_direct_beam_list(idx)
+                    self.update_direct_beam_table(idx, self._data_manager.active_channel)
+                self.ui.reductionTable.setRowCount(len(self._data_manager.reduction_list))
+                for idx, _ in enumerate(self._data_manager.reduction_list):
+                    self._data_manager.set_active_data_from_reduction_list(idx)
+                    self.update_reduction_table(idx, self._data_manager.active_channel)
+
+                direct_beam_ids = [str(r.number) for r in self._data_manager.direct_beam_list]
+                self.ui.normalization_list_label.setText(u", ".join(direct_beam_ids))
+
+                self.file_loaded()
+
+                if self._data_manager.active_channel is not None:
+                    self.populate_from_configuration(self._data_manager.active_channel.configuration)
+                    self.update_file_list(self._data_manager.current_file)
+                self.main_window.auto_change_active = False
 
     # Actions defined in Qt Designer
     def file_open_dialog(self):
@@ -449,6 +485,7 @@ class MainHandler(object):
 
             Returns true if everything is ok, false otherwise.
         """
+        self.main_window.flush_pending_reduction()
         # Update the configuration according to current parameters
         # Note that when a data set is first loaded, the peaks may have a different
         # range for each cross-section. If the option to use a common set of ranges
@@ -619,6 +656,7 @@ class MainHandler(object):
         """
             Add / remove dataset to the available normalizations or clear the normalization list.
         """
+        self.main_window.flush_pending_reduction()
         # Update all cross-section parameters as needed.
         if self.ui.action_use_common_ranges.isChecked():
             config = self.get_configuration()
@@ -1025,11 +1063,13 @@ class MainHandler(object):
         """
             Stitch the reflectivity parts and normalize to 1.
         """
+        self.main_window.flush_pending_reduction()
         # Update the configuration so we can remember the cutoff value
         # later if it was changed
-        self.get_configuration()
+        configuration = self.get_configuration()
         self._data_manager.stitch_data_sets(normalize_to_unity=self.ui.normalize_to_unity_checkbox.isChecked(),
-                                            q_cutoff=self.ui.normalization_q_cutoff_spinbox.value())
+                                            q_cutoff=self.ui.normalization_q_cutoff_spinbox.value(),
+                                            global_fit=configuration.global_stitching)
 
         for i in range(len(self._data_manager.reduction_list)):
             xs = self._data_manager.active_channel.name
@@ -3,15 +3,18 @@
     computes a meaningful progress status accordingly.
 """
 from __future__ import absolute_import, division, print_function, unicode_literals
+from PyQt5 import QtWidgets
 
 class ProgressReporter(object):
     """
         Progress reporter class that allows for sub-tasks.
     """
     def __init__(self, max_value=100, call_back=None,
-                 status_bar=None, progress_bar=None):
+                 status_bar=None, progress_bar=None, cancel_button=None, parent=None):
         """
             :param str message: message to be displayed
+            :param QPushButton cancel_button: button shown while a task can be cancelled
+            :param ProgressReporter parent: reporter of the task this is a sub-task of
         """
         self.max_value = max_value
         self.message = ''
@@ -20,6 +23,8 @@ class ProgressReporter(object):
         self.sub_tasks = []
         self.status_bar = status_bar
         self.progress_bar = progress_bar
+        self.cancel_button = cancel_button
+        self.parent = parent
 
     def __call__(self, value, message='', out_of=None):
         """
@@ -60,6 +65,21 @@ class ProgressReporter(object):
         if message and self.status_bar:
             self.status_bar.setText(message)
 
+        # Process the user input so that the task can be cancelled
+        if self.cancel_button is not None and self.cancel_button.isVisible():
+            QtWidgets.QApplication.instance().processEvents()
+
+    def set_cancellable(self, cancellable):
+        """
+            Show or hide the cancel button while a task that can be cancelled is running.
+            :param bool cancellable: if True, the cancel button is shown
+        """
+        if self.parent is not None:
+            self.parent.set_cancellable(cancellable)
+        elif self.cancel_button is not None:
+            self.cancel_button.setVisible(cancellable)
+            QtWidgets.QApplication.instance().processEvents()
+
     def create_sub_task(self, max_value):
         """
             Create a sub-task, with max_value being its portion
@@ -68,6 +88,6 @@ class ProgressReporter(object):
 
             :param int max_value: portion of the task
         """
-        sub_task_progress = ProgressReporter(max_value, self.update)
+        sub_task_progress = ProgressReporter(max_value, self.update, parent=self)
         self.sub_tasks.append(sub_task_progress)
         return sub_task_progress
@@ -84,6 +84,9 @@ class Ui_Dialog(object):
         self.matlab = QtWidgets.QCheckBox(self.groupBox_3)
         self.matlab.setObjectName("matlab")
         self.gridLayout.addWidget(self.matlab, 2, 1, 1, 1)
+        self.hdf5 = QtWidgets.QCheckBox(self.groupBox_3)
+        self.hdf5.setObjectName("hdf5")
+        self.gridLayout.addWidget(self.hdf5, 3, 0, 1, 1)
         self.verticalLayout_2.addWidget(self.groupBox_3)
         self.horizontalLayout_2 = QtWidgets.QHBoxLayout()
         self.horizontalLayout_2.setObjectName("horizontalLayout_2")
@@ -206,6 +209,8 @@ class Ui_Dialog(object):
         self.numpy.setText(_translate("Dialog", "Numpy .npz"))
         self.mantid_script_checkbox.setText(_translate("Dialog", "Mantid script"))
         self.matlab.setText(_translate("Dialog", "Matlab"))
+        self.hdf5.setToolTip(_translate("Dialog", "Write each cross-section as compressed datasets in an HDF5 file"))
+        self.hdf5.setText(_translate("Dialog", "HDF5"))
         self.label.setText(_translate("Dialog", "Directory"))
         self.toolButton.setText(_translate("Dialog", "..."))
         self.label_2.setText(_translate("Dialog", "File Naming"))
@@ -12,12 +12,17 @@ import reflectivity_ui
 import reflectivity_ui.interfaces.generated.ui_main_window
 from reflectivity_ui.interfaces.event_handlers.plot_handler import PlotHandler
 from reflectivity_ui.interfaces.event_handlers.main_handler import MainHandler
+from .configuration import Configuration
 from .data_manager import DataManager
+from .data_handling import worker_pool, tracing, cube_cache, ApplicationConfiguration
 from .plotting import PlotManager
 from .reduction_dialog import ReductionDialog
 from .event_handlers.progress_reporter import ProgressReporter
 from .smooth_dialog import SmoothDialog
 
+# Time to wait after the last change of reduction parameters before running the reduction [ms]
+REDUCTION_DELAY = 500
+
 
 class MainWindow(QtWidgets.QMainWindow,
                  reflectivity_ui.interfaces.generated.ui_main_window.Ui_MainWindow):
@@ -46,6 +51,8 @@ class MainWindow(QtWidgets.QMainWindow,
 
         # Application settings
         self.settings = QtCore.QSettings('.refredm')
+        self.application_conf = ApplicationConfiguration(self.settings)
+        cube_cache.configure(self.application_conf)
 
         # Object managers
         self.data_manager = DataManager(self.settings.value('current_directory', os.path.expanduser('~')))
@@ -53,6 +60,14 @@ class MainWindow(QtWidgets.QMainWindow,
 
         self.auto_change_active=False
 
+        # The reduction is run once the user stops changing the extraction region.
+        # A fast estimate of the reflectivity is shown in the meantime.
+        self._pending_reduction = None
+        self._reduction_timer = QtCore.QTimer(self)
+        self._reduction_timer.setSingleShot(True)
+        self._reduction_timer.setInterval(REDUCTION_DELAY)
+        self._reduction_timer.timeout.connect(self.run_pending_reduction)
+
         # Event handlers
         self.plot_handler = PlotHandler(self)
         self.file_handler = MainHandler(self)
@@ -75,8 +90,28 @@ class MainWindow(QtWidgets.QMainWindow,
     def closeEvent(self, event):
         """ Close UI event """
         self.file_handler.get_configuration()
+        self.application_conf.to_q_settings(self.settings)
+        worker_pool.shutdown()
+        self.write_timing()
         event.accept()
 
+    def write_timing(self):
+        """
+            Log the time spent in each processing stage during the session,
+            and write the stage timing as a Chrome trace file if one was requested,
+            see ApplicationConfiguration.trace_file.
+        """
+        tracer = tracing.get_tracer()
+        if not tracer.spans:
+            return
+        logging.info("Processing time:\n%s", tracer.get_summary_table())
+        trace_file = ApplicationConfiguration().trace_file
+        if trace_file:
+            try:
+                tracer.write_chrome_trace(trace_file)
+            except:
+                logging.error("Could not write %s: %s", trace_file, sys.exc_info()[1])
+
     def keyPressEvent(self, event):
         """ UI event """
         if event.modifiers()==QtCore.Qt.ControlModifier:
@@ -219,7 +254,7 @@ class MainWindow(QtWidgets.QMainWindow,
 
             if self.data_manager.active_channel is not None:
                 active_only = not self.ui.action_use_common_ranges.isChecked()
-                self.data_manager.update_configuration(configuration=configuration, active_only=active_only)
+                stages = self.data_manager.update_configuration(configuration=configuration, active_only=active_only)
                 self.plot_handler.change_region_values()
                 self.file_handler.update_calculated_data()
 
@@ -227,16 +262,50 @@ class MainWindow(QtWidgets.QMainWindow,
                 self.file_handler.update_tables()
 
                 QtWidgets.QApplication.instance().processEvents()
-                if change_type > 0:
+                # Scaling, trimming and the output options are applied on the fly,
+                # no need to run the reduction again
+                if change_type > 0 and stages & set(Configuration.STAGES) - set([Configuration.STAGE_SCALING]):
                     try:
-                        self.data_manager.calculate_reflectivity(configuration=configuration, active_only=active_only)
+                        self.data_manager.calculate_preview(active_only=active_only)
                     except:
-                        self.file_handler.report_message("There was a problem updating the reflectivity",
-                                                         pop_up=False)
-                        logging.error("There was a problem updating the reflectivity\n%s", sys.exc_value)
+                        logging.error("Could not compute the reflectivity preview\n%s", sys.exc_value)
+                    self._pending_reduction = (configuration, active_only,
+                                               self.data_manager._nexus_data, self.data_manager.active_channel)
+                    self._reduction_timer.start()
                 self.plot_manager.plot_refl()
                 self.update_specular_viewer.emit()
 
+    def run_pending_reduction(self):
+        """
+            Run the reduction for the last change of the extraction region,
+            once the user has stopped changing it.
+        """
+        if self._pending_reduction is None:
+            return
+        configuration, active_only, nexus_data, active_channel = self._pending_reduction
+        self._pending_reduction = None
+        try:
+            if active_channel is self.data_manager.active_channel:
+                self.data_manager.calculate_reflectivity(configuration=configuration, active_only=active_only)
+            else:
+                # The active data changed in the meantime
+                self.data_manager.calculate_reflectivity(configuration=configuration, active_only=active_only,
+                                                         nexus_data=nexus_data, cross_section=active_channel)
+        except:
+            self.file_handler.report_message("There was a problem updating the reflectivity",
+                                             pop_up=False)
+            logging.error("There was a problem updating the reflectivity\n%s", sys.exc_value)
+        self.plot_manager.plot_refl()
+        self.update_specular_viewer.emit()
+
+    def flush_pending_reduction(self):
+        """
+            Run the pending reduction right away, if there is one, so that
+            the reduced data is up to date before it is used.
+        """
+        self._reduction_timer.stop()
+        self.run_pending_reduction()
+
     def reductionTableChanged(self, item):
         '''
         Perform action upon change in data reduction list.
@@ -361,6 +430,7 @@ class MainWindow(QtWidgets.QMainWindow,
         Open a dialog to select reduction options for the current list of
         reduction items.
         '''
+        self.flush_pending_reduction()
         if len(self.data_manager.reduction_list)==0:
             self.file_handler.report_message("The data to be reduced must be added to the reduction table",
                                              pop_up=True)
@@ -390,7 +460,11 @@ class MainWindow(QtWidgets.QMainWindow,
             # and call: self.canvas.print_figure(unicode(fname[0]))
             from .data_handling.processing_workflow import ProcessingWorkflow
             wrk = ProcessingWorkflow(self.data_manager, output_options)
-            wrk.execute(self.file_handler.new_progress_reporter())
+            try:
+                wrk.execute(self.file_handler.new_progress_reporter())
+            except worker_pool.Cancelled:
+                self.file_handler.report_message("Export cancelled: %s" % sys.exc_info()[1], pop_up=False)
+                return
 
             # Show final results
             if output_options['export_offspec']:
@@ -3,6 +3,18 @@
 import sys
 import logging
 import numpy as np
+from .data_handling import tracing
+
+
+def _get_trace_context(plot_manager):
+    """
+        Return the run and cross-section being plotted
+    """
+    data = plot_manager.main_window.data_manager.active_channel
+    if data is None:
+        return {}
+    return dict(run=data.number, cross_section=data.name)
+
 
 class PlotManager(object):
     _refl_color_list=['blue', 'red', 'green', 'purple', '#aaaa00', 'cyan']
@@ -27,6 +39,7 @@ class PlotManager(object):
         self.xtof_bck1 = None
         self.xtof_bck2 = None
 
+    @tracing.traced('PlotManager.plot_overview', 'plot', context=_get_trace_context)
     def plot_overview(self):
         '''
         X vs. Y and X vs. Tof for main channel.
@@ -141,6 +154,7 @@ class PlotManager(object):
         main_window.ui.xy_overview.draw()
         main_window.ui.xtof_overview.draw()
 
+    @tracing.traced('PlotManager.plot_xy', 'plot', context=_get_trace_context)
     def plot_xy(self):
         """
             X vs. Y plots for all channels.
@@ -209,6 +223,7 @@ class PlotManager(object):
             plots[i].draw()
         progress(100, message="Ready", out_of=100)
 
+    @tracing.traced('PlotManager.plot_xtof', 'plot', context=_get_trace_context)
     def plot_xtof(self):
         """
             X vs. ToF plots for all channels.
@@ -280,6 +295,7 @@ class PlotManager(object):
             plots[i].draw()
         progress(100, message="Ready", out_of=100)
 
+    @tracing.traced('PlotManager.plot_projections', 'plot', context=_get_trace_context)
     def plot_projections(self, preserve_lim=False):
         """
             Create projections of the data on the x and y axes.
@@ -369,6 +385,7 @@ class PlotManager(object):
         main_window.ui.x_project.draw()
         main_window.ui.y_project.draw()
 
+    @tracing.traced('PlotManager.plot_offspec', 'plot', context=_get_trace_context)
     def plot_offspec(self, recalc=True, crop=False):
         """
             Create an offspecular plot for all channels of the datasets in the
@@ -482,6 +499,7 @@ class PlotManager(object):
             plot.draw()
         progress(100, message=final_msg, out_of=100)
 
+    @tracing.traced('PlotManager.plot_refl', 'plot', context=_get_trace_context)
     def plot_refl(self, preserve_lim=False):
         '''
         Calculate and display the reflectivity from the current dataset
@@ -489,9 +507,10 @@ class PlotManager(object):
         measurements can be used for normalization.
         '''
         if self.main_window.data_manager.active_channel is None \
-            or self.main_window.data_manager.active_channel.r is None \
-            or self.main_window.data_manager.active_channel.q is None \
-            or self.main_window.data_manager.active_channel.dr is None:
+            or (self.main_window.data_manager.active_channel.preview is None and \
+                (self.main_window.data_manager.active_channel.r is None \
+                 or self.main_window.data_manager.active_channel.q is None \
+                 or self.main_window.data_manager.active_channel.dr is None)):
             self.main_window.ui.refl.clear()
             self.main_window.ui.refl.canvas.ax.text(0.5, 0.5,
                                         u'No data',
@@ -502,8 +521,19 @@ class PlotManager(object):
             self.main_window.ui.refl.draw()
             return False
 
+        # Show the fast estimate of the reflectivity while the reduction is pending
+        data = self.main_window.data_manager.active_channel
+        if data.preview is not None:
+            q, r, dr = data.preview
+            active_label = 'Preview'
+        else:
+            q, r, dr = data.q, data._r, data._dr
+            active_label = 'Active'
+        r = r * data.configuration.scaling_factor
+        dr = dr * data.configuration.scaling_factor
+
         P0=self.main_window.ui.rangeStart.value()
-        PN=len(self.main_window.data_manager.active_channel.q)-self.main_window.ui.rangeEnd.value()
+        PN=len(q)-self.main_window.ui.rangeEnd.value()
 
         if len(self.main_window.ui.refl.toolbar._views)>0:
             spos=self.main_window.ui.refl.toolbar._views._pos
@@ -513,7 +543,6 @@ class PlotManager(object):
             view=None
 
         self.main_window.ui.refl.clear()
-        data = self.main_window.data_manager.active_channel
         if data.total_counts == 0:
             self.main_window.ui.refl.canvas.ax.text(0.5, 0.5,
                                         u'No points to show\nin active dataset!',
@@ -524,13 +553,12 @@ class PlotManager(object):
         else:
             ymin =1.5
             ymax = 1e-7
-            ynormed = self.main_window.data_manager.active_channel.r[P0:PN]
+            ynormed = r[P0:PN]
             if len(ynormed[ynormed>0])>=2:
                 ymin=min(ymin, ynormed[ynormed>0].min())
                 ymax=max(ymax, ynormed.max())
-                self.main_window.ui.refl.errorbar(self.main_window.data_manager.active_channel.q[P0:PN], ynormed,
-                                      yerr=self.main_window.data_manager.active_channel.dr[P0:PN],
-                                      label='Active', lw=2, color='black')
+                self.main_window.ui.refl.errorbar(q[P0:PN], ynormed, yerr=dr[P0:PN],
+                                      label=active_label, lw=2, color='black')
             else:
                 self.main_window.ui.refl.canvas.ax.text(0.5, 0.5,
                                             u'No points to show\nin active dataset!',
@@ -583,6 +611,7 @@ class PlotManager(object):
 
         self.main_window.ui.compare_widget.update_preview()
 
+    @tracing.traced('PlotManager.plot_gisans', 'plot', context=_get_trace_context)
     def plot_gisans(self):
         """
             Create GISANS plots of the current dataset with Qy-Qz maps.
@@ -36,6 +36,7 @@ class ReductionDialog(QtWidgets.QDialog, reflectivity_ui.interfaces.generated.ui
         # Formats
         self.genx.setChecked(self._verify_true('format_genx', False))
         self.matlab.setChecked(self._verify_true('format_matlab', False))
+        self.hdf5.setChecked(self._verify_true('format_hdf5', False))
         self.multiAscii.setChecked(self._verify_true('format_multi', False))
         self.numpy.setChecked(self._verify_true('format_numpy', False))
         self.mantid_script_checkbox.setChecked(self._verify_true('format_mantid', False))
@@ -76,6 +77,7 @@ class ReductionDialog(QtWidgets.QDialog, reflectivity_ui.interfaces.generated.ui
                     export_offspec_smooth=self.exportOffSpecularSmoothed.isChecked(),
                     format_genx=self.genx.isChecked(),
                     format_matlab=self.matlab.isChecked(),
+                    format_hdf5=self.hdf5.isChecked(),
                     format_mantid=self.mantid_script_checkbox.isChecked(),
                     format_multi=self.multiAscii.isChecked(),
                     format_numpy=self.numpy.isChecked(),
@@ -118,6 +120,7 @@ class ReductionDialog(QtWidgets.QDialog, reflectivity_ui.interfaces.generated.ui
 
         self.settings.setValue('format_genx', self.genx.isChecked())
         self.settings.setValue('format_matlab', self.matlab.isChecked())
+        self.settings.setValue('format_hdf5', self.hdf5.isChecked())
         self.settings.setValue('format_multi', self.multiAscii.isChecked())
         self.settings.setValue('format_numpy', self.numpy.isChecked())
         self.settings.setValue('format_mantid', self.mantid_script_checkbox.isChecked())
@@ -45,11 +45,11 @@ setup(name="reflectivity_ui",
       url = "https://github.com/mdoucet/reflectivity_ui",
       long_description = """Desktop application for magnetic reflectivity reduction""",
       license = "Apache License 2.0",
-      scripts=["bin/RefRedM", "bin/quicknxs2"],
+      scripts=["bin/RefRedM", "bin/quicknxs2", "bin/RefRedM-batch"],
       zip_safe=False,
       packages=find_packages(),
       package_dir={},
       package_data=package_data,
-      install_requires=['numpy','matplotlib'],
+      install_requires=['numpy','matplotlib','h5py'],
       setup_requires=[],
 )
@@ -0,0 +1,43 @@
+import unittest
+import sys
+sys.path.append('..')
+import math
+import numpy as np
+
+from reflectivity_ui.interfaces.data_handling import asymmetry
+
+
+class AsymmetryTest(unittest.TestCase):
+
+    def test_matching(self):
+        """
+            Compare to a point-by-point calculation, with a minus state
+            that has fewer points and some zeros.
+        """
+        np.random.seed(42)
+        q_p = np.sort(np.random.uniform(0.01, 0.1, 50))
+        q_m = np.sort(np.random.uniform(0.01, 0.09, 40))
+        p_data = np.vstack([q_p, np.random.uniform(0, 1, 50), np.random.uniform(0, 0.1, 50),
+                            0.01 * q_p, np.ones(50)]).T
+        m_data = np.vstack([q_m, np.random.uniform(0, 1, 40), np.random.uniform(0, 0.1, 40),
+                            0.01 * q_m, np.ones(40)]).T
+        p_data[3, 1] = 0
+        m_data[5, 1] = 0
+
+        expected = []
+        for p_point in p_data:
+            i_m = len(m_data[m_data.T[0] < p_point[0]])
+            if i_m < len(m_data):
+                m_point = m_data[i_m]
+                if p_point[1] > 0 and m_point[1] > 0:
+                    ratio = (p_point[1] - m_point[1]) / (p_point[1] + m_point[1])
+                    d_ratio = 2.0 / (p_point[1] + m_point[1])**2
+                    d_ratio *= math.sqrt(m_point[1]**2 * p_point[2]**2 + p_point[1]**2 * m_point[2]**2)
+                    expected.append([p_point[0], ratio, d_ratio, p_point[3], p_point[4]])
+
+        result = asymmetry.spin_asymmetry(p_data, m_data)
+        self.assertEqual(result.shape, (len(expected), 5))
+        self.assertTrue(np.allclose(result, np.asarray(expected)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import unittest
+import sys
+sys.path.append('..')
+import os
+import shutil
+import tempfile
+
+from reflectivity_ui.interfaces.auto_reduction import AutoReduction, DirectoryWatcher, RunInfo
+
+
+def write_file(file_path, content='data'):
+    with open(file_path, 'a') as fd:
+        fd.write(content)
+
+
+class DirectoryWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.existing = os.path.join(self.data_dir, 'REF_M_1.nxs.h5')
+        write_file(self.existing)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_poll(self):
+        """
+            A new file is reported once it has not changed for the settle time
+        """
+        watcher = DirectoryWatcher(self.data_dir, settle_time=10.0)
+        self.assertEqual(watcher.reported, set([self.existing]))
+        self.assertEqual(watcher.poll(now=0.0), [])
+
+        file_path = os.path.join(self.data_dir, 'REF_M_2.nxs.h5')
+        write_file(file_path)
+        # Files not matching the pattern are ignored
+        write_file(os.path.join(self.data_dir, 'REF_M_2.log'))
+        self.assertEqual(watcher.poll(now=100.0), [])
+        self.assertEqual(watcher.poll(now=109.0), [])
+
+        # The file is still being written
+        write_file(file_path, 'more data')
+        self.assertEqual(watcher.poll(now=109.5), [])
+        self.assertEqual(watcher.poll(now=119.0), [])
+        self.assertEqual(watcher.poll(now=119.5), [file_path])
+        # It is reported until it is marked as done
+        self.assertEqual(watcher.poll(now=120.0), [file_path])
+        watcher.done(file_path)
+        self.assertEqual(watcher.poll(now=200.0), [])
+
+    def test_include_existing(self):
+        watcher = DirectoryWatcher(self.data_dir, settle_time=10.0, include_existing=True)
+        self.assertEqual(watcher.poll(now=0.0), [])
+        self.assertEqual(watcher.poll(now=10.0), [self.existing])
+
+    def test_retry(self):
+        """
+            A file that can't be read yet is reported again after another settle time
+        """
+        watcher = DirectoryWatcher(self.data_dir, settle_time=10.0, include_existing=True)
+        watcher.poll(now=0.0)
+        self.assertEqual(watcher.poll(now=10.0), [self.existing])
+        watcher.retry(self.existing, now=10.0)
+        self.assertEqual(watcher.poll(now=19.0), [])
+        self.assertEqual(watcher.poll(now=20.0), [self.existing])
+
+        # Retrying a file that is not pending does nothing
+        watcher.retry('REF_M_3.nxs.h5', now=20.0)
+        self.assertNotIn('REF_M_3.nxs.h5', watcher._pending)
+
+
+class DirectBeamTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+        from event_data_generator import RunParameters, write_event_file
+        cls.data_dir = tempfile.mkdtemp()
+        cls.runs = [RunParameters(30000, direct_beam=True, lambda_request=5.0, slit_widths=(0.4, 0.5, 0.6)),
+                    RunParameters(30001, direct_beam=True, lambda_request=5.0, slit_widths=(0.8, 1.0, 1.2)),
+                    RunParameters(30005, direct_beam=True, lambda_request=5.0, slit_widths=(0.8, 1.0, 1.2)),
+                    RunParameters(30002, direct_beam=True, lambda_request=7.0, slit_widths=(0.4, 0.5, 0.6))]
+        for parameters in cls.runs:
+            write_event_file(os.path.join(cls.data_dir, parameters.file_name), parameters,
+                             n_events=10000, seed=parameters.run_number)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.data_dir)
+
+    def get_run(self, run_number, lambda_request=5.0, slit_widths=(0.4, 0.5, 0.6)):
+        from event_data_generator import RunParameters, write_event_file
+        parameters = RunParameters(run_number, lambda_request=lambda_request, slit_widths=slit_widths)
+        file_path = os.path.join(self.output_dir, parameters.file_name)
+        write_event_file(file_path, parameters, n_events=10000, seed=run_number)
+        return RunInfo(file_path)
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_run_info(self):
+        run_info = self.get_run(30010, lambda_request=6.0, slit_widths=(0.2, 0.3, 0.4))
+        self.assertEqual(run_info.number, 30010)
+        self.assertFalse(run_info.is_direct_beam)
+        self.assertAlmostEqual(run_info.lambda_center, 6.0)
+        self.assertAlmostEqual(run_info.slit1_width, 0.2)
+        self.assertAlmostEqual(run_info.slit3_width, 0.4)
+
+    def test_find_direct_beam(self):
+        """
+            The direct beams already in the directory are remembered, and the closest
+            matching one is used, ignoring the slits if none matches them
+        """
+        service = AutoReduction(self.data_dir, None, {}, self.output_dir)
+        self.assertEqual(sorted([item.number for item in service.direct_beams]), [30000, 30001, 30002, 30005])
+        self.assertEqual(len(service.queue), 0)
+
+        self.assertEqual(service.find_direct_beam(self.get_run(30010)).number, 30000)
+        self.assertEqual(service.find_direct_beam(self.get_run(30010, slit_widths=(0.8, 1.0, 1.2))).number, 30005)
+        self.assertEqual(service.find_direct_beam(self.get_run(30003, slit_widths=(0.8, 1.0, 1.2))).number, 30001)
+        self.assertEqual(service.find_direct_beam(self.get_run(30010, lambda_request=7.0,
+                                                               slit_widths=(2.0, 2.0, 2.0))).number, 30002)
+        self.assertIsNone(service.find_direct_beam(self.get_run(30010, lambda_request=3.0)))
+
+    def test_scan(self):
+        """
+            New runs are queued, and new direct beams are remembered
+        """
+        service = AutoReduction(self.data_dir, None, {}, self.output_dir, settle_time=10.0)
+        run_info = self.get_run(30020)
+        shutil.copy(run_info.file_path, self.data_dir)
+        try:
+            service.scan(now=0.0)
+            self.assertEqual(len(service.queue), 0)
+            service.scan(now=10.0)
+            self.assertEqual([item.number for item in service.queue], [30020])
+            service.scan(now=20.0)
+            self.assertEqual(len(service.queue), 1)
+        finally:
+            os.remove(os.path.join(self.data_dir, os.path.basename(run_info.file_path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
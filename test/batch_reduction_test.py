@@ -0,0 +1,80 @@
+import unittest
+import sys
+sys.path.append('..')
+import os
+import shutil
+import tempfile
+
+from reflectivity_ui.interfaces import batch_reduction
+from reflectivity_ui.interfaces.data_handling.processing_workflow import DEFAULT_OPTIONS
+
+
+class BatchReductionTest(unittest.TestCase):
+
+    def test_parse_run_list(self):
+        self.assertEqual(batch_reduction.parse_run_list('25001'), [25001])
+        self.assertEqual(batch_reduction.parse_run_list('25001-25003,25010'), [25001, 25002, 25003, 25010])
+        self.assertEqual(batch_reduction.parse_run_list(' 25001 , ,25002-25002,'), [25001, 25002])
+        self.assertEqual(batch_reduction.parse_run_list(''), [])
+        self.assertRaises(ValueError, batch_reduction.parse_run_list, '25001-abc')
+
+    def test_get_output_options(self):
+        options = batch_reduction.get_output_options('/tmp/out', ['hdf5', 'ascii'], ['specular', 'asym'])
+        self.assertEqual(options['output_directory'], '/tmp/out')
+        self.assertEqual(options['output_file_template'], DEFAULT_OPTIONS['output_file_template'])
+        for key, option in batch_reduction.OUTPUT_FORMATS.items():
+            self.assertEqual(options[option], key in ['hdf5', 'ascii'], key)
+        for key, option in batch_reduction.OUTPUT_ITEMS.items():
+            self.assertEqual(options[option], key in ['specular', 'asym'], key)
+
+        options = batch_reduction.get_output_options('/tmp/out', [], [], template='{numbers}.{type}')
+        self.assertEqual(options['output_file_template'], '{numbers}.{type}')
+        # The defaults are not modified
+        self.assertEqual(DEFAULT_OPTIONS['output_directory'], '')
+
+    def test_get_summary(self):
+        results = [dict(name='25001+25002', status='OK', error='', n_runs=2, files=['a', 'b'], time=1.5),
+                   dict(name='REF_M_25003', status='FAILED', error='No data could be loaded',
+                        n_runs=0, files=[], time=0.5)]
+        lines = batch_reduction.get_summary(results, 2.0).split('\n')
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('Set '))
+        self.assertEqual(lines[1].split(), ['25001+25002', 'OK', '2', '1.5', '2'])
+        self.assertTrue(lines[2].endswith('No data could be loaded'))
+        self.assertEqual(lines[3], '1 sets reduced, 1 failed, in 2.0 sec')
+
+    def test_unique_names(self):
+        """
+            Sets with the same name get a suffix, used for their log and output files
+        """
+        data_dir = tempfile.mkdtemp()
+        try:
+            for run in [25001, 25002, 25003]:
+                open(os.path.join(data_dir, 'REF_M_%s.nxs.h5' % run), 'w').close()
+            inputs = ['25001-25002', '/data/a/REF_M_25003.dat', '25003',
+                      '25001,25002', '/data/b/REF_M_25003.dat']
+            reduction_sets = batch_reduction.get_reduction_sets(inputs, data_dir, direct_beams=[25003])
+        finally:
+            shutil.rmtree(data_dir)
+
+        names = [item['name'] for item in reduction_sets]
+        self.assertEqual(names, ['25001+25002_1', 'REF_M_25003_2', '25003', '25001+25002_4', 'REF_M_25003_5'])
+        self.assertEqual(reduction_sets[0]['runs'], [25001, 25002])
+        self.assertEqual(reduction_sets[0]['data_files'][1], os.path.join(data_dir, 'REF_M_25002.nxs.h5'))
+        self.assertEqual(reduction_sets[0]['direct_beam_files'], [os.path.join(data_dir, 'REF_M_25003.nxs.h5')])
+
+        output_options = batch_reduction.get_output_options('/tmp/out', ['ascii'], ['specular'])
+        options = [batch_reduction.get_set_output_options(output_options, item) for item in reduction_sets]
+        self.assertEqual(options[0]['output_file_template'], '(instrument)_{numbers}_1_{item}_{state}.{type}')
+        self.assertEqual(options[3]['output_file_template'], '(instrument)_{numbers}_4_{item}_{state}.{type}')
+        self.assertIs(options[2], output_options)
+
+        # Without run numbers in the file names, the outputs go in a directory for each set
+        output_options['output_file_template'] = 'reflectivity.{type}'
+        options = batch_reduction.get_set_output_options(output_options, reduction_sets[1])
+        self.assertEqual(options['output_directory'], os.path.join('/tmp/out', 'REF_M_25003_2'))
+        self.assertEqual(output_options['output_directory'], '/tmp/out')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,362 @@
+"""
+    Generate synthetic REF_M event nexus files, to test and benchmark
+    the loading, reduction and export of data without beamline data.
+
+    The files follow the layout of the .nxs.h5 files written at the
+    beamline, as read by LoadEventNexus and event_reader:
+        /entry                          run information
+        /entry/bank1_events             events, with one entry per pulse in event_index
+        /entry/DASlogs/<name>           time series for each log
+        /entry/instrument/name          REF_M
+
+    The events come from a specular peak, with some diffuse scattering and
+    a flat background. The cross-section changes over time, as given by the
+    BL4A:SF:ICP:getDI log, and each cross-section has its own reflectivity.
+    Direct beam files have the peak at the direct pixel and no reflectivity.
+
+    Events are generated and written a block of pulses at a time, so that
+    files with up to 1e9 events can be produced with a limited amount of memory.
+
+    Usage:
+        python event_data_generator.py <output file> [number of events] [--direct-beam]
+        python event_data_generator.py --corpus <output directory> [number of events per run]
+"""
+#pylint: disable=invalid-name, too-many-arguments, too-many-locals
+from __future__ import absolute_import, division, print_function
+import os
+import sys
+import argparse
+import datetime
+from collections import OrderedDict
+import numpy as np
+import h5py
+
+# Value of the BL4A:SF:ICP:getDI log for each cross-section, see Instrument.dummy_filter_cross_sections
+STATE_LOG = "BL4A:SF:ICP:getDI"
+STATES = OrderedDict([('Off_Off', 15),
+                      ('On_Off', 47),
+                      ('Off_On', 31),
+                      ('On_On', 63)])
+
+# Relative count rate of each cross-section
+STATE_RATES = dict(Off_Off=1.0, On_On=0.7, Off_On=0.08, On_Off=0.08)
+
+# Critical momentum transfer, in 1/A, and roughness, in A, of the reflectivity of each cross-section.
+# The magnetic scattering length density adds to the nuclear one for one spin state
+# and is subtracted for the other.
+STATE_REFLECTIVITY = dict(Off_Off=(0.0250, 5.0), On_On=(0.0180, 5.0),
+                          Off_On=(0.0217, 8.0), On_Off=(0.0217, 8.0))
+
+N_X_PIXELS = 304
+N_Y_PIXELS = 256
+PULSE_RATE = 60.0 # Hz
+H_OVER_M_NEUTRON = 3.956034e-7 # h/m_n [m^2/s]
+PROTON_CHARGE_PER_PULSE = 1.0e7 # pC
+
+# Number of events generated and written at once
+BLOCK_SIZE = 2**22
+
+
+class RunParameters(object):
+    """
+        Instrument settings of a synthetic run
+    """
+    def __init__(self, run_number=30000, direct_beam=False, lambda_request=5.0, sangle=0.6,
+                 slit_widths=(0.4, 0.5, 0.6), duration=600.0, n_states=4):
+        """
+            :param int run_number: run number
+            :param bool direct_beam: if True, a direct beam will be simulated
+            :param float lambda_request: center of the wavelength band, in Angstrom
+            :param float sangle: sample angle, in degrees
+            :param tuple slit_widths: opening of the three slits, in mm
+            :param float duration: duration of the run, in seconds
+            :param int n_states: number of cross-sections (1, 2 or 4)
+        """
+        self.run_number = run_number
+        self.direct_beam = direct_beam
+        self.lambda_request = lambda_request
+        self.sangle = 0.0 if direct_beam else sangle
+        self.slit_widths = slit_widths
+        self.duration = duration
+        self.states = list(STATES.keys())[:n_states]
+        self.start_time = datetime.datetime(2020, 1, 1, 12, 0, 0) + datetime.timedelta(seconds=run_number)
+
+        self.speed_request = 60.0
+        self.wl_bandwidth = 3.2
+        self.sample_det_distance = 2562.0 # mm
+        self.moderator_sample_distance = 13630.0 # mm
+        self.pixel_width = 0.7 # mm
+        self.direct_pixel = 230.0
+        self.dangle0 = 4.0
+        # The reflected beam is at twice the sample angle from the direct beam
+        two_theta_pixels = np.radians(2.0 * self.sangle) * self.sample_det_distance / self.pixel_width
+        self.peak_pixel = self.direct_pixel - two_theta_pixels
+        self.dangle = self.dangle0 + 2.0 * self.sangle
+        self.low_res_center = 130.0
+
+    @property
+    def file_name(self):
+        return 'REF_M_%s.nxs.h5' % self.run_number
+
+    def get_logs(self):
+        """
+            Return the constant logs, as {name: (value, units)}
+        """
+        peak = int(round(self.peak_pixel))
+        logs = dict(LambdaRequest=(self.lambda_request, 'Angstrom'),
+                    SpeedRequest1=(self.speed_request, 'Hz'),
+                    SampleDetDis=(self.sample_det_distance, 'mm'),
+                    ModeratorSamDis=(self.moderator_sample_distance, 'mm'),
+                    DIRPIX=(self.direct_pixel, 'pixel'),
+                    DANGLE=(self.dangle, 'degree'),
+                    DANGLE0=(self.dangle0, 'degree'),
+                    SANGLE=(self.sangle, 'degree'),
+                    HuberX=(0.0, 'mm'),
+                    data_type=(1 if self.direct_beam else 0, ''),
+                    ROI1StartX=(peak - 8, 'pixel'), ROI1SizeX=(17, 'pixel'),
+                    ROI1StartY=(self.low_res_center - 40, 'pixel'), ROI1SizeY=(80, 'pixel'),
+                    ROI2StartX=(peak - 25, 'pixel'), ROI2SizeX=(51, 'pixel'),
+                    ROI2StartY=(self.low_res_center - 40, 'pixel'), ROI2SizeY=(80, 'pixel'))
+        for i, width in enumerate(self.slit_widths):
+            logs['S%sHWidth' % (i + 1)] = (width, 'mm')
+            logs['BL4A:Mot:S%s:X:Gap' % (i + 1)] = (width, 'mm')
+        return logs
+
+    def get_state_schedule(self, period=30.0):
+        """
+            Return the times, in seconds, at which the cross-section changes,
+            and the index of the cross-section starting at each time.
+            :param float period: time spent in each cross-section
+        """
+        times = np.arange(0.0, self.duration, period)
+        return times, np.arange(len(times)) % len(self.states)
+
+
+def reflectivity(q, q_c=0.0217, roughness=5.0):
+    """
+        Fresnel reflectivity with a roughness damping
+        :param array q: momentum transfer, in 1/Angstrom
+        :param float q_c: critical momentum transfer
+        :param float roughness: roughness, in Angstrom
+    """
+    q = np.asarray(q, dtype=float)
+    k_z = np.sqrt(np.maximum(q**2 - q_c**2, 0).astype(complex))
+    r = np.abs((q - k_z) / (q + k_z))**2
+    return np.where(q < q_c, 1.0, r * np.exp(-(q * roughness)**2))
+
+
+def get_wavelength_sampler(parameters, pol_state='Off_Off', n_grid=1000):
+    """
+        Return the wavelength grid and cumulative distribution of the detected neutrons
+        :param RunParameters parameters: run settings
+        :param str pol_state: cross-section, which determines the reflectivity
+        :param int n_grid: number of points of the wavelength grid
+    """
+    half_width = parameters.wl_bandwidth / 2.0 * 60.0 / parameters.speed_request
+    wl = np.linspace(parameters.lambda_request - half_width, parameters.lambda_request + half_width, n_grid)
+    # Incident spectrum, peaked at short wavelengths
+    weights = np.exp(-(wl - 2.5)**2 / 8.0)
+    if not parameters.direct_beam:
+        q_c, roughness = STATE_REFLECTIVITY[pol_state]
+        weights *= reflectivity(4.0 * np.pi * np.sin(np.radians(parameters.sangle)) / wl,
+                                q_c=q_c, roughness=roughness)
+    cdf = np.cumsum(weights)
+    return wl, cdf / cdf[-1]
+
+
+def generate_events(parameters, n_events, wl_sampler, rng, diffuse_fraction=0.1, background_fraction=0.05):
+    """
+        Generate pixel IDs and time-of-flight, in microseconds, for a number of events
+        :param RunParameters parameters: run settings
+        :param int n_events: number of events
+        :param tuple wl_sampler: wavelength grid and cumulative distribution
+        :param numpy.random.RandomState rng: random number generator
+        :param float diffuse_fraction: fraction of events spread around the specular peak
+        :param float background_fraction: fraction of events uniformly distributed
+    """
+    wl_grid, cdf = wl_sampler
+    wl = np.interp(rng.uniform(size=n_events), cdf, wl_grid)
+    x = rng.normal(parameters.peak_pixel, 2.0, size=n_events)
+    y = rng.normal(parameters.low_res_center, 15.0, size=n_events)
+
+    kind = rng.uniform(size=n_events)
+    diffuse = kind < diffuse_fraction
+    x[diffuse] = rng.normal(parameters.peak_pixel, 40.0, size=np.sum(diffuse))
+    background = kind > 1.0 - background_fraction
+    n_background = np.sum(background)
+    x[background] = rng.uniform(0, N_X_PIXELS, size=n_background)
+    y[background] = rng.uniform(0, N_Y_PIXELS, size=n_background)
+    wl[background] = rng.uniform(wl_grid[0], wl_grid[-1], size=n_background)
+
+    x = np.clip(np.round(x), 0, N_X_PIXELS - 1).astype(np.uint32)
+    y = np.clip(np.round(y), 0, N_Y_PIXELS - 1).astype(np.uint32)
+    distance = (parameters.moderator_sample_distance + parameters.sample_det_distance) / 1000.0
+    tof = wl * 1e-10 * distance / H_OVER_M_NEUTRON * 1e6
+    return x * N_Y_PIXELS + y, tof.astype(np.float32)
+
+
+def _create_log(logs_group, name, times, values, units, start):
+    """
+        Write a DAS log as an NXlog group
+    """
+    log = logs_group.create_group(name)
+    log.attrs['NX_class'] = b'NXlog'
+    log.create_dataset('time', data=np.asarray(times, dtype=float)).attrs['start'] = start
+    value = log.create_dataset('value', data=np.asarray(values, dtype=float))
+    value.attrs['units'] = units.encode('utf8')
+    return log
+
+
+def write_event_file(file_path, parameters, n_events=1000000, seed=None, compression=None):
+    """
+        Write a synthetic event nexus file.
+        Returns the number of events for each cross-section.
+
+        :param str file_path: output file path
+        :param RunParameters parameters: run settings
+        :param int n_events: total number of events
+        :param int seed: seed of the random number generator
+        :param str compression: compression to use for the event data (None or 'gzip')
+    """
+    rng = np.random.RandomState(seed)
+    n_pulses = max(int(parameters.duration * PULSE_RATE), 1)
+    pulse_times = np.arange(n_pulses) / PULSE_RATE
+    start = parameters.start_time.isoformat().encode('utf8')
+
+    # Cross-section of each pulse, and the number of events it holds
+    state_times, state_index = parameters.get_state_schedule()
+    pulse_states = state_index[np.searchsorted(state_times, pulse_times, side='right') - 1]
+    rates = np.asarray([STATE_RATES[parameters.states[i]] for i in pulse_states])
+    events_per_pulse = rng.multinomial(int(n_events), rates / rates.sum())
+    event_index = np.concatenate([[0], np.cumsum(events_per_pulse)[:-1]]).astype(np.uint64)
+
+    with h5py.File(file_path, 'w') as nxs:
+        entry = nxs.create_group('entry')
+        entry.attrs['NX_class'] = b'NXentry'
+        entry['run_number'] = np.array([str(parameters.run_number).encode('utf8')])
+        entry['title'] = np.array([b'Synthetic data'])
+        entry['experiment_identifier'] = np.array([b'IPTS-00000'])
+        entry['start_time'] = np.array([start])
+        end_time = parameters.start_time + datetime.timedelta(seconds=parameters.duration)
+        entry['end_time'] = np.array([end_time.isoformat().encode('utf8')])
+        entry['duration'] = np.array([parameters.duration], dtype=np.float32)
+        entry['proton_charge'] = np.array([n_pulses * PROTON_CHARGE_PER_PULSE])
+        entry['total_counts'] = np.array([n_events], dtype=np.uint64)
+        instrument = entry.create_group('instrument')
+        instrument.attrs['NX_class'] = b'NXinstrument'
+        instrument['name'] = np.array([b'REF_M'])
+
+        # Event data
+        bank = entry.create_group('bank1_events')
+        bank.attrs['NX_class'] = b'NXevent_data'
+        chunks = (max(min(int(n_events), 2**20), 1),)
+        event_id = bank.create_dataset('event_id', shape=(n_events,), dtype=np.uint32,
+                                       chunks=chunks, compression=compression)
+        event_tof = bank.create_dataset('event_time_offset', shape=(n_events,), dtype=np.float32,
+                                        chunks=chunks, compression=compression)
+        event_tof.attrs['units'] = b'microsecond'
+        pulse_time = bank.create_dataset('event_time_zero', data=pulse_times)
+        pulse_time.attrs['offset'] = start
+        pulse_time.attrs['units'] = b'second'
+        bank.create_dataset('event_index', data=event_index)
+        bank['total_counts'] = np.array([n_events], dtype=np.uint64)
+
+        wl_samplers = [get_wavelength_sampler(parameters, pol_state) for pol_state in parameters.states]
+        i_event = 0
+        while i_event < n_events:
+            n_block = int(min(BLOCK_SIZE, n_events - i_event))
+            # Cross-section of the pulse each event belongs to
+            pulses = np.searchsorted(event_index, np.arange(i_event, i_event + n_block, dtype=np.uint64),
+                                     side='right') - 1
+            event_states = pulse_states[pulses]
+            pixel_ids = np.empty(n_block, dtype=np.uint32)
+            tof = np.empty(n_block, dtype=np.float32)
+            for i, wl_sampler in enumerate(wl_samplers):
+                selected = event_states == i
+                pixel_ids[selected], tof[selected] = generate_events(parameters, int(np.sum(selected)),
+                                                                     wl_sampler, rng)
+            event_id[i_event:i_event + n_block] = pixel_ids
+            event_tof[i_event:i_event + n_block] = tof
+            i_event += n_block
+
+        # Logs
+        logs_group = entry.create_group('DASlogs')
+        logs_group.attrs['NX_class'] = b'NXcollection'
+        for name, (value, units) in parameters.get_logs().items():
+            _create_log(logs_group, name, [0.0], [value], units, start)
+        state_values = [STATES[parameters.states[i]] for i in state_index]
+        _create_log(logs_group, STATE_LOG, state_times, state_values, '', start)
+        polarizer = [1 if parameters.states[i].startswith('On') else 0 for i in state_index]
+        analyzer = [1 if parameters.states[i].endswith('On') else 0 for i in state_index]
+        _create_log(logs_group, 'PolarizerState', state_times, polarizer, '', start)
+        _create_log(logs_group, 'AnalyzerState', state_times, analyzer, '', start)
+        _create_log(logs_group, 'PolarizerVeto', [0.0], [0], '', start)
+        _create_log(logs_group, 'AnalyzerVeto', [0.0], [0], '', start)
+        _create_log(logs_group, 'proton_charge', pulse_times,
+                    np.ones(n_pulses) * PROTON_CHARGE_PER_PULSE, 'picoCoulomb', start)
+
+    counts = np.bincount(pulse_states, weights=events_per_pulse, minlength=len(parameters.states))
+    return dict((parameters.states[i], int(counts[i])) for i in range(len(parameters.states)))
+
+
+def generate_corpus(output_dir, n_events=1000000, n_runs=4, first_run=30000, n_states=4, seed=None):
+    """
+        Write a direct beam and a series of reflectivity runs at increasing angles,
+        as measured for a typical sample. Returns the list of file paths.
+
+        :param str output_dir: output directory
+        :param int n_events: number of events for each reflectivity run
+        :param int n_runs: number of reflectivity runs
+        :param int first_run: run number of the direct beam
+        :param int n_states: number of cross-sections
+        :param int seed: seed of the random number generator
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    file_list = []
+    run_list = [RunParameters(first_run, direct_beam=True, n_states=n_states)]
+    for i in range(n_runs):
+        # Open the slits with the angle to keep a constant footprint
+        scale = 2.0**i
+        run_list.append(RunParameters(first_run + i + 1, sangle=0.3 * scale, n_states=n_states,
+                                      slit_widths=(0.4 * scale, 0.5 * scale, 0.6 * scale)))
+    for i, parameters in enumerate(run_list):
+        file_path = os.path.join(output_dir, parameters.file_name)
+        _seed = None if seed is None else seed + i
+        counts = write_event_file(file_path, parameters, n_events=n_events, seed=_seed)
+        print("%s: %s" % (file_path, counts))
+        file_list.append(file_path)
+    return file_list
+
+
+def main(argv=None):
+    """
+        Command line entry point
+    """
+    parser = argparse.ArgumentParser(description="Generate synthetic REF_M event files")
+    parser.add_argument('output', help="output file, or output directory with --corpus")
+    parser.add_argument('n_events', nargs='?', type=float, default=1e6, help="number of events")
+    parser.add_argument('--corpus', action='store_true', help="write a direct beam and several reflectivity runs")
+    parser.add_argument('--runs', type=int, default=4, help="number of reflectivity runs in the corpus")
+    parser.add_argument('--direct-beam', action='store_true', help="write a direct beam")
+    parser.add_argument('--run-number', type=int, default=30000, help="run number")
+    parser.add_argument('--sangle', type=float, default=0.6, help="sample angle, in degrees")
+    parser.add_argument('--states', type=int, default=4, choices=[1, 2, 4], help="number of cross-sections")
+    parser.add_argument('--duration', type=float, default=600.0, help="duration of the run, in seconds")
+    parser.add_argument('--compress', action='store_true', help="compress the event data")
+    parser.add_argument('--seed', type=int, default=None, help="seed of the random number generator")
+    args = parser.parse_args(argv)
+
+    if args.corpus:
+        generate_corpus(args.output, n_events=int(args.n_events), n_runs=args.runs,
+                        first_run=args.run_number, n_states=args.states, seed=args.seed)
+    else:
+        parameters = RunParameters(args.run_number, direct_beam=args.direct_beam, sangle=args.sangle,
+                                   duration=args.duration, n_states=args.states)
+        counts = write_event_file(args.output, parameters, n_events=int(args.n_events),
+                                  seed=args.seed, compression='gzip' if args.compress else None)
+        print("%s: %s" % (args.output, counts))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
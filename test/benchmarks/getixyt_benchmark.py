@@ -0,0 +1,90 @@
+"""
+    Benchmark the extraction of the [x, y, TOF] detector cube from a
+    rebinned REF_M workspace, for a single cross-section.
+
+    The bulk extraction in data_set.getIxyt is compared with the
+    original per-pixel readY loop.
+
+    Usage:
+        python getixyt_benchmark.py [number of TOF bins] [number of repeats]
+"""
+#pylint: disable=invalid-name, wrong-import-position
+from __future__ import absolute_import, division, print_function
+import sys
+import time
+import numpy as np
+sys.path.append('../..')
+
+from reflectivity_ui.interfaces.data_handling.data_set import getIxyt, api
+
+
+def getIxyt_loop(nxs_data):
+    """
+        Original implementation, reading one pixel at a time.
+        @param nxs_data: Mantid workspace
+    """
+    _tof_axis = nxs_data.readX(0)[:].copy()
+    nbr_tof = len(_tof_axis)
+
+    sz_y_axis = int(nxs_data.getInstrument().getNumberParameter("number-of-y-pixels")[0])
+    sz_x_axis = int(nxs_data.getInstrument().getNumberParameter("number-of-x-pixels")[0])
+
+    _y_axis = np.zeros((sz_x_axis, sz_y_axis, nbr_tof-1))
+    for x in range(sz_x_axis):
+        for y in range(sz_y_axis):
+            _index = int(sz_y_axis*x+y)
+            _y_axis[x, y, :] = nxs_data.readY(_index)[:]
+    return _y_axis.astype(float)
+
+
+def create_workspace(n_tof):
+    """
+        Create a REF_M workspace with random counts, as we would get
+        after rebinning a cross-section.
+        :param int n_tof: number of TOF bins
+    """
+    empty_ws = api.LoadEmptyInstrument(InstrumentName='REF_M', OutputWorkspace='bench_empty')
+    n_spectra = empty_ws.getNumberHistograms()
+    tof_edges = np.linspace(10000., 50000., n_tof+1)
+    counts = np.random.poisson(2, size=n_spectra*n_tof).astype(float)
+    return api.CreateWorkspace(DataX=np.tile(tof_edges, n_spectra), DataY=counts,
+                               NSpec=n_spectra, UnitX='TOF', ParentWorkspace=empty_ws,
+                               OutputWorkspace='bench_rebinned')
+
+
+def time_call(function, workspace, n_repeat):
+    """
+        Return the best time out of n_repeat calls, and the last result
+    """
+    best = None
+    result = None
+    for _ in range(n_repeat):
+        t_0 = time.time()
+        result = function(workspace)
+        elapsed = time.time() - t_0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(n_tof=400, n_repeat=3):
+    """
+        Run the benchmark and print the time per cross-section
+    """
+    workspace = create_workspace(n_tof)
+    t_loop, loop_data = time_call(getIxyt_loop, workspace, n_repeat)
+    t_bulk, bulk_data = time_call(getIxyt, workspace, n_repeat)
+
+    if not np.array_equal(loop_data, bulk_data):
+        raise RuntimeError("Bulk extraction does not match the per-pixel loop")
+
+    print("Detector cube: %s [%.1f MB]" % (str(bulk_data.shape), bulk_data.nbytes/1024.**2))
+    print("Per-pixel loop:  %8.4f sec per cross-section" % t_loop)
+    print("Bulk extraction: %8.4f sec per cross-section" % t_bulk)
+    print("Speedup:         %8.1fx" % (t_loop / t_bulk))
+    return t_loop, t_bulk
+
+
+if __name__ == '__main__':
+    _n_tof = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    _n_repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    main(_n_tof, _n_repeat)
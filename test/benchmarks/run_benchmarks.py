@@ -0,0 +1,602 @@
+"""
+    Benchmark suite for the data-handling hot paths.
+
+    Each benchmark is run for every combination of the parameters it depends on:
+    the number of TOF bins of the [x, y, TOF] detector cube, and the number of
+    runs in the reduction list. For each case, the best time out of n calls is
+    recorded, together with the peak memory allocated by Python and NumPy
+    during one call, as seen by tracemalloc. Memory allocated by Mantid
+    itself, or by worker processes, is not included.
+    Where tracemalloc is not available, as with Python 2, each case is run
+    once more in its own process, and the increase of the maximum resident
+    set size of that process during the call is recorded instead.
+
+    Benchmarks that need loaded data use a corpus of synthetic event files,
+    written by event_data_generator, and are reported as skipped if the data
+    cannot be loaded, for instance when Mantid is not available.
+    The others use arrays shaped like the output of the reduction.
+
+    Results are stored in results/<commit>.json, so that the timings of two
+    commits can be compared. To benchmark another commit, check it out
+    in a separate work tree and point --source to it:
+        git worktree add /tmp/reflectivity_ui_old <commit>
+        python run_benchmarks.py --source /tmp/reflectivity_ui_old
+
+    Usage:
+        python run_benchmarks.py [-b benchmark] [--tof-bins 100,400] [--runs 1,4] [-n repeats]
+        python run_benchmarks.py --list
+        python run_benchmarks.py --compare <reference commit> [<commit>]
+"""
+#pylint: disable=invalid-name, bare-except, import-outside-toplevel, too-many-locals
+from __future__ import absolute_import, division, print_function
+import os
+import sys
+import copy
+import glob
+import json
+import time
+import platform
+import tempfile
+import argparse
+import itertools
+import subprocess
+from collections import OrderedDict
+import numpy as np
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULT_DIR = os.path.join(BENCHMARK_DIR, 'results')
+
+# Default parameter values
+TOF_BINS = [100, 400]
+RUNS = [1, 4]
+
+# Ratio of times above which a benchmark is reported as a regression
+REGRESSION_THRESHOLD = 1.2
+
+# Registered benchmarks: name -> (setup function, list of parameters it depends on)
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(*params):
+    """
+        Register a benchmark. The decorated function takes the corpus and
+        the values of the parameters, and returns the function to time.
+        :param str params: names of the parameters the benchmark depends on
+    """
+    def decorator(function):
+        BENCHMARKS[function.__name__.replace('bench_', '', 1)] = (function, params)
+        return function
+    return decorator
+
+
+class Corpus(object):
+    """
+        Synthetic data loaded in a DataManager, for each number of TOF bins
+        and number of runs. The event files are only written once.
+    """
+    def __init__(self, data_dir, n_events=1000000):
+        """
+            :param str data_dir: directory for the event files
+            :param int n_events: number of events per run
+        """
+        self.root_dir = data_dir
+        self.data_dir = os.path.join(data_dir, 'corpus_%d' % n_events)
+        self.n_events = n_events
+        self._data_managers = {}
+        self._file_list = []
+
+    def get_files(self, n_runs):
+        """
+            Return the direct beam file and the list of data files
+            :param int n_runs: number of runs
+        """
+        if len(self._file_list) < n_runs + 1:
+            self._file_list = sorted(glob.glob(os.path.join(self.data_dir, 'REF_M_*.nxs.h5')))
+        if len(self._file_list) < n_runs + 1:
+            from event_data_generator import generate_corpus
+            self._file_list = generate_corpus(self.data_dir, n_events=self.n_events, n_runs=n_runs, seed=42)
+        return self._file_list[0], self._file_list[1:n_runs + 1]
+
+    def get_data_manager(self, n_tof, n_runs):
+        """
+            Return a DataManager with the direct beam and the runs loaded,
+            and the reflectivity stitched.
+            :param int n_tof: number of TOF bins
+            :param int n_runs: number of runs in the reduction list
+        """
+        key = (n_tof, n_runs)
+        if key not in self._data_managers:
+            from reflectivity_ui.interfaces.configuration import Configuration
+            from reflectivity_ui.interfaces.data_manager import DataManager
+
+            direct_beam_file, file_list = self.get_files(n_runs)
+            configuration = Configuration()
+            configuration.tof_bins = n_tof
+            data_manager = DataManager(self.data_dir)
+            data_manager.load(direct_beam_file, copy.deepcopy(configuration))
+            data_manager.add_active_to_normalization()
+            configuration.match_direct_beam = True
+            for file_path in file_list:
+                data_manager.load(file_path, copy.deepcopy(configuration))
+                data_manager.add_active_to_reduction()
+            data_manager.stitch_data_sets()
+            self._data_managers[key] = data_manager
+        return self._data_managers[key]
+
+    def get_offspec(self, n_tof, n_runs):
+        """
+            Return a DataManager for which the off-specular data was computed
+        """
+        data_manager = self.get_data_manager(n_tof, n_runs)
+        if not data_manager.is_offspec_available():
+            data_manager.reduce_offspec()
+        return data_manager
+
+    def get_gisans(self, n_tof, n_runs):
+        """
+            Return a DataManager for which the GISANS data was computed
+        """
+        data_manager = self.get_data_manager(n_tof, n_runs)
+        if not data_manager.is_gisans_available(active_only=False):
+            data_manager.reduce_gisans()
+        return data_manager
+
+
+def get_channel(data_manager):
+    """
+        Return the first cross-section of the first run, and the matching direct beam
+        :param DataManager data_manager: loaded data
+    """
+    nexus_data = data_manager.reduction_list[0]
+    channel = nexus_data.cross_sections[list(nexus_data.cross_sections.keys())[0]]
+    direct_beam = data_manager.direct_beam_list[0]
+    return channel, direct_beam.cross_sections[list(direct_beam.cross_sections.keys())[0]]
+
+
+class SyntheticCrossSection(object):
+    """
+        Cross-section with the attributes used by the GISANS calculation,
+        so that it can be benchmarked without loading data with Mantid.
+    """
+    def __init__(self, n_tof, seed=42):
+        """
+            :param int n_tof: number of TOF bins
+            :param int seed: seed of the random counts
+        """
+        class _Configuration(object):
+            peak_position = 180
+            low_res_position = 130
+            scaling_factor = 1.0
+            cut_first_n_points = 1
+            cut_last_n_points = 1
+            tof_bins = n_tof
+        self.configuration = _Configuration()
+        self.proton_charge = 1.0
+        self.det_size_x = 0.0007 * 304
+        self.dist_sam_det = 2.55
+        self.dist_mod_det = 17.0
+        self.direct_pixel = 230.0
+        self.dangle = 1.2
+        self.angle_offset = 0.0
+        # 2 to 8 Angstrom
+        self.tof_edges = np.linspace(8600., 34400., n_tof + 1)
+        self.tof = (self.tof_edges[:-1] + self.tof_edges[1:]) / 2.0
+        self.data = np.random.RandomState(seed).poisson(2.0, size=(304, 256, n_tof)).astype(float)
+        self.xydata = self.data.sum(axis=2).transpose()
+
+
+def create_gisans_list(n_tof, n_runs, pol_state='Off_Off'):
+    """
+        Create a reduction list of synthetic runs for which the GISANS data was computed
+        :param int n_tof: number of TOF bins
+        :param int n_runs: number of runs
+        :param str pol_state: polarization state of the cross-sections
+    """
+    from reflectivity_ui.interfaces.data_handling.gisans import GISANS
+
+    class _NexusData(object):
+        def __init__(self, cross_section):
+            self.cross_sections = {pol_state: cross_section}
+
+    reduction_list = []
+    for i in range(n_runs):
+        cross_section = SyntheticCrossSection(n_tof, seed=i)
+        cross_section.gisans_data = GISANS(cross_section)
+        cross_section.gisans_data(direct_beam=None)
+        reduction_list.append(_NexusData(cross_section))
+    return reduction_list
+
+
+def create_specular_data(n_points):
+    """
+        Create specular data as produced by ProcessingWorkflow.get_output_data
+        :param int n_points: number of points
+    """
+    q = np.linspace(0.005, 0.2, n_points)
+    r = np.exp(-q / 0.01)
+    return np.vstack((q, r, 0.1 * r, 0.02 * q, np.ones(n_points))).transpose()
+
+
+### Benchmarks ###############################################################
+
+@benchmark('n_tof')
+def bench_getIxyt(_corpus, n_tof):
+    from reflectivity_ui.interfaces.data_handling.data_set import getIxyt
+    from getixyt_benchmark import create_workspace
+    workspace = create_workspace(n_tof)
+    return lambda: getIxyt(workspace)
+
+
+@benchmark('n_tof')
+def bench_prepare_plot_data(corpus, n_tof):
+    from reflectivity_ui.interfaces.data_handling import data_set
+    channel, _ = get_channel(corpus.get_data_manager(n_tof, 1))
+
+    def _call():
+        # Measure the binning of the events, not the reading of the cube cache
+        get_cube_cache = data_set.get_cube_cache
+        data_set.get_cube_cache = lambda: None
+        try:
+            channel.xtofdata = None
+            channel.prepare_plot_data()
+        finally:
+            data_set.get_cube_cache = get_cube_cache
+    return _call
+
+
+@benchmark('n_tof')
+def bench_offspecular(corpus, n_tof):
+    from reflectivity_ui.interfaces.data_handling.off_specular import OffSpecular
+    channel, direct_beam = get_channel(corpus.get_data_manager(n_tof, 1))
+    channel.prepare_plot_data()
+    return lambda: OffSpecular(channel)(direct_beam)
+
+
+@benchmark('n_tof')
+def bench_gisans(corpus, n_tof):
+    from reflectivity_ui.interfaces.data_handling.gisans import GISANS
+    channel, direct_beam = get_channel(corpus.get_data_manager(n_tof, 1))
+    channel.prepare_plot_data()
+    return lambda: GISANS(channel)(direct_beam)
+
+
+@benchmark('n_tof', 'n_runs')
+def bench_offspec_rebin_extract(corpus, n_tof, n_runs):
+    from reflectivity_ui.interfaces.data_handling import off_specular
+    data_manager = corpus.get_offspec(n_tof, n_runs)
+    pol_state = data_manager.reduction_states[0]
+    return lambda: off_specular.rebin_extract(data_manager.reduction_list, pol_state)
+
+
+@benchmark('n_tof', 'n_runs')
+def bench_smooth_data(_corpus, n_tof, n_runs):
+    from reflectivity_ui.interfaces.data_handling import off_specular
+    from writer_benchmark import create_data
+    # Same inputs as ProcessingWorkflow.smooth_offspec for the default axes
+    data = np.hstack(create_data(n_runs, n_tof))
+    x = data[:, :, 4].flatten()
+    y = data[:, :, 1].flatten()
+    I = data[:, :, 5].flatten()
+    return lambda: off_specular.smooth_data(x, y, I, axis_sigma_scaling=2, xysigma0=data[:, :, 2].max() / 3.)
+
+
+@benchmark('n_tof', 'n_runs')
+def bench_gisans_rebin_extract(corpus, n_tof, n_runs):
+    from reflectivity_ui.interfaces.data_handling import gisans
+    data_manager = corpus.get_gisans(n_tof, n_runs)
+    pol_state = data_manager.reduction_states[0]
+    return lambda: gisans.rebin_extract(data_manager.reduction_list, pol_state, wl_min=2.0, wl_max=8.0)
+
+
+@benchmark('n_tof', 'n_runs')
+def bench_gisans_rebin_bands(_corpus, n_tof, n_runs):
+    from reflectivity_ui.interfaces.data_handling import gisans
+    reduction_list = create_gisans_list(n_tof, n_runs)
+    return lambda: gisans.rebin_bands(reduction_list, 'Off_Off', wl_min=2.0, wl_max=8.0, wl_npts=4)
+
+
+@benchmark('n_tof', 'n_runs')
+def bench_smart_stitch_reflectivity(corpus, n_tof, n_runs):
+    from reflectivity_ui.interfaces.data_handling import data_manipulation
+    data_manager = corpus.get_data_manager(n_tof, n_runs)
+    pol_state = data_manager.reduction_states[0]
+    return lambda: data_manipulation.smart_stitch_reflectivity(data_manager.reduction_list, pol_state)
+
+
+@benchmark('n_tof', 'n_runs')
+def bench_get_output_data(corpus, n_tof, n_runs):
+    from reflectivity_ui.interfaces.data_handling.processing_workflow import ProcessingWorkflow, DEFAULT_OPTIONS
+    workflow = ProcessingWorkflow(corpus.get_data_manager(n_tof, n_runs), copy.deepcopy(DEFAULT_OPTIONS))
+    return workflow.get_output_data
+
+
+@benchmark('n_tof', 'n_runs')
+def bench_write_reflectivity_header(corpus, n_tof, n_runs):
+    from reflectivity_ui.interfaces.data_handling import quicknxs_io
+    data_manager = corpus.get_data_manager(n_tof, n_runs)
+    output_path = os.path.join(tempfile.gettempdir(), 'benchmark_header.dat')
+    return lambda: quicknxs_io.write_reflectivity_header(data_manager.reduction_list, data_manager.direct_beam_list,
+                                                         output_path, data_manager.reduction_states)
+
+
+@benchmark('n_tof', 'n_runs')
+def bench_write_specular_data(_corpus, n_tof, n_runs):
+    from reflectivity_ui.interfaces.data_handling import quicknxs_io
+    data = create_specular_data(n_tof * n_runs)
+    output_path = os.path.join(tempfile.gettempdir(), 'benchmark_specular.dat')
+    return lambda: quicknxs_io.write_reflectivity_data(output_path, data, ['Qz', 'R', 'dR', 'dQz', 'theta'])
+
+
+@benchmark('n_tof', 'n_runs')
+def bench_write_offspec_data(_corpus, n_tof, n_runs):
+    from reflectivity_ui.interfaces.data_handling import quicknxs_io
+    from writer_benchmark import create_data, COLUMNS
+    data = create_data(n_runs, n_tof)
+    output_path = os.path.join(tempfile.gettempdir(), 'benchmark_offspec.dat')
+    return lambda: quicknxs_io.write_reflectivity_data(output_path, data, COLUMNS)
+
+##############################################################################
+
+
+def get_memory_method():
+    """
+        Return the way the peak memory is measured, or None if it can't be
+    """
+    if tracemalloc is not None:
+        return 'tracemalloc'
+    if resource is not None:
+        return 'ru_maxrss'
+    return None
+
+
+def get_max_rss():
+    """
+        Return the maximum resident set size of the process, in MB
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # The size is given in bytes on macOS, and in kB elsewhere
+    if sys.platform == 'darwin':
+        return max_rss / 1024.**2
+    return max_rss / 1024.
+
+
+def measure_max_rss(name, params, corpus, source_dir):
+    """
+        Run a benchmark case once in a new process, and return the increase
+        of the maximum resident set size of the process during the call, in MB
+        :param str name: name of the benchmark
+        :param dict params: value of each parameter
+        :param Corpus corpus: synthetic data
+        :param str source_dir: work tree of the code to benchmark
+    """
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '-b', name,
+                                      '--max-rss', json.dumps(params), '--source', source_dir,
+                                      '--data-dir', corpus.root_dir, '--events', str(corpus.n_events)])
+    return float(output.decode('utf-8').strip().split('\n')[-1])
+
+
+def measure(function, n_repeat):
+    """
+        Return the best time out of n_repeat calls, and the peak memory of one call in MB.
+        The peak memory is None if tracemalloc is not available.
+        :param function: function to call
+        :param int n_repeat: number of calls to time
+    """
+    best = None
+    for _ in range(n_repeat):
+        t_0 = time.time()
+        function()
+        elapsed = time.time() - t_0
+        best = elapsed if best is None else min(best, elapsed)
+
+    # Tracing allocations slows down the call, so the memory is measured separately
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1] / 1024.**2
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+
+def get_key(name, params):
+    """
+        Return the identifier of a benchmark case, such as offspec_rebin_extract[n_tof=400,n_runs=4]
+    """
+    return '%s[%s]' % (name, ','.join(['%s=%s' % item for item in params.items()]))
+
+
+def run(names, corpus, values, n_repeat=3, source_dir=None):
+    """
+        Run benchmarks for all combinations of their parameters.
+        Returns a dictionary of results, keyed by benchmark case.
+
+        :param list names: names of the benchmarks to run
+        :param Corpus corpus: synthetic data
+        :param dict values: list of values for each parameter
+        :param int n_repeat: number of calls to time
+        :param str source_dir: work tree of the code to benchmark, for the memory
+                               measurements made in a separate process
+    """
+    results = OrderedDict()
+    for name in names:
+        function, param_names = BENCHMARKS[name]
+        for combination in itertools.product(*[values[item] for item in param_names]):
+            params = OrderedDict(zip(param_names, combination))
+            key = get_key(name, params)
+            result = dict(benchmark=name, params=params, time=None, peak_memory=None, skipped='')
+            try:
+                result['time'], result['peak_memory'] = measure(function(corpus, **params), n_repeat)
+                if result['peak_memory'] is None and source_dir is not None and resource is not None:
+                    result['peak_memory'] = measure_max_rss(name, params, corpus, source_dir)
+                memory = '' if result['peak_memory'] is None else '%10.1f MB' % result['peak_memory']
+                print("%-55s %10.4f sec %s" % (key, result['time'], memory))
+            except:
+                result['skipped'] = '%s: %s' % (sys.exc_info()[0].__name__, sys.exc_info()[1])
+                print("%-55s skipped: %s" % (key, result['skipped']))
+            results[key] = result
+    return results
+
+
+def get_commit(source_dir):
+    """
+        Return the short hash of the commit checked out in a directory,
+        followed by '+' if there are local changes
+        :param str source_dir: work tree
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=source_dir)
+        commit = commit.decode('utf-8').strip()
+        status = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=source_dir)
+        return commit + '+' if status.strip() else commit
+    except:
+        return 'unknown'
+
+
+def get_result_path(commit):
+    """
+        Return the path of the result file for a commit.
+        A commit hash prefix is enough if it identifies a single file.
+        :param str commit: commit hash
+    """
+    file_path = os.path.join(RESULT_DIR, '%s.json' % commit)
+    if not os.path.isfile(file_path):
+        matches = glob.glob(os.path.join(RESULT_DIR, '%s*.json' % commit))
+        if len(matches) == 1:
+            return matches[0]
+    return file_path
+
+
+def save_results(commit, results, info):
+    """
+        Add results to the result file of a commit, and return its path
+        :param str commit: commit hash
+        :param dict results: results returned by run()
+        :param dict info: description of the machine and of the run
+    """
+    if not os.path.isdir(RESULT_DIR):
+        os.makedirs(RESULT_DIR)
+    file_path = os.path.join(RESULT_DIR, '%s.json' % commit)
+    content = dict(commit=commit, results={})
+    if os.path.isfile(file_path):
+        with open(file_path, 'r') as fd:
+            content = json.load(fd)
+    content.update(info)
+    content['results'].update(results)
+    with open(file_path, 'w') as fd:
+        json.dump(content, fd, indent=2)
+    return file_path
+
+
+def compare(reference, commit, threshold=REGRESSION_THRESHOLD):
+    """
+        Print the ratio of the times and peak memory between two commits.
+        Returns the number of regressions.
+
+        :param str reference: reference commit
+        :param str commit: commit to compare to the reference
+        :param float threshold: ratio above which a benchmark is a regression
+    """
+    data = []
+    for item in [reference, commit]:
+        with open(get_result_path(item), 'r') as fd:
+            data.append(json.load(fd))
+    ref_results, new_results = data[0]['results'], data[1]['results']
+
+    print("%-55s %10s %10s %7s %7s" % ('Benchmark', data[0]['commit'], data[1]['commit'], 'Time', 'Memory'))
+    n_regressions = 0
+    for key in sorted(set(ref_results.keys()) & set(new_results.keys())):
+        ref, new = ref_results[key], new_results[key]
+        if ref['time'] is None or new['time'] is None:
+            continue
+        ratio = new['time'] / ref['time'] if ref['time'] > 0 else 1.0
+        memory_ratio = ''
+        # Peak memory measured in different ways can't be compared
+        same_method = data[0].get('memory', 'tracemalloc') == data[1].get('memory', 'tracemalloc')
+        if same_method and ref['peak_memory'] and new['peak_memory'] is not None:
+            memory_ratio = '%6.2fx' % (new['peak_memory'] / ref['peak_memory'])
+        flag = ''
+        if ratio > threshold:
+            flag = ' REGRESSION'
+            n_regressions += 1
+        print("%-55s %10.4f %10.4f %6.2fx %7s%s" % (key, ref['time'], new['time'], ratio, memory_ratio, flag))
+    return n_regressions
+
+
+def main(argv=None):
+    """
+        Command line entry point. Returns the number of regressions when comparing commits.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the data-handling hot paths")
+    parser.add_argument('-b', '--benchmark', action='append', default=None,
+                        help="benchmark to run, may be repeated [all]")
+    parser.add_argument('--tof-bins', default=','.join([str(i) for i in TOF_BINS]),
+                        help="comma-separated numbers of TOF bins of the detector cube")
+    parser.add_argument('--runs', default=','.join([str(i) for i in RUNS]),
+                        help="comma-separated numbers of runs in the reduction list")
+    parser.add_argument('-n', '--repeat', type=int, default=3, help="number of calls to time")
+    parser.add_argument('--events', type=float, default=1e6, help="number of events per synthetic run")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'refredm_benchmarks'),
+                        help="directory for the synthetic event files")
+    parser.add_argument('--source', default=os.path.join(BENCHMARK_DIR, '..', '..'),
+                        help="work tree of the code to benchmark")
+    parser.add_argument('--list', action='store_true', help="list the benchmarks")
+    parser.add_argument('--compare', nargs='+', default=None, metavar='COMMIT',
+                        help="compare the results of a reference commit with another commit [current]")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="time ratio above which a benchmark is reported as a regression")
+    # Used by measure_max_rss() to run one case in a new process
+    parser.add_argument('--max-rss', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    source_dir = os.path.abspath(args.source)
+
+    if args.list:
+        for name, (_, params) in BENCHMARKS.items():
+            print("%-30s %s" % (name, ', '.join(params)))
+        return 0
+
+    if args.compare is not None:
+        commit = args.compare[1] if len(args.compare) > 1 else get_commit(source_dir)
+        return compare(args.compare[0], commit, args.threshold)
+
+    names = args.benchmark or list(BENCHMARKS.keys())
+    unknown = [item for item in names if item not in BENCHMARKS]
+    if unknown:
+        parser.error("Unknown benchmark: %s" % ','.join(unknown))
+
+    sys.path.insert(0, BENCHMARK_DIR)
+    sys.path.insert(0, source_dir)
+    values = dict(n_tof=[int(item) for item in args.tof_bins.split(',')],
+                  n_runs=[int(item) for item in args.runs.split(',')])
+    corpus = Corpus(args.data_dir, int(args.events))
+    if args.max_rss is not None:
+        function = BENCHMARKS[names[0]][0](corpus, **json.loads(args.max_rss))
+        max_rss = get_max_rss()
+        function()
+        print(max(get_max_rss() - max_rss, 0.0))
+        return 0
+    results = run(names, corpus, values, args.repeat, source_dir=source_dir)
+
+    commit = get_commit(source_dir)
+    info = dict(date=time.strftime("%Y-%m-%d %H:%M:%S"), machine=platform.node(),
+                platform=platform.platform(), python=platform.python_version(),
+                numpy=np.__version__, n_events=int(args.events), n_repeat=args.repeat,
+                memory=get_memory_method())
+    print("Results stored in %s" % save_results(commit, results, info))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+    Benchmark the text export of off-specular data, for a reduction
+    list of several runs.
+
+    The bulk writer in quicknxs_io.write_reflectivity_data is compared with
+    the original loop calling np.savetxt for each pixel.
+    Both must produce identical files.
+
+    Usage:
+        python writer_benchmark.py [number of runs] [number of TOF bins] [number of repeats]
+"""
+#pylint: disable=invalid-name, wrong-import-position
+from __future__ import absolute_import, division, print_function
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+sys.path.append('../..')
+
+from reflectivity_ui.interfaces.data_handling.quicknxs_io import write_reflectivity_data
+
+COLUMNS = ['Qx [1/A]', 'Qz [1/A]', 'ki_z [1/A]', 'kf_z [1/A]', 'ki_z-kf_z [1/A]', 'I []', 'dI []']
+
+
+def write_reflectivity_data_loop(output_path, data, col_names):
+    """
+        Original implementation, writing one pixel at a time.
+        :param str output_path: output file path
+        :param list data: list of [pixel][TOF][parameter] arrays
+        :param list col_names: list of column names
+    """
+    with open(output_path, 'a') as fd:
+        fd.write("# [Data]\n")
+        toks = [u'%12s' % item for item in col_names[:4]]
+        fd.write(u"# %s\n" % '\t'.join(toks))
+        for tof_item in data:
+            for pixel_item in tof_item:
+                np.savetxt(fd, pixel_item, delimiter='\t', fmt='%-18e')
+                fd.write(u'\n')
+
+
+def create_data(n_runs, n_tof, n_pixels=304):
+    """
+        Create off-specular data as produced by OffSpecular.__call__,
+        one [pixel][TOF][parameter] array per run.
+        :param int n_runs: number of runs in the reduction list
+        :param int n_tof: number of TOF bins
+        :param int n_pixels: number of pixels along the reflectivity direction
+    """
+    data = []
+    for i in range(n_runs):
+        k = np.linspace(0.8, 4.0, n_tof)[np.newaxis, :] * np.ones((n_pixels, 1))
+        a_f = np.radians(0.5 + 0.5 * i + np.linspace(-1.0, 1.0, n_pixels))[:, np.newaxis]
+        a_i = np.radians(0.5 + 0.5 * i)
+        ki_z = k * np.sin(a_i)
+        kf_z = k * np.sin(a_f)
+        qx = k * (np.cos(a_f) - np.cos(a_i))
+        intensity = np.random.lognormal(-10, 2, size=k.shape)
+        error = intensity * np.random.uniform(0.05, 0.5, size=k.shape)
+        data.append(np.array([qx, ki_z + kf_z, ki_z, kf_z, ki_z - kf_z,
+                              intensity, error]).transpose((1, 2, 0)))
+    return data
+
+
+def time_call(function, data, n_repeat):
+    """
+        Return the best time out of n_repeat calls, and the content of the last output file
+    """
+    best = None
+    content = None
+    for _ in range(n_repeat):
+        _fd, output_path = tempfile.mkstemp(suffix='.dat')
+        os.close(_fd)
+        t_0 = time.time()
+        function(output_path, data, COLUMNS)
+        elapsed = time.time() - t_0
+        best = elapsed if best is None else min(best, elapsed)
+        with open(output_path, 'r') as fd:
+            content = fd.read()
+        os.remove(output_path)
+    return best, content
+
+
+def main(n_runs=4, n_tof=400, n_repeat=3):
+    """
+        Run the benchmark and print the time per file
+    """
+    data = create_data(n_runs, n_tof)
+    t_loop, loop_output = time_call(write_reflectivity_data_loop, data, n_repeat)
+    t_bulk, bulk_output = time_call(write_reflectivity_data, data, n_repeat)
+
+    if loop_output != bulk_output:
+        raise RuntimeError("Bulk writer output does not match the per-pixel loop")
+
+    n_points = sum([item.shape[0] * item.shape[1] for item in data])
+    print("Off-specular data: %s runs, %s points [%.1f MB of text]" % (n_runs, n_points, len(bulk_output)/1024.**2))
+    print("Per-pixel loop: %8.4f sec per file" % t_loop)
+    print("Bulk writer:    %8.4f sec per file" % t_bulk)
+    print("Speedup:        %8.1fx" % (t_loop / t_bulk))
+    return t_loop, t_bulk
+
+
+if __name__ == '__main__':
+    _n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    _n_tof = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    _n_repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    main(_n_runs, _n_tof, _n_repeat)
@@ -0,0 +1,47 @@
+import unittest
+import sys
+sys.path.append('..')
+import copy
+
+from reflectivity_ui.interfaces.configuration import Configuration
+
+
+class ConfigurationTest(unittest.TestCase):
+
+    def test_parameter_stages(self):
+        """
+            Every reduction option is assigned to a processing stage
+        """
+        configuration = Configuration()
+        # The instrument is not a reduction option
+        parameters = set(vars(configuration)) - set(['instrument'])
+        self.assertEqual(sorted(parameters - set(Configuration.PARAMETER_STAGES)), [])
+        self.assertEqual(sorted(set(Configuration.PARAMETER_STAGES) - parameters), [])
+        for stage in Configuration.PARAMETER_STAGES.values():
+            self.assertTrue(stage in Configuration.STAGES + Configuration.OUTPUT_STAGES)
+
+    def test_changed_stages(self):
+        configuration = Configuration()
+        self.assertEqual(configuration.changed_stages(copy.deepcopy(configuration)), set())
+
+        changed = copy.deepcopy(configuration)
+        changed.use_tight_bck = not configuration.use_tight_bck
+        self.assertEqual(changed.changed_stages(configuration),
+                         set([Configuration.STAGE_ROI, Configuration.STAGE_NORMALIZATION,
+                              Configuration.STAGE_SCALING]))
+
+        changed = copy.deepcopy(configuration)
+        changed.match_direct_beam = not configuration.match_direct_beam
+        self.assertEqual(changed.changed_stages(configuration),
+                         set([Configuration.STAGE_NORMALIZATION, Configuration.STAGE_SCALING]))
+
+        # Output options don't invalidate the processed data
+        changed = copy.deepcopy(configuration)
+        changed.off_spec_nxbins += 1
+        changed.log_1d = not configuration.log_1d
+        self.assertEqual(changed.changed_stages(configuration),
+                         set([Configuration.STAGE_OFFSPEC, Configuration.STAGE_DISPLAY]))
+
+
+if __name__ == '__main__':
+    unittest.main()
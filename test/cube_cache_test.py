@@ -0,0 +1,150 @@
+import unittest
+import sys
+sys.path.append('..')
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from reflectivity_ui.interfaces.data_handling import cube_cache, ApplicationConfiguration
+from reflectivity_ui.interfaces.data_handling.cube_cache import CubeCache
+
+EVENT_FILTER = ['PolarizerState', 'PolarizerVeto', 'AnalyzerState', 'AnalyzerVeto', True]
+
+
+class CubeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.work_dir, 'cache')
+        self.file_path = os.path.join(self.work_dir, 'REF_M_1.nxs.h5')
+        with open(self.file_path, 'w') as fd:
+            fd.write('data')
+        self.tof_edges = np.linspace(10000, 40000, 51)
+        rng = np.random.RandomState(42)
+        self.data = rng.poisson(2.0, size=(30, 20, 50)).astype(float)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def store(self, cache, cross_section='Off_Off', tof_edges=None, event_filter=EVENT_FILTER):
+        tof_edges = self.tof_edges if tof_edges is None else tof_edges
+        cache.store(self.file_path, cross_section, tof_edges, self.data,
+                    self.data.sum(axis=2).transpose(), self.data.sum(axis=1), event_filter=event_filter)
+
+    def test_store_load(self):
+        """
+            The cached arrays are read back memory-mapped
+        """
+        cache = CubeCache(self.cache_dir, 1024**3)
+        self.assertIsNone(cache.load(self.file_path, 'Off_Off', self.tof_edges, EVENT_FILTER))
+        self.assertFalse(cache.contains(self.file_path, 'Off_Off', self.tof_edges, EVENT_FILTER))
+        self.store(cache)
+        self.assertTrue(cache.contains(self.file_path, 'Off_Off', self.tof_edges, EVENT_FILTER))
+
+        data, xydata, xtofdata = cache.load(self.file_path, 'Off_Off', self.tof_edges, EVENT_FILTER)
+        self.assertTrue(isinstance(data, np.memmap))
+        self.assertTrue(np.array_equal(data, self.data))
+        self.assertTrue(np.array_equal(xydata, self.data.sum(axis=2).transpose()))
+        self.assertTrue(np.array_equal(xtofdata, self.data.sum(axis=1)))
+        self.assertEqual(len(cache.get_entries()), 1)
+        # No temporary directory is left behind
+        self.assertEqual(os.listdir(self.cache_dir), [os.path.basename(cache.get_entries()[0][2])])
+
+    def test_key(self):
+        """
+            Data is not reused if the file, the cross-section, the event filtering or the binning changes
+        """
+        cache = CubeCache(self.cache_dir, 1024**3)
+        self.store(cache)
+        self.assertIsNone(cache.load(self.file_path, 'On_On', self.tof_edges, EVENT_FILTER))
+        self.assertIsNone(cache.load(self.file_path, 'Off_Off', self.tof_edges[:-1], EVENT_FILTER))
+        self.assertIsNone(cache.load(self.file_path, 'Off_Off', self.tof_edges, EVENT_FILTER[:-1] + [False]))
+        self.assertIsNone(cache.load(self.file_path, 'Off_Off', self.tof_edges,
+                                     ['PolarizerState', 'PolarizerVeto', 'SF1', 'AnalyzerVeto', True]))
+        self.assertIsNotNone(cache.load(self.file_path, 'Off_Off', self.tof_edges, list(EVENT_FILTER)))
+
+        # The file is rewritten
+        with open(self.file_path, 'a') as fd:
+            fd.write('more data')
+        self.assertIsNone(cache.load(self.file_path, 'Off_Off', self.tof_edges, EVENT_FILTER))
+
+    def test_evict(self):
+        """
+            The least recently used entries are removed to stay within the size budget
+        """
+        cache = CubeCache(self.cache_dir, 1024**3)
+        tof_edges = [self.tof_edges + i for i in range(3)]
+        for i in range(3):
+            self.store(cache, tof_edges=tof_edges[i])
+            entry = os.path.join(self.cache_dir, cache.get_key(self.file_path, 'Off_Off', tof_edges[i], EVENT_FILTER))
+            os.utime(entry, (1000.0 + i, 1000.0 + i))
+        entry_size = cache.get_entries()[0][1]
+        self.assertEqual(cache.get_size(), 3 * entry_size)
+
+        # Reading the oldest entry makes it the most recently used
+        self.assertIsNotNone(cache.load(self.file_path, 'Off_Off', tof_edges[0], EVENT_FILTER))
+        cache.max_size = 2 * entry_size
+        cache.evict()
+        self.assertEqual(cache.get_size(), 2 * entry_size)
+        self.assertIsNotNone(cache.load(self.file_path, 'Off_Off', tof_edges[0], EVENT_FILTER))
+        self.assertIsNone(cache.load(self.file_path, 'Off_Off', tof_edges[1], EVENT_FILTER))
+        self.assertIsNotNone(cache.load(self.file_path, 'Off_Off', tof_edges[2], EVENT_FILTER))
+
+        # A new entry pushes out the least recently used one
+        for i, access_time in [(0, 2000.0), (2, 3000.0)]:
+            entry = os.path.join(self.cache_dir, cache.get_key(self.file_path, 'Off_Off', tof_edges[i], EVENT_FILTER))
+            os.utime(entry, (access_time, access_time))
+        self.store(cache, tof_edges=self.tof_edges + 10)
+        self.assertEqual(cache.get_size(), 2 * entry_size)
+        self.assertIsNone(cache.load(self.file_path, 'Off_Off', tof_edges[0], EVENT_FILTER))
+
+        # Nothing is stored in a cache without a budget
+        cache.max_size = 0
+        self.store(cache, cross_section='On_On')
+        self.assertFalse(cache.contains(self.file_path, 'On_On', self.tof_edges, EVENT_FILTER))
+
+    def test_clear(self):
+        cache = CubeCache(self.cache_dir, 1024**3)
+        self.store(cache)
+        self.store(cache, cross_section='On_On')
+        self.assertEqual(len(cache.get_entries()), 2)
+        cache.clear()
+        self.assertEqual(cache.get_entries(), [])
+        self.assertEqual(cache.get_size(), 0)
+
+    def test_configure(self):
+        """
+            The location, size and use of the application cache are configurable
+        """
+        class Settings(dict):
+            def value(self, key, default=None):
+                return self.get(key, default)
+            def setValue(self, key, value):
+                self[key] = value
+
+        settings = Settings(cube_cache_dir=self.cache_dir, cube_cache_size='1000')
+        try:
+            cube_cache.configure(ApplicationConfiguration(settings))
+            cache = cube_cache.get_cube_cache()
+            self.assertEqual(cache.directory, self.cache_dir)
+            self.assertEqual(cache.max_size, 1000)
+            self.assertIs(cube_cache.get_cube_cache(), cache)
+
+            settings['use_cube_cache'] = 'false'
+            cube_cache.configure(ApplicationConfiguration(settings))
+            self.assertIsNone(cube_cache.get_cube_cache())
+
+            # The settings are saved back
+            saved = Settings()
+            ApplicationConfiguration(settings).to_q_settings(saved)
+            self.assertEqual(saved['cube_cache_dir'], self.cache_dir)
+            self.assertEqual(saved['cube_cache_size'], 1000)
+            self.assertFalse(saved['use_cube_cache'])
+            self.assertFalse(saved['load_preview'])
+        finally:
+            cube_cache.configure(None)
+
+
+if __name__ == '__main__':
+    unittest.main()
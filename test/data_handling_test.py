@@ -47,6 +47,77 @@ class DataLoaderTest(unittest.TestCase):
         self.assertEqual(len(data_list), 6)
         self.assertEqual(data_list[4][2].normalization, None)
 
+class CachedData(object):
+    """
+        Data set in the data manager cache
+    """
+    def __init__(self, file_path, memory_size):
+        self.file_path = file_path
+        self.number = 0
+        self.memory_size = memory_size
+        self.cross_sections = {}
+        self.released = False
+
+    def release_workspaces(self):
+        self.released = True
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = DataManager(os.getcwd())
+        self.manager.MAX_CACHE_MEMORY = 1000
+        self.manager._cache = [CachedData('REF_M_%s' % i, 200 * (i + 1)) for i in range(4)]
+
+    def get_files(self):
+        return [item.file_path for item in self.manager._cache]
+
+    def test_evict(self):
+        """
+            The least recently used data sets are removed until the cache fits its budget
+        """
+        data = list(self.manager._cache)
+        self.assertEqual(self.manager.get_cache_memory(), 2000)
+        self.manager.MAX_CACHE_MEMORY = 1500
+        self.manager._evict_cache()
+        self.assertEqual(self.get_files(), ['REF_M_2', 'REF_M_3'])
+        self.assertEqual(self.manager.get_cache_memory(), 1400)
+        self.assertEqual([item.released for item in data], [True, True, False, False])
+
+        self.manager.MAX_CACHE_MEMORY = 800
+        self.manager._evict_cache()
+        self.assertEqual(self.get_files(), ['REF_M_3'])
+        self.assertTrue(data[2].released)
+
+    def test_in_use(self):
+        """
+            The active data set and those in the reduction or direct beam lists are kept
+        """
+        data = list(self.manager._cache)
+        self.manager._nexus_data = data[0]
+        self.manager.reduction_list = [data[1]]
+        self.manager.direct_beam_list = [data[2]]
+        self.manager._evict_cache()
+        self.assertEqual(self.get_files(), ['REF_M_0', 'REF_M_1', 'REF_M_2'])
+        self.assertTrue(data[3].released)
+        self.assertEqual([item.released for item in data[:3]], [False, False, False])
+
+        # The budget can be exceeded by the data in use
+        self.manager.MAX_CACHE_MEMORY = 100
+        self.manager._evict_cache()
+        self.assertEqual(self.get_files(), ['REF_M_0', 'REF_M_1', 'REF_M_2'])
+
+    def test_load_from_cache(self):
+        """
+            Loading a cached file makes it the most recently used
+        """
+        self.assertTrue(self.manager.load('REF_M_0', Configuration()))
+        self.assertEqual(self.get_files(), ['REF_M_1', 'REF_M_2', 'REF_M_3', 'REF_M_0'])
+        self.manager._nexus_data = None
+        self.manager._evict_cache()
+        self.assertEqual(self.get_files(), ['REF_M_3', 'REF_M_0'])
+
+
 class DataManagerTest(unittest.TestCase):
 
     def test_manager(self):
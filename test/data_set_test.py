@@ -0,0 +1,187 @@
+import unittest
+import sys
+sys.path.append('..')
+import numpy as np
+
+from reflectivity_ui.interfaces.configuration import Configuration
+from reflectivity_ui.interfaces.data_handling import data_set
+from reflectivity_ui.interfaces.data_handling.data_set import CrossSectionData, NexusData
+
+
+class RoiIntegralTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.data = rng.poisson(3.0, size=(30, 20, 8)).astype(float)
+        self.cross_section = CrossSectionData('Off_Off', Configuration())
+        self.cross_section.set_histogram_data(self.data)
+
+    def test_summed_area_table(self):
+        integral = self.cross_section.get_roi_integral()
+        self.assertEqual(integral.shape, (31, 21, 8))
+        self.assertTrue(np.array_equal(integral[0], np.zeros((21, 8))))
+        self.assertTrue(np.array_equal(integral[:, 0], np.zeros((31, 8))))
+        self.assertTrue(np.allclose(integral[-1, -1], self.data.sum(axis=(0, 1))))
+        # The table is computed once
+        self.assertIs(self.cross_section.get_roi_integral(), integral)
+
+    def test_roi_counts(self):
+        """
+            The counts in a region are the same as summing the data directly
+        """
+        rng = np.random.RandomState(1)
+        ranges = [([5, 17], [3, 11]), ([0, 30], [0, 20]), ([0, 1], [19, 20]), ([29, 30], [0, 20])]
+        for _ in range(20):
+            x_min, x_max = np.sort(rng.randint(0, 31, 2))
+            y_min, y_max = np.sort(rng.randint(0, 21, 2))
+            ranges.append(([x_min, x_max], [y_min, y_max]))
+        for x_range, y_range in ranges:
+            expected = self.data[x_range[0]:x_range[1], y_range[0]:y_range[1]].sum(axis=(0, 1))
+            counts = self.cross_section.get_roi_counts(x_range, y_range)
+            self.assertEqual(counts.shape, (8,))
+            self.assertTrue(np.allclose(counts, expected), msg="%s %s" % (x_range, y_range))
+
+    def test_roi_counts_clipped(self):
+        """
+            Ranges extending past the detector are clipped to it, and empty or
+            inverted ranges give no counts
+        """
+        self.assertTrue(np.allclose(self.cross_section.get_roi_counts([-5, 40], [-1, 25]),
+                                    self.data.sum(axis=(0, 1))))
+        self.assertTrue(np.allclose(self.cross_section.get_roi_counts([25, 100], [15, 100]),
+                                    self.data[25:, 15:].sum(axis=(0, 1))))
+        self.assertTrue(np.allclose(self.cross_section.get_roi_counts([-10, 3], [-10, 4]),
+                                    self.data[:3, :4].sum(axis=(0, 1))))
+        for x_range, y_range in [([10, 10], [0, 20]), ([0, 30], [7, 7]), ([12, 5], [0, 20]),
+                                 ([0, 30], [15, 2]), ([35, 40], [0, 20]), ([-5, -1], [0, 20])]:
+            counts = self.cross_section.get_roi_counts(x_range, y_range)
+            self.assertTrue(np.array_equal(counts, np.zeros(8)), msg="%s %s" % (x_range, y_range))
+
+    def test_background(self):
+        """
+            The background excludes the pixels it shares with the peak
+        """
+        configuration = self.cross_section.configuration
+        configuration.peak_roi = [10, 15]
+        configuration.bck_roi = [5, 12]
+        configuration.low_res_roi = [2, 18]
+        # The ROI setters don't round-trip exactly
+        bck_min, peak_min = configuration.bck_roi[0], configuration.peak_roi[0]
+        y_min, y_max = configuration.low_res_roi
+        self.assertTrue(bck_min < peak_min < configuration.bck_roi[1])
+        summed = self.data[bck_min:peak_min, y_min:y_max].sum(axis=(0, 1))
+        size = float((peak_min - bck_min) * (y_max - y_min))
+        bck, d_bck = self.cross_section.get_background_vs_TOF(with_variance=True)
+        self.assertTrue(np.allclose(bck, summed / size))
+        self.assertTrue(np.allclose(d_bck, summed / size**2))
+        self.assertTrue(np.array_equal(self.cross_section.get_background_vs_TOF(), bck))
+
+        # No background pixels
+        configuration.bck_roi = [12, 13]
+        self.assertTrue(peak_min <= configuration.bck_roi[0] < configuration.bck_roi[1] <= configuration.peak_roi[1])
+        self.assertTrue(np.array_equal(self.cross_section.get_background_vs_TOF(), np.zeros(8)))
+
+    def test_new_data(self):
+        """
+            The table is recomputed when the data changes
+        """
+        self.cross_section.get_roi_integral()
+        self.cross_section.set_histogram_data(2 * self.data)
+        self.assertTrue(np.allclose(self.cross_section.get_roi_counts([3, 9], [2, 5]),
+                                    2 * self.data[3:9, 2:5].sum(axis=(0, 1))))
+
+
+class ReductionMemoTest(unittest.TestCase):
+
+    def setUp(self):
+        configuration = Configuration()
+        self.nexus_data = NexusData('REF_M_1', configuration)
+        self.nexus_data.number = 1
+        for xs in ['Off_Off', 'On_On']:
+            cross_section = CrossSectionData(xs, configuration, entry_name=xs)
+            cross_section._event_workspace = 'REF_M_1_%s' % xs
+            self.nexus_data.cross_sections[xs] = cross_section
+        self.nexus_data.main_cross_section = 'Off_Off'
+        self.reductions = []
+        self.nexus_data._reduce_histograms = self.reduce
+
+    def tearDown(self):
+        self.nexus_data.release_workspaces()
+
+    def reduce(self, conf, direct_beam, apply_norm, ws_norm, ws_list, output_ws):
+        """
+            Stand-in for the Mantid reduction, with a different result each time it is called
+        """
+        self.reductions.append(conf.peak_position)
+        for xs in self.nexus_data.cross_sections:
+            ws_name = "%s_%s" % (output_ws, xs)
+            q = np.arange(1, 11) * 0.01
+            r = np.ones(10) * len(self.reductions)
+            data_set.api.CreateWorkspace(DataX=q, DataY=r, DataE=0.1 * r, OutputWorkspace=ws_name)
+            self.nexus_data.cross_sections[xs].q = q
+            self.nexus_data.cross_sections[xs]._r = r
+            self.nexus_data.cross_sections[xs]._dr = 0.1 * r
+            self.nexus_data.cross_sections[xs]._reflectivity_workspace = ws_name
+
+    def get_r(self):
+        return [self.nexus_data.cross_sections[xs]._r[0] for xs in self.nexus_data.cross_sections]
+
+    def test_hit_and_miss(self):
+        self.nexus_data.calculate_reflectivity()
+        self.assertEqual(len(self.reductions), 1)
+        self.assertEqual(len(self.nexus_data._reduction_memo), 1)
+
+        # Same parameters: the results are reused
+        self.nexus_data.cross_sections['On_On']._r[0] = -1
+        self.nexus_data.calculate_reflectivity()
+        self.assertEqual(len(self.reductions), 1)
+        self.assertEqual(self.get_r(), [1, 1])
+
+        # Parameters applied after the reduction are not part of the key
+        self.nexus_data.set_parameter('scaling_factor', 2.0)
+        self.nexus_data.set_parameter('cut_first_n_points', 3)
+        self.nexus_data.calculate_reflectivity()
+        self.assertEqual(len(self.reductions), 1)
+
+        # A reduction parameter changed
+        self.nexus_data.set_parameter('peak_position', 140)
+        self.nexus_data.calculate_reflectivity()
+        self.assertEqual(len(self.reductions), 2)
+        self.assertEqual(self.get_r(), [2, 2])
+
+        # Going back to the previous parameters
+        self.nexus_data.set_parameter('peak_position', Configuration().peak_position)
+        self.nexus_data.calculate_reflectivity()
+        self.assertEqual(len(self.reductions), 2)
+        self.assertEqual(self.get_r(), [1, 1])
+
+        # A different direct beam
+        direct_beam = CrossSectionData('Off_Off', Configuration())
+        direct_beam.number = 2
+        direct_beam._event_workspace = 'REF_M_2_Off_Off'
+        self.nexus_data.calculate_reflectivity(direct_beam=direct_beam)
+        self.assertEqual(len(self.reductions), 3)
+        self.nexus_data.calculate_reflectivity(direct_beam=direct_beam)
+        self.assertEqual(len(self.reductions), 3)
+
+    def test_memo_size(self):
+        """
+            Only the most recent results are kept
+        """
+        for i in range(data_set.REDUCTION_MEMO_SIZE + 2):
+            self.nexus_data.set_parameter('peak_position', 100 + i)
+            self.nexus_data.calculate_reflectivity()
+        self.assertEqual(len(self.nexus_data._reduction_memo), data_set.REDUCTION_MEMO_SIZE)
+
+        # The oldest results were dropped
+        self.nexus_data.set_parameter('peak_position', 100)
+        self.nexus_data.calculate_reflectivity()
+        self.assertEqual(self.reductions[-1], 100)
+        self.assertEqual(len(self.reductions), data_set.REDUCTION_MEMO_SIZE + 3)
+        self.nexus_data.set_parameter('peak_position', 100 + data_set.REDUCTION_MEMO_SIZE + 1)
+        self.nexus_data.calculate_reflectivity()
+        self.assertEqual(len(self.reductions), data_set.REDUCTION_MEMO_SIZE + 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import sys
+sys.path.append('..')
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from reflectivity_ui.interfaces.data_handling import event_reader
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+from event_data_generator import RunParameters, write_event_file
+
+
+class GeneratedFileTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data_dir = tempfile.mkdtemp()
+        cls.parameters = RunParameters(30001, lambda_request=4.5, sangle=0.4, slit_widths=(0.2, 0.3, 0.4))
+        cls.file_path = os.path.join(cls.data_dir, cls.parameters.file_name)
+        cls.counts = write_event_file(cls.file_path, cls.parameters, n_events=10000, seed=42)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.data_dir)
+
+    def test_read_logs(self):
+        logs, units = event_reader.read_logs(self.file_path)
+        self.assertEqual(logs['run_number'], 30001)
+        for name, (value, _units) in self.parameters.get_logs().items():
+            self.assertAlmostEqual(logs[name], value, msg=name)
+            self.assertEqual(units[name], _units)
+        self.assertIn(event_reader.STATE_LOG, logs)
+
+        logs, units = event_reader.read_logs(self.file_path, names=['LambdaRequest', 'not_a_log'])
+        self.assertEqual(sorted(logs.keys()), ['LambdaRequest', 'run_number'])
+        self.assertEqual(units['LambdaRequest'], 'Angstrom')
+
+    def test_read_event_histograms(self):
+        """
+            The events are split by cross-section, and each cross-section has its own reflectivity
+        """
+        logs, units = event_reader.read_logs(self.file_path)
+        tof_range = event_reader.get_tof_range(logs, units, self.parameters.wl_bandwidth)
+        tof_edges = np.linspace(tof_range[0], tof_range[1], 51)
+        histograms = event_reader.read_event_histograms(self.file_path, tof_edges)
+        self.assertEqual(sorted(histograms.keys()), sorted(self.parameters.states))
+        for pol_state, (counts, _, n_events) in histograms.items():
+            self.assertEqual(n_events, self.counts[pol_state])
+            self.assertEqual(counts.shape, (304, 256, 50))
+
+        # The Off_Off reflectivity has a higher critical edge, so it extends to shorter wavelengths
+        mean_tof = dict([(pol_state, np.average(tof_edges[1:], weights=histograms[pol_state][0].sum(axis=(0, 1))))
+                         for pol_state in histograms])
+        self.assertLess(mean_tof['Off_Off'], mean_tof['On_On'])
+
+
+if __name__ == '__main__':
+    unittest.main()
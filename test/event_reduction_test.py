@@ -0,0 +1,53 @@
+import unittest
+import sys
+sys.path.append('..')
+import os
+import copy
+import numpy as np
+
+from reflectivity_ui.interfaces.data_manager import DataManager
+from reflectivity_ui.interfaces.configuration import Configuration
+
+# Maximum median relative difference between the event and histogram reductions
+TOLERANCE = 0.1
+
+class EventReductionTest(unittest.TestCase):
+
+    def compare_to_histograms(self, configuration):
+        """
+            Compute the reflectivity with MagnetismReflectometryReduction and with
+            the event backend, and return the median relative difference over the
+            common Q range.
+        """
+        manager = DataManager(os.getcwd())
+        configuration.reduction_backend = Configuration.REDUCTION_HISTOGRAM
+        manager.load("REF_M_29160", configuration)
+        manager.calculate_reflectivity()
+
+        channel = manager.active_channel
+        q_ref = channel.q if len(channel.q) == len(channel._r) else (channel.q[1:]+channel.q[:-1])/2.0
+        r_ref = channel._r.copy()
+
+        configuration = copy.deepcopy(channel.configuration)
+        configuration.reduction_backend = Configuration.REDUCTION_EVENTS
+        manager.update_configuration(configuration)
+        manager.calculate_reflectivity()
+        q, r = channel.q, channel._r
+
+        good = r_ref > 0
+        in_range = (q >= q_ref[good].min()) & (q <= q_ref[good].max()) & (r > 0)
+        self.assertTrue(np.sum(in_range) > 10)
+        r_interp = np.exp(np.interp(q[in_range], q_ref[good], np.log(r_ref[good])))
+        return np.median(np.fabs(r[in_range] - r_interp) / r_interp)
+
+    def test_event_reduction(self):
+        configuration = Configuration()
+        self.assertLess(self.compare_to_histograms(configuration), TOLERANCE)
+
+    def test_event_reduction_constant_q(self):
+        configuration = Configuration()
+        configuration.use_constant_q = True
+        self.assertLess(self.compare_to_histograms(configuration), TOLERANCE)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import sys
+sys.path.append('..')
+import numpy as np
+
+from reflectivity_ui.interfaces.data_handling import gisans
+
+
+class CrossSectionData(object):
+    def __init__(self, gisans_data):
+        self.gisans_data = gisans_data
+
+
+class GISANSData(object):
+    """
+        Reduction list item holding random GISANS data for one cross-section
+    """
+    def __init__(self, rng, n_x=20, n_y=15, n_tof=30):
+        data = gisans.GISANS(None)
+        data.wavelengths = np.sort(rng.uniform(2.0, 8.0, n_tof))
+        data.k = 2. * np.pi / data.wavelengths
+        phi = rng.uniform(-0.02, 0.02, n_y)
+        af = rng.uniform(0.0, 0.03, n_x)
+        ai = rng.uniform(0.005, 0.01)
+        data._qy_xy = np.sin(phi) * np.cos(af)[:, np.newaxis]
+        data._p_f = data.k[np.newaxis, :] * np.sin(af)[:, np.newaxis]
+        data._qz = data.k[np.newaxis, :] * np.sin(ai) + data._p_f
+        data.S = rng.uniform(0, 10, (n_x, n_y, n_tof))
+        data.dS = np.sqrt(data.S)
+        self.cross_sections = dict(Off_Off=CrossSectionData(data))
+
+
+class RebinTest(unittest.TestCase):
+
+    def histogram2d(self, reduction_list, wl_min, wl_max, qy_npts, qz_npts, use_pf):
+        """
+            Reference rebinning of a wavelength band, with all the points in memory
+        """
+        qy, z, s, ds = [], [], [], []
+        for item in reduction_list:
+            data = item.cross_sections['Off_Off'].gisans_data
+            in_band = (data.wavelengths >= wl_min) & (data.wavelengths <= wl_max)
+            qy.append(data.Qy[:, :, in_band].ravel())
+            z.append((data.p_f if use_pf else data.Qz)[:, :, in_band].ravel())
+            s.append(data.S[:, :, in_band].ravel())
+            ds.append(data.dS[:, :, in_band].ravel())
+        qy, z, s, ds = [np.concatenate(values) for values in (qy, z, s, ds)]
+        bins = (qy_npts + 1, qz_npts + 1)
+        n_points, qy_edges, z_edges = np.histogram2d(qy, z, bins=bins)
+        summed, _, _ = np.histogram2d(qy, z, bins=bins, weights=s)
+        variance, _, _ = np.histogram2d(qy, z, bins=bins, weights=ds**2)
+        has_points = n_points > 0
+        summed[has_points] /= n_points[has_points]
+        error = np.sqrt(variance)
+        error[has_points] /= n_points[has_points]
+        return summed, (qy_edges[1:] + qy_edges[:-1]) / 2., (z_edges[1:] + z_edges[:-1]) / 2., error
+
+    def test_rebin_bands(self):
+        """
+            Rebinning each band one TOF bin at a time gives the same result as numpy.histogram2d
+        """
+        rng = np.random.RandomState(42)
+        reduction_list = [GISANSData(rng), GISANSData(rng, n_tof=25)]
+        for use_pf in [False, True]:
+            bands = gisans.rebin_bands(reduction_list, 'Off_Off', 2.0, 8.0, wl_npts=3,
+                                       qy_npts=12, qz_npts=10, use_pf=use_pf)
+            self.assertEqual(len(bands), 3)
+            for i, band in enumerate(bands):
+                expected = self.histogram2d(reduction_list, 2.0 + 2.0 * i, 4.0 + 2.0 * i, 12, 10, use_pf)
+                for value, expected_value in zip(band, expected):
+                    np.testing.assert_allclose(value, expected_value, rtol=1e-10, atol=1e-12)
+
+        # A single band is the same as rebin_extract
+        band = gisans.rebin_bands(reduction_list, 'Off_Off', 3.0, 5.0, wl_npts=1, qy_npts=12, qz_npts=10)[0]
+        extracted = gisans.rebin_extract(reduction_list, 'Off_Off', 3.0, 5.0, qy_npts=12, qz_npts=10)
+        for value, expected_value in zip(band, extracted):
+            self.assertTrue(np.array_equal(value, expected_value))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import sys
+sys.path.append('..')
+import os
+import shutil
+import tempfile
+import numpy as np
+import h5py
+
+from reflectivity_ui.interfaces.data_handling import hdf5_io
+
+
+class HDF5OutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.output_dir, 'output.h5')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_chunk_shape(self):
+        """
+            Chunks hold complete rows of the leading axis and stay close to the target size
+        """
+        self.assertEqual(hdf5_io.get_chunk_shape((100, 5)), (100, 5))
+        self.assertEqual(hdf5_io.get_chunk_shape((100000, 5)), (hdf5_io.CHUNK_SIZE // 40, 5))
+        self.assertEqual(hdf5_io.get_chunk_shape((304, 400, 7)), (hdf5_io.CHUNK_SIZE // (8 * 400 * 7), 400, 7))
+        # A row larger than the target size gives one row per chunk
+        self.assertEqual(hdf5_io.get_chunk_shape((10, 1000, 100)), (1, 1000, 100))
+        self.assertEqual(hdf5_io.get_chunk_shape((100, 5), item_size=4), (100, 5))
+
+    def test_specular(self):
+        """
+            Each cross-section is a group with its data and attributes
+        """
+        rng = np.random.RandomState(42)
+        output_data = dict(units=['1/A', 'a.u.', 'a.u.', '1/A', 'rad'],
+                           columns=['Qz', 'R', 'dR', 'dQz', 'theta'],
+                           cross_sections={'Off_Off': '++', 'On_Off': '-+'},
+                           Off_Off=rng.uniform(size=(50, 5)), On_Off=rng.uniform(size=(40, 5)))
+        hdf5_io.write_hdf5(self.output_path, output_data, [], [], data_type='Specular')
+
+        with h5py.File(self.output_path, 'r') as h5_file:
+            self.assertEqual(h5_file.attrs['type'], 'Specular')
+            self.assertEqual(h5_file.attrs['extracted_states'], 'Off_Off,On_Off')
+            self.assertNotIn('reduction', h5_file)
+            for pol_state in ['Off_Off', 'On_Off']:
+                group = h5_file[pol_state]
+                self.assertEqual(group.attrs['label'], output_data['cross_sections'][pol_state])
+                self.assertEqual(list(group.attrs['columns']), output_data['columns'])
+                self.assertEqual(list(group.attrs['units']), output_data['units'])
+                self.assertTrue(np.array_equal(group['data'][()], output_data[pol_state]))
+                self.assertEqual(group['data'].compression, 'gzip')
+
+    def test_offspec_runs(self):
+        """
+            Off-specular data has one dataset per run
+        """
+        rng = np.random.RandomState(42)
+        runs = [rng.uniform(size=(30, 20, 7)), rng.uniform(size=(30, 25, 7))]
+        output_data = dict(units=['1/A'] * 5 + ['a.u.'] * 2,
+                           columns=['Qx', 'Qz', 'ki_z', 'kf_z', 'ki_z-kf_z', 'I', 'dI'],
+                           cross_sections={'Off_Off': '++'}, Off_Off=runs)
+        hdf5_io.write_hdf5(self.output_path, output_data, [], [], data_type='OffSpec')
+
+        with h5py.File(self.output_path, 'r') as h5_file:
+            group = h5_file['Off_Off']
+            self.assertNotIn('data', group)
+            for i, run in enumerate(runs):
+                self.assertTrue(np.array_equal(group['data_%d' % i][()], run))
+                self.assertEqual(group['data_%d' % i].chunks, hdf5_io.get_chunk_shape(run.shape))
+            # Reading a range of pixels back
+            self.assertTrue(np.array_equal(group['data_1'][5:10], runs[1][5:10]))
+
+    def test_gisans_bands(self):
+        """
+            GISANS wavelength bands are sub-groups of their cross-section
+        """
+        rng = np.random.RandomState(42)
+        output_data = dict(units=['1/A', '1/A', 'a.u.', 'a.u.'], columns=['Qy', 'Qz', 'I', 'dI'],
+                           cross_sections={'Off_Off_0': '++ band 0', 'Off_Off_1': '++ band 1'},
+                           cross_section_bins={'Off_Off': ['Off_Off_0', 'Off_Off_1']},
+                           wavelength_bands={'Off_Off_0': [2.0, 5.0], 'Off_Off_1': [5.0, 8.0]},
+                           Off_Off_0=[rng.uniform(size=(10, 12, 4))], Off_Off_1=[rng.uniform(size=(10, 12, 4))])
+        hdf5_io.write_hdf5(self.output_path, output_data, [], [], data_type='GISANS')
+
+        with h5py.File(self.output_path, 'r') as h5_file:
+            self.assertEqual(sorted(h5_file['Off_Off'].keys()), ['Off_Off_0', 'Off_Off_1'])
+            for band in ['Off_Off_0', 'Off_Off_1']:
+                group = h5_file['Off_Off'][band]
+                self.assertEqual(group.attrs['label'], output_data['cross_sections'][band])
+                self.assertTrue(np.array_equal(group.attrs['wavelength_range'], output_data['wavelength_bands'][band]))
+                self.assertTrue(np.array_equal(group['data'][()], output_data[band][0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
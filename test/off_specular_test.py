@@ -0,0 +1,170 @@
+import unittest
+import sys
+sys.path.append('..')
+import numpy as np
+import scipy.stats
+
+from reflectivity_ui.interfaces.configuration import Configuration
+from reflectivity_ui.interfaces.data_handling import off_specular
+
+
+def brute_force_smoothing(x, y, I, sigmas=3., gridx=150, gridy=50,
+                          sigmax=0.0005, sigmay=0.0005,
+                          x1=-0.03, x2=0.03, y1=0.0, y2=0.1,
+                          axis_sigma_scaling=None, xysigma0=0.06):
+    """
+        Smoothing as done before the KD-tree was used: the distance
+        to every data point is computed for each grid point.
+    """
+    xout=np.linspace(x1, x2, gridx)
+    yout=np.linspace(y1, y2, gridy)
+    Xout, Yout=np.meshgrid(xout, yout)
+    Iout=np.zeros_like(Xout)
+    ssigmax, ssigmay=sigmax**2, sigmay**2
+
+    for i in range(len(Xout)):
+        for j in range(gridx):
+            xij=Xout[i, j]
+            yij=Yout[i, j]
+            if axis_sigma_scaling:
+                if axis_sigma_scaling==1: xyij=xij
+                elif axis_sigma_scaling==2: xyij=yij
+                elif axis_sigma_scaling==3: xyij=xij+yij
+                if xyij==0:
+                    continue
+                ssigmaxi=ssigmax/xysigma0*xyij
+                ssigmayi=ssigmay/xysigma0*xyij
+                rij=(x-xij)**2/ssigmaxi+(y-yij)**2/ssigmayi
+            else:
+                rij=(x-xij)**2/ssigmax+(y-yij)**2/ssigmay
+            take=np.where(rij<sigmas**2)
+            if len(take[0])==0:
+                continue
+            Pij=np.exp(-0.5*rij[take])
+            Pij/=Pij.sum()
+            Iout[i, j]=(Pij*I[take]).sum()
+    return Xout, Yout, Iout
+
+
+def binned_statistic_rebin(reduction_list, pol_state, axes=None, use_weights=True,
+                           n_bins_x=350, n_bins_y=350, x_min=-0.015, x_max=0.015, y_min=0, y_max=0.1):
+    """
+        Rebinning as done before OffSpecularAccumulator was used:
+        the runs are merged and binned with scipy.stats.binned_statistic_2d.
+    """
+    Qx, Qz, ki_z, kf_z, delta_k, S, dS = off_specular.merge(reduction_list, pol_state)
+    _bins = [n_bins_x, n_bins_y]
+    _range = [[x_min, x_max], [y_min, y_max]]
+
+    x_label, y_label = 'ki_z-kf_z', 'Qz'
+    x_values, y_values = delta_k, Qz
+    if axes == Configuration.QX_VS_QZ:
+        x_label = 'Qx'
+        x_values = Qx
+    elif axes == Configuration.KZI_VS_KZF:
+        x_label, y_label = 'ki_z', 'kf_z'
+        x_values, y_values = ki_z, kf_z
+
+    if use_weights:
+        statistic, x_edge, y_edge, _ = scipy.stats.binned_statistic_2d(x_values, y_values, S/dS**2, statistic='sum',
+                                                                       range=_range, bins=_bins)
+        w_statistic, _, _, _ = scipy.stats.binned_statistic_2d(x_values, y_values, 1/dS**2, statistic='sum',
+                                                               bins=[x_edge, y_edge])
+        result = (statistic / w_statistic).T
+        error = np.sqrt(1.0/w_statistic).T
+    else:
+        statistic, x_edge, y_edge, _ = scipy.stats.binned_statistic_2d(x_values, y_values, S, statistic='mean',
+                                                                       range=_range, bins=_bins)
+        w_statistic, _, _, _ = scipy.stats.binned_statistic_2d(x_values, y_values, dS**2, statistic='sum',
+                                                               bins=[x_edge, y_edge])
+        counts, _, _, _ = scipy.stats.binned_statistic_2d(x_values, y_values, np.ones(len(x_values)),
+                                                          statistic='sum', bins=[x_edge, y_edge])
+        result = statistic.T
+        error = (np.sqrt(w_statistic) / counts).T
+
+    x_middle = x_edge[:-1] + (x_edge[1] - x_edge[0]) / 2.0
+    y_middle = y_edge[:-1] + (y_edge[1] - y_edge[0]) / 2.0
+    return np.nan_to_num(result), np.nan_to_num(error), x_middle, y_middle, [x_label, y_label]
+
+
+class FakeData(object):
+    """ Container for the attributes read by the off-specular rebinning """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def create_run(seed, n_x=60, n_tof=40):
+    """
+        Create a run with an off-specular result for a single cross-section
+        :param int seed: seed of the random values
+    """
+    rng = np.random.RandomState(seed)
+    ki_z = rng.uniform(0.0, 0.06, (n_x, n_tof))
+    kf_z = rng.uniform(0.0, 0.06, (n_x, n_tof))
+    offspec = FakeData(Qx=rng.uniform(-0.0002, 0.0002, (n_x, n_tof)), Qz=ki_z+kf_z,
+                       ki_z=ki_z, kf_z=kf_z,
+                       S=rng.exponential(1.0, (n_x, n_tof)), dS=rng.uniform(0.1, 1.0, (n_x, n_tof)))
+    # Points on the last bin edges
+    offspec.Qz[0, 5] = 0.1
+    offspec.ki_z[1, 5] = 0.015
+    configuration = FakeData(cut_first_n_points=1, cut_last_n_points=2)
+    cross_section = FakeData(off_spec=offspec, configuration=configuration)
+    return FakeData(cross_sections={'Off_Off': cross_section})
+
+
+class RebinTest(unittest.TestCase):
+
+    def test_rebin_extract(self):
+        """
+            The accumulated sums give the same result as binned_statistic_2d on the merged runs
+        """
+        reduction_list = [create_run(seed) for seed in range(3)]
+        for axes in [Configuration.DELTA_KZ_VS_QZ, Configuration.QX_VS_QZ, Configuration.KZI_VS_KZF]:
+            for use_weights in [True, False]:
+                options = dict(axes=axes, use_weights=use_weights, n_bins_x=30, n_bins_y=20)
+                if axes == Configuration.QX_VS_QZ:
+                    options.update(x_min=-0.0002, x_max=0.0002)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    expected = binned_statistic_rebin(reduction_list, 'Off_Off', **options)
+                    result = off_specular.rebin_extract(reduction_list, 'Off_Off', **options)
+                for i in range(4):
+                    self.assertTrue(np.allclose(result[i], expected[i], rtol=1e-10, atol=0),
+                                    "axes=%s use_weights=%s output %s" % (axes, use_weights, i))
+                self.assertEqual(result[4], expected[4])
+
+
+class SmoothingTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.x = rng.uniform(-0.03, 0.03, 3000)
+        self.y = rng.uniform(0.0, 0.1, 3000)
+        self.I = rng.exponential(1.0, 3000)
+        self.options = dict(sigmas=3., gridx=40, gridy=30, sigmax=0.002, sigmay=0.004,
+                            x1=-0.03, x2=0.03, y1=0.0, y2=0.1)
+
+    def test_smoothing(self):
+        for axis_sigma_scaling in [None, 1, 2, 3]:
+            # Sigmas scaled by a negative x value overflow in both versions
+            with np.errstate(over='ignore', invalid='ignore'):
+                _, _, expected = brute_force_smoothing(self.x, self.y, self.I,
+                                                       axis_sigma_scaling=axis_sigma_scaling, **self.options)
+                _, _, result = off_specular._smooth_data(self.x, self.y, self.I,
+                                                         axis_sigma_scaling=axis_sigma_scaling,
+                                                         indices=[0, self.options['gridx']], **self.options)
+            self.assertTrue(np.allclose(result, expected, rtol=1e-10, atol=1e-12, equal_nan=True),
+                            "axis_sigma_scaling=%s" % axis_sigma_scaling)
+
+    def test_smoothing_columns(self):
+        """
+            Computing a range of columns gives the same values as the whole grid
+        """
+        _, _, expected = brute_force_smoothing(self.x, self.y, self.I, **self.options)
+        _, _, result = off_specular._smooth_data(self.x, self.y, self.I, indices=[10, 25], **self.options)
+        self.assertTrue(np.allclose(result[:, 10:25], expected[:, 10:25], rtol=1e-10, atol=1e-12))
+        self.assertEqual(np.count_nonzero(result[:, :10]), 0)
+        self.assertEqual(np.count_nonzero(result[:, 25:]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+import sys
+sys.path.append('..')
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from reflectivity_ui.interfaces.data_manager import DataManager
+from reflectivity_ui.interfaces.configuration import Configuration
+
+# Maximum median relative difference between the preview and the reduction
+TOLERANCE = 0.1
+
+class PreviewTest(unittest.TestCase):
+
+    def compare_to_reduction(self, configuration):
+        """
+            Compute the reflectivity with Mantid and with the NumPy preview,
+            and return the median relative difference over the common Q range.
+        """
+        manager = DataManager(os.getcwd())
+        manager.load("REF_M_29160", configuration)
+        manager.calculate_reflectivity()
+        manager.calculate_preview()
+
+        channel = manager.active_channel
+        q, r, _ = channel.preview
+        q_ref = channel.q if len(channel.q) == len(channel._r) else (channel.q[1:]+channel.q[:-1])/2.0
+        r_ref = channel._r
+
+        good = r_ref > 0
+        in_range = (q >= q_ref[good].min()) & (q <= q_ref[good].max()) & (r > 0)
+        self.assertTrue(np.sum(in_range) > 10)
+        r_interp = np.exp(np.interp(q[in_range], q_ref[good], np.log(r_ref[good])))
+        return np.median(np.fabs(r[in_range] - r_interp) / r_interp)
+
+    def test_preview(self):
+        configuration = Configuration()
+        configuration.do_final_rebin = False
+        self.assertLess(self.compare_to_reduction(configuration), TOLERANCE)
+
+    def test_preview_final_rebin(self):
+        configuration = Configuration()
+        self.assertLess(self.compare_to_reduction(configuration), TOLERANCE)
+
+    def test_preview_constant_q(self):
+        configuration = Configuration()
+        configuration.do_final_rebin = False
+        configuration.use_constant_q = True
+        self.assertLess(self.compare_to_reduction(configuration), TOLERANCE)
+
+    def test_load_with_preview(self):
+        """
+            The preview histograms are shown while the file is loading,
+            and replaced by the full data once it is loaded
+        """
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+        from event_data_generator import RunParameters, write_event_file
+        data_dir = tempfile.mkdtemp()
+        try:
+            parameters = RunParameters(run_number=30001)
+            file_path = os.path.join(data_dir, parameters.file_name)
+            write_event_file(file_path, parameters, n_events=100000, seed=1)
+
+            manager = DataManager(data_dir)
+            previews = []
+            def _show_preview():
+                previews.append(manager._nexus_data)
+                self.assertTrue(manager.active_channel.xydata.sum() > 0)
+                # The preview can't be reduced
+                self.assertTrue(manager._nexus_data.is_preview)
+                self.assertFalse(manager.add_active_to_reduction())
+                self.assertFalse(manager.add_active_to_normalization())
+            manager.load(file_path, Configuration(), preview=_show_preview)
+
+            self.assertEqual(len(previews), 1)
+            self.assertFalse(previews[0] is manager._nexus_data)
+            self.assertFalse(manager._nexus_data.is_preview)
+            self.assertEqual(list(previews[0].cross_sections.keys()),
+                             list(manager._nexus_data.cross_sections.keys()))
+            self.assertTrue(manager._nexus_data in manager._cache)
+            self.assertFalse(previews[0] in manager._cache)
+        finally:
+            shutil.rmtree(data_dir)
+
+    def test_preview_geometry(self):
+        """
+            The geometry of the preview is read from the DAS logs
+        """
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+        from event_data_generator import RunParameters, write_event_file
+        from reflectivity_ui.interfaces.data_handling.data_set import NexusData
+        data_dir = tempfile.mkdtemp()
+        try:
+            parameters = RunParameters(run_number=30002)
+            file_path = os.path.join(data_dir, parameters.file_name)
+            write_event_file(file_path, parameters, n_events=10000, seed=1)
+            configuration = Configuration()
+            nexus_data = NexusData(file_path, configuration)
+            self.assertTrue(len(nexus_data.load_preview()) > 0)
+            self.assertTrue(nexus_data.is_preview)
+        finally:
+            shutil.rmtree(data_dir)
+
+        for channel in nexus_data.cross_sections.values():
+            # Distances are logged in mm
+            self.assertAlmostEqual(channel.dist_sam_det, parameters.sample_det_distance / 1000.0)
+            self.assertAlmostEqual(channel.dist_mod_det,
+                                   (parameters.moderator_sample_distance + parameters.sample_det_distance) / 1000.0)
+            self.assertAlmostEqual(channel.dangle, parameters.dangle)
+            self.assertAlmostEqual(channel.det_size_x, configuration.instrument.n_x_pixel * configuration.instrument.pixel_width)
+
+if __name__ == '__main__':
+    unittest.main()
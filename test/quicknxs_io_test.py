@@ -0,0 +1,89 @@
+import unittest
+import sys
+sys.path.append('..')
+import io
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from reflectivity_ui.interfaces.data_handling import quicknxs_io
+
+
+def savetxt(blocks, delimiter, separator):
+    """
+        Write blocks one at a time with numpy.savetxt
+    """
+    fd = io.StringIO()
+    for block in blocks:
+        np.savetxt(fd, block, delimiter=delimiter, fmt='%-18e')
+        if separator:
+            fd.write(u'\n')
+    return fd.getvalue()
+
+
+class WriteBlocksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(42)
+        self.output_dir = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.output_dir, 'output.dat')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def write_blocks(self, blocks, delimiter='\t', separator=True):
+        fd = io.StringIO()
+        quicknxs_io._write_blocks(fd, blocks, delimiter=delimiter, separator=separator)
+        return fd.getvalue()
+
+    def test_write_blocks(self):
+        """
+            The output is the same as numpy.savetxt, including across chunks
+        """
+        blocks = self.rng.uniform(-1e3, 1e3, size=(25, 7, 3))
+        blocks[0, 0, 0] = 0
+        blocks[1, 1, 1] = 1e-300
+        self.assertEqual(self.write_blocks(blocks), savetxt(blocks, '\t', True))
+        self.assertEqual(self.write_blocks(blocks, delimiter=' ', separator=False), savetxt(blocks, ' ', False))
+
+        write_chunk_size = quicknxs_io.WRITE_CHUNK_SIZE
+        try:
+            quicknxs_io.WRITE_CHUNK_SIZE = 50
+            self.assertEqual(self.write_blocks(blocks), savetxt(blocks, '\t', True))
+        finally:
+            quicknxs_io.WRITE_CHUNK_SIZE = write_chunk_size
+
+    def read_data(self):
+        with open(self.output_path, 'r') as fd:
+            content = fd.read()
+        # Skip the data header and the column names
+        return content.split('# [Data]\n', 1)[1].split('\n', 1)[1]
+
+    def test_four_columns(self):
+        data = self.rng.uniform(size=(40, 5))
+        quicknxs_io.write_reflectivity_data(self.output_path, data, ['Qz', 'R', 'dR', 'dQz', 'theta'], as_5col=False)
+        self.assertEqual(self.read_data(), savetxt([data[:, :4]], ' ', False))
+
+    def test_five_columns(self):
+        data = self.rng.uniform(size=(40, 5))
+        quicknxs_io.write_reflectivity_data(self.output_path, data, ['Qz', 'R', 'dR', 'dQz', 'theta'], as_5col=True)
+        self.assertEqual(self.read_data(), savetxt([data], '\t', False))
+
+    def test_list_of_rows(self):
+        """
+            Off-specular data is a list of [pixel][parameter] arrays, with an empty line after each pixel
+        """
+        data = [self.rng.uniform(size=(12, 7)) for _ in range(3)]
+        quicknxs_io.write_reflectivity_data(self.output_path, data, ['Qx', 'Qz', 'ki_z', 'kf_z'])
+        self.assertEqual(self.read_data(), savetxt([pixel for item in data for pixel in item], '\t', True))
+
+        # Each pixel can also be a list of rows
+        os.remove(self.output_path)
+        data = [self.rng.uniform(size=(4, 6, 3)).tolist() for _ in range(2)]
+        quicknxs_io.write_reflectivity_data(self.output_path, data, ['Qy', 'Qz', 'I'])
+        self.assertEqual(self.read_data(), savetxt([np.asarray(pixel) for item in data for pixel in item], '\t', True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import unittest
+import sys
+sys.path.append('..')
+import numpy as np
+
+from reflectivity_ui.interfaces.data_handling import stitching
+
+
+class Configuration(object):
+    def __init__(self, scaling_factor):
+        self.scaling_factor = scaling_factor
+        self.cut_first_n_points = 1
+        self.cut_last_n_points = 2
+
+
+class CrossSectionData(object):
+    def __init__(self, q, r, dr, scaling_factor):
+        self.q = q
+        self._r = r
+        self._dr = dr
+        self.configuration = Configuration(scaling_factor)
+
+
+class NexusData(object):
+    def __init__(self, cross_sections):
+        self.cross_sections = cross_sections
+
+
+class StitchingTest(unittest.TestCase):
+
+    def setUp(self):
+        """
+            Create three overlapping runs of the same curve, each with its own scale.
+        """
+        self.scales = [2.0, 0.5, 10.0]
+        self.data = []
+        for i, scale in enumerate(self.scales):
+            q = np.linspace(0.01 + 0.02 * i, 0.04 + 0.02 * i, 40)
+            r = 1e-3 / q**2 / scale
+            self.data.append([(q, r, 0.01 * r)])
+
+    def test_chained(self):
+        factors = stitching.compute_scaling_factors(self.data, scaling_factor=self.scales[0])
+        self.assertTrue(np.allclose(factors, self.scales, rtol=1e-3))
+
+    def test_global_fit(self):
+        factors = stitching.compute_scaling_factors(self.data, scaling_factor=self.scales[0], global_fit=True)
+        self.assertTrue(np.allclose(factors, self.scales, rtol=1e-3))
+
+    def get_residual(self, data, factors):
+        """
+            Sum of the squared normalized differences between the scaled runs,
+            over the overlap region of every pair of runs
+        """
+        total = 0.0
+        for i in range(len(data) - 1):
+            for j in range(i + 1, len(data)):
+                (q_a, r_a, dr_a), = data[i]
+                (q_b, r_b, dr_b), = data[j]
+                idx = (q_b >= q_a.min()) & (q_b <= q_a.max())
+                r_low = factors[i] * np.interp(q_b[idx], q_a, r_a)
+                dr_low = factors[i] * np.interp(q_b[idx], q_a, dr_a)
+                total += np.sum((r_low - factors[j] * r_b[idx])**2 / (dr_low**2 + (factors[j] * dr_b[idx])**2))
+        return total
+
+    def test_global_fit_inconsistent(self):
+        """
+            With noise and one overlap pair that doesn't agree with the others, chaining
+            propagates the error of that pair while the global fit uses all the overlaps
+        """
+        rng = np.random.RandomState(42)
+        data = []
+        for i, scale in enumerate(self.scales):
+            q = np.linspace(0.01 + 0.01 * i, 0.04 + 0.01 * i, 40)
+            r = 1e-3 / q**2 / scale * (1.0 + 0.02 * rng.standard_normal(40))
+            if i == 1:
+                # Only the overlap with the first run is off
+                r[q < 0.03] *= 1.2
+            data.append([(q, r, 0.02 * r)])
+        chained = stitching.compute_scaling_factors(data, scaling_factor=self.scales[0])
+        fitted = stitching.compute_scaling_factors(data, scaling_factor=self.scales[0], global_fit=True)
+        self.assertLess(self.get_residual(data, fitted), self.get_residual(data, chained))
+        self.assertLess(abs(fitted[2] - self.scales[2]), abs(chained[2] - self.scales[2]))
+
+    def test_no_overlap(self):
+        q = np.linspace(0.2, 0.3, 10)
+        data = [self.data[0], [(q, np.ones(10), np.ones(10))]]
+        factors = stitching.compute_scaling_factors(data, scaling_factor=3.0)
+        self.assertEqual(factors, [3.0, 3.0])
+
+
+class MergeTest(unittest.TestCase):
+
+    def setUp(self):
+        """
+            Create two overlapping runs with two cross-sections, each run with its own scale
+        """
+        rng = np.random.RandomState(42)
+        self.reduction_list = []
+        for q_min, q_max, scale in [(0.01, 0.03, 2.0), (0.02, 0.05, 0.5)]:
+            cross_sections = {}
+            for xs in ['Off_Off', 'On_On']:
+                q = np.linspace(q_min, q_max, 30) + rng.uniform(-1e-4, 1e-4, 30)
+                r = rng.uniform(0.5, 1.5, 30) * 1e-3 / q**2
+                dr = rng.uniform(0.05, 0.2, 30) * r
+                cross_sections[xs] = CrossSectionData(q, r, dr, scale)
+            self.reduction_list.append(NexusData(cross_sections))
+        # Points without a valid uncertainty are left out
+        self.reduction_list[1].cross_sections['On_On']._dr[5] = 0
+        self.reduction_list[1].cross_sections['On_On']._r[6] = np.nan
+
+    def get_expected(self, xs, edges):
+        """
+            Weighted mean of the scaled points in each bin, computed point by point
+        """
+        sums = {}
+        for item in self.reduction_list:
+            q, r, dr = stitching.get_points(item.cross_sections[xs])
+            scale = item.cross_sections[xs].configuration.scaling_factor
+            for _q, _r, _dr in zip(q, r * scale, dr * scale):
+                if not (_dr > 0 and np.isfinite(_r)):
+                    continue
+                for i in range(len(edges) - 1):
+                    if edges[i] <= _q < edges[i+1] or (i == len(edges) - 2 and _q == edges[-1]):
+                        w, wr, runs = sums.get(i, (0.0, 0.0, set()))
+                        sums[i] = (w + 1.0 / _dr**2, wr + _r / _dr**2, runs | set([id(item)]))
+        bins = sorted(sums)
+        q = np.asarray([(edges[i] + edges[i+1]) / 2.0 for i in bins])
+        r = np.asarray([sums[i][1] / sums[i][0] for i in bins])
+        dr = np.asarray([1.0 / np.sqrt(sums[i][0]) for i in bins])
+        n_runs = np.asarray([len(sums[i][2]) for i in bins])
+        return q, r, dr, n_runs
+
+    def test_merge(self):
+        """
+            Points in the same Q bin are averaged with 1/dR^2 weights, and dR = 1/sqrt(sum of the weights)
+        """
+        merged = stitching.merge_reduction_list(self.reduction_list, ['Off_Off', 'On_On'], q_min=0.005, q_step=0.002)
+        self.assertEqual(sorted(merged.keys()), ['Off_Off', 'On_On'])
+        # The grid covers the data from q_min with a constant step
+        edges = 0.005 + 0.002 * np.arange(24)
+        for xs in ['Off_Off', 'On_On']:
+            q, r, dr = merged[xs]
+            expected_q, expected_r, expected_dr, n_runs = self.get_expected(xs, edges)
+            self.assertTrue(np.allclose(q, expected_q))
+            self.assertTrue(np.allclose(r, expected_r, rtol=1e-10))
+            self.assertTrue(np.allclose(dr, expected_dr, rtol=1e-10))
+            # The overlap region has bins with points from both runs
+            self.assertTrue(np.sum(n_runs == 2) >= 3)
+
+    def test_log_grid(self):
+        """
+            A negative step gives bins that grow by a constant factor
+        """
+        edges = stitching.get_q_edges(0.005, -0.02, 0.05)
+        self.assertEqual(edges[0], 0.005)
+        self.assertTrue(np.allclose(edges[1:] / edges[:-1], 1.02))
+        self.assertTrue(edges[-1] >= 0.05)
+        self.assertTrue(edges[-2] < 0.05)
+
+        merged = stitching.merge_reduction_list(self.reduction_list, ['Off_Off'], q_min=0.005, q_step=-0.02)
+        q, r, dr = merged['Off_Off']
+        expected_q, expected_r, expected_dr, _ = self.get_expected('Off_Off', edges)
+        self.assertTrue(np.allclose(q, expected_q))
+        self.assertTrue(np.allclose(r, expected_r, rtol=1e-10))
+        self.assertTrue(np.allclose(dr, expected_dr, rtol=1e-10))
+
+    def test_merge_missing(self):
+        self.assertEqual(stitching.merge_reduction_list(self.reduction_list, ['Off_On']), {})
+        self.assertEqual(stitching.merge_reduction_list([], ['Off_Off']), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+import sys
+sys.path.append('..')
+import os
+import json
+import tempfile
+import numpy as np
+
+from reflectivity_ui.interfaces.data_handling import tracing
+from reflectivity_ui.interfaces.data_handling import ApplicationConfiguration
+
+
+class TracingTest(unittest.TestCase):
+
+    def test_nesting(self):
+        """
+            Nested spans inherit the context and their time is excluded from the self time
+        """
+        tracer = tracing.Tracer()
+        with tracer.span('load', 'load', run=1) as outer:
+            with tracer.span('bin', 'load', cross_section='Off_Off', nbytes=1024) as inner:
+                self.assertEqual(tracer.current_span, inner)
+            outer.set(cached=False)
+        self.assertIsNone(tracer.current_span)
+
+        self.assertEqual(len(tracer.spans), 2)
+        self.assertEqual(inner.context, dict(run=1, cross_section='Off_Off'))
+        self.assertEqual(inner.depth, 1)
+        self.assertEqual(outer.context, dict(run=1, cached=False))
+        self.assertAlmostEqual(outer.self_time, outer.duration - inner.duration)
+
+    def test_error(self):
+        """
+            A span is recorded when an exception goes through it
+        """
+        tracer = tracing.Tracer()
+        try:
+            with tracer.span('load'):
+                raise RuntimeError("no data")
+        except RuntimeError:
+            pass
+        self.assertEqual(tracer.spans[0].context['error'], 'no data')
+        self.assertIsNone(tracer.current_span)
+
+    def test_summary(self):
+        tracer = tracing.Tracer()
+        for run in [1, 2, 2]:
+            with tracer.span('reduce', run=run) as _span:
+                _span.add_bytes(1024**2)
+        summary = tracer.get_summary()
+        self.assertEqual(len(summary), 1)
+        self.assertEqual(summary[0]['calls'], 3)
+        self.assertEqual(summary[0]['nbytes'], 3 * 1024**2)
+
+        summary = tracer.get_summary(group_by='run')
+        self.assertEqual(sorted([(item['group'], item['calls']) for item in summary]), [(1, 1), (2, 2)])
+        table = tracer.get_summary_table(group_by='run')
+        self.assertEqual(len(table.split('\n')), 4)
+
+    def test_chrome_trace(self):
+        tracer = tracing.Tracer()
+
+        @tracing.traced('compute', 'reduction', context=lambda item: dict(run=item))
+        def compute(run):
+            return run * 2
+
+        tracing._tracer = tracer
+        try:
+            self.assertEqual(compute(3), 6)
+        finally:
+            tracing._tracer = None
+
+        _fd, file_path = tempfile.mkstemp(suffix='.json')
+        os.close(_fd)
+        try:
+            tracer.write_chrome_trace(file_path)
+            with open(file_path, 'r') as fd:
+                trace = json.load(fd)
+        finally:
+            os.remove(file_path)
+        events = [item for item in trace['traceEvents'] if item['ph'] == 'X']
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['name'], 'compute')
+        self.assertEqual(events[0]['cat'], 'reduction')
+        self.assertEqual(events[0]['args'], dict(run=3, bytes=0))
+        self.assertGreaterEqual(events[0]['dur'], 0)
+
+    def test_to_json(self):
+        """
+            Text is written as is, including non-ASCII text
+        """
+        self.assertEqual(tracing._to_json(u'Off_Off \u00c5'), u'Off_Off \u00c5')
+        self.assertEqual(tracing._to_json('REF_M_1'), 'REF_M_1')
+        self.assertEqual(tracing._to_json(np.int64(3)), 3)
+        self.assertEqual(tracing._to_json([1, 2]), '[1, 2]')
+        self.assertIsNone(tracing._to_json(None))
+
+    def test_trace_file_option(self):
+        """
+            The trace file is only written when requested
+        """
+        value = os.environ.pop('REFREDM_TRACE_FILE', None)
+        try:
+            self.assertIsNone(ApplicationConfiguration().trace_file)
+            os.environ['REFREDM_TRACE_FILE'] = '/tmp/trace.json'
+            self.assertEqual(ApplicationConfiguration().trace_file, '/tmp/trace.json')
+        finally:
+            os.environ.pop('REFREDM_TRACE_FILE', None)
+            if value is not None:
+                os.environ['REFREDM_TRACE_FILE'] = value
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+import sys
+sys.path.append('..')
+import os
+import time
+import numpy as np
+
+from reflectivity_ui.interfaces.data_handling import worker_pool
+
+
+def sum_rows(task):
+    """
+        Sum the rows [start, stop[ of a shared array
+    """
+    data = worker_pool.load(task['data'])
+    start, stop = task['rows']
+    return data[start:stop].sum(axis=0)
+
+
+def wait(task):
+    time.sleep(task)
+    return task
+
+
+def fail(task):
+    raise ValueError("Task %s failed" % task)
+
+
+class Progress(object):
+    """
+        Progress reporter that cancels the tasks once some of them are done
+    """
+    def __init__(self, pool, cancel_after=None):
+        self.pool = pool
+        self.cancel_after = cancel_after
+        self.calls = []
+        self.cancellable = []
+
+    def __call__(self, value, message='', out_of=None):
+        self.calls.append((value, out_of))
+        if self.cancel_after is not None and value >= self.cancel_after:
+            self.pool.cancel()
+
+    def set_cancellable(self, cancellable):
+        self.cancellable.append(cancellable)
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = worker_pool.WorkerPool(n_workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.shutdown()
+
+    def test_chunks(self):
+        for n_items in [1, 7, 8, 100]:
+            chunks = self.pool.chunks(n_items)
+            self.assertTrue(len(chunks) <= 2 * worker_pool.CHUNKS_PER_WORKER)
+            self.assertEqual(chunks[0][0], 0)
+            self.assertEqual(chunks[-1][1], n_items)
+            for i in range(len(chunks) - 1):
+                self.assertEqual(chunks[i][1], chunks[i+1][0])
+            sizes = [stop - start for start, stop in chunks]
+            self.assertTrue(max(sizes) - min(sizes) <= 1)
+        self.assertEqual(self.pool.chunks(0), [])
+
+    def test_shared_arrays(self):
+        """
+            The workers read the arrays from the shared files, which are removed afterwards
+        """
+        rng = np.random.RandomState(42)
+        data = rng.uniform(size=(100, 3))
+        counts = rng.randint(0, 100, size=(10, 4)).astype(np.int32)
+        with worker_pool.SharedArrays() as shared:
+            directory = shared.directory
+            if os.access(worker_pool.SHARED_MEMORY_DIR, os.W_OK):
+                self.assertEqual(os.path.dirname(directory), worker_pool.SHARED_MEMORY_DIR)
+            data_descriptor = shared.add('data', data)
+            counts_descriptor = shared.add('counts', counts)
+            empty_descriptor = shared.add('empty', np.zeros((0, 3)))
+            self.assertEqual(sorted(os.listdir(directory)), ['counts.dat', 'data.dat'])
+
+            # The descriptors are small and can be sent to the workers
+            tasks = [dict(data=data_descriptor, rows=rows) for rows in self.pool.chunks(100)]
+            results = self.pool.map(sum_rows, tasks)
+            self.assertTrue(np.allclose(np.sum(results, axis=0), data.sum(axis=0)))
+            results = self.pool.map(sum_rows, [dict(data=counts_descriptor, rows=[0, 10])])
+            self.assertTrue(np.array_equal(results[0], counts.sum(axis=0)))
+
+            loaded = worker_pool.load(counts_descriptor)
+            self.assertEqual(loaded.dtype, np.int32)
+            self.assertTrue(np.array_equal(loaded, counts))
+            self.assertRaises(ValueError, loaded.__setitem__, (0, 0), 1)
+            self.assertEqual(worker_pool.load(empty_descriptor).shape, (0, 3))
+            del loaded
+        self.assertFalse(os.path.exists(directory))
+        self.assertEqual(shared.descriptors, {})
+
+    def test_progress(self):
+        progress = Progress(self.pool)
+        self.assertEqual(self.pool.map(wait, [0.01, 0.02, 0.0], progress=progress), [0.01, 0.02, 0.0])
+        self.assertEqual(progress.calls[-1], (3, 3))
+        self.assertEqual(progress.cancellable, [True, False])
+
+    def test_cancel(self):
+        """
+            Cancelling stops the workers, removes the shared files and leaves the pool usable
+        """
+        progress = Progress(self.pool, cancel_after=1)
+        directory = None
+        try:
+            with worker_pool.SharedArrays() as shared:
+                directory = shared.directory
+                shared.add('data', np.ones(10))
+                self.pool.map(wait, [0.0] + [5.0] * 4, progress=progress)
+            self.fail("The tasks were not cancelled")
+        except worker_pool.Cancelled:
+            pass
+        self.assertFalse(os.path.exists(directory))
+        self.assertIsNone(self.pool._pool)
+        self.assertEqual(progress.cancellable, [True, False])
+        self.assertTrue(progress.calls[-1][0] < 5)
+
+        # The pool is restarted when needed
+        self.assertEqual(self.pool.map(wait, [0.0, 0.0]), [0.0, 0.0])
+
+    def test_error(self):
+        self.assertRaises(ValueError, self.pool.map, fail, [1, 2])
+        self.assertEqual(self.pool.map(wait, [0.0]), [0.0])
+
+
+if __name__ == '__main__':
+    unittest.main()